@@ -3,6 +3,8 @@ from channels.generic.websocket import WebsocketConsumer
 from asgiref.sync import async_to_sync
 from django.utils import timezone
 
+from file_manager.thumbnails import thumbnail_url
+
 
 class ChatConsumer(WebsocketConsumer):
     def connect(self):
@@ -79,6 +81,7 @@ class ChatConsumer(WebsocketConsumer):
                     'file_url': file_url,
                     'file_name': file_name,
                     'is_image': is_image,
+                    'thumb_url': thumbnail_url(msg.file_attachment, 'chat') if msg.is_image() else None,
                     'file_size': file_size,
                     'file_extension': file_extension,
                     'timestamp': msg.timestamp.isoformat(),
@@ -194,6 +197,7 @@ class ChatConsumer(WebsocketConsumer):
             'file_url': event['file_url'],
             'file_name': event['file_name'],
             'is_image': event['is_image'],
+            'thumb_url': event.get('thumb_url'),
             'file_size': event['file_size'],
             'file_extension': event['file_extension'],
             'timestamp': event['timestamp'],
@@ -0,0 +1,24 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat_manager", "0003_message_edited_deleted"),
+        ("file_manager", "0010_contentblob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="content_blob",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="chat_messages",
+                to="file_manager.contentblob",
+            ),
+        ),
+    ]
@@ -79,6 +79,13 @@ class Message(models.Model):
         blank=True,
         verbose_name='Файл'
     )
+    content_blob = models.ForeignKey(
+        'file_manager.ContentBlob',
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='chat_messages'
+    )
     timestamp = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
     edited_at = models.DateTimeField(null=True, blank=True)
@@ -111,6 +118,14 @@ class Message(models.Model):
         ext = self.file_attachment.name.split('.')[-1].lower()
         return ext in image_extensions
     
+    def get_download_name(self):
+        """Имя файла при скачивании (вложение лежит в blob-хранилище под хешем)"""
+        if not self.file_attachment:
+            return ''
+        ext = self.file_attachment.name.rsplit('.', 1)[-1].lower() if '.' in self.file_attachment.name else 'bin'
+        stamp = self.timestamp.strftime('%Y%m%d_%H%M%S') if self.timestamp else str(self.id)
+        return f"chat{self.room_id}_msg{stamp}.{ext}"
+
     def get_file_extension(self):
         """Получить расширение файла"""
         if not self.file_attachment:
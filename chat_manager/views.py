@@ -7,6 +7,9 @@ from django.views.decorators.http import require_http_methods
 from .models import ChatRoom, Message
 from .forms import ChatFileUploadForm
 from classroom_core.models import Course
+from file_manager.blobstore import acquire_blob, release_blob
+from file_manager.thumbnails import schedule_thumbnails, thumbnail_url
+from file_manager.delivery import local_file_response
 from django.contrib.auth.models import User
 import json
 
@@ -138,13 +141,22 @@ def upload_file_to_chat(request, room_id):
         content = form.cleaned_data.get('content', '')
         file_attachment = form.cleaned_data['file_attachment']
         
-                                    
-        message = Message.objects.create(
-            room=room,
-            user=request.user,
-            content=content,
-            file_attachment=file_attachment
-        )
+        # Одинаковые вложения (разосланная всем лекция) хранятся одним blob
+        blob = acquire_blob(file_attachment, file_attachment.name)
+        try:
+            message = Message(
+                room=room,
+                user=request.user,
+                content=content,
+                content_blob=blob
+            )
+            message.file_attachment.name = blob.storage_path
+            message.save()
+        except Exception:
+            release_blob(blob.id)
+            raise
+        if message.is_image():
+            schedule_thumbnails(message.file_attachment, ['chat'])
         
                                          
         response_data = {
@@ -156,7 +168,8 @@ def upload_file_to_chat(request, room_id):
             'has_file': True,
             'is_image': message.is_image(),
             'file_url': message.file_attachment.url if message.file_attachment else None,
-            'file_name': message.file_attachment.name.split('/')[-1] if message.file_attachment else None,
+            'thumb_url': thumbnail_url(message.file_attachment, 'chat') if message.is_image() else None,
+            'file_name': message.get_download_name() if message.file_attachment else None,
             'file_size': message.get_file_size_display(),
             'file_extension': message.get_file_extension(),
         }
@@ -186,8 +199,9 @@ def download_message_file(request, message_id):
     if not os.path.exists(file_path):
         return HttpResponse('Файл не найден на сервере', status=404)
     
-                                 
-    with open(file_path, 'rb') as fh:
-        response = HttpResponse(fh.read(), content_type="application/octet-stream")
-        response['Content-Disposition'] = f'attachment; filename="{os.path.basename(file_path)}"'
-        return response
\ No newline at end of file
+    return local_file_response(
+        request,
+        file_path,
+        filename=message.get_download_name(),
+        as_attachment=True,
+    )
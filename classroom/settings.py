@@ -98,6 +98,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.sites',
     'django.contrib.messages',
+    'django.contrib.postgres',
     'channels',
     'django.contrib.staticfiles',
     'whitenoise.runserver_nostatic',
@@ -294,9 +295,100 @@ if env_bool("DJANGO_BEHIND_PROXY", False):
 
 SERVE_MEDIA_FROM_DJANGO = env_bool("DJANGO_SERVE_MEDIA", not DEBUG)
 
+# Размер блока при потоковой отдаче файлов (скачивание, предпросмотр, прокси Яндекс.Диска).
+FILE_DELIVERY_CHUNK_SIZE = env_int("FILE_DELIVERY_CHUNK_SIZE", 64 * 1024)
+# stream | x-accel-redirect (nginx) | x-sendfile (Apache/lighttpd); см. file_manager/delivery.py.
+FILE_DELIVERY_MODE = os.getenv("FILE_DELIVERY_MODE", "stream").strip().lower()
+FILE_DELIVERY_INTERNAL_PREFIX = os.getenv("FILE_DELIVERY_INTERNAL_PREFIX", "/protected-media/").strip()
+
+# Извлечение текста из документов в пуле процессов (file_manager/extraction.py).
+TEXT_EXTRACTION_WORKERS = env_int("TEXT_EXTRACTION_WORKERS", 2)
+TEXT_EXTRACTION_TIMEOUT = env_int("TEXT_EXTRACTION_TIMEOUT", 60)
+TEXT_EXTRACTION_MAX_RSS_MB = env_int("TEXT_EXTRACTION_MAX_RSS_MB", 768)
+TEXT_EXTRACTION_MAX_CHARS = env_int("TEXT_EXTRACTION_MAX_CHARS", 2_000_000)
+# Кэш результатов по SHA-256 содержимого (Django-кэш / Redis), 0 — выключен.
+TEXT_EXTRACTION_CACHE_TTL = env_int("TEXT_EXTRACTION_CACHE_TTL", 30 * 24 * 3600)
+
+# Сверка файлов Яндекс.Диска с БД в фоне (file_manager/yandex_sync.py): не чаще раза в N секунд
+# на пользователя при открытии списка файлов; 0 — только командой reconcile_yandex_files.
+YANDEX_RECONCILE_INTERVAL = env_int("YANDEX_RECONCILE_INTERVAL", 300)
+
+# HTTP-клиент Яндекс.Диска (file_manager/yandex_disk.py): пул keep-alive соединений на процесс
+# и повторы с экспоненциальной паузой на 429/5xx. YANDEX_DISK_API_BASE — для фейкового сервера.
+YANDEX_DISK_API_BASE = os.getenv("YANDEX_DISK_API_BASE", "https://cloud-api.yandex.net/v1/disk").strip()
+YANDEX_HTTP_POOL_SIZE = env_int("YANDEX_HTTP_POOL_SIZE", 10)
+YANDEX_HTTP_RETRIES = env_int("YANDEX_HTTP_RETRIES", 3)
+YANDEX_HTTP_BACKOFF = float(os.getenv("YANDEX_HTTP_BACKOFF", "0.5") or 0)
+# Потоковые загрузки/скачивания Яндекс.Диска (file_manager/yandex_transfer.py):
+# размер блока и число одновременных передач на процесс.
+YANDEX_TRANSFER_CHUNK_SIZE = env_int("YANDEX_TRANSFER_CHUNK_SIZE", 256 * 1024)
+YANDEX_TRANSFER_CONCURRENCY = env_int("YANDEX_TRANSFER_CONCURRENCY", 4)
+# Кэш (Django-кэш / Redis) ответов API Яндекс.Диска, секунд; 0 — не кэшировать.
+# Ссылка на скачивание хранится не дольше срока её действия (параметр expires).
+YANDEX_DOWNLOAD_URL_CACHE_TTL = env_int("YANDEX_DOWNLOAD_URL_CACHE_TTL", 15 * 60)
+YANDEX_RESOURCE_INFO_CACHE_TTL = env_int("YANDEX_RESOURCE_INFO_CACHE_TTL", 10 * 60)
+YANDEX_DISK_INFO_CACHE_TTL = env_int("YANDEX_DISK_INFO_CACHE_TTL", 5 * 60)
+# Локальный кэш содержимого файлов Яндекс.Диска (file_manager/content_cache.py), LRU на диске;
+# вне MEDIA_ROOT. YANDEX_CONTENT_CACHE_MAX_BYTES=0 — выключен.
+YANDEX_CONTENT_CACHE_DIR = os.getenv("YANDEX_CONTENT_CACHE_DIR", str(BASE_DIR / "var" / "yandex_content_cache"))
+YANDEX_CONTENT_CACHE_MAX_BYTES = env_int("YANDEX_CONTENT_CACHE_MAX_BYTES", 2 * 1024**3)
+YANDEX_CONTENT_CACHE_MAX_FILE_BYTES = env_int("YANDEX_CONTENT_CACHE_MAX_FILE_BYTES", 200 * 1024**2)
+
+# Кэш итогов списка файлов (число и объём) по набору фильтров, секунд; 0 — без кэша.
+FILE_LIST_SUMMARY_CACHE_TTL = env_int("FILE_LIST_SUMMARY_CACHE_TTL", 60)
+
+# Фоновая очередь задач (file_manager/jobs.py, воркер: manage.py run_job_worker).
+# redis — списки в JOB_QUEUE_REDIS_URL; database — таблица BackgroundJob (без Redis).
+JOB_QUEUE_BACKEND = os.getenv(
+    "JOB_QUEUE_BACKEND",
+    "database" if env_bool("CHANNEL_LAYER_IN_MEMORY", False) else "redis",
+).strip().lower()
+JOB_QUEUE_REDIS_URL = _redis_url_for_container(os.getenv("JOB_QUEUE_REDIS_URL", "").strip() or REDIS_URL)
+JOB_QUEUE_EAGER = env_bool("JOB_QUEUE_EAGER", False)
+JOB_QUEUE_VISIBILITY_TIMEOUT = env_int("JOB_QUEUE_VISIBILITY_TIMEOUT", 30 * 60)
+
+# Журнал FileActivity пишется пачками (file_manager/activity_log.py); 0 — каждое событие сразу.
+ACTIVITY_LOG_BUFFER_SIZE = env_int("ACTIVITY_LOG_BUFFER_SIZE", 100)
+ACTIVITY_LOG_FLUSH_INTERVAL = env_int("ACTIVITY_LOG_FLUSH_INTERVAL", 5)
+ACTIVITY_LOG_VIA_QUEUE = env_bool("ACTIVITY_LOG_VIA_QUEUE", False)
+# Старше — сворачивается в дневные сводки командой rollup_file_activity.
+ACTIVITY_LOG_RETENTION_DAYS = env_int("ACTIVITY_LOG_RETENTION_DAYS", 180)
+# Свёрнутые строки журнала переносятся в архивную таблицу FileActivityArchive (false — только удаляются).
+ACTIVITY_LOG_ARCHIVE = env_bool("ACTIVITY_LOG_ARCHIVE", True)
+
+# Извлечение текста, модерация, выгрузка на Яндекс.Диск и версии — в воркере, загрузка отвечает сразу.
+UPLOAD_PROCESSING_IN_BACKGROUND = env_bool("UPLOAD_PROCESSING_IN_BACKGROUND", True)
+
 LIBREOFFICE_PATH = os.getenv("LIBREOFFICE_PATH", "").strip()
+# Пул тёплых headless LibreOffice на процесс (file_manager/libreoffice_pool.py); 0 — soffice на
+# каждую конвертацию. LIBREOFFICE_PYTHON — интерпретатор с модулем uno (по умолчанию ищется сам).
+LIBREOFFICE_WORKERS = env_int("LIBREOFFICE_WORKERS", 2)
+LIBREOFFICE_PYTHON = os.getenv("LIBREOFFICE_PYTHON", "").strip()
+LIBREOFFICE_JOB_TIMEOUT = env_int("LIBREOFFICE_JOB_TIMEOUT", 120)
+LIBREOFFICE_QUEUE_TIMEOUT = env_int("LIBREOFFICE_QUEUE_TIMEOUT", 20)
+LIBREOFFICE_MAX_QUEUE = env_int("LIBREOFFICE_MAX_QUEUE", 8)
+LIBREOFFICE_MAX_JOBS_PER_WORKER = env_int("LIBREOFFICE_MAX_JOBS_PER_WORKER", 200)
+LIBREOFFICE_MAX_RSS_MB = env_int("LIBREOFFICE_MAX_RSS_MB", 1024)
 
 CONVERTAPI_SECRET = os.getenv("CONVERTAPI_SECRET", "").strip()
+# Кэш PDF офисных документов (file_manager/renditions.py): PDF готовится фоновой задачей после
+# загрузки и новой версии. Увеличьте OFFICE_PDF_RENDITION_VERSION, чтобы пересоздать все PDF.
+OFFICE_PDF_EAGER_RENDITIONS = env_bool("OFFICE_PDF_EAGER_RENDITIONS", True)
+OFFICE_PDF_RENDITION_VERSION = os.getenv("OFFICE_PDF_RENDITION_VERSION", "1").strip() or "1"
+# Страницы PDF для просмотрщика: WebP-миниатюры и изображения страниц (pdftoppm из poppler-utils),
+# линеаризованный PDF (qpdf). Без pdftoppm просмотрщик загружает PDF целиком через pdf.js.
+PDFTOPPM_PATH = os.getenv("PDFTOPPM_PATH", "").strip()
+QPDF_PATH = os.getenv("QPDF_PATH", "").strip()
+PDF_THUMBNAIL_WIDTH = env_int("PDF_THUMBNAIL_WIDTH", 200)
+PDF_PAGE_IMAGE_WIDTH = env_int("PDF_PAGE_IMAGE_WIDTH", 1200)
+PDF_THUMBNAIL_PREFETCH_PAGES = env_int("PDF_THUMBNAIL_PREFETCH_PAGES", 50)
+PDF_RENDER_CONCURRENCY = env_int("PDF_RENDER_CONCURRENCY", 2)
+# Миниатюры изображений (file_manager/thumbnails.py): аватары, обложки, вложения чата — рядом
+# с оригиналом в MEDIA, превью файлов — в кэше рендишнов. Пресеты размеров — THUMBNAIL_PRESETS.
+THUMBNAIL_EAGER = env_bool("THUMBNAIL_EAGER", True)
+THUMBNAIL_FORMAT = os.getenv("THUMBNAIL_FORMAT", "webp").strip().lower() or "webp"
+THUMBNAIL_QUALITY = env_int("THUMBNAIL_QUALITY", 80)
+THUMBNAIL_MAX_SOURCE_PIXELS = env_int("THUMBNAIL_MAX_SOURCE_PIXELS", 50_000_000)
 
 CLAMAV_ENABLED = env_bool("CLAMAV_ENABLED", False)
 CLAMAV_FAIL_OPEN = env_bool(
@@ -308,6 +400,18 @@ CLAMAV_SOCKET_PATH = os.getenv("CLAMAV_SOCKET_PATH", "/var/run/clamav/clamd.ctl"
 CLAMAV_USE_TCP = env_bool("CLAMAV_USE_TCP", False)
 CLAMAV_TCP_HOST = os.getenv("CLAMAV_TCP_HOST", "127.0.0.1").strip()
 CLAMAV_TCP_PORT = env_int("CLAMAV_TCP_PORT", 3310)
+# Пул сессий clamd и лимит одновременных проверок на процесс (file_manager/clamav.py).
+CLAMAV_POOL_SIZE = env_int("CLAMAV_POOL_SIZE", 4)
+CLAMAV_MAX_CONCURRENT_SCANS = env_int("CLAMAV_MAX_CONCURRENT_SCANS", 4)
+CLAMAV_QUEUE_TIMEOUT = env_int("CLAMAV_QUEUE_TIMEOUT", 10)
+CLAMAV_TIMEOUT = env_int("CLAMAV_TIMEOUT", 60)
+CLAMAV_IDLE_TIMEOUT = env_int("CLAMAV_IDLE_TIMEOUT", 20)
+# Кэш вердиктов по SHA-256: «чисто» — до обновления баз сигнатур, «заражено» — бессрочно.
+CLAMAV_VERDICT_CACHE = env_bool("CLAMAV_VERDICT_CACHE", True)
+CLAMAV_VERDICT_CACHE_TTL = env_int("CLAMAV_VERDICT_CACHE_TTL", 7 * 24 * 3600)
+CLAMAV_VERSION_CHECK_INTERVAL = env_int("CLAMAV_VERSION_CHECK_INTERVAL", 60)
+# Загрузки принимаются на карантин и проверяются фоновой задачей file.scan_upload.
+CLAMAV_QUARANTINE = env_bool("CLAMAV_QUARANTINE", False)
 
 
 def _log_level(name: str, default: str) -> str:
@@ -171,7 +171,7 @@ class AssignmentSubmitCombinedForm(forms.Form):
         if user:
             self.fields['storage_file'].queryset = File.objects.filter(
                 Q(uploaded_by=user) | Q(visibility='public') | Q(shared_with=user),
-            ).distinct().order_by('-uploaded_at')
+            ).exclude(~Q(uploaded_by=user), processing_state='quarantine').distinct().order_by('-uploaded_at')
 
     def clean(self):
         cleaned_data = super().clean()
@@ -4,6 +4,7 @@ from django.contrib.auth.models import User
 from .models import UserProfile 
 from chat_manager.models import ChatRoom
 from .models import Course
+from file_manager.thumbnails import schedule_thumbnails
 
 @receiver(post_save ,sender =User )
 def create_user_profile(sender ,instance ,created ,**kwargs ):
@@ -14,6 +15,24 @@ def create_user_profile(sender ,instance ,created ,**kwargs ):
 def save_user_profile(sender ,instance ,**kwargs ):
     instance.profile.save()
 
+def _image_field_saved(update_fields, field_name):
+    return update_fields is None or field_name in update_fields
+
+
+@receiver(post_save, sender=UserProfile)
+def schedule_avatar_thumbnails(sender, instance, update_fields=None, **kwargs):
+    """Миниатюры аватара для списков готовит фоновая задача (file_manager/thumbnails.py)."""
+    if _image_field_saved(update_fields, "avatar"):
+        schedule_thumbnails(instance.avatar, ["avatar"])
+
+
+@receiver(post_save, sender=Course)
+def schedule_cover_thumbnails(sender, instance, update_fields=None, **kwargs):
+    """Обложка курса: баннер страницы курса и значок карточки в списке курсов."""
+    if _image_field_saved(update_fields, "cover_image"):
+        schedule_thumbnails(instance.cover_image, ["cover", "icon"])
+
+
 @receiver(post_save, sender=Course)
 def create_course_chat(sender, instance, created, **kwargs):
     """
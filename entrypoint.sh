@@ -1,11 +1,15 @@
 #!/bin/sh
 set -e
 
+# Режим контейнера: web (по умолчанию) — миграции и Daphne; worker — только воркер фоновых
+# задач (сервис worker в docker-compose.yml, перезапускается Docker при падении).
+_mode="${1:-web}"
+
 _clamav_enabled() {
   case "${CLAMAV_ENABLED:-}" in 1|true|True|yes|YES|on|ON) return 0 ;; *) return 1 ;; esac
 }
 
-if _clamav_enabled; then
+if [ "$_mode" = "web" ] && _clamav_enabled; then
   echo "ClamAV: обновление баз (freshclam), первый запуск может занять несколько минут..."
   freshclam --stdout || echo "ClamAV: freshclam завершился с ошибкой (проверьте сеть); clamd может не стартовать без баз."
   echo "ClamAV: запуск clamd..."
@@ -59,6 +63,16 @@ else
   echo "Redis доступен."
 fi
 
+if [ "$_mode" = "worker" ]; then
+  # Миграции применяет web: воркер ждёт их, чтобы не брать задачи на старой схеме.
+  echo "Ожидание миграций..."
+  until python manage.py migrate --check >/dev/null 2>&1; do
+    sleep 2
+  done
+  echo "Запуск воркера фоновых задач..."
+  exec python manage.py run_job_worker
+fi
+
 echo "Миграции..."
 python manage.py migrate --noinput
 
@@ -70,5 +84,16 @@ fi
 echo "Проверка суперпользователя (первый запуск)..."
 python scripts/docker_bootstrap_superuser.py
 
+_job_worker_enabled() {
+  case "${JOB_WORKER_IN_CONTAINER:-true}" in 0|false|False|no|NO|off|OFF) return 1 ;; *) return 0 ;; esac
+}
+
+# Только для запуска образа без docker-compose: за фоновым процессом никто не следит,
+# в compose воркер — отдельный сервис worker, а здесь JOB_WORKER_IN_CONTAINER=false.
+if _job_worker_enabled; then
+  echo "Запуск воркера фоновых задач (в контейнере web)..."
+  python manage.py run_job_worker &
+fi
+
 echo "Запуск ASGI (Daphne)..."
 exec daphne -b 0.0.0.0 -p 8000 classroom.asgi:application
@@ -0,0 +1,190 @@
+"""
+Буферизованная запись журнала FileActivity.
+
+Раньше каждый просмотр, скачивание и загрузка делали отдельный INSERT в запросе — на
+популярных файлах курса журнал удваивал нагрузку на запись. Теперь события копятся
+в буфере процесса и пишутся одним bulk_create:
+  - когда в буфере ACTIVITY_LOG_BUFFER_SIZE событий;
+  - в конце запроса (request_finished), если с прошлой записи прошло
+    ACTIVITY_LOG_FLUSH_INTERVAL секунд;
+  - при завершении процесса (atexit) — события не теряются при штатной остановке;
+  - при ACTIVITY_LOG_VIA_QUEUE пачка уходит задачей activity.write фоновой очереди,
+    а в БД её пишет воркер.
+ACTIVITY_LOG_BUFFER_SIZE=0 — писать каждое событие сразу, как раньше.
+
+Событие попадает в буфер после коммита транзакции, в которой его записали (отменённая
+транзакция не оставляет записи, как и прежний INSERT). Время события берётся при log(),
+а не при записи пачки (FileActivity.created_at — default). Если файл удалили, пока событие
+ждало в буфере, ссылка на него обнуляется, как это сделал бы on_delete=SET_NULL.
+"""
+from __future__ import annotations
+
+import atexit
+import logging
+import threading
+import time
+from typing import Any
+
+from django.conf import settings
+from django.core.signals import request_finished, setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUFFER_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 5
+BULK_BATCH_SIZE = 500
+MAX_RETAINED_EVENTS = 10_000
+
+
+def _buffer_size() -> int:
+    return max(int(getattr(settings, "ACTIVITY_LOG_BUFFER_SIZE", DEFAULT_BUFFER_SIZE) or 0), 0)
+
+
+def _flush_interval() -> float:
+    return float(getattr(settings, "ACTIVITY_LOG_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL) or 0)
+
+
+def _event(file_id, user_id, activity_type, description, ip_address) -> dict[str, Any]:
+    return {
+        "file_id": file_id,
+        "user_id": user_id,
+        "activity_type": activity_type,
+        "description": description,
+        "ip_address": ip_address,
+        "created_at": timezone.now().isoformat(),
+    }
+
+
+def write_events(events: list[dict[str, Any]]) -> int:
+    """Пишет события одним bulk_create; возвращает число записанных строк."""
+    from .models import File, FileActivity
+
+    from django.contrib.auth.models import User
+
+    if not events:
+        return 0
+    # Пока событие ждало в буфере, файл или пользователя могли удалить: ссылка на файл
+    # обнуляется (SET_NULL), событие удалённого пользователя отбрасывается (CASCADE).
+    # Проверка заранее, а не по IntegrityError: в PostgreSQL внешние ключи проверяются при коммите.
+    file_ids = {event["file_id"] for event in events if event["file_id"]}
+    existing = set(File.objects.filter(pk__in=file_ids).order_by().values_list("pk", flat=True)) if file_ids else set()
+    users = set(User.objects.filter(pk__in={event["user_id"] for event in events}).values_list("pk", flat=True))
+    events = [event for event in events if event["user_id"] in users]
+    FileActivity.objects.bulk_create(
+        [
+            FileActivity(
+                file_id=event["file_id"] if event["file_id"] in existing else None,
+                user_id=event["user_id"],
+                activity_type=event["activity_type"],
+                description=event["description"],
+                ip_address=event["ip_address"],
+                created_at=parse_datetime(event["created_at"]),
+            )
+            for event in events
+        ],
+        batch_size=BULK_BATCH_SIZE,
+    )
+    return len(events)
+
+
+class ActivityBuffer:
+    """Буфер событий процесса; потокобезопасен."""
+
+    def __init__(self):
+        self._events: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def add(self, event: dict[str, Any]) -> None:
+        with self._lock:
+            self._events.append(event)
+            full = len(self._events) >= _buffer_size()
+        if full:
+            self.flush()
+
+    def flush_if_due(self) -> None:
+        if self._events and time.monotonic() - self._last_flush >= _flush_interval():
+            self.flush()
+
+    def flush(self) -> int:
+        with self._lock:
+            events, self._events = self._events, []
+            self._last_flush = time.monotonic()
+        if not events:
+            return 0
+        if getattr(settings, "ACTIVITY_LOG_VIA_QUEUE", False):
+            from .jobs import enqueue
+
+            enqueue("activity.write", events=events)
+            return len(events)
+        try:
+            return write_events(events)
+        except Exception:
+            # Журнал не должен ронять запрос; пачка вернётся в буфер до следующей записи.
+            logger.warning("activity_log: не удалось записать %s событий", len(events), exc_info=True)
+            with self._lock:
+                # При долгой недоступности БД буфер не растёт бесконечно: старые события отбрасываются.
+                self._events[:0] = events[-MAX_RETAINED_EVENTS:]
+                del self._events[:-MAX_RETAINED_EVENTS]
+            return 0
+
+
+_buffer = ActivityBuffer()
+
+
+def get_buffer() -> ActivityBuffer:
+    return _buffer
+
+
+def log(file, user, activity_type, description="", ip_address=None):
+    """
+    Добавляет событие в журнал. При ACTIVITY_LOG_BUFFER_SIZE=0 пишет сразу и возвращает
+    FileActivity, иначе кладёт в буфер и возвращает None.
+    """
+    from .models import FileActivity
+
+    file_id = getattr(file, "pk", None)
+    if _buffer_size() <= 0:
+        return FileActivity.objects.create(
+            file_id=file_id,
+            user=user,
+            activity_type=activity_type,
+            description=description,
+            ip_address=ip_address,
+        )
+    event = _event(file_id, user.pk, activity_type, description, ip_address)
+    # В буфер — только после коммита: событие отменённой транзакции не записывается, как и прежний INSERT.
+    transaction.on_commit(lambda: _buffer.add(event))
+    return None
+
+
+def flush() -> int:
+    return _buffer.flush()
+
+
+def _flush_at_exit() -> None:
+    try:
+        flush()
+    except Exception:
+        logger.exception("activity_log: события не записаны при завершении процесса")
+
+
+atexit.register(_flush_at_exit)
+
+
+@receiver(request_finished)
+def _flush_after_request(**kwargs):
+    _buffer.flush_if_due()
+
+
+@receiver(setting_changed)
+def _flush_on_setting_change(*, setting, **kwargs):
+    if setting.startswith("ACTIVITY_LOG_"):
+        flush()
@@ -0,0 +1,110 @@
+"""
+Хранение журнала FileActivity: подробные строки за ACTIVITY_LOG_RETENTION_DAYS дней,
+всё, что старше, — дневные сводки FileActivityDailyRollup (файл, пользователь, тип, число).
+
+Команда rollup_file_activity (по cron раз в сутки) сворачивает журнал по одному дню:
+в одной транзакции считает группы, добавляет их к сводкам, копирует исходные строки
+в архив FileActivityArchive (ACTIVITY_LOG_ARCHIVE) и удаляет их из журнала, поэтому
+прерванный запуск не задваивает ни счётчики, ни архив, а повторный продолжает с того же дня.
+Рабочая таблица журнала остаётся ограниченной по размеру: вместо секционирования по месяцам
+(только PostgreSQL, а тесты и разработка идут на SQLite) старые строки уходят в архив.
+"""
+from __future__ import annotations
+
+import datetime
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from .models import FileActivity, FileActivityArchive, FileActivityDailyRollup
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RETENTION_DAYS = 180
+ARCHIVE_BATCH_SIZE = 1000
+
+
+def retention_cutoff(days: int | None = None) -> datetime.datetime:
+    """Начало локального дня, раньше которого строки журнала сворачиваются."""
+    if days is None:
+        days = int(getattr(settings, "ACTIVITY_LOG_RETENTION_DAYS", DEFAULT_RETENTION_DAYS) or 0)
+    today = timezone.localdate()
+    return _day_start(today - datetime.timedelta(days=max(days, 0)))
+
+
+def _day_start(day: datetime.date) -> datetime.datetime:
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def rollup_day(day: datetime.date, *, dry_run: bool = False) -> tuple[int, int]:
+    """Сворачивает строки журнала за день day; (строк журнала, групп в сводке)."""
+    rows = FileActivity.objects.filter(
+        created_at__gte=_day_start(day),
+        created_at__lt=_day_start(day + datetime.timedelta(days=1)),
+    )
+    with transaction.atomic():
+        groups = list(
+            rows.order_by().values("file_id", "user_id", "activity_type").annotate(total=Count("id"))
+        )
+        total_rows = sum(group["total"] for group in groups)
+        if dry_run or not groups:
+            return total_rows, len(groups)
+        # Сводка за этот день уже может быть (строки, дописанные буфером после прошлого запуска).
+        existing = {
+            (rollup.file_id, rollup.user_id, rollup.activity_type): rollup
+            for rollup in FileActivityDailyRollup.objects.select_for_update().filter(day=day)
+        }
+        created, updated = [], []
+        for group in groups:
+            key = (group["file_id"], group["user_id"], group["activity_type"])
+            rollup = existing.get(key)
+            if rollup is None:
+                created.append(FileActivityDailyRollup(
+                    day=day,
+                    file_id=group["file_id"],
+                    user_id=group["user_id"],
+                    activity_type=group["activity_type"],
+                    count=group["total"],
+                ))
+            else:
+                rollup.count += group["total"]
+                updated.append(rollup)
+        FileActivityDailyRollup.objects.bulk_create(created, batch_size=1000)
+        FileActivityDailyRollup.objects.bulk_update(updated, ["count"], batch_size=1000)
+        if getattr(settings, "ACTIVITY_LOG_ARCHIVE", True):
+            _archive(rows)
+        rows.delete()
+    return total_rows, len(groups)
+
+
+def _archive(rows) -> None:
+    """Копирует строки журнала в FileActivityArchive пачками, не загружая день целиком."""
+    batch = []
+    fields = ("id", "file_id", "user_id", "activity_type", "description", "created_at", "ip_address")
+    for row in rows.order_by().values(*fields).iterator(chunk_size=ARCHIVE_BATCH_SIZE):
+        batch.append(FileActivityArchive(original_id=row.pop("id"), **row))
+        if len(batch) >= ARCHIVE_BATCH_SIZE:
+            FileActivityArchive.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        FileActivityArchive.objects.bulk_create(batch)
+
+
+def rollup_activity(*, days: int | None = None, dry_run: bool = False) -> dict[str, int]:
+    """Сворачивает все дни раньше retention_cutoff; возвращает счётчики для отчёта."""
+    cutoff = retention_cutoff(days)
+    report = {"days": 0, "rows": 0, "groups": 0}
+    pending = FileActivity.objects.filter(created_at__lt=cutoff)
+    # Пустые дни пропускаются: следующий день берётся по самой ранней оставшейся строке.
+    while (oldest := pending.aggregate(oldest=Min("created_at"))["oldest"]) is not None:
+        day = timezone.localtime(oldest).date()
+        rows, groups = rollup_day(day, dry_run=dry_run)
+        report["days"] += 1
+        report["rows"] += rows
+        report["groups"] += groups
+        logger.info("activity rollup day=%s rows=%s groups=%s dry_run=%s", day, rows, groups, dry_run)
+        pending = pending.filter(created_at__gte=_day_start(day + datetime.timedelta(days=1)))
+    return report
@@ -2,11 +2,16 @@ from django import forms
 from django.contrib import admin
 from django.utils.html import format_html
 from .models import (
+    BackgroundJob,
+    ContentBlob,
     File,
     Tag,
     FileComment,
     FileVersion,
     FileActivity,
+    FileActivityArchive,
+    FileActivityDailyRollup,
+    Rendition,
     UserStorageQuota,
 )
 
@@ -53,11 +58,17 @@ class FileAdmin(admin.ModelAdmin):
     ]
     readonly_fields =[
     'file_size','extracted_text','download_count',
-    'version','uploaded_at','updated_at'
+    'version','uploaded_at','updated_at','content_sha256'
     ]
     filter_horizontal = ["shared_with", "favorite"]
     date_hierarchy ='uploaded_at'
 
+    def save_model(self ,request ,obj ,form ,change ):
+        # Заменённый вручную файл: запомненный хэш старого содержимого больше не верен.
+        if 'file'in form.changed_data :
+            obj.content_sha256 =""
+        super().save_model(request ,obj ,form ,change )
+
     def title_display(self ,obj ):
         return format_html('<i class="bi bi-file-earmark"></i> {}',obj.title )
     title_display.short_description ='Название'
@@ -136,6 +147,25 @@ class FileActivityAdmin(admin.ModelAdmin ):
         )
     activity_type_display.short_description ='Тип активности'
 
+@admin.register(FileActivityDailyRollup )
+class FileActivityDailyRollupAdmin(admin.ModelAdmin ):
+    list_display =['day','user','activity_type','file','count']
+    list_filter =['activity_type','day']
+    search_fields =['user__username','file__title']
+    date_hierarchy ='day'
+    raw_id_fields =['file','user']
+
+@admin.register(FileActivityArchive )
+class FileActivityArchiveAdmin(admin.ModelAdmin ):
+    list_display =['created_at','user_id','activity_type','file_id','ip_address']
+    list_filter =['activity_type']
+    search_fields =['description']
+    date_hierarchy ='created_at'
+    readonly_fields =[
+    'original_id','file_id','user_id','activity_type',
+    'description','created_at','ip_address'
+    ]
+
 @admin.register(UserStorageQuota )
 class UserStorageQuotaAdmin(admin.ModelAdmin ):
     list_display =[
@@ -173,4 +203,26 @@ class UserStorageQuotaAdmin(admin.ModelAdmin ):
         '{}%</div></div>',
         color ,width_str ,percentage_str ,percentage_str 
         )
-    used_percentage_display.short_description ='Использовано'
\ No newline at end of file
+    used_percentage_display.short_description ='Использовано'
+
+
+@admin.register(ContentBlob)
+class ContentBlobAdmin(admin.ModelAdmin):
+    list_display = ["sha256", "size", "ref_count", "storage_path", "last_referenced_at"]
+    search_fields = ["sha256", "storage_path"]
+    readonly_fields = ["sha256", "size", "storage_path", "ref_count", "created_at", "last_referenced_at"]
+
+
+@admin.register(Rendition)
+class RenditionAdmin(admin.ModelAdmin):
+    list_display = ["source_sha256", "kind", "converter_version", "size", "created_at"]
+    list_filter = ["kind", "converter_version"]
+    search_fields = ["source_sha256"]
+    readonly_fields = ["source_sha256", "kind", "converter_version", "content_blob", "size", "created_at"]
+
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ["id", "name", "status", "attempts", "max_attempts", "run_after", "updated_at"]
+    list_filter = ["status", "name"]
+    readonly_fields = ["created_at", "updated_at", "locked_at", "last_error"]
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class FileManagerConfig(AppConfig ):
     name ='file_manager'
+
+    def ready(self ):
+        from file_manager.signals import connect_blob_reference_signals ,connect_file_list_summary_signals 
+
+        connect_blob_reference_signals()
+        connect_file_list_summary_signals()
@@ -0,0 +1,215 @@
+"""
+Контентно-адресуемое хранилище локальных файлов.
+
+Байты сохраняются один раз по пути blobs/<sha[:2]>/<sha[2:4]>/<sha256>[.ext] в default_storage;
+File.file, FileVersion.version_file/blob_storage_path и вложения чата указывают на этот путь,
+а ссылку на строку ContentBlob держат через поле content_blob.
+
+Счётчик ссылок:
+  acquire_blob() — +1 (каждая запись File / FileVersion / Message держит одну ссылку);
+  release_blob() — -1, вызывается при замене содержимого и в post_delete (signals.py).
+Сами байты удаляет только collect_garbage() (команда collect_blobs): blob без ссылок
+старше grace-периода, после пересчёта реальных ссылок из БД.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+from datetime import timedelta
+from pathlib import PurePosixPath
+
+from django.core.files.base import ContentFile, File as DjangoFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ContentBlob, File, FileVersion
+from .thumbnails import delete_sidecars
+
+logger = logging.getLogger(__name__)
+
+BLOB_ROOT = "blobs"
+HASH_CHUNK_SIZE = 1024 * 1024
+DEFAULT_GC_GRACE = timedelta(hours=1)
+
+
+def blob_storage_path(sha256: str, original_name: str = "") -> str:
+    ext = PurePosixPath(original_name or "").suffix.lower()
+    if not ext[1:].isalnum() or len(ext) > 11:
+        ext = ""
+    return f"{BLOB_ROOT}/{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}"
+
+
+def hash_source(source) -> tuple[str, int]:
+    """(SHA-256, размер) bytes, пути к файлу или файлового объекта; файл читается блоками."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(source).hexdigest(), len(source)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as fh:
+            return hash_source(fh)
+    digest = hashlib.sha256()
+    size = 0
+    if hasattr(source, "seek"):
+        source.seek(0)
+    chunks = source.chunks(HASH_CHUNK_SIZE) if hasattr(source, "chunks") else iter(
+        lambda: source.read(HASH_CHUNK_SIZE), b""
+    )
+    for chunk in chunks:
+        digest.update(chunk)
+        size += len(chunk)
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return digest.hexdigest(), size
+
+
+def _as_django_file(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return ContentFile(bytes(source))
+    if isinstance(source, DjangoFile):
+        return source
+    return DjangoFile(source)
+
+
+def acquire_blob(source, original_name: str = "", *, sha256: str | None = None) -> ContentBlob:
+    """
+    Сохраняет содержимое (bytes, UploadedFile, открытый файл или путь к файлу) в blob-хранилище
+    и увеличивает счётчик ссылок. Повторная загрузка тех же байтов на диск не пишет.
+    sha256 можно передать, если хеш bytes уже посчитан.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as fh:
+            return acquire_blob(fh, original_name, sha256=sha256)
+    if sha256 and isinstance(source, (bytes, bytearray, memoryview)):
+        size = len(source)
+    else:
+        sha256, size = hash_source(source)
+    blob = ContentBlob.objects.filter(sha256=sha256).first()
+    saved_name = None
+    if blob is None or not default_storage.exists(blob.storage_path):
+        target = blob_storage_path(sha256, original_name)
+        if default_storage.exists(target):
+            saved_name = target
+        else:
+            saved_name = default_storage.save(target, _as_django_file(source))
+
+    if blob is None:
+        try:
+            with transaction.atomic():
+                blob, _ = ContentBlob.objects.get_or_create(
+                    sha256=sha256,
+                    defaults={"size": size, "storage_path": saved_name},
+                )
+        except IntegrityError:
+            blob = ContentBlob.objects.get(sha256=sha256)
+
+    if saved_name and blob.storage_path != saved_name:
+        if default_storage.exists(blob.storage_path):
+            # Параллельная загрузка тех же байтов уже записала копию — лишнюю убираем.
+            default_storage.delete(saved_name)
+        else:
+            blob.storage_path = saved_name
+            ContentBlob.objects.filter(pk=blob.pk).update(storage_path=saved_name)
+
+    updated = ContentBlob.objects.filter(pk=blob.pk).update(
+        ref_count=F("ref_count") + 1,
+        last_referenced_at=timezone.now(),
+    )
+    if not updated:
+        # Сборщик мусора успел удалить строку между чтением и инкрементом — записываем заново.
+        return acquire_blob(source, original_name, sha256=sha256)
+    blob.refresh_from_db(fields=["ref_count", "last_referenced_at"])
+    return blob
+
+
+def release_blob(blob_id: int | None) -> None:
+    """Снимает одну ссылку; сами байты удаляет только сборщик мусора."""
+    if not blob_id:
+        return
+    ContentBlob.objects.filter(pk=blob_id).update(
+        ref_count=F("ref_count") - 1,
+        last_referenced_at=timezone.now(),
+    )
+
+
+def is_blob_path(name: str | None) -> bool:
+    return bool(name) and str(name).startswith(f"{BLOB_ROOT}/")
+
+
+def count_blob_references(blob: ContentBlob) -> int:
+    """Реальное число ссылок по всем моделям с ForeignKey на ContentBlob."""
+    total = 0
+    for rel in ContentBlob._meta.related_objects:
+        if rel.one_to_many:
+            total += rel.related_model._default_manager.filter(**{rel.field.name: blob}).count()
+    return total
+
+
+def recount_references() -> int:
+    """Пересчитывает ref_count всех blob по БД (после сбоев между записью blob и строки). Возвращает число исправлений."""
+    fixed = 0
+    for blob in ContentBlob.objects.only("pk", "ref_count").iterator():
+        refs = count_blob_references(blob)
+        if refs != blob.ref_count:
+            ContentBlob.objects.filter(pk=blob.pk).update(ref_count=refs)
+            fixed += 1
+    return fixed
+
+
+def collect_garbage(*, grace: timedelta = DEFAULT_GC_GRACE, dry_run: bool = False) -> tuple[int, int]:
+    """
+    Удаляет blob без ссылок, к которым не обращались дольше grace.
+    Возвращает (число удалённых blob, освобождённые байты).
+    """
+    cutoff = timezone.now() - grace
+    candidate_ids = list(
+        ContentBlob.objects.filter(ref_count__lte=0, last_referenced_at__lt=cutoff).values_list("pk", flat=True)
+    )
+    removed = 0
+    freed = 0
+    for blob_id in candidate_ids:
+        with transaction.atomic():
+            blob = ContentBlob.objects.select_for_update().filter(pk=blob_id).first()
+            if blob is None:
+                continue
+            # Строка перечитана под блокировкой: пока шёл отбор, acquire_blob мог взять blob
+            # заново (ref_count растёт сразу, а строка File сохраняется позже — ссылок по FK ещё нет).
+            if blob.ref_count > 0 or blob.last_referenced_at >= cutoff:
+                continue
+            refs = count_blob_references(blob)
+            if refs:
+                if blob.ref_count != refs:
+                    logger.warning("blobstore: ref_count %s -> %s sha256=%s", blob.ref_count, refs, blob.sha256)
+                    ContentBlob.objects.filter(pk=blob.pk).update(ref_count=refs)
+                continue
+            removed += 1
+            freed += blob.size
+            if dry_run:
+                continue
+            storage_path = blob.storage_path
+            blob.delete()
+            transaction.on_commit(lambda p=storage_path: _delete_blob_file(p))
+    return removed, freed
+
+
+def _delete_blob_file(storage_path: str) -> None:
+    default_storage.delete(storage_path)
+    # Миниатюры вложений чата лежат рядом с blob (thumbnails.py).
+    delete_sidecars(storage_path)
+
+
+def storage_totals() -> dict[str, int]:
+    """
+    Логический объём (сумма размеров всех файлов и blob-версий, как видит пользователь)
+    и физический (реально записанные уникальные blob).
+    """
+    logical = (File.objects.aggregate(total=models.Sum("file_size"))["total"] or 0) + (
+        FileVersion.objects.filter(content_blob__isnull=False).aggregate(total=models.Sum("blob_size"))["total"] or 0
+    )
+    physical = ContentBlob.objects.aggregate(total=models.Sum("size"))["total"] or 0
+    return {
+        "logical_bytes": logical,
+        "physical_bytes": physical,
+        "blob_count": ContentBlob.objects.count(),
+    }
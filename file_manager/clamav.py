@@ -6,18 +6,385 @@
   CLAMAV_FAIL_OPEN — если True и демон недоступен, файл всё равно принимается (с предупреждением).
   CLAMAV_SOCKET_PATH — сокет Unix clamd.
   CLAMAV_USE_TCP / CLAMAV_TCP_HOST / CLAMAV_TCP_PORT — альтернатива TCP.
+  CLAMAV_POOL_SIZE — сколько простаивающих соединений держать открытыми.
+  CLAMAV_MAX_CONCURRENT_SCANS / CLAMAV_QUEUE_TIMEOUT — не больше N проверок одновременно на процесс;
+    кто ждёт слот дольше таймаута, получает skipped="busy" (дальше — как при недоступном демоне).
+  CLAMAV_TIMEOUT — таймаут сокета, CLAMAV_IDLE_TIMEOUT — соединение, простоявшее дольше,
+    не переиспользуется (clamd закрывает сессию по своему IdleTimeout, по умолчанию 30 с).
+  CLAMAV_QUARANTINE — не ждать clamd в запросе: загрузка и новая версия принимаются в состоянии
+    «quarantine», проверяет фоновая задача file.scan_upload; до результата содержимое
+    недоступно (File.is_content_available). Команда rescan_media перепроверяет хранилище
+    после обновления баз.
+  CLAMAV_VERDICT_CACHE — кэш вердиктов по SHA-256 содержимого (Django cache):
+    «чисто» действует, пока не сменилась версия баз сигнатур (команда VERSION, проверяется
+    не чаще CLAMAV_VERSION_CHECK_INTERVAL секунд, хранится CLAMAV_VERDICT_CACHE_TTL),
+    «заражено» — бессрочно. Одна и та же лекция от 120 студентов проверяется один раз.
+
+Клиент говорит с clamd напрямую (протокол INSTREAM в сессии IDSESSION), без python-clamd,
+который открывает новый сокет на каждую команду и принимает только целый буфер:
+  - содержимое уходит кусками из UploadedFile.chunks(), открытого файла или пути на диске,
+    целиком в памяти файл не собирается;
+  - соединения в сессии IDSESSION берутся из небольшого пула, а не открываются на каждый файл;
+  - число одновременных проверок ограничено семафором: всплеск загрузок перед дедлайном
+    ждёт в очереди, а не перегружает clamd и воркеры.
 """
 from __future__ import annotations
 
-import io
+import atexit
+import contextlib
 import logging
+import os
+import socket
+import struct
+import threading
+import hashlib
 import time
-from typing import Any
+from typing import Any, Callable, Iterable, Iterator
 
 from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 
 logger = logging.getLogger(__name__)
 
+CHUNK_SIZE = 64 * 1024
+DEFAULT_POOL_SIZE = 4
+DEFAULT_MAX_CONCURRENT_SCANS = 4
+DEFAULT_VERDICT_CACHE_TTL = 7 * 24 * 3600
+
+_cache_stats = {"hits": 0, "misses": 0}
+_cache_stats_lock = threading.Lock()
+
+
+class ClamdError(Exception):
+    """clamd недоступен, закрыл соединение или ответил ошибкой протокола."""
+
+
+class ClamdUnavailableError(ClamdError):
+    """Не удалось подключиться к clamd."""
+
+
+class ClamdBusyError(ClamdError):
+    """Все слоты проверки заняты дольше CLAMAV_QUEUE_TIMEOUT."""
+
+
+class ClamdConnection:
+    """Одно соединение с clamd в режиме IDSESSION: команды идут подряд без переподключения."""
+
+    def __init__(self, family: int, address, timeout: float):
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(address)
+            self.sock.sendall(b"zIDSESSION\0")
+        except OSError:
+            self.sock.close()
+            raise
+        self.last_used = time.monotonic()
+        self.broken = False
+        self._next_id = 1
+        self._buffer = b""
+
+    def _command(self, command: bytes) -> int:
+        request_id = self._next_id
+        self._next_id += 1
+        self.sock.sendall(b"z" + command + b"\0")
+        return request_id
+
+    def _reply(self, request_id: int) -> str:
+        while b"\0" not in self._buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                raise ClamdError("clamd закрыл соединение")
+            self._buffer += data
+        raw, self._buffer = self._buffer.split(b"\0", 1)
+        prefix, _, reply = raw.decode("utf-8", "replace").partition(": ")
+        if prefix != str(request_id):
+            raise ClamdError(f"Неожиданный ответ clamd: {raw!r}")
+        return reply
+
+    def version(self) -> str:
+        return self._reply(self._command(b"VERSION"))
+
+    def instream(self, chunks: Iterable[bytes]) -> str:
+        """Ответ clamd на поток: «stream: OK», «stream: <сигнатура> FOUND» или «… ERROR»."""
+        request_id = self._command(b"INSTREAM")
+        for chunk in chunks:
+            if chunk:
+                self.sock.sendall(struct.pack("!L", len(chunk)) + bytes(chunk))
+        self.sock.sendall(struct.pack("!L", 0))
+        reply = self._reply(request_id)
+        if reply.endswith("ERROR"):
+            # После ошибки (например, StreamMaxLength) clamd закрывает сессию.
+            self.broken = True
+            raise ClamdError(reply)
+        return reply
+
+    def close(self) -> None:
+        with contextlib.suppress(OSError):
+            self.sock.sendall(b"zEND\0")
+        with contextlib.suppress(OSError):
+            self.sock.close()
+
+
+class ClamdPool:
+    """Пул сессий clamd с ограничением одновременных проверок."""
+
+    def __init__(
+        self,
+        family: int,
+        address,
+        *,
+        size: int = DEFAULT_POOL_SIZE,
+        max_concurrent: int = DEFAULT_MAX_CONCURRENT_SCANS,
+        queue_timeout: float = 10,
+        timeout: float = 60,
+        idle_timeout: float = 20,
+    ):
+        self.family = family
+        self.address = address
+        self.size = size
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._slots = threading.BoundedSemaphore(max(max_concurrent, 1))
+        self._idle: list[ClamdConnection] = []
+        self._lock = threading.Lock()
+        self._signature_version: str | None = None
+        self._signature_checked = 0.0
+
+    def _connect(self) -> ClamdConnection:
+        try:
+            return ClamdConnection(self.family, self.address, self.timeout)
+        except OSError as exc:
+            raise ClamdUnavailableError(f"Не удалось подключиться к clamd ({self.address}): {exc}") from exc
+
+    def _checkout(self) -> ClamdConnection | None:
+        """Свежайшее простаивающее соединение; протухшие закрываются."""
+        deadline = time.monotonic() - self.idle_timeout
+        with self._lock:
+            while self._idle:
+                conn = self._idle.pop()
+                if conn.last_used >= deadline:
+                    return conn
+                conn.close()
+        return None
+
+    def _checkin(self, conn: ClamdConnection) -> None:
+        conn.last_used = time.monotonic()
+        with self._lock:
+            if not conn.broken and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def _call(self, func: Callable[[ClamdConnection], Any]) -> Any:
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise ClamdBusyError("Все слоты антивирусной проверки заняты")
+        try:
+            conn = self._checkout()
+            if conn is not None:
+                try:
+                    result = func(conn)
+                except (OSError, ClamdError) as exc:
+                    conn.close()
+                    if conn.broken:
+                        raise ClamdError(str(exc)) from exc
+                    # Сессию мог закрыть сам clamd (IdleTimeout) — повтор на новом соединении.
+                    logger.debug("clamav: переподключение после %s", exc)
+                else:
+                    self._checkin(conn)
+                    return result
+            conn = self._connect()
+            try:
+                result = func(conn)
+            except OSError as exc:
+                conn.close()
+                raise ClamdError(str(exc)) from exc
+            except BaseException:
+                conn.close()
+                raise
+            self._checkin(conn)
+            return result
+        finally:
+            self._slots.release()
+
+    def scan(self, open_chunks: Callable[[], Iterable[bytes]]) -> str:
+        """open_chunks() даёт итератор кусков заново — на случай повтора на новом соединении."""
+        return self._call(lambda conn: conn.instream(open_chunks()))
+
+    def version(self) -> str:
+        return self._call(lambda conn: conn.version())
+
+    def signature_version(self, max_age: float) -> str:
+        """Версия баз: «ClamAV 1.0.5/27400/Fri Oct 16 …» -> «27400»; VERSION не чаще раза в max_age."""
+        now = time.monotonic()
+        if self._signature_version is None or now - self._signature_checked >= max_age:
+            reply = self.version()
+            parts = reply.split("/")
+            self._signature_version = parts[1].strip() if len(parts) >= 3 else reply.strip()
+            self._signature_checked = now
+        return self._signature_version
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pool: ClamdPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ClamdPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if getattr(settings, "CLAMAV_USE_TCP", False):
+                    family = socket.AF_INET
+                    address = (
+                        getattr(settings, "CLAMAV_TCP_HOST", "127.0.0.1"),
+                        int(getattr(settings, "CLAMAV_TCP_PORT", 3310)),
+                    )
+                else:
+                    family = socket.AF_UNIX
+                    address = getattr(settings, "CLAMAV_SOCKET_PATH", "/var/run/clamav/clamd.ctl")
+                _pool = ClamdPool(
+                    family,
+                    address,
+                    size=int(getattr(settings, "CLAMAV_POOL_SIZE", DEFAULT_POOL_SIZE) or 0),
+                    max_concurrent=int(
+                        getattr(settings, "CLAMAV_MAX_CONCURRENT_SCANS", DEFAULT_MAX_CONCURRENT_SCANS) or 1
+                    ),
+                    queue_timeout=float(getattr(settings, "CLAMAV_QUEUE_TIMEOUT", 10) or 0),
+                    timeout=float(getattr(settings, "CLAMAV_TIMEOUT", 60) or 60),
+                    idle_timeout=float(getattr(settings, "CLAMAV_IDLE_TIMEOUT", 20) or 0),
+                )
+    return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+
+
+atexit.register(shutdown_pool)
+
+
+@receiver(setting_changed)
+def _reset_pool(*, setting, **kwargs):
+    if setting.startswith("CLAMAV_"):
+        shutdown_pool()
+
+
+def _iter_source(source) -> Iterator[bytes]:
+    """Куски содержимого: bytes, django File/UploadedFile (chunks()), путь или открытый файл."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        for offset in range(0, len(view), CHUNK_SIZE):
+            yield view[offset : offset + CHUNK_SIZE]
+        return
+    if hasattr(source, "chunks"):
+        # File.chunks() сама перематывает файл в начало.
+        yield from source.chunks(CHUNK_SIZE)
+        return
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as fh:
+            yield from iter(lambda: fh.read(CHUNK_SIZE), b"")
+        return
+    if hasattr(source, "seek"):
+        source.seek(0)
+    yield from iter(lambda: source.read(CHUNK_SIZE), b"")
+
+
+def _source_size(source) -> int:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return len(source)
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    size = getattr(source, "size", None)
+    if size is None and hasattr(source, "fileno"):
+        with contextlib.suppress(OSError, ValueError):
+            size = os.fstat(source.fileno()).st_size
+    return int(size or 0)
+
+
+def quarantine_enabled() -> bool:
+    return bool(getattr(settings, "CLAMAV_ENABLED", False) and getattr(settings, "CLAMAV_QUARANTINE", False))
+
+
+def quarantine_placeholder() -> dict[str, Any]:
+    """Результат «проверка отложена»: файл принят на карантин, проверит фоновая задача."""
+    return {
+        "performed": False,
+        "clean": None,
+        "threat": None,
+        "error": None,
+        "skipped": "quarantine",
+    }
+
+
+def _sha256_of(source) -> str:
+    digest = hashlib.sha256()
+    for chunk in _iter_source(source):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _infected_key(sha256: str) -> str:
+    return f"clamav:verdict:infected:{sha256}"
+
+
+def _clean_key(sha256: str, signature_version: str) -> str:
+    return f"clamav:verdict:clean:{signature_version}:{sha256}"
+
+
+def _count_cache_lookup(hit: bool) -> float:
+    """Учитывает обращение к кэшу вердиктов, возвращает долю попаданий в процессе."""
+    with _cache_stats_lock:
+        _cache_stats["hits" if hit else "misses"] += 1
+        total = _cache_stats["hits"] + _cache_stats["misses"]
+        return _cache_stats["hits"] / total
+
+
+def verdict_cache_stats() -> dict[str, float]:
+    with _cache_stats_lock:
+        hits, misses = _cache_stats["hits"], _cache_stats["misses"]
+    total = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.0}
+
+
+def _cached_verdict(sha256: str) -> tuple[dict[str, Any] | None, str | None]:
+    """(вердикт из кэша или None, версия баз для записи нового вердикта)."""
+    threat = cache.get(_infected_key(sha256))
+    if threat is not None:
+        return {"performed": True, "clean": False, "threat": threat, "error": None, "skipped": None}, None
+    try:
+        signature_version = get_pool().signature_version(
+            float(getattr(settings, "CLAMAV_VERSION_CHECK_INTERVAL", 60) or 0)
+        )
+    except (ClamdError, OSError) as exc:
+        # Без версии баз «чистому» вердикту верить нельзя; дальше проверка сама сообщит об ошибке.
+        logger.debug("clamav VERSION недоступна: %s", exc)
+        return None, None
+    if cache.get(_clean_key(sha256, signature_version)):
+        return {"performed": True, "clean": True, "threat": None, "error": None, "skipped": None}, signature_version
+    return None, signature_version
+
+
+def _remember_verdict(out: dict[str, Any], sha256: str, signature_version: str | None) -> None:
+    if out.get("clean") is False and out.get("threat"):
+        cache.set(_infected_key(sha256), out["threat"], None)
+    elif out.get("clean") is True and signature_version:
+        ttl = int(getattr(settings, "CLAMAV_VERDICT_CACHE_TTL", DEFAULT_VERDICT_CACHE_TTL) or DEFAULT_VERDICT_CACHE_TTL)
+        cache.set(_clean_key(sha256, signature_version), 1, ttl)
+
 
 def _scan_log_ctx(
     size: int,
@@ -38,9 +405,12 @@ def _log_scan_outcome(
     size: int,
     user_id: int | None,
     filename: str | None,
+    cache_status: str | None = None,
 ) -> None:
     duration_ms = (time.monotonic() - started) * 1000
     ctx = _scan_log_ctx(size, user_id=user_id, filename=filename)
+    if cache_status:
+        ctx = f"{ctx} cache={cache_status} cache_hit_rate={verdict_cache_stats()['hit_rate']:.2f}"
     if out.get("performed") and out.get("clean") is True:
         logger.info("clamav scan clean %s duration_ms=%.1f", ctx, duration_ms)
         return
@@ -62,23 +432,39 @@ def _log_scan_outcome(
         )
 
 
-def scan_upload_bytes(
-    data: bytes,
+def _not_scanned(skipped: str, error: str | None, ctx: str) -> dict[str, Any]:
+    if getattr(settings, "CLAMAV_FAIL_OPEN", True):
+        logger.info("clamav accept without scan (fail_open) skipped=%s %s", skipped, ctx)
+    return {
+        "performed": False,
+        "clean": None,
+        "threat": None,
+        "error": error,
+        "skipped": skipped,
+    }
+
+
+def scan_upload(
+    source,
     *,
     user_id: int | None = None,
     filename: str | None = None,
+    sha256: str | None = None,
 ) -> dict[str, Any]:
     """
-    Результат проверки байтов файла.
+    Результат проверки файла. source — bytes, UploadedFile / django File, путь к файлу
+    или открытый бинарный файл; содержимое уходит в clamd кусками по CHUNK_SIZE.
+    sha256 — если хеш содержимого уже известен (иначе считается для кэша вердиктов).
 
     Ключи:
       performed — была ли попытка реальной проверки clamd
       clean — True / False / None (None если проверки не было)
       threat — имя сигнатуры при clean=False
-      error — текст ошибки демона / модуля
-      skipped — короткий код причины пропуска
+      error — текст ошибки демона
+      skipped — короткий код причины пропуска (disabled, daemon, busy, scan_error)
+      cached — вердикт взят из кэша (только при performed)
     """
-    size = len(data)
+    size = _source_size(source)
     ctx = _scan_log_ctx(size, user_id=user_id, filename=filename)
 
     if not getattr(settings, "CLAMAV_ENABLED", False):
@@ -91,98 +477,56 @@ def scan_upload_bytes(
             "skipped": "disabled",
         }
 
-    try:
-        import clamd
-    except ImportError:
-        err = "Пакет clamd не установлен (pip install clamd)"
-        logger.error("clamav %s %s", err, ctx)
-        if getattr(settings, "CLAMAV_FAIL_OPEN", True):
-            logger.info("clamav accept without scan (fail_open) skipped=no_module %s", ctx)
-            return {
-                "performed": False,
-                "clean": None,
-                "threat": None,
-                "error": err,
-                "skipped": "no_module",
-            }
-        return {
-            "performed": False,
-            "clean": None,
-            "threat": None,
-            "error": err,
-            "skipped": "no_module",
-        }
-
-    client = _make_clamd_client()
-    if client is None:
-        err = "Не удалось подключиться к clamd (проверьте сокет или TCP)"
-        logger.warning("clamav %s %s", err, ctx)
-        if getattr(settings, "CLAMAV_FAIL_OPEN", True):
-            logger.info("clamav accept without scan (fail_open) skipped=daemon %s", ctx)
-            return {
-                "performed": False,
-                "clean": None,
-                "threat": None,
-                "error": err,
-                "skipped": "daemon",
-            }
-        return {
-            "performed": False,
-            "clean": None,
-            "threat": None,
-            "error": err,
-            "skipped": "daemon",
-        }
-
     t0 = time.monotonic()
+    cache_status = None
+    signature_version = None
+    if getattr(settings, "CLAMAV_VERDICT_CACHE", True):
+        sha256 = sha256 or _sha256_of(source)
+        cached, signature_version = _cached_verdict(sha256)
+        _count_cache_lookup(cached is not None)
+        if cached is not None:
+            cached["cached"] = True
+            _log_scan_outcome(cached, t0, size, user_id, filename, "hit")
+            if hasattr(source, "seek"):
+                source.seek(0)
+            return cached
+        cache_status = "miss"
     try:
-        result = client.instream(io.BytesIO(data))
-    except Exception as exc:
+        reply = get_pool().scan(lambda: _iter_source(source))
+    except ClamdBusyError as exc:
+        logger.warning("clamav %s %s", exc, ctx)
+        return _not_scanned("busy", str(exc), ctx)
+    except ClamdUnavailableError as exc:
+        logger.warning("clamav %s %s", exc, ctx)
+        return _not_scanned("daemon", str(exc), ctx)
+    except ClamdError as exc:
+        logger.warning("clamav instream failed: %s %s", exc, ctx)
+        return _not_scanned("scan_error", str(exc), ctx)
+    except OSError as exc:
         logger.exception("clamav instream failed %s", ctx)
-        if getattr(settings, "CLAMAV_FAIL_OPEN", True):
-            logger.info("clamav accept without scan (fail_open) skipped=scan_error %s", ctx)
-            return {
-                "performed": False,
-                "clean": None,
-                "threat": None,
-                "error": str(exc),
-                "skipped": "scan_error",
-            }
-        return {
-            "performed": False,
-            "clean": None,
-            "threat": None,
-            "error": str(exc),
-            "skipped": "scan_error",
-        }
+        return _not_scanned("scan_error", str(exc), ctx)
+    finally:
+        if hasattr(source, "seek"):
+            # Вызывающий дальше читает тот же UploadedFile с начала.
+            source.seek(0)
 
-    out = _interpret_clamd_result(result)
-    _log_scan_outcome(out, t0, size, user_id, filename)
+    out = _interpret_clamd_result(_parse_instream_reply(reply))
+    out["cached"] = False
+    if cache_status:
+        _remember_verdict(out, sha256, signature_version)
+    _log_scan_outcome(out, t0, size, user_id, filename, cache_status)
     return out
 
 
-def _make_clamd_client():
-    import clamd
-
-    if getattr(settings, "CLAMAV_USE_TCP", False):
-        host = getattr(settings, "CLAMAV_TCP_HOST", "127.0.0.1")
-        port = int(getattr(settings, "CLAMAV_TCP_PORT", 3310))
-        try:
-            return clamd.ClamdNetworkSocket(host=host, port=port)
-        except Exception as exc:
-            logger.warning("ClamdNetworkSocket: %s", exc)
-            return None
-
-    path = getattr(
-        settings,
-        "CLAMAV_SOCKET_PATH",
-        "/var/run/clamav/clamd.ctl",
-    )
-    try:
-        return clamd.ClamdUnixSocket(path)
-    except Exception as exc:
-        logger.warning("ClamdUnixSocket(%s): %s", path, exc)
-        return None
+def _parse_instream_reply(reply: str):
+    """«stream: OK» / «stream: Eicar-Signature FOUND» -> формат ответа python-clamd."""
+    _, _, status = reply.partition(": ")
+    status = status or reply
+    if status == "OK":
+        return {"stream": ("OK", None)}
+    if status.endswith(" FOUND"):
+        return {"stream": ("FOUND", status[: -len(" FOUND")])}
+    return {"stream": status}
 
 
 def _interpret_clamd_result(result) -> dict[str, Any]:
@@ -273,6 +617,13 @@ def flash_scan_followup(request, scan: dict[str, Any]) -> None:
 
     if not scan:
         return
+    if scan.get("skipped") == "quarantine":
+        messages.info(
+            request,
+            "Файл принят и проходит антивирусную проверку. Скачать и открыть доступ к нему "
+            "можно будет после проверки.",
+        )
+        return
     if scan.get("performed") and scan.get("clean"):
         messages.info(
             request,
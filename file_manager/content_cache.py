@@ -0,0 +1,228 @@
+"""
+Локальный read-through кэш содержимого файлов Яндекс.Диска.
+
+Предпросмотр, скачивание, конвертация в PDF, просмотр текста и экспорт архива берут файл
+отсюда, а не с Диска при каждом открытии:
+  - запись — <YANDEX_CONTENT_CACHE_DIR>/<2 символа>/<ключ>.bin, ключ — sha256(yandex_path + md5
+    ревизии на Диске); метаданные ресурса приходят из кэша API (yandex_disk), так что проверка
+    свежести обычно не делает запросов; изменённый на Диске файл получает новый ключ;
+  - файл скачивается во временный .part и переименовывается (атомарно), параллельные
+    заполнения одной записи сериализуются flock-блокировкой (256 полос на каталог), поэтому
+    два зрителя одного файла — одно скачивание, в том числе из разных процессов;
+  - LRU по mtime (обновляется при попадании), общий объём — не больше
+    YANDEX_CONTENT_CACHE_MAX_BYTES, файлы крупнее YANDEX_CONTENT_CACHE_MAX_FILE_BYTES не кэшируются;
+  - счётчики попаданий/промахов/вытеснений лежат в Django-кэше (общие для процессов):
+    stats(), команда manage.py content_cache --stats.
+Кэш лежит вне MEDIA_ROOT: его файлы не должны отдаваться как медиа.
+"""
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .yandex_disk import get_resource_info
+from .yandex_transfer import get_engine
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+STAT_NAMES = ("hits", "misses", "bypass", "fill_bytes", "evictions", "evicted_bytes")
+# Недавно использованные записи не вытесняются: их путь мог только что уйти в конвертер.
+EVICTION_GRACE_SECONDS = 60
+# После вытеснения объём опускается до этой доли лимита, чтобы не чистить на каждом заполнении.
+EVICTION_LOW_WATERMARK = 0.9
+LOCK_STRIPES = 256
+
+_thread_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+
+def cache_dir() -> str:
+    return str(getattr(settings, "YANDEX_CONTENT_CACHE_DIR", "") or "")
+
+
+def max_bytes() -> int:
+    return int(getattr(settings, "YANDEX_CONTENT_CACHE_MAX_BYTES", 0) or 0)
+
+
+def max_file_bytes() -> int:
+    return int(getattr(settings, "YANDEX_CONTENT_CACHE_MAX_FILE_BYTES", 0) or 0)
+
+
+def is_enabled() -> bool:
+    return bool(cache_dir()) and max_bytes() > 0
+
+
+def _record(name: str, amount: int = 1) -> None:
+    key = f"content_cache:{name}"
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        pass
+
+
+def entry_key(yandex_path: str, revision: str) -> str:
+    return hashlib.sha256(f"{yandex_path}\0{revision}".encode("utf-8")).hexdigest()
+
+
+def _entry_path(key: str) -> str:
+    return os.path.join(cache_dir(), key[:2], f"{key}.bin")
+
+
+def _touch(path: str) -> bool:
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+@contextlib.contextmanager
+def _fill_lock(key: str):
+    stripe = int(key[:2], 16) % LOCK_STRIPES
+    with _thread_locks[stripe]:
+        if fcntl is None:
+            yield
+            return
+        lock_dir = os.path.join(cache_dir(), "locks")
+        os.makedirs(lock_dir, exist_ok=True)
+        with open(os.path.join(lock_dir, f"{stripe:02x}.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _remote_revision(access_token: str, yandex_path: str) -> tuple[str, int] | None:
+    info = get_resource_info(access_token, yandex_path)
+    if not info or info.get("type", "file") != "file":
+        return None
+    revision = info.get("md5") or info.get("sha256") or info.get("revision") or info.get("modified")
+    if not revision:
+        return None
+    return str(revision), int(info.get("size") or 0)
+
+
+def lookup(access_token: str, yandex_path: str) -> str | None:
+    """Путь к записи, если она уже есть (без скачивания)."""
+    if not is_enabled():
+        return None
+    remote = _remote_revision(access_token, yandex_path)
+    if remote is None:
+        return None
+    path = _entry_path(entry_key(yandex_path, remote[0]))
+    if _touch(path):
+        _record("hits")
+        return path
+    return None
+
+
+def get_local_copy(access_token: str, yandex_path: str) -> str | None:
+    """
+    Путь к локальной копии файла Диска (из кэша или только что скачанной).
+    None — кэш выключен, файла нет на Диске или он больше YANDEX_CONTENT_CACHE_MAX_FILE_BYTES;
+    тогда вызывающий читает файл с Диска сам. Путь принадлежит кэшу — не удалять.
+    """
+    if not is_enabled():
+        return None
+    remote = _remote_revision(access_token, yandex_path)
+    if remote is None:
+        return None
+    revision, size = remote
+    limit = max_file_bytes()
+    if (limit and size > limit) or size > max_bytes():
+        _record("bypass")
+        return None
+
+    key = entry_key(yandex_path, revision)
+    path = _entry_path(key)
+    if _touch(path):
+        _record("hits")
+        return path
+    with _fill_lock(key):
+        # Пока ждали блокировку, запись мог заполнить другой поток или процесс.
+        if _touch(path):
+            _record("hits")
+            return path
+        _record("misses")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        written = get_engine().download_to_file(access_token, yandex_path, path)
+        _record("fill_bytes", written)
+    evict(keep=path)
+    return path
+
+
+def _entries() -> list[tuple[float, int, str]]:
+    root = cache_dir()
+    entries = []
+    if not root or not os.path.isdir(root):
+        return entries
+    with os.scandir(root) as shards:
+        for shard in shards:
+            if not shard.is_dir() or shard.name == "locks":
+                continue
+            with os.scandir(shard.path) as files:
+                for entry in files:
+                    if not entry.name.endswith(".bin"):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+
+def evict(keep: str | None = None, *, limit: int | None = None) -> tuple[int, int]:
+    """Удаляет самые давно использованные записи сверх лимита. Возвращает (записей, байт)."""
+    limit = max_bytes() if limit is None else limit
+    entries = _entries()
+    total = sum(size for _, size, _ in entries)
+    if total <= limit:
+        return 0, 0
+    target = int(limit * EVICTION_LOW_WATERMARK)
+    fresh_after = time.time() - EVICTION_GRACE_SECONDS
+    removed = freed = 0
+    for mtime, size, path in sorted(entries):
+        if total <= target:
+            break
+        if path == keep or (mtime > fresh_after and limit > 0):
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        total -= size
+        removed += 1
+        freed += size
+    if removed:
+        _record("evictions", removed)
+        _record("evicted_bytes", freed)
+        logger.info("content cache: вытеснено %s записей (%s байт)", removed, freed)
+    return removed, freed
+
+
+def stats() -> dict[str, int]:
+    values = cache.get_many([f"content_cache:{name}" for name in STAT_NAMES])
+    result = {name: int(values.get(f"content_cache:{name}") or 0) for name in STAT_NAMES}
+    entries = _entries()
+    result["entries"] = len(entries)
+    result["bytes"] = sum(size for _, size, _ in entries)
+    result["max_bytes"] = max_bytes()
+    return result
+
+
+def reset_stats() -> None:
+    cache.delete_many([f"content_cache:{name}" for name in STAT_NAMES])
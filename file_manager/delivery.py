@@ -0,0 +1,363 @@
+"""
+Потоковая отдача файлов клиенту (скачивание, предпросмотр, вложения чата).
+
+Файл никогда не читается в память целиком:
+  - локальные файлы отдаются блоками по FILE_DELIVERY_CHUNK_SIZE, с поддержкой
+    заголовков Range / If-Range (перемотка <video>/<audio>, докачка);
+  - файлы Яндекс.Диска проксируются потоком (stream=True через пул соединений клиента
+    yandex_disk), Range клиента пробрасывается на сервер загрузки Яндекса;
+  - собранные на лету временные файлы отдаются блоками и удаляются после отдачи;
+  - содержимое, которое генерируется по ходу отдачи (ZIP-архив, zipstream.py), уходит
+    клиенту сразу, без Content-Length.
+
+Под ASGI (Daphne) синхронный итератор StreamingHttpResponse Django собирает в список
+целиком, поэтому ответ читает блоки по одному через sync_to_async.
+
+FILE_DELIVERY_MODE — кто отдаёт байты локальных файлов из MEDIA_ROOT:
+  stream            — Django (по умолчанию);
+  x-accel-redirect  — nginx: Django проверяет доступ и отвечает заголовком
+                      X-Accel-Redirect на internal-location FILE_DELIVERY_INTERNAL_PREFIX;
+  x-sendfile        — Apache mod_xsendfile / lighttpd: заголовок X-Sendfile с абсолютным
+                      (URL-кодированным) путём.
+Файлы вне MEDIA_ROOT и файлы Яндекс.Диска всегда отдаются потоком из Django.
+
+Пример для nginx (alias — тот же каталог, что MEDIA_ROOT):
+    location /protected-media/ {
+        internal;
+        alias /app/media/;
+    }
+"""
+from __future__ import annotations
+
+import logging
+import os
+import re
+from typing import Iterable, Iterator
+from urllib.parse import quote
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+from .yandex_disk import get_client
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+DELIVERY_MODE_STREAM = "stream"
+DELIVERY_MODE_X_ACCEL = "x-accel-redirect"
+DELIVERY_MODE_X_SENDFILE = "x-sendfile"
+DELIVERY_MODES = frozenset({DELIVERY_MODE_STREAM, DELIVERY_MODE_X_ACCEL, DELIVERY_MODE_X_SENDFILE})
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_END_OF_STREAM = object()
+
+# Заголовки ответа сервера загрузки Яндекса, которые передаются клиенту как есть.
+_PROXIED_RESPONSE_HEADERS = ("Content-Length", "Content-Range", "Accept-Ranges", "ETag", "Last-Modified")
+_PROXIED_REQUEST_HEADERS = {"HTTP_RANGE": "Range", "HTTP_IF_RANGE": "If-Range"}
+
+
+def get_chunk_size() -> int:
+    size = int(getattr(settings, "FILE_DELIVERY_CHUNK_SIZE", DEFAULT_CHUNK_SIZE) or DEFAULT_CHUNK_SIZE)
+    return max(size, 4096)
+
+
+def get_delivery_mode() -> str:
+    mode = (getattr(settings, "FILE_DELIVERY_MODE", "") or DELIVERY_MODE_STREAM).strip().lower()
+    if mode not in DELIVERY_MODES:
+        logger.warning("FILE_DELIVERY_MODE=%r не поддерживается, используется stream", mode)
+        return DELIVERY_MODE_STREAM
+    return mode
+
+
+class ChunkedStreamingResponse(StreamingHttpResponse):
+    """StreamingHttpResponse, который и под ASGI отдаёт синхронный итератор по блокам."""
+
+    async def __aiter__(self):
+        if self.is_async:
+            async for part in self.streaming_content:
+                yield part
+            return
+        iterator = iter(self.streaming_content)
+        while True:
+            part = await sync_to_async(next, thread_sensitive=False)(iterator, _END_OF_STREAM)
+            if part is _END_OF_STREAM:
+                break
+            yield part
+
+
+def parse_range_header(header: str | None, size: int) -> tuple[int, int] | None | bool:
+    """
+    Разбор заголовка Range для одного диапазона байт.
+
+    Возвращает (start, end) включительно; None — заголовка нет или он не поддерживается
+    (несколько диапазонов, другие единицы) и нужно отдать файл целиком;
+    False — диапазон не удовлетворим (ответ 416).
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            return False
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    if start >= size:
+        return False
+    end = int(last) if last else size - 1
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _local_etag(stat: os.stat_result) -> str:
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def _if_range_allows_partial(request, etag: str, last_modified: int) -> bool:
+    """If-Range: частичный ответ только если файл не изменился с момента первого запроса."""
+    if_range = (request.META.get("HTTP_IF_RANGE") or "").strip()
+    if not if_range:
+        return True
+    if if_range.startswith("W/"):
+        # If-Range сравнивает ETag строго (RFC 9110, 13.1.5): слабый не совпадает никогда.
+        return False
+    if if_range.startswith('"'):
+        return not etag.startswith("W/") and if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and int(last_modified) <= since
+
+
+def _iter_file_range(path: str, start: int, length: int, chunk_size: int) -> Iterator[bytes]:
+    with open(path, "rb") as fh:
+        fh.seek(start)
+        remaining = length
+        while remaining > 0:
+            block = fh.read(min(chunk_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+def _apply_disposition(response, filename: str | None, as_attachment: bool) -> None:
+    if filename:
+        response["Content-Disposition"] = content_disposition_header(as_attachment, filename)
+
+
+def _media_relative_path(path: str) -> str | None:
+    """Путь относительно MEDIA_ROOT (с '/'), либо None, если файл лежит вне MEDIA_ROOT."""
+    media_root = os.path.realpath(settings.MEDIA_ROOT)
+    real_path = os.path.realpath(path)
+    try:
+        if os.path.commonpath([media_root, real_path]) != media_root:
+            return None
+    except ValueError:
+        return None
+    return os.path.relpath(real_path, media_root).replace(os.sep, "/")
+
+
+def internal_redirect_response(
+    path: str,
+    *,
+    content_type: str = "application/octet-stream",
+    filename: str | None = None,
+    as_attachment: bool = False,
+):
+    """
+    Ответ без тела с X-Accel-Redirect / X-Sendfile — байты отдаёт фронт-прокси
+    (zero-copy, с его собственной обработкой Range). None, если режим stream
+    или файл лежит вне MEDIA_ROOT.
+    """
+    mode = get_delivery_mode()
+    if mode == DELIVERY_MODE_STREAM:
+        return None
+    relative = _media_relative_path(path)
+    if relative is None:
+        return None
+
+    response = HttpResponse(content_type=content_type)
+    if mode == DELIVERY_MODE_X_ACCEL:
+        prefix = (getattr(settings, "FILE_DELIVERY_INTERNAL_PREFIX", "") or "/protected-media/").rstrip("/")
+        response["X-Accel-Redirect"] = f"{prefix}/{quote(relative)}"
+    else:
+        # mod_xsendfile (XSendFileUnescape) раскодирует %XX — так проходят кириллические имена.
+        response["X-Sendfile"] = quote(os.path.realpath(path))
+    _apply_disposition(response, filename, as_attachment)
+    return response
+
+
+def local_file_response(
+    request,
+    path: str,
+    *,
+    content_type: str = "application/octet-stream",
+    filename: str | None = None,
+    as_attachment: bool = False,
+    etag: str | None = None,
+    last_modified: int | None = None,
+):
+    """
+    Отдаёт локальный файл потоком (или через фронт-прокси); поддерживает Range / If-Range.
+    etag / last_modified заменяют значения по stat файла (например, ETag по содержимому).
+    """
+    redirected = internal_redirect_response(
+        path,
+        content_type=content_type,
+        filename=filename,
+        as_attachment=as_attachment,
+    )
+    if redirected is not None:
+        return redirected
+
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = etag or _local_etag(stat)
+    last_modified = int(stat.st_mtime) if last_modified is None else int(last_modified)
+
+    byte_range = None
+    if _if_range_allows_partial(request, etag, last_modified):
+        byte_range = parse_range_header(request.META.get("HTTP_RANGE"), size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        response["Accept-Ranges"] = "bytes"
+        return response
+
+    chunk_size = get_chunk_size()
+    if byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        response = ChunkedStreamingResponse(
+            _iter_file_range(path, start, length, chunk_size),
+            status=206,
+            content_type=content_type,
+        )
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    else:
+        length = size
+        response = ChunkedStreamingResponse(
+            _iter_file_range(path, 0, size, chunk_size),
+            content_type=content_type,
+        )
+
+    response["Content-Length"] = str(length)
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    _apply_disposition(response, filename, as_attachment)
+    return response
+
+
+def _iter_open_file(fh, chunk_size: int) -> Iterator[bytes]:
+    try:
+        while True:
+            block = fh.read(chunk_size)
+            if not block:
+                return
+            yield block
+    finally:
+        fh.close()
+
+
+def temporary_file_response(
+    fh,
+    *,
+    content_type: str = "application/octet-stream",
+    filename: str | None = None,
+    as_attachment: bool = False,
+):
+    """
+    Отдаёт открытый временный файл (tempfile.TemporaryFile) с начала и закрывает его
+    по окончании отдачи — вместе с закрытием файл удаляется.
+    """
+    fh.seek(0, os.SEEK_END)
+    size = fh.tell()
+    fh.seek(0)
+    response = ChunkedStreamingResponse(_iter_open_file(fh, get_chunk_size()), content_type=content_type)
+    response["Content-Length"] = str(size)
+    _apply_disposition(response, filename, as_attachment)
+    return response
+
+
+def generated_content_response(
+    chunks: Iterable[bytes],
+    *,
+    content_type: str = "application/octet-stream",
+    filename: str | None = None,
+    as_attachment: bool = False,
+):
+    """Отдаёт блоки по мере генерации; длина заранее неизвестна, ответ идёт chunked."""
+    response = ChunkedStreamingResponse(chunks, content_type=content_type)
+    # Буферизующий прокси (nginx) не должен копить архив целиком перед отдачей.
+    response["X-Accel-Buffering"] = "no"
+    _apply_disposition(response, filename, as_attachment)
+    return response
+
+
+def _iter_upstream(upstream: requests.Response, chunk_size: int) -> Iterator[bytes]:
+    try:
+        for block in upstream.iter_content(chunk_size=chunk_size):
+            if block:
+                yield block
+    finally:
+        upstream.close()
+
+
+def remote_file_response(
+    request,
+    url: str,
+    *,
+    content_type: str = "application/octet-stream",
+    filename: str | None = None,
+    as_attachment: bool = False,
+    timeout: int = 60,
+):
+    """
+    Проксирует файл по прямой ссылке (сервер загрузки Яндекс.Диска) потоком.
+
+    Range / If-Range клиента передаются вверх по потоку, ответ 206 / 416 и Content-Range —
+    обратно, так что перемотка медиа работает и для облачных файлов.
+    """
+    upstream_headers = {
+        header: request.META[meta_key]
+        for meta_key, header in _PROXIED_REQUEST_HEADERS.items()
+        if request.META.get(meta_key)
+    }
+    upstream = get_client().session.get(url, headers=upstream_headers, stream=True, timeout=timeout)
+    if upstream.status_code == 416:
+        upstream.close()
+        response = HttpResponse(status=416)
+        if upstream.headers.get("Content-Range"):
+            response["Content-Range"] = upstream.headers["Content-Range"]
+        return response
+    try:
+        upstream.raise_for_status()
+    except requests.HTTPError:
+        upstream.close()
+        raise
+
+    response = ChunkedStreamingResponse(
+        _iter_upstream(upstream, get_chunk_size()),
+        status=206 if upstream.status_code == 206 else 200,
+        content_type=content_type,
+    )
+    for header in _PROXIED_RESPONSE_HEADERS:
+        value = upstream.headers.get(header)
+        if value:
+            response[header] = value
+    # requests прозрачно распаковывает gzip — длина исходного потока тогда не совпадёт.
+    if upstream.headers.get("Content-Encoding"):
+        response.headers.pop("Content-Length", None)
+    _apply_disposition(response, filename, as_attachment)
+    return response
@@ -0,0 +1,474 @@
+"""
+Извлечение текста из документов (PDF, DOCX, XLSX, PPTX, TXT) вне веб-процесса.
+
+Парсеры (PyPDF2, python-docx, openpyxl, python-pptx) запускаются в ограниченном
+ProcessPoolExecutor: у каждой задачи свой таймаут, лимит памяти и предел страниц/строк
+по формату. Текст собирается списком фрагментов и обрезается по TEXT_EXTRACTION_MAX_CHARS.
+При таймауте, нехватке памяти или ошибке парсера возвращается уже извлечённая часть
+с truncated=True — а не пустая строка.
+
+Настройки:
+  TEXT_EXTRACTION_WORKERS     — размер пула (0 — парсить в текущем процессе, для отладки);
+  TEXT_EXTRACTION_TIMEOUT     — верхняя граница таймаута задачи, с;
+  TEXT_EXTRACTION_MAX_RSS_MB  — лимит памяти процесса-парсера (RLIMIT_AS + проверка RSS);
+  TEXT_EXTRACTION_MAX_CHARS   — предел длины результата;
+  TEXT_EXTRACTION_CACHE_TTL   — сколько секунд хранить результат в кэше (0 — не кэшировать).
+
+Кэш: результат хранится в Django-кэше (Redis) под ключом SHA-256 содержимого + формат +
+EXTRACTOR_VERSION, поэтому одни и те же байты (загрузка, новая версия, просмотрщик)
+разбираются один раз. Таймауты и нехватка памяти не кэшируются — это не свойство файла.
+При изменении парсеров увеличьте EXTRACTOR_VERSION.
+
+Модерация (matcher=wordfilter.BannedWordMatcher) идёт в том же проходе: каждый фрагмент
+(страница PDF, абзац DOCX, строка XLSX, слайд PPTX, блок TXT) сразу проверяется словарём,
+и на первой найденной записи разбор останавливается — запрещённый 400-страничный PDF
+отклоняется после нескольких страниц, а не после полного разбора. Такой результат
+(banned, текст неполный) не кэшируется; при попадании в кэш словарь проверяет готовый текст.
+
+Модуль не импортирует модели: процессы пула поднимаются через forkserver без Django.
+"""
+from __future__ import annotations
+
+import codecs
+import hashlib
+import logging
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+EXTRACTOR_VERSION = 2
+DEFAULT_CACHE_TTL = 30 * 24 * 3600
+HASH_CHUNK_SIZE = 1024 * 1024
+_TXT_BLOCK = 256 * 1024
+# Ошибки, зависящие от нагрузки, а не от содержимого файла, — такой результат не кэшируется.
+TRANSIENT_ERRORS = frozenset({"timeout", "memory"})
+
+DEFAULT_WORKERS = 2
+DEFAULT_TIMEOUT = 60
+DEFAULT_MAX_RSS_MB = 768
+DEFAULT_MAX_CHARS = 2_000_000
+# Запас родителя сверх таймаута задачи: процесс, не ответивший за это время, убивается.
+HARD_TIMEOUT_GRACE = 10
+
+
+@dataclass(frozen=True)
+class FormatLimits:
+    timeout: int
+    # Страницы PDF, абзацы DOCX, строки XLSX (по всем листам), слайды PPTX.
+    max_units: int
+
+
+FORMAT_LIMITS = {
+    "pdf": FormatLimits(timeout=60, max_units=1000),
+    "docx": FormatLimits(timeout=30, max_units=50_000),
+    "xlsx": FormatLimits(timeout=45, max_units=200_000),
+    "pptx": FormatLimits(timeout=30, max_units=1000),
+    "txt": FormatLimits(timeout=10, max_units=0),
+}
+
+# Расширение -> парсер (как в прежнем utils.extract_text_from_file).
+FORMAT_BY_EXT = {
+    "pdf": "pdf",
+    "txt": "txt",
+    "docx": "docx",
+    "doc": "docx",
+    "xlsx": "xlsx",
+    "xls": "xlsx",
+    "pptx": "pptx",
+    "ppt": "pptx",
+}
+
+
+@dataclass
+class ExtractionResult:
+    text: str = ""
+    truncated: bool = False
+    # "", "timeout", "memory" или текст исключения парсера.
+    error: str = ""
+    # Запись словаря модерации, на которой разбор остановлен (только при matcher).
+    banned: str = ""
+
+    def __str__(self) -> str:
+        return self.text
+
+
+class ExtractionTimeout(Exception):
+    pass
+
+
+class _Truncated:
+    """Маркер от парсера: достигнут предел страниц/строк."""
+
+
+TRUNCATED = _Truncated()
+
+
+def _iter_pdf(path: str, max_units: int) -> Iterator[str | _Truncated]:
+    import PyPDF2
+
+    with open(path, "rb") as fh:
+        reader = PyPDF2.PdfReader(fh)
+        for index, page in enumerate(reader.pages):
+            if max_units and index >= max_units:
+                yield TRUNCATED
+                return
+            yield page.extract_text() or ""
+
+
+def _txt_encoding(path: str) -> str:
+    """utf-8, если весь файл в ней декодируется, иначе latin-1 — до первого блока текста."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        with open(path, "rb") as fh:
+            while block := fh.read(_TXT_BLOCK):
+                decoder.decode(block)
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        return "latin-1"
+    return "utf-8"
+
+
+def _iter_txt(path: str, max_units: int) -> Iterator[str | _Truncated]:
+    # Кодировка выбирается заранее: переход на latin-1 посреди файла повторил бы уже отданный текст.
+    with open(path, "r", encoding=_txt_encoding(path)) as fh:
+        while block := fh.read(_TXT_BLOCK):
+            yield block
+
+
+def _iter_docx(path: str, max_units: int) -> Iterator[str | _Truncated]:
+    import docx
+
+    document = docx.Document(path)
+    for index, paragraph in enumerate(document.paragraphs):
+        if max_units and index >= max_units:
+            yield TRUNCATED
+            return
+        yield paragraph.text + "\n"
+
+
+def _iter_xlsx(path: str, max_units: int) -> Iterator[str | _Truncated]:
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    rows = 0
+    try:
+        for sheet_name in workbook.sheetnames:
+            yield f"Sheet: {sheet_name}\n"
+            for row in workbook[sheet_name].iter_rows(values_only=True):
+                if max_units and rows >= max_units:
+                    yield TRUNCATED
+                    return
+                rows += 1
+                yield " | ".join("" if cell is None else str(cell) for cell in row) + "\n"
+    finally:
+        workbook.close()
+
+
+def _iter_pptx(path: str, max_units: int) -> Iterator[str | _Truncated]:
+    from pptx import Presentation
+
+    presentation = Presentation(path)
+    for slide_number, slide in enumerate(presentation.slides, 1):
+        if max_units and slide_number > max_units:
+            yield TRUNCATED
+            return
+        yield f"Slide {slide_number}:\n"
+        for shape in slide.shapes:
+            if hasattr(shape, "text"):
+                yield shape.text + "\n"
+
+
+_EXTRACTORS = {
+    "pdf": _iter_pdf,
+    "txt": _iter_txt,
+    "docx": _iter_docx,
+    "xlsx": _iter_xlsx,
+    "pptx": _iter_pptx,
+}
+
+
+def _current_rss_bytes() -> int | None:
+    try:
+        with open("/proc/self/statm", "rb") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _on_alarm(signum, frame):
+    raise ExtractionTimeout()
+
+
+def _run_extractor(
+    path: str,
+    fmt: str,
+    max_units: int,
+    timeout: int,
+    max_chars: int,
+    max_rss: int,
+    matcher=None,
+) -> ExtractionResult:
+    parts: list[str] = []
+    total = 0
+    result = ExtractionResult()
+    stream = matcher.stream() if matcher else None
+    # Таймаут через SIGALRM прерывает чистый Python-парсер и оставляет накопленный текст.
+    use_alarm = timeout > 0 and threading.current_thread() is threading.main_thread()
+    if use_alarm:
+        previous_handler = signal.signal(signal.SIGALRM, _on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        for chunk in _EXTRACTORS[fmt](path, max_units):
+            if chunk is TRUNCATED:
+                result.truncated = True
+                break
+            if total + len(chunk) > max_chars:
+                chunk = chunk[: max_chars - total]
+                result.truncated = True
+            parts.append(chunk)
+            total += len(chunk)
+            if stream is not None and (hit := stream.feed(chunk)):
+                result.banned = hit
+                break
+            if result.truncated:
+                break
+            if max_rss:
+                rss = _current_rss_bytes()
+                if rss is not None and rss > max_rss:
+                    result.truncated = True
+                    result.error = "memory"
+                    break
+    except ExtractionTimeout:
+        result.truncated = True
+        result.error = "timeout"
+    except MemoryError:
+        result.truncated = True
+        result.error = "memory"
+    except Exception as exc:
+        result.truncated = True
+        result.error = f"{type(exc).__name__}: {exc}"
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+    if stream is not None and not result.banned:
+        result.banned = stream.finish() or ""
+    result.text = "".join(parts)
+    return result
+
+
+def _init_worker(max_rss: int) -> None:
+    # Жёсткий предел адресного пространства: парсер получит MemoryError, а не OOM-killer.
+    if max_rss:
+        try:
+            import resource
+
+            resource.setrlimit(resource.RLIMIT_AS, (max_rss * 2, max_rss * 2))
+        except (ImportError, ValueError, OSError):
+            pass
+
+
+def _setting(name: str, default: int) -> int:
+    from django.conf import settings
+
+    value = getattr(settings, name, default)
+    return default if value is None else int(value)
+
+
+_executor: ProcessPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(workers: int, max_rss: int) -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(max_rss,),
+            )
+        return _executor
+
+
+def _discard_executor(kill: bool = False) -> None:
+    """Сбрасывает пул (после зависшей или упавшей задачи); новый создаётся при следующем вызове."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is None:
+        return
+    if kill:
+        for process in list(getattr(executor, "_processes", {}).values()):
+            try:
+                process.kill()
+            except Exception:
+                pass
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pool() -> None:
+    _discard_executor()
+
+
+def detect_format(path: str) -> str | None:
+    return FORMAT_BY_EXT.get(os.path.splitext(path)[1].lower().lstrip("."))
+
+
+def extract_text(path: str, fmt: str | None = None, *, matcher=None) -> ExtractionResult:
+    """
+    Извлекает текст файла; формат по расширению, если не задан. Не бросает исключений.
+    matcher — словарь модерации: разбор останавливается на первой найденной записи (result.banned).
+    """
+    fmt = fmt or detect_format(path)
+    if fmt not in _EXTRACTORS or not os.path.exists(path):
+        return ExtractionResult()
+
+    limits = FORMAT_LIMITS[fmt]
+    timeout = min(limits.timeout, _setting("TEXT_EXTRACTION_TIMEOUT", DEFAULT_TIMEOUT))
+    max_chars = _setting("TEXT_EXTRACTION_MAX_CHARS", DEFAULT_MAX_CHARS)
+    max_rss = _setting("TEXT_EXTRACTION_MAX_RSS_MB", DEFAULT_MAX_RSS_MB) * 1024 * 1024
+    workers = _setting("TEXT_EXTRACTION_WORKERS", DEFAULT_WORKERS)
+
+    if workers <= 0:
+        result = _run_extractor(path, fmt, limits.max_units, timeout, max_chars, 0, matcher)
+    else:
+        try:
+            future = _get_executor(workers, max_rss).submit(
+                _run_extractor, path, fmt, limits.max_units, timeout, max_chars, max_rss, matcher
+            )
+            result = future.result(timeout=timeout + HARD_TIMEOUT_GRACE)
+        except FutureTimeoutError:
+            logger.warning("extraction: процесс не ответил за %s с, пул пересоздаётся path=%r", timeout, path)
+            _discard_executor(kill=True)
+            result = ExtractionResult(truncated=True, error="timeout")
+        except BrokenProcessPool:
+            logger.warning("extraction: процесс пула аварийно завершился path=%r", path)
+            _discard_executor()
+            result = ExtractionResult(truncated=True, error="memory")
+
+    if result.banned:
+        logger.info("extraction %s: остановлено на записи словаря, chars=%s path=%r", fmt, len(result.text), path)
+    if result.error:
+        logger.warning(
+            "extraction %s: %s truncated=%s chars=%s path=%r",
+            fmt,
+            result.error,
+            result.truncated,
+            len(result.text),
+            path,
+        )
+    return result
+
+
+def _cache_key(sha256: str, fmt: str) -> str:
+    max_chars = _setting("TEXT_EXTRACTION_MAX_CHARS", DEFAULT_MAX_CHARS)
+    return f"extract:v{EXTRACTOR_VERSION}:{fmt}:{max_chars}:{sha256}"
+
+
+def _cache_get(sha256: str, fmt: str) -> ExtractionResult | None:
+    from django.core.cache import cache
+
+    if _setting("TEXT_EXTRACTION_CACHE_TTL", DEFAULT_CACHE_TTL) <= 0:
+        return None
+    try:
+        cached = cache.get(_cache_key(sha256, fmt))
+    except Exception:
+        logger.warning("extraction: кэш недоступен", exc_info=True)
+        return None
+    if not cached:
+        return None
+    return ExtractionResult(text=cached["text"], truncated=cached["truncated"], error=cached["error"])
+
+
+def _cache_set(sha256: str, fmt: str, result: ExtractionResult) -> None:
+    from django.core.cache import cache
+
+    ttl = _setting("TEXT_EXTRACTION_CACHE_TTL", DEFAULT_CACHE_TTL)
+    # Разбор, остановленный модерацией, дал только начало текста.
+    if ttl <= 0 or result.error in TRANSIENT_ERRORS or result.banned:
+        return
+    try:
+        cache.set(
+            _cache_key(sha256, fmt),
+            {"text": result.text, "truncated": result.truncated, "error": result.error},
+            ttl,
+        )
+    except Exception:
+        logger.warning("extraction: не удалось записать результат в кэш", exc_info=True)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        while block := fh.read(HASH_CHUNK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _moderate_cached(cached: ExtractionResult, matcher) -> ExtractionResult:
+    if matcher:
+        cached.banned = matcher.find(cached.text) or ""
+    return cached
+
+
+def extract_text_cached(
+    path: str,
+    fmt: str | None = None,
+    *,
+    sha256: str | None = None,
+    matcher=None,
+) -> ExtractionResult:
+    """extract_text() через кэш; sha256 можно передать, если хеш уже известен (ContentBlob)."""
+    fmt = fmt or detect_format(path)
+    if fmt not in _EXTRACTORS or not os.path.exists(path):
+        return ExtractionResult()
+    sha256 = sha256 or file_sha256(path)
+    cached = _cache_get(sha256, fmt)
+    if cached is not None:
+        return _moderate_cached(cached, matcher)
+    result = extract_text(path, fmt, matcher=matcher)
+    _cache_set(sha256, fmt, result)
+    return result
+
+
+def extract_text_from_bytes(
+    content: bytes,
+    file_name: str,
+    *,
+    sha256: str | None = None,
+    matcher=None,
+) -> ExtractionResult:
+    """Текст из содержимого в памяти; при попадании в кэш временный файл не создаётся."""
+    fmt = detect_format(file_name)
+    if not content or fmt not in _EXTRACTORS:
+        return ExtractionResult()
+    sha256 = sha256 or hashlib.sha256(content).hexdigest()
+    cached = _cache_get(sha256, fmt)
+    if cached is not None:
+        return _moderate_cached(cached, matcher)
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{fmt}") as tmp:
+            tmp.write(content)
+            tmp_path = tmp.name
+        result = extract_text(tmp_path, fmt, matcher=matcher)
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+    _cache_set(sha256, fmt, result)
+    return result
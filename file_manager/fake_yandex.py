@@ -0,0 +1,292 @@
+"""
+Локальный фейковый сервер REST API Яндекс.Диска для тестов и бенчмарков.
+
+Поддерживает ровно то, чем пользуется yandex_disk.YandexDiskClient:
+GET /v1/disk, GET|PUT|DELETE /v1/disk/resources, GET /v1/disk/resources/{download,upload}
+и выданные ими href (_download / _upload, в том числе Range и chunked-загрузку).
+Считает запросы и TCP-соединения, умеет отвечать ошибками (fail_next) и задержкой (latency).
+
+    with FakeYandexDisk() as fake:
+        with override_settings(YANDEX_DISK_API_BASE=fake.api_base, YANDEX_HTTP_BACKOFF=0):
+            ...
+
+Отдельный запуск: python -m file_manager.fake_yandex --port 8765
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+
+
+def _normalize(path: str) -> str:
+    path = path or "disk:/"
+    if not (path.startswith("disk:/") or path.startswith("app:/")):
+        path = "disk:/" + path.lstrip("/")
+    root, _, rest = path.partition(":/")
+    rest = rest.strip("/")
+    return f"{root}:/{rest}" if rest else f"{root}:/"
+
+
+def _parent(path: str) -> str:
+    root, _, rest = path.partition(":/")
+    if "/" not in rest:
+        return f"{root}:/"
+    return f"{root}:/{rest.rsplit('/', 1)[0]}"
+
+
+def _name(path: str) -> str:
+    return path.rstrip("/").rsplit("/", 1)[-1]
+
+
+class FakeYandexDisk:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, *, latency: float = 0.0):
+        self.files: dict[str, bytes] = {}
+        self.folders: set[str] = {"disk:/", "app:/"}
+        self.requests: Counter[str] = Counter()
+        self.connections = 0
+        self.latency = latency
+        self.href_lifetime = 3600
+        self._failures: list[tuple[int, str | None]] = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_base(self) -> str:
+        return f"{self.base_url}/v1/disk"
+
+    def start(self) -> "FakeYandexDisk":
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeYandexDisk":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def fail_next(self, status: int, count: int = 1, *, path: str | None = None) -> None:
+        """Следующие count запросов (к URL-пути path, если задан) получат status."""
+        with self._lock:
+            self._failures.extend([(status, path)] * count)
+
+    def put_file(self, path: str, content: bytes) -> None:
+        path = _normalize(path)
+        parent = _parent(path)
+        while parent not in self.folders:
+            self.folders.add(parent)
+            parent = _parent(parent)
+        self.files[path] = content
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self.requests.clear()
+            self.connections = 0
+
+    def _take_failure(self, path: str) -> int | None:
+        with self._lock:
+            for index, (status, failure_path) in enumerate(self._failures):
+                if failure_path is None or failure_path == path:
+                    del self._failures[index]
+                    return status
+        return None
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with fake._lock:
+                    fake.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            # --- ответы ---
+
+            def _send(self, status: int, body: bytes = b"", content_type: str = "application/json", headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                if body and self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def _json(self, status: int, payload: dict):
+                self._send(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+            def _error(self, status: int, error: str):
+                self._json(status, {"error": error, "message": error})
+
+            def _read_body(self) -> bytes:
+                if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                    chunks = []
+                    while True:
+                        size = int(self.rfile.readline().split(b";", 1)[0].strip() or b"0", 16)
+                        if size == 0:
+                            self.rfile.readline()
+                            break
+                        chunks.append(self.rfile.read(size))
+                        self.rfile.readline()
+                    return b"".join(chunks)
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length) if length else b""
+
+            # --- маршрутизация ---
+
+            def _dispatch(self):
+                url = urlsplit(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                body = self._read_body() if self.command in ("PUT", "POST") else b""
+                with fake._lock:
+                    fake.requests[f"{self.command} {url.path}"] += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+                failure = fake._take_failure(url.path)
+                if failure:
+                    return self._error(failure, "InjectedFailure")
+                route = (self.command, url.path)
+                if route == ("GET", "/v1/disk"):
+                    used = sum(len(content) for content in fake.files.values())
+                    return self._json(200, {"total_space": 10 * 1024**3, "used_space": used})
+                if url.path == "/v1/disk/resources":
+                    return self._resources(query)
+                if route == ("GET", "/v1/disk/resources/download"):
+                    path = _normalize(query.get("path", ""))
+                    if path not in fake.files:
+                        return self._error(404, "DiskNotFoundError")
+                    expires = int(time.time() + fake.href_lifetime)
+                    href = f"{fake.base_url}/_download?path={quote(path)}&expires={expires}"
+                    return self._json(200, {"href": href, "method": "GET"})
+                if route == ("GET", "/v1/disk/resources/upload"):
+                    path = _normalize(query.get("path", ""))
+                    if _parent(path) not in fake.folders:
+                        return self._error(409, "DiskPathDoesntExistsError")
+                    if path in fake.files and query.get("overwrite") != "true":
+                        return self._error(409, "DiskResourceAlreadyExistsError")
+                    return self._json(200, {"href": f"{fake.base_url}/_upload?path={quote(path)}", "method": "PUT"})
+                if route == ("PUT", "/_upload"):
+                    fake.files[_normalize(query.get("path", ""))] = body
+                    return self._send(201)
+                if route in (("GET", "/_download"), ("HEAD", "/_download")):
+                    return self._download(_normalize(query.get("path", "")))
+                return self._error(404, "NotFound")
+
+            def _resources(self, query):
+                path = _normalize(query.get("path", "disk:/"))
+                if self.command == "GET":
+                    if path in fake.files:
+                        return self._json(200, self._item(path))
+                    if path not in fake.folders:
+                        return self._error(404, "DiskNotFoundError")
+                    children = sorted(
+                        child for child in (*fake.folders, *fake.files) if child != path and _parent(child) == path
+                    )
+                    offset = int(query.get("offset") or 0)
+                    limit = int(query.get("limit") or 20)
+                    items = [self._item(child) for child in children[offset : offset + limit]]
+                    payload = self._item(path)
+                    payload["_embedded"] = {"items": items, "offset": offset, "limit": limit, "total": len(children)}
+                    return self._json(200, payload)
+                if self.command == "PUT":
+                    if path in fake.folders or path in fake.files:
+                        return self._error(409, "DiskPathPointsToExistentDirectoryError")
+                    if _parent(path) not in fake.folders:
+                        return self._error(409, "DiskPathDoesntExistsError")
+                    fake.folders.add(path)
+                    return self._json(201, {"href": path, "method": "GET"})
+                if self.command == "DELETE":
+                    if path in fake.files:
+                        del fake.files[path]
+                        return self._send(204)
+                    if path in fake.folders:
+                        prefix = path.rstrip("/") + "/"
+                        fake.folders = {f for f in fake.folders if f != path and not f.startswith(prefix)}
+                        for file_path in [f for f in fake.files if f.startswith(prefix)]:
+                            del fake.files[file_path]
+                        return self._send(204)
+                    return self._error(404, "DiskNotFoundError")
+                return self._error(405, "MethodNotAllowed")
+
+            def _item(self, path):
+                if path in fake.files:
+                    content = fake.files[path]
+                    return {
+                        "name": _name(path),
+                        "path": path,
+                        "type": "file",
+                        "size": len(content),
+                        "md5": hashlib.md5(content).hexdigest(),
+                        "sha256": hashlib.sha256(content).hexdigest(),
+                    }
+                return {"name": _name(path), "path": path, "type": "dir"}
+
+            def _download(self, path):
+                content = fake.files.get(path)
+                if content is None:
+                    return self._error(404, "NotFound")
+                range_header = self.headers.get("Range", "")
+                if range_header.startswith("bytes="):
+                    start_s, _, end_s = range_header[6:].split(",", 1)[0].partition("-")
+                    if start_s:
+                        start = int(start_s)
+                        end = min(int(end_s), len(content) - 1) if end_s else len(content) - 1
+                    else:
+                        start = max(len(content) - int(end_s), 0)
+                        end = len(content) - 1
+                    if start >= len(content):
+                        return self._send(416, headers={"Content-Range": f"bytes */{len(content)}"})
+                    return self._send(
+                        206,
+                        content[start : end + 1],
+                        "application/octet-stream",
+                        {"Content-Range": f"bytes {start}-{end}/{len(content)}", "Accept-Ranges": "bytes"},
+                    )
+                return self._send(200, content, "application/octet-stream", {"Accept-Ranges": "bytes"})
+
+            do_GET = do_PUT = do_DELETE = do_HEAD = do_POST = _dispatch
+
+        return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Фейковый Яндекс.Диск для локальных бенчмарков")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, секунды")
+    args = parser.parse_args()
+    fake = FakeYandexDisk(args.host, args.port, latency=args.latency)
+    print(f"YANDEX_DISK_API_BASE={fake.api_base}")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
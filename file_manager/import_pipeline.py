@@ -1,16 +1,17 @@
 from pathlib import PurePosixPath
 
 from .models import ExternalStorageConnection, File
-from .yandex_disk import upload_file_bytes
+from .yandex_transfer import get_engine
 
 
 def import_yandex_file(user, filename, content):
+    """content: bytes, путь к файлу или файловый объект — выгружается потоком."""
     connection = ExternalStorageConnection.objects.filter(user=user, provider="yandex_disk").first()
     if not connection:
         raise RuntimeError("Yandex Disk is not connected")
 
     remote_path = f"app:/Classroom/{user.id}/{PurePosixPath(filename).name}"
-    upload_file_bytes(connection.access_token, remote_path, content, overwrite=True)
+    size = get_engine().upload(connection.access_token, remote_path, content, overwrite=True)
 
     file_obj = File(
         title=filename,
@@ -18,7 +19,7 @@ def import_yandex_file(user, filename, content):
         visibility="private",
         storage_provider="yandex_disk",
         yandex_path=remote_path,
-        file_size=len(content),
+        file_size=size,
     )
     file_obj.save()
     return file_obj
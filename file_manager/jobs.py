@@ -0,0 +1,384 @@
+"""
+Локальная очередь фоновых задач (без Celery): тяжёлую обработку загрузок выполняет
+отдельный процесс `manage.py run_job_worker`, а запрос возвращается сразу.
+
+Регистрация обработчика (модули <app>/tasks.py подхватываются автоматически):
+
+    @job("file.process_upload", max_attempts=3, on_failure=mark_failed)
+    def process_upload(file_id):
+        ...
+
+    enqueue("file.process_upload", file_id=file_obj.id)
+
+JOB_QUEUE_BACKEND:
+  redis    — списки Redis (JOB_QUEUE_REDIS_URL, по умолчанию REDIS_URL): ready -> BLMOVE в
+             processing, отложенные повторы — в sorted set; задачи упавшего воркера
+             возвращаются в очередь через JOB_QUEUE_VISIBILITY_TIMEOUT (воркер проверяет
+             processing при старте и затем каждые recovery_interval() секунд);
+  database — таблица BackgroundJob, выборка SELECT ... FOR UPDATE SKIP LOCKED.
+JOB_QUEUE_EAGER=1 — выполнять задачу сразу в вызывающем процессе (тесты, отладка).
+
+Задача ставится в очередь после коммита транзакции; если очередь недоступна, задача
+выполняется сразу, как раньше, — загрузка не теряется.
+Повторы: экспоненциальная пауза min(5 * 2**attempts, 300) с; после max_attempts
+вызывается on_failure(payload, exc).
+"""
+from __future__ import annotations
+
+import json
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any, Callable
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+logger = logging.getLogger(__name__)
+
+BACKEND_REDIS = "redis"
+BACKEND_DATABASE = "database"
+
+DEFAULT_MAX_ATTEMPTS = 3
+MAX_RETRY_DELAY = 300
+DEFAULT_VISIBILITY_TIMEOUT = 30 * 60
+MAX_RECOVERY_INTERVAL = 60
+
+
+@dataclass
+class JobHandler:
+    name: str
+    func: Callable[..., Any]
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS
+    on_failure: Callable[[dict, BaseException], Any] | None = None
+
+
+@dataclass
+class Job:
+    name: str
+    payload: dict
+    attempts: int = 0
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS
+    # Идентификатор в бэкенде: строка Redis-очереди или pk BackgroundJob.
+    ref: Any = None
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+
+
+_handlers: dict[str, JobHandler] = {}
+_discovered = False
+
+
+def job(name: str, *, max_attempts: int = DEFAULT_MAX_ATTEMPTS, on_failure=None):
+    """Декоратор: регистрирует функцию как обработчик задачи name."""
+
+    def decorator(func):
+        _handlers[name] = JobHandler(name=name, func=func, max_attempts=max_attempts, on_failure=on_failure)
+        return func
+
+    return decorator
+
+
+def get_handler(name: str) -> JobHandler | None:
+    global _discovered
+    if name not in _handlers and not _discovered:
+        autodiscover_modules("tasks")
+        _discovered = True
+    return _handlers.get(name)
+
+
+def retry_delay(attempts: int) -> int:
+    return min(5 * 2 ** max(attempts, 0), MAX_RETRY_DELAY)
+
+
+def _visibility_timeout() -> int:
+    return int(getattr(settings, "JOB_QUEUE_VISIBILITY_TIMEOUT", DEFAULT_VISIBILITY_TIMEOUT) or DEFAULT_VISIBILITY_TIMEOUT)
+
+
+def recovery_interval() -> float:
+    """Как часто воркер ищет зависшие задачи: не реже раза в минуту и дважды за visibility timeout."""
+    return min(_visibility_timeout() / 2, MAX_RECOVERY_INTERVAL)
+
+
+class RedisJobBackend:
+    """Очередь на списках Redis: надёжная выборка через BLMOVE ready -> processing."""
+
+    def __init__(self, url: str, prefix: str = "classroom:jobs"):
+        import redis
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.ready_key = f"{prefix}:ready"
+        self.processing_key = f"{prefix}:processing"
+        self.delayed_key = f"{prefix}:delayed"
+        self.started_key = f"{prefix}:started"
+
+    @staticmethod
+    def _dump(job_obj: Job) -> str:
+        return json.dumps(
+            {
+                "id": job_obj.id,
+                "name": job_obj.name,
+                "payload": job_obj.payload,
+                "attempts": job_obj.attempts,
+                "max_attempts": job_obj.max_attempts,
+            },
+            ensure_ascii=False,
+        )
+
+    @staticmethod
+    def _load(raw: str) -> Job:
+        data = json.loads(raw)
+        return Job(
+            id=data["id"],
+            name=data["name"],
+            payload=data.get("payload") or {},
+            attempts=int(data.get("attempts") or 0),
+            max_attempts=int(data.get("max_attempts") or DEFAULT_MAX_ATTEMPTS),
+            ref=raw,
+        )
+
+    def push(self, job_obj: Job) -> None:
+        self.client.lpush(self.ready_key, self._dump(job_obj))
+
+    def _promote_delayed(self) -> None:
+        due = self.client.zrangebyscore(self.delayed_key, "-inf", time.time(), start=0, num=100)
+        for raw in due:
+            # ZREM вернёт 1 только одному из воркеров — задача не задублируется.
+            if self.client.zrem(self.delayed_key, raw):
+                self.client.lpush(self.ready_key, raw)
+
+    def recover_stale(self) -> int:
+        """Возвращает в очередь задачи, которые висят в processing дольше visibility timeout."""
+        cutoff = time.time() - _visibility_timeout()
+        recovered = 0
+        for raw in self.client.lrange(self.processing_key, 0, -1):
+            try:
+                job_id = json.loads(raw)["id"]
+            except (ValueError, KeyError, TypeError):
+                self.client.lrem(self.processing_key, 1, raw)
+                continue
+            started = self.client.hget(self.started_key, job_id)
+            if started is None:
+                # Задачу только что взяли BLMOVE, и reserve ещё не записал время старта. Отсчёт
+                # ставится здесь (HSETNX не перетрёт время от reserve): если воркер упал между
+                # BLMOVE и HSET, задача вернётся в очередь через visibility timeout.
+                self.client.hsetnx(self.started_key, job_id, time.time())
+                continue
+            if float(started) > cutoff:
+                continue
+            if self.client.lrem(self.processing_key, 1, raw):
+                self.client.hdel(self.started_key, job_id)
+                self.client.lpush(self.ready_key, raw)
+                recovered += 1
+        return recovered
+
+    def reserve(self, timeout: float) -> Job | None:
+        self._promote_delayed()
+        raw = self.client.blmove(self.ready_key, self.processing_key, timeout, "RIGHT", "LEFT")
+        if raw is None:
+            return None
+        job_obj = self._load(raw)
+        self.client.hset(self.started_key, job_obj.id, time.time())
+        job_obj.attempts += 1
+        return job_obj
+
+    def _finish(self, job_obj: Job, pipe) -> None:
+        pipe.lrem(self.processing_key, 1, job_obj.ref)
+        pipe.hdel(self.started_key, job_obj.id)
+
+    def ack(self, job_obj: Job) -> None:
+        pipe = self.client.pipeline()
+        self._finish(job_obj, pipe)
+        pipe.execute()
+
+    def retry(self, job_obj: Job, delay: int, error: str) -> None:
+        pipe = self.client.pipeline()
+        self._finish(job_obj, pipe)
+        pipe.zadd(self.delayed_key, {self._dump(job_obj): time.time() + delay})
+        pipe.execute()
+
+    def fail(self, job_obj: Job, error: str) -> None:
+        self.ack(job_obj)
+
+
+class DatabaseJobBackend:
+    """Очередь в таблице BackgroundJob: для установок без Redis."""
+
+    def push(self, job_obj: Job) -> None:
+        from .models import BackgroundJob
+
+        BackgroundJob.objects.create(
+            name=job_obj.name,
+            payload=job_obj.payload,
+            max_attempts=job_obj.max_attempts,
+        )
+
+    def recover_stale(self) -> int:
+        from .models import BackgroundJob
+
+        cutoff = timezone.now() - timedelta(seconds=_visibility_timeout())
+        return BackgroundJob.objects.filter(status="running", locked_at__lt=cutoff).update(
+            status="queued",
+            locked_at=None,
+        )
+
+    def reserve(self, timeout: float) -> Job | None:
+        from .models import BackgroundJob
+
+        deadline = time.monotonic() + timeout
+        while True:
+            with transaction.atomic():
+                row = (
+                    BackgroundJob.objects.select_for_update(skip_locked=True)
+                    .filter(status="queued", run_after__lte=timezone.now())
+                    .order_by("run_after", "id")
+                    .first()
+                )
+                if row is not None:
+                    row.status = "running"
+                    row.locked_at = timezone.now()
+                    row.attempts += 1
+                    row.save(update_fields=["status", "locked_at", "attempts", "updated_at"])
+                    return Job(
+                        name=row.name,
+                        payload=row.payload or {},
+                        attempts=row.attempts,
+                        max_attempts=row.max_attempts,
+                        ref=row.pk,
+                        id=str(row.pk),
+                    )
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(min(1.0, max(deadline - time.monotonic(), 0)))
+
+    def ack(self, job_obj: Job) -> None:
+        from .models import BackgroundJob
+
+        BackgroundJob.objects.filter(pk=job_obj.ref).delete()
+
+    def retry(self, job_obj: Job, delay: int, error: str) -> None:
+        from .models import BackgroundJob
+
+        BackgroundJob.objects.filter(pk=job_obj.ref).update(
+            status="queued",
+            locked_at=None,
+            run_after=timezone.now() + timedelta(seconds=delay),
+            last_error=error,
+            updated_at=timezone.now(),
+        )
+
+    def fail(self, job_obj: Job, error: str) -> None:
+        from .models import BackgroundJob
+
+        BackgroundJob.objects.filter(pk=job_obj.ref).update(
+            status="failed",
+            locked_at=None,
+            last_error=error,
+            updated_at=timezone.now(),
+        )
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        kind = (getattr(settings, "JOB_QUEUE_BACKEND", "") or BACKEND_DATABASE).strip().lower()
+        if kind == BACKEND_REDIS:
+            url = getattr(settings, "JOB_QUEUE_REDIS_URL", "") or settings.REDIS_URL
+            _backend = RedisJobBackend(url)
+        else:
+            _backend = DatabaseJobBackend()
+    return _backend
+
+
+@receiver(setting_changed)
+def _reset_backend(*, setting, **kwargs):
+    global _backend
+    if setting.startswith("JOB_QUEUE_"):
+        _backend = None
+
+
+def _run_inline(name: str, payload: dict) -> None:
+    handler = get_handler(name)
+    if handler is None:
+        logger.error("jobs: неизвестная задача %s", name)
+        return
+    try:
+        handler.func(**payload)
+    except Exception as exc:
+        logger.exception("jobs: задача %s завершилась ошибкой (inline)", name)
+        if handler.on_failure:
+            handler.on_failure(payload, exc)
+
+
+def _push(job_obj: Job) -> None:
+    try:
+        get_backend().push(job_obj)
+    except Exception:
+        logger.warning("jobs: очередь недоступна, задача %s выполняется сразу", job_obj.name, exc_info=True)
+        _run_inline(job_obj.name, job_obj.payload)
+
+
+def enqueue(name: str, **payload) -> None:
+    """Ставит задачу в очередь после коммита текущей транзакции (payload — JSON-совместимый)."""
+    if getattr(settings, "JOB_QUEUE_EAGER", False):
+        _run_inline(name, payload)
+        return
+    handler = get_handler(name)
+    job_obj = Job(
+        name=name,
+        payload=payload,
+        max_attempts=handler.max_attempts if handler else DEFAULT_MAX_ATTEMPTS,
+    )
+    transaction.on_commit(lambda: _push(job_obj))
+
+
+def run_job(job_obj: Job, backend=None) -> bool:
+    """Выполняет зарезервированную задачу; True — успешно."""
+    backend = backend or get_backend()
+    handler = get_handler(job_obj.name)
+    if handler is None:
+        logger.error("jobs: неизвестная задача %s id=%s", job_obj.name, job_obj.id)
+        backend.fail(job_obj, f"unknown job {job_obj.name}")
+        return False
+    started = time.monotonic()
+    try:
+        handler.func(**job_obj.payload)
+    except Exception as exc:
+        error = f"{type(exc).__name__}: {exc}"
+        if job_obj.attempts >= job_obj.max_attempts:
+            logger.exception(
+                "jobs: %s id=%s не выполнена после %s попыток",
+                job_obj.name,
+                job_obj.id,
+                job_obj.attempts,
+            )
+            backend.fail(job_obj, error)
+            if handler.on_failure:
+                try:
+                    handler.on_failure(job_obj.payload, exc)
+                except Exception:
+                    logger.exception("jobs: on_failure %s упал", job_obj.name)
+        else:
+            delay = retry_delay(job_obj.attempts)
+            logger.warning(
+                "jobs: %s id=%s попытка %s/%s: %s; повтор через %s с",
+                job_obj.name,
+                job_obj.id,
+                job_obj.attempts,
+                job_obj.max_attempts,
+                error,
+                delay,
+            )
+            backend.retry(job_obj, delay, error)
+        return False
+    backend.ack(job_obj)
+    logger.info("jobs: %s id=%s выполнена за %.2f с", job_obj.name, job_obj.id, time.monotonic() - started)
+    return True
@@ -0,0 +1,387 @@
+"""
+Пул долгоживущих headless-процессов LibreOffice для конвертации документов в PDF.
+
+Раньше каждая конвертация запускала новый soffice (холодный старт в несколько секунд),
+а одновременные зрители — сколько угодно процессов. Теперь в каждом процессе Django
+(веб, воркер задач) не больше LIBREOFFICE_WORKERS воркеров:
+  - воркер — мост lo_bridge.py под Python с модулем uno и держащий тёплый soffice
+    с собственным профилем (-env:UserInstallation); задания идут по Unix-сокету;
+  - если Python с uno не найден, воркер запускает soffice --convert-to на каждое задание,
+    но со своим постоянным профилем и в тех же лимитах пула;
+  - ожидающих свободного воркера не больше LIBREOFFICE_MAX_QUEUE, ждут не дольше
+    LIBREOFFICE_QUEUE_TIMEOUT — иначе ConversionBusyError (ответ 503 с Retry-After);
+  - задание дольше LIBREOFFICE_JOB_TIMEOUT убивает группу процессов воркера;
+  - воркер перезапускается после LIBREOFFICE_MAX_JOBS_PER_WORKER заданий или когда
+    его процессы занимают больше LIBREOFFICE_MAX_RSS_MB.
+"""
+from __future__ import annotations
+
+import atexit
+import functools
+import json
+import logging
+import os
+import queue
+import select
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+BRIDGE_SCRIPT = str(Path(__file__).with_name("lo_bridge.py"))
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+class ConversionBusyError(RuntimeError):
+    """Все воркеры LibreOffice заняты, очередь переполнена или ожидание истекло."""
+
+
+class _WorkerFailed(RuntimeError):
+    """Воркер не запустился, завис или упал — его нужно убить и заменить."""
+
+
+def _process_group_rss(pgid: int) -> int:
+    total = 0
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else ():
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "rb") as fh:
+                fields = fh.read().rsplit(b")", 1)[1].split()
+            if int(fields[2]) != pgid:
+                continue
+            with open(f"/proc/{entry}/statm", "rb") as fh:
+                total += int(fh.read().split()[1]) * _PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+def _kill_group(process: subprocess.Popen) -> None:
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    try:
+        process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        pass
+
+
+class _BridgeWorker:
+    """soffice за мостом lo_bridge.py; одно задание за раз."""
+
+    def __init__(self, command: list[str], soffice: str, profile_dir: str, start_timeout: float):
+        self.jobs = 0
+        self._socket_path = os.path.join(profile_dir, "bridge.sock")
+        # Убитый предыдущий воркер слота мог оставить сокет.
+        if os.path.exists(self._socket_path):
+            os.unlink(self._socket_path)
+        self._process = subprocess.Popen(
+            [
+                *command,
+                "--socket", self._socket_path,
+                "--profile", os.path.join(profile_dir, "profile"),
+                "--soffice", soffice,
+                "--start-timeout", str(start_timeout),
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        ready, _, _ = select.select([self._process.stdout], [], [], start_timeout)
+        line = self._process.stdout.readline() if ready else b""
+        if line.strip() != b"READY":
+            _kill_group(self._process)
+            raise _WorkerFailed("LibreOffice-воркер не запустился")
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(self._socket_path)
+        self._stream = self._sock.makefile("rwb")
+
+    @property
+    def pid(self) -> int:
+        return self._process.pid
+
+    def alive(self) -> bool:
+        return self._process.poll() is None
+
+    def rss_bytes(self) -> int:
+        return _process_group_rss(self._process.pid)
+
+    def convert(self, src: str, dst: str, timeout: float) -> None:
+        self._sock.settimeout(timeout)
+        try:
+            self._stream.write((json.dumps({"src": src, "dst": dst}) + "\n").encode("utf-8"))
+            self._stream.flush()
+            line = self._stream.readline()
+        except (OSError, socket.timeout) as exc:
+            raise _WorkerFailed(f"LibreOffice не ответил за {timeout:g} с") from exc
+        if not line:
+            raise _WorkerFailed("LibreOffice-воркер завершился во время конвертации")
+        self.jobs += 1
+        reply = json.loads(line)
+        if not reply.get("ok"):
+            raise RuntimeError(f"LibreOffice: {reply.get('error') or 'ошибка конвертации'}")
+
+    def kill(self) -> None:
+        self._sock.close()
+        _kill_group(self._process)
+
+    def stop(self) -> None:
+        try:
+            self._sock.settimeout(5)
+            self._stream.write(b'{"cmd": "quit"}\n')
+            self._stream.flush()
+            self._process.wait(timeout=15)
+        except (OSError, socket.timeout, subprocess.TimeoutExpired):
+            pass
+        finally:
+            self._sock.close()
+            _kill_group(self._process)
+
+
+class _OneShotWorker:
+    """Без uno: soffice --convert-to на задание, но с постоянным профилем слота."""
+
+    def __init__(self, soffice: str, profile_dir: str):
+        self.jobs = 0
+        self.pid = None
+        self._soffice = soffice
+        self._profile_url = Path(profile_dir, "profile").resolve().as_uri()
+
+    def alive(self) -> bool:
+        return True
+
+    def rss_bytes(self) -> int:
+        return 0
+
+    def convert(self, src: str, dst: str, timeout: float) -> None:
+        outdir = os.path.dirname(dst)
+        process = subprocess.Popen(
+            [
+                self._soffice,
+                "--headless",
+                "--norestore",
+                "--nolockcheck",
+                f"-env:UserInstallation={self._profile_url}",
+                "--convert-to",
+                "pdf",
+                "--outdir",
+                outdir,
+                src,
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+        )
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired as exc:
+            _kill_group(process)
+            raise RuntimeError("Конвертация в PDF превысила время ожидания.") from exc
+        self.jobs += 1
+        if process.returncode != 0:
+            err = (stderr or stdout or b"").decode("utf-8", "replace")[:2000]
+            raise RuntimeError(f"LibreOffice завершился с ошибкой: {err}")
+        produced = os.path.join(outdir, f"{Path(src).stem}.pdf")
+        if not os.path.exists(produced):
+            raise RuntimeError("После конвертации PDF не найден.")
+        os.replace(produced, dst)
+
+    def kill(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+
+class LibreOfficePool:
+    def __init__(
+        self,
+        *,
+        soffice: str,
+        size: int = 2,
+        bridge_command: list[str] | None = None,
+        job_timeout: float = 120,
+        queue_timeout: float = 20,
+        max_queue: int = 8,
+        max_jobs_per_worker: int = 200,
+        max_rss_bytes: int = 0,
+        start_timeout: float = 60,
+    ):
+        self.soffice = soffice
+        self.size = max(int(size), 1)
+        self.bridge_command = bridge_command
+        self.job_timeout = job_timeout
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_rss_bytes = max_rss_bytes
+        self.start_timeout = start_timeout
+        self.started = 0
+        self._base_dir = tempfile.mkdtemp(prefix=f"classroom-lo-{os.getpid()}-")
+        # В очереди — свободные слоты: запущенный воркер или номер слота без процесса.
+        # LIFO, чтобы чаще доставался уже тёплый воркер.
+        self._free: queue.LifoQueue = queue.LifoQueue()
+        for slot in reversed(range(self.size)):
+            self._free.put(slot)
+        self._workers: dict[int, object] = {}
+        self._waiting = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _acquire(self):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Пул LibreOffice остановлен")
+            if self._free.empty() and self._waiting >= self.max_queue:
+                raise ConversionBusyError("Очередь конвертации переполнена")
+            self._waiting += 1
+        try:
+            return self._free.get(timeout=self.queue_timeout)
+        except queue.Empty:
+            raise ConversionBusyError(
+                f"Нет свободного воркера LibreOffice за {self.queue_timeout:g} с"
+            ) from None
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def _start_worker(self, slot: int):
+        profile_dir = os.path.join(self._base_dir, f"slot{slot}")
+        os.makedirs(profile_dir, exist_ok=True)
+        if self.bridge_command:
+            worker = _BridgeWorker(self.bridge_command, self.soffice, profile_dir, self.start_timeout)
+        else:
+            worker = _OneShotWorker(self.soffice, profile_dir)
+        worker.slot = slot
+        self.started += 1
+        logger.info("libreoffice pool: слот %s запущен pid=%s", slot, worker.pid)
+        return worker
+
+    def _should_recycle(self, worker) -> bool:
+        if self.max_jobs_per_worker and worker.jobs >= self.max_jobs_per_worker:
+            return True
+        return bool(self.max_rss_bytes) and worker.rss_bytes() > self.max_rss_bytes
+
+    def convert(self, src_path: str) -> bytes:
+        if not os.path.isfile(src_path):
+            raise FileNotFoundError(src_path)
+        item = self._acquire()
+        slot = item if isinstance(item, int) else item.slot
+        worker = None if isinstance(item, int) else item
+        try:
+            if worker is not None and not worker.alive():
+                worker.kill()
+                worker = None
+            if worker is None:
+                worker = self._start_worker(slot)
+                self._workers[slot] = worker
+            with tempfile.TemporaryDirectory(prefix="lo_pdf_") as tmpdir:
+                dst = os.path.join(tmpdir, "out.pdf")
+                try:
+                    worker.convert(os.path.abspath(src_path), dst, self.job_timeout)
+                except _WorkerFailed:
+                    worker.kill()
+                    worker = None
+                    raise
+                if not os.path.exists(dst):
+                    raise RuntimeError("После конвертации PDF не найден.")
+                with open(dst, "rb") as fh:
+                    return fh.read()
+        finally:
+            if worker is not None and self._should_recycle(worker):
+                logger.info("libreoffice pool: перезапуск слота %s после %s заданий", slot, worker.jobs)
+                worker.stop()
+                worker = None
+            if worker is None:
+                self._workers.pop(slot, None)
+            self._free.put(worker if worker is not None else slot)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._closed = True
+        for worker in list(self._workers.values()):
+            worker.stop()
+        self._workers.clear()
+        shutil.rmtree(self._base_dir, ignore_errors=True)
+
+
+@functools.lru_cache(maxsize=8)
+def _python_has_uno(python: str) -> bool:
+    try:
+        return subprocess.run([python, "-c", "import uno"], capture_output=True, timeout=20).returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+
+def get_libreoffice_python(soffice: str) -> str | None:
+    """Интерпретатор с модулем uno: LIBREOFFICE_PYTHON, python из комплекта LibreOffice или системный python3."""
+    override = (getattr(settings, "LIBREOFFICE_PYTHON", "") or "").strip()
+    if override:
+        return override if _python_has_uno(override) else None
+    program_dir = os.path.dirname(os.path.realpath(soffice))
+    candidates = [os.path.join(program_dir, name) for name in ("python", "python.bin", "python.exe")]
+    candidates += [shutil.which("python3") or "", sys.executable]
+    for candidate in candidates:
+        if candidate and os.path.isfile(candidate) and _python_has_uno(candidate):
+            return candidate
+    return None
+
+
+_pool: LibreOfficePool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(soffice: str) -> LibreOfficePool | None:
+    """Пул процесса; None — LIBREOFFICE_WORKERS=0 (прежний soffice на каждую конвертацию)."""
+    global _pool
+    size = int(getattr(settings, "LIBREOFFICE_WORKERS", 2) or 0)
+    if size <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                python = get_libreoffice_python(soffice)
+                if python is None:
+                    logger.info("libreoffice pool: Python с uno не найден, воркеры запускают soffice на задание")
+                _pool = LibreOfficePool(
+                    soffice=soffice,
+                    size=size,
+                    bridge_command=[python, BRIDGE_SCRIPT] if python else None,
+                    job_timeout=int(getattr(settings, "LIBREOFFICE_JOB_TIMEOUT", 120) or 120),
+                    queue_timeout=int(getattr(settings, "LIBREOFFICE_QUEUE_TIMEOUT", 20) or 0),
+                    max_queue=int(getattr(settings, "LIBREOFFICE_MAX_QUEUE", 8) or 0),
+                    max_jobs_per_worker=int(getattr(settings, "LIBREOFFICE_MAX_JOBS_PER_WORKER", 200) or 0),
+                    max_rss_bytes=int(getattr(settings, "LIBREOFFICE_MAX_RSS_MB", 1024) or 0) * 1024 * 1024,
+                )
+    return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+atexit.register(shutdown_pool)
+
+
+@receiver(setting_changed)
+def _reset_pool(*, setting, **kwargs):
+    if setting.startswith("LIBREOFFICE_"):
+        shutdown_pool()
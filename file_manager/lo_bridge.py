@@ -0,0 +1,153 @@
+"""
+Мост к долгоживущему headless LibreOffice для пула конвертации (file_manager/libreoffice_pool.py).
+
+Запускается интерпретатором, в котором есть модуль uno (Python из комплекта LibreOffice
+или системный python3 с пакетом python3-uno), поэтому Django здесь не импортируется.
+Скрипт поднимает soffice со своим профилем (-env:UserInstallation), подключается к нему
+по UNO и принимает задания на Unix-сокете: по строке JSON на задание
+    {"src": "/abs/in.docx", "dst": "/abs/out.pdf"}  ->  {"ok": true} | {"ok": false, "error": "..."}
+    {"cmd": "quit"}                                 ->  завершение soffice и моста.
+Готовность сообщается строкой READY в stdout.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+PDF_FILTERS = (
+    ("com.sun.star.text.TextDocument", "writer_pdf_Export"),
+    ("com.sun.star.sheet.SpreadsheetDocument", "calc_pdf_Export"),
+    ("com.sun.star.presentation.PresentationDocument", "impress_pdf_Export"),
+    ("com.sun.star.drawing.DrawingDocument", "draw_pdf_Export"),
+)
+
+
+def _file_url(path):
+    import uno
+
+    return uno.systemPathToFileUrl(os.path.abspath(path))
+
+
+def _prop(name, value):
+    from com.sun.star.beans import PropertyValue
+
+    prop = PropertyValue()
+    prop.Name = name
+    prop.Value = value
+    return prop
+
+
+def start_office(soffice, profile, pipe_name):
+    os.makedirs(profile, exist_ok=True)
+    return subprocess.Popen(
+        [
+            soffice,
+            "--headless",
+            "--invisible",
+            "--nologo",
+            "--norestore",
+            "--nodefault",
+            "--nolockcheck",
+            "-env:UserInstallation=" + _file_url(profile),
+            "--accept=pipe,name=%s;urp;StarOffice.ComponentContext" % pipe_name,
+        ],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def connect(pipe_name, office, timeout):
+    import uno
+
+    local = uno.getComponentContext()
+    resolver = local.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            context = resolver.resolve("uno:pipe,name=%s;urp;StarOffice.ComponentContext" % pipe_name)
+            return context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+        except Exception:
+            if office.poll() is not None:
+                raise RuntimeError("soffice завершился при запуске (код %s)" % office.returncode)
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.25)
+
+
+def convert(desktop, src, dst):
+    document = desktop.loadComponentFromURL(
+        _file_url(src),
+        "_blank",
+        0,
+        (_prop("Hidden", True), _prop("ReadOnly", True), _prop("UpdateDocMode", 0)),
+    )
+    if document is None:
+        raise RuntimeError("LibreOffice не смог открыть документ")
+    try:
+        filter_name = next(
+            (name for service, name in PDF_FILTERS if document.supportsService(service)),
+            "writer_pdf_Export",
+        )
+        document.storeToURL(_file_url(dst), (_prop("FilterName", filter_name),))
+    finally:
+        document.close(True)
+
+
+def serve(desktop, socket_path):
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+    sys.stdout.write("READY\n")
+    sys.stdout.flush()
+    while True:
+        conn, _ = server.accept()
+        with conn, conn.makefile("rwb") as stream:
+            for line in stream:
+                request = json.loads(line)
+                if request.get("cmd") == "quit":
+                    return
+                try:
+                    convert(desktop, request["src"], request["dst"])
+                    reply = {"ok": True}
+                except Exception as exc:
+                    reply = {"ok": False, "error": "%s: %s" % (type(exc).__name__, exc)}
+                stream.write((json.dumps(reply) + "\n").encode("utf-8"))
+                stream.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", required=True)
+    parser.add_argument("--profile", required=True)
+    parser.add_argument("--soffice", required=True)
+    parser.add_argument("--start-timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    pipe_name = "classroom_lo_%d" % os.getpid()
+    office = start_office(args.soffice, args.profile, pipe_name)
+    desktop = None
+    try:
+        desktop = connect(pipe_name, office, args.start_timeout)
+        serve(desktop, args.socket)
+    finally:
+        if desktop is not None:
+            try:
+                desktop.terminate()
+            except Exception:
+                pass
+        try:
+            office.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            office.kill()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import re
+import time
+
+from django.core.management import BaseCommand
+
+from file_manager.wordfilter import BannedWordMatcher, load_banned_entries
+
+SAMPLE_PARAGRAPH = (
+    "Лекция 7. Интегрирование по частям. Пусть функции u(x) и v(x) непрерывно дифференцируемы "
+    "на отрезке [a, b]; тогда интеграл от u dv равен uv минус интеграл от v du. "
+)
+
+
+def legacy_find_banned_match(text, entries):
+    """Прежняя реализация: отдельное регулярное выражение и отдельный проход на каждую запись."""
+    lowered_full = text.lower()
+    for entry in sorted(entries, key=len, reverse=True):
+        e = entry.strip()
+        if not e:
+            continue
+        if " " in e:
+            if e.lower() in lowered_full:
+                return entry
+            continue
+        pattern = re.compile(r"(?<!\w)" + re.escape(e) + r"(?!\w)", re.IGNORECASE | re.UNICODE)
+        if pattern.search(text):
+            return entry
+    return None
+
+
+class Command(BaseCommand):
+    help = "Сравнить скомпилированный словарь модерации с прежней проверкой по одной записи на чистом тексте"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--kib", type=int, default=256, help="Объём текста, КиБ")
+        parser.add_argument("--repeat", type=int, default=3, help="Сколько раз повторить каждую проверку")
+        parser.add_argument("--chunk", type=int, default=64 * 1024, help="Размер куска для потоковой проверки, символов")
+
+    def handle(self, *args, **options):
+        entries = load_banned_entries()
+        if not entries:
+            self.stdout.write(self.style.WARNING("Словарь words.txt пуст или не найден"))
+            return
+        size = max(options["kib"], 1) * 1024
+        text = (SAMPLE_PARAGRAPH * (size // len(SAMPLE_PARAGRAPH) + 1))[:size]
+        repeat = max(options["repeat"], 1)
+        chunk = max(options["chunk"], 1)
+
+        started = time.perf_counter()
+        matcher = BannedWordMatcher(entries)
+        self.stdout.write(f"записей: {len(entries)}, текст: {len(text)} символов")
+        self.stdout.write(f"компиляция словаря: {(time.perf_counter() - started) * 1000:.1f} мс")
+
+        self._measure("по одной записи", repeat, lambda: legacy_find_banned_match(text, entries))
+        self._measure("BannedWordMatcher.find", repeat, lambda: matcher.find(text))
+        self._measure(
+            f"BannedWordMatcher.scan (куски по {chunk})",
+            repeat,
+            lambda: matcher.scan(text[i : i + chunk] for i in range(0, len(text), chunk)),
+        )
+
+    def _measure(self, label, repeat, func):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - started)
+        self.stdout.write(f"{label}: {min(timings) * 1000:.1f} мс (лучшее из {repeat}), найдено: {result!r}")
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management import BaseCommand
+
+from file_manager.fake_yandex import FakeYandexDisk
+from file_manager.yandex_disk import YandexDiskClient
+
+
+class Command(BaseCommand):
+    help = "Сравнить клиент Яндекс.Диска с пулом соединений и запросы без пула на локальном фейковом сервере"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--files", type=int, default=50, help="Сколько файлов загрузить")
+        parser.add_argument("--depth", type=int, default=3, help="Глубина папки назначения")
+        parser.add_argument("--latency", type=float, default=0.005, help="Задержка ответа сервера, секунд")
+
+    def handle(self, *args, **options):
+        folder = "/".join(f"level{i}" for i in range(max(options["depth"], 1)))
+        paths = [f"app:/Bench/{folder}/file{i}.txt" for i in range(options["files"])]
+        payload = b"x" * 1024
+
+        with FakeYandexDisk(latency=options["latency"]) as fake:
+            # Без пула: новый Session (и соединение) на каждую загрузку и без кэша папок —
+            # так вёл себя модуль на голых requests.get/put.
+            started = time.perf_counter()
+            for path in paths:
+                client = YandexDiskClient(api_base=fake.api_base, retries=0)
+                client.upload_file_bytes("token", path, payload)
+                client.session.close()
+            self._report("без пула", fake, time.perf_counter() - started)
+
+            fake.reset_counters()
+            fake.files.clear()
+            fake.folders = {"disk:/", "app:/"}
+            client = YandexDiskClient(api_base=fake.api_base)
+            started = time.perf_counter()
+            for path in paths:
+                client.upload_file_bytes("token", path, payload)
+            self._report("YandexDiskClient", fake, time.perf_counter() - started)
+            client.session.close()
+
+    def _report(self, label, fake, elapsed):
+        self.stdout.write(
+            f"{label}: {elapsed:.3f} с, HTTP-запросов {sum(fake.requests.values())}, "
+            f"TCP-соединений {fake.connections}"
+        )
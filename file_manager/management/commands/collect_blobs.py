@@ -0,0 +1,49 @@
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+
+from file_manager.blobstore import collect_garbage, recount_references, storage_totals
+from file_manager.quota_units import format_bytes_ru
+from file_manager.renditions import prune_renditions
+
+
+class Command(BaseCommand):
+    help = (
+        "Удалить устаревшие рендишны PDF и blob-содержимое без ссылок, "
+        "показать логический/физический объём хранилища"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace-minutes",
+            type=int,
+            default=60,
+            help="Не трогать blob, на которые ссылались позже этого срока (идущие загрузки)",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Только посчитать, ничего не удалять")
+        parser.add_argument(
+            "--recount",
+            action="store_true",
+            help="Сначала пересчитать ссылки на blob по БД (исправляет счётчики после сбоев)",
+        )
+
+    def handle(self, *args, **options):
+        if options["recount"] and not options["dry_run"]:
+            fixed = recount_references()
+            self.stdout.write(f"Исправлено счётчиков ссылок: {fixed}")
+        pruned = prune_renditions(dry_run=options["dry_run"])
+        self.stdout.write(f"Устаревших рендишнов PDF: {pruned}")
+        removed, freed = collect_garbage(
+            grace=timedelta(minutes=max(options["grace_minutes"], 0)),
+            dry_run=options["dry_run"],
+        )
+        verb = "Будет удалено" if options["dry_run"] else "Удалено"
+        self.stdout.write(f"{verb} blob: {removed} ({format_bytes_ru(freed)})")
+
+        totals = storage_totals()
+        self.stdout.write(
+            f"Логический объём: {format_bytes_ru(totals['logical_bytes'])}; "
+            f"физический (blob): {format_bytes_ru(totals['physical_bytes'])}; "
+            f"blob: {totals['blob_count']}"
+        )
+        self.stdout.write(self.style.SUCCESS("Сборка мусора blob завершена"))
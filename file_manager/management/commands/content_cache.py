@@ -0,0 +1,39 @@
+from django.core.management import BaseCommand
+
+from file_manager import content_cache
+from file_manager.quota_units import format_bytes_ru
+
+
+class Command(BaseCommand):
+    help = "Статистика и очистка локального кэша содержимого файлов Яндекс.Диска"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--stats", action="store_true", help="Показать попадания, промахи и занятый объём")
+        parser.add_argument("--clear", action="store_true", help="Удалить все записи кэша")
+        parser.add_argument("--evict", action="store_true", help="Вытеснить записи сверх лимита")
+        parser.add_argument("--reset-stats", action="store_true", help="Обнулить счётчики")
+
+    def handle(self, *args, **options):
+        if options["clear"]:
+            removed, freed = content_cache.evict(limit=0)
+            self.stdout.write(f"Удалено записей: {removed} ({format_bytes_ru(freed)})")
+        elif options["evict"]:
+            removed, freed = content_cache.evict()
+            self.stdout.write(f"Вытеснено записей: {removed} ({format_bytes_ru(freed)})")
+        if options["reset_stats"]:
+            content_cache.reset_stats()
+            self.stdout.write("Счётчики обнулены")
+        if options["stats"] or not any(options[name] for name in ("clear", "evict", "reset_stats")):
+            stats = content_cache.stats()
+            lookups = stats["hits"] + stats["misses"]
+            hit_rate = stats["hits"] / lookups * 100 if lookups else 0.0
+            self.stdout.write(
+                f"Каталог: {content_cache.cache_dir() or '—'}"
+                f" ({'включён' if content_cache.is_enabled() else 'выключен'})\n"
+                f"Записей: {stats['entries']}, объём: {format_bytes_ru(stats['bytes'])}"
+                f" из {format_bytes_ru(stats['max_bytes'])}\n"
+                f"Попаданий: {stats['hits']}, промахов: {stats['misses']} ({hit_rate:.1f}% попаданий), "
+                f"в обход кэша: {stats['bypass']}\n"
+                f"Скачано в кэш: {format_bytes_ru(stats['fill_bytes'])}; "
+                f"вытеснено: {stats['evictions']} ({format_bytes_ru(stats['evicted_bytes'])})"
+            )
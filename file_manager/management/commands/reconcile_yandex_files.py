@@ -0,0 +1,23 @@
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand
+
+from file_manager.yandex_sync import reconcile_user
+
+
+class Command(BaseCommand):
+    help = "Сверить файлы Яндекс.Диска с записями File и удалить записи об удалённых на Диске файлах"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, action="append", help="id пользователя (можно несколько)")
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(uploaded_files__storage_provider="yandex_disk").distinct()
+        if options["user"]:
+            users = users.filter(pk__in=options["user"])
+        total = 0
+        for user in users.iterator():
+            removed = reconcile_user(user)
+            total += removed
+            if removed:
+                self.stdout.write(f"{user.username}: удалено записей {removed}")
+        self.stdout.write(self.style.SUCCESS(f"Сверка Яндекс.Диска завершена, удалено записей: {total}"))
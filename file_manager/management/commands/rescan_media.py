@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from file_manager.rescan import rescan_media
+
+
+class Command(BaseCommand):
+    help = (
+        "Перепроверить ClamAV сохранённые файлы, вложения чата, аватары и обложки "
+        "(после обновления баз сигнатур) и заблокировать заражённые"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Только найти угрозы, ничего не блокировать")
+        parser.add_argument("--limit", type=int, default=0, help="Не больше N blob за запуск")
+        parser.add_argument("--skip-media", action="store_true", help="Не проверять аватары и обложки курсов")
+
+    def handle(self, *args, **options):
+        if not getattr(settings, "CLAMAV_ENABLED", False):
+            raise CommandError("ClamAV выключен (CLAMAV_ENABLED=0)")
+        report = rescan_media(
+            dry_run=options["dry_run"],
+            limit=options["limit"] or None,
+            media=not options["skip_media"],
+        )
+        for label, threat in report["threats"]:
+            self.stdout.write(self.style.WARNING(f"{label}: {threat}"))
+        self.stdout.write(
+            f"Проверено: {report['scanned']} (из кэша вердиктов: {report['cached']}); "
+            f"угроз: {report['infected']}; ошибок проверки: {report['errors']}; "
+            f"повторно в очереди: {report['requeued']}"
+        )
+        if report["errors"]:
+            self.stdout.write(self.style.WARNING("Часть содержимого не проверена — запустите команду ещё раз"))
+        self.stdout.write(self.style.SUCCESS("Перепроверка ClamAV завершена"))
@@ -0,0 +1,28 @@
+from django.core.management import BaseCommand
+
+from file_manager.activity_rollup import rollup_activity
+
+
+class Command(BaseCommand):
+    help = (
+        "Свернуть журнал действий с файлами старше срока хранения в дневные сводки "
+        "(файл, пользователь, тип, число), перенеся исходные строки в архив"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=None,
+            help="Сколько дней хранить подробный журнал (по умолчанию ACTIVITY_LOG_RETENTION_DAYS)",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Только посчитать, ничего не менять")
+
+    def handle(self, *args, **options):
+        report = rollup_activity(days=options["days"], dry_run=options["dry_run"])
+        verb = "Будет свёрнуто" if options["dry_run"] else "Свёрнуто"
+        self.stdout.write(
+            f"{verb} строк журнала: {report['rows']} за дней: {report['days']} "
+            f"(строк сводки: {report['groups']})"
+        )
+        self.stdout.write(self.style.SUCCESS("Свёртка журнала активности завершена"))
@@ -0,0 +1,71 @@
+import signal
+import time
+
+from django.core.management import BaseCommand
+from django.db import close_old_connections
+
+from file_manager.jobs import get_backend, recovery_interval, run_job
+
+
+class Command(BaseCommand):
+    help = "Воркер фоновой очереди задач (обработка загрузок и т.п.), см. file_manager/jobs.py"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--burst",
+            action="store_true",
+            help="Выполнить накопившиеся задачи и выйти (cron, отладка)",
+        )
+        parser.add_argument(
+            "--poll-timeout",
+            type=float,
+            default=5.0,
+            help="Сколько секунд ждать новую задачу за один опрос очереди",
+        )
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        stopping = False
+
+        def request_stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+            self.stdout.write("Остановка воркера после текущей задачи...")
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        self._recover(backend)
+        next_recovery = time.monotonic() + recovery_interval()
+        self.stdout.write(self.style.SUCCESS(f"Воркер очереди запущен ({type(backend).__name__})"))
+
+        processed = failed = 0
+        timeout = 0.1 if options["burst"] else max(options["poll_timeout"], 0.1)
+        while not stopping:
+            close_old_connections()
+            # Не только при старте: задачи воркера, перезапущенного посреди работы, станут
+            # «зависшими» лишь через visibility timeout — их подберёт одна из следующих проверок.
+            if time.monotonic() >= next_recovery:
+                self._recover(backend)
+                next_recovery = time.monotonic() + recovery_interval()
+            job_obj = backend.reserve(timeout)
+            if job_obj is None:
+                if options["burst"]:
+                    break
+                continue
+            if run_job(job_obj, backend):
+                processed += 1
+            else:
+                failed += 1
+        close_old_connections()
+        self.stdout.write(f"Выполнено задач: {processed}; с ошибкой: {failed}")
+
+    def _recover(self, backend):
+        try:
+            recovered = backend.recover_stale()
+        except Exception as exc:
+            # Недоступность очереди не должна останавливать воркер — проверка повторится.
+            self.stderr.write(f"Не удалось проверить зависшие задачи: {exc}")
+            return
+        if recovered:
+            self.stdout.write(f"Возвращено в очередь зависших задач: {recovered}")
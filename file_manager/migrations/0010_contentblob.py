@@ -0,0 +1,54 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("file_manager", "0009_remove_file_extracted_text_btree_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ContentBlob",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("sha256", models.CharField(max_length=64, unique=True)),
+                ("size", models.BigIntegerField(default=0)),
+                ("storage_path", models.CharField(max_length=1024)),
+                ("ref_count", models.IntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("last_referenced_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                "verbose_name": "Blob содержимого",
+                "verbose_name_plural": "Blob содержимого",
+                "indexes": [
+                    models.Index(fields=["ref_count", "last_referenced_at"], name="file_manage_ref_cou_6df762_idx"),
+                ],
+            },
+        ),
+        migrations.AddField(
+            model_name="file",
+            name="content_blob",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="files",
+                to="file_manager.contentblob",
+            ),
+        ),
+        migrations.AddField(
+            model_name="fileversion",
+            name="content_blob",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="file_versions",
+                to="file_manager.contentblob",
+            ),
+        ),
+    ]
@@ -0,0 +1,60 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("file_manager", "0010_contentblob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="file",
+            name="processing_state",
+            field=models.CharField(
+                choices=[
+                    ("ready", "Готов"),
+                    ("processing", "Обработка"),
+                    ("rejected", "Отклонён"),
+                    ("failed", "Ошибка обработки"),
+                ],
+                default="ready",
+                max_length=20,
+            ),
+        ),
+        migrations.AddField(
+            model_name="file",
+            name="processing_error",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.CreateModel(
+            name="BackgroundJob",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("name", models.CharField(max_length=100)),
+                ("payload", models.JSONField(blank=True, default=dict)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[("queued", "В очереди"), ("running", "Выполняется"), ("failed", "Ошибка")],
+                        default="queued",
+                        max_length=20,
+                    ),
+                ),
+                ("attempts", models.IntegerField(default=0)),
+                ("max_attempts", models.IntegerField(default=3)),
+                ("run_after", models.DateTimeField(default=django.utils.timezone.now)),
+                ("locked_at", models.DateTimeField(blank=True, null=True)),
+                ("last_error", models.TextField(blank=True, default="")),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Фоновая задача",
+                "verbose_name_plural": "Фоновые задачи",
+                "ordering": ["run_after", "id"],
+                "indexes": [models.Index(fields=["status", "run_after"], name="file_manage_status_1b35dc_idx")],
+            },
+        ),
+    ]
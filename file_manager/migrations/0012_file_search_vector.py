@@ -0,0 +1,81 @@
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Полнотекстовый индекс файлов (только PostgreSQL; на SQLite поиск остаётся через icontains).
+# search_vector поддерживает триггер: вектор пересчитывается только при изменении
+# title / description / extracted_text, иначе сохраняется прежний (save() с устаревшим
+# экземпляром его не затирает). Текст ограничен по длине — предел tsvector 1 МБ.
+FORWARD_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    CREATE OR REPLACE FUNCTION file_manager_file_search_vector(title text, description text, body text)
+    RETURNS tsvector LANGUAGE sql IMMUTABLE AS $$
+        SELECT
+            setweight(to_tsvector('russian', coalesce(title, '')), 'A')
+            || setweight(to_tsvector('english', coalesce(title, '')), 'A')
+            || setweight(to_tsvector('russian', coalesce(description, '')), 'B')
+            || setweight(to_tsvector('english', coalesce(description, '')), 'B')
+            || setweight(to_tsvector('russian', left(coalesce(body, ''), 300000)), 'C')
+            || setweight(to_tsvector('english', left(coalesce(body, ''), 300000)), 'D')
+    $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION file_manager_file_search_vector_trigger() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'INSERT'
+           OR OLD.search_vector IS NULL
+           OR NEW.title IS DISTINCT FROM OLD.title
+           OR NEW.description IS DISTINCT FROM OLD.description
+           OR NEW.extracted_text IS DISTINCT FROM OLD.extracted_text THEN
+            NEW.search_vector := file_manager_file_search_vector(NEW.title, NEW.description, NEW.extracted_text);
+        ELSE
+            NEW.search_vector := OLD.search_vector;
+        END IF;
+        RETURN NEW;
+    END
+    $$
+    """,
+    """
+    CREATE TRIGGER file_manager_file_search_vector_update
+    BEFORE INSERT OR UPDATE ON file_manager_file
+    FOR EACH ROW EXECUTE FUNCTION file_manager_file_search_vector_trigger()
+    """,
+    "UPDATE file_manager_file SET search_vector = file_manager_file_search_vector(title, description, extracted_text)",
+    "CREATE INDEX file_manager_file_search_gin ON file_manager_file USING gin (search_vector)",
+    "CREATE INDEX file_manager_file_title_trgm ON file_manager_file USING gin (title gin_trgm_ops)",
+]
+
+REVERSE_SQL = [
+    "DROP INDEX IF EXISTS file_manager_file_title_trgm",
+    "DROP INDEX IF EXISTS file_manager_file_search_gin",
+    "DROP TRIGGER IF EXISTS file_manager_file_search_vector_update ON file_manager_file",
+    "DROP FUNCTION IF EXISTS file_manager_file_search_vector_trigger()",
+    "DROP FUNCTION IF EXISTS file_manager_file_search_vector(text, text, text)",
+]
+
+
+def _run_postgres_sql(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != "postgresql":
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("file_manager", "0011_file_processing_state_backgroundjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="file",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(_run_postgres_sql(FORWARD_SQL), _run_postgres_sql(REVERSE_SQL)),
+    ]
@@ -0,0 +1,41 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("file_manager", "0012_file_search_vector"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Rendition",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("source_sha256", models.CharField(max_length=64)),
+                ("kind", models.CharField(choices=[("pdf", "PDF")], default="pdf", max_length=20)),
+                ("converter_version", models.CharField(max_length=200)),
+                ("size", models.BigIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "content_blob",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="renditions",
+                        to="file_manager.contentblob",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Рендишн",
+                "verbose_name_plural": "Рендишны",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("source_sha256", "kind", "converter_version"),
+                        name="file_manager_rendition_unique",
+                    )
+                ],
+            },
+        ),
+    ]
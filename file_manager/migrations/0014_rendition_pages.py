@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("file_manager", "0013_rendition"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="rendition",
+            name="file_manager_rendition_unique",
+        ),
+        migrations.AddField(
+            model_name="rendition",
+            name="page",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name="rendition",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("pdf", "PDF"),
+                    ("pdf_linear", "Линеаризованный PDF"),
+                    ("page_thumb", "Миниатюра страницы"),
+                    ("page", "Изображение страницы"),
+                ],
+                default="pdf",
+                max_length=20,
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="rendition",
+            constraint=models.UniqueConstraint(
+                fields=("source_sha256", "kind", "page", "converter_version"),
+                name="file_manager_rendition_page_unique",
+            ),
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("file_manager", "0014_rendition_pages"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="rendition",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("pdf", "PDF"),
+                    ("pdf_linear", "Линеаризованный PDF"),
+                    ("page_thumb", "Миниатюра страницы"),
+                    ("page", "Изображение страницы"),
+                    ("image_thumb", "Превью изображения"),
+                ],
+                default="pdf",
+                max_length=20,
+            ),
+        ),
+    ]
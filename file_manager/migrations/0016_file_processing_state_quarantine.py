@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("file_manager", "0015_rendition_image_thumb"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="file",
+            name="processing_state",
+            field=models.CharField(
+                choices=[
+                    ("ready", "Готов"),
+                    ("processing", "Обработка"),
+                    ("quarantine", "Антивирусная проверка"),
+                    ("rejected", "Отклонён"),
+                    ("failed", "Ошибка обработки"),
+                ],
+                default="ready",
+                max_length=20,
+            ),
+        ),
+    ]
@@ -0,0 +1,72 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("file_manager", "0017_fileactivity_created_at_default"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="fileactivity",
+            index=models.Index(fields=["-created_at", "-id"], name="file_manag_created_id_idx"),
+        ),
+        migrations.CreateModel(
+            name="FileActivityDailyRollup",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("day", models.DateField()),
+                (
+                    "activity_type",
+                    models.CharField(
+                        choices=[
+                            ("upload", "Uploaded"),
+                            ("download", "Downloaded"),
+                            ("view", "Viewed"),
+                            ("edit", "Edited"),
+                            ("delete", "Deleted"),
+                            ("share", "Shared"),
+                            ("comment", "Commented"),
+                            ("version_create", "Created new version"),
+                            ("favorite_add", "Added to favorites"),
+                            ("favorite_remove", "Removed from favorites"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("count", models.PositiveIntegerField(default=0)),
+                (
+                    "file",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="activity_rollups",
+                        to="file_manager.file",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="file_activity_rollups",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Сводка активности за день",
+                "verbose_name_plural": "Сводки активности по дням",
+                "ordering": ["-day"],
+                "indexes": [
+                    models.Index(fields=["day", "activity_type"], name="file_manage_day_09dc63_idx"),
+                    models.Index(fields=["file", "day"], name="file_manage_file_id_d7a556_idx"),
+                    models.Index(fields=["user", "day"], name="file_manage_user_id_a73013_idx"),
+                ],
+            },
+        ),
+    ]
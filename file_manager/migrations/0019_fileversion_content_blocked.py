@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("file_manager", "0018_fileactivity_rollup_keyset"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="fileversion",
+            name="content_blocked",
+            field=models.BooleanField(default=False),
+        ),
+    ]
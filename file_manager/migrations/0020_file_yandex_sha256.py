@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("file_manager", "0019_fileversion_content_blocked"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="file",
+            name="yandex_sha256",
+            field=models.CharField(blank=True, db_index=True, default="", max_length=64),
+        ),
+    ]
@@ -0,0 +1,46 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("file_manager", "0020_file_yandex_sha256"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FileActivityArchive",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("original_id", models.BigIntegerField()),
+                ("file_id", models.BigIntegerField(blank=True, null=True)),
+                ("user_id", models.BigIntegerField()),
+                (
+                    "activity_type",
+                    models.CharField(
+                        choices=[
+                            ("upload", "Uploaded"),
+                            ("download", "Downloaded"),
+                            ("view", "Viewed"),
+                            ("edit", "Edited"),
+                            ("delete", "Deleted"),
+                            ("share", "Shared"),
+                            ("comment", "Commented"),
+                            ("version_create", "Created new version"),
+                            ("favorite_add", "Added to favorites"),
+                            ("favorite_remove", "Removed from favorites"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("description", models.TextField(blank=True)),
+                ("created_at", models.DateTimeField(db_index=True)),
+                ("ip_address", models.GenericIPAddressField(blank=True, null=True)),
+            ],
+            options={
+                "verbose_name": "Архивная активность с файлом",
+                "verbose_name_plural": "Архив активности с файлами",
+                "ordering": ["-created_at"],
+            },
+        ),
+    ]
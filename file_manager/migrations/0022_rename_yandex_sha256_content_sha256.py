@@ -0,0 +1,16 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("file_manager", "0021_fileactivityarchive"),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name="file",
+            old_name="yandex_sha256",
+            new_name="content_sha256",
+        ),
+    ]
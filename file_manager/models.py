@@ -1,5 +1,7 @@
 from django.apps import apps
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models 
+from django.db.models import F 
 from django.contrib.auth.models import User 
 from django.utils import timezone 
 import os 
@@ -48,6 +50,27 @@ class Tag(models.Model ):
     def filter_swatch_attrs(self ):
         return format_html('style="background-color:{};"', self._safe_hex_color())
 
+class ContentBlob(models.Model):
+    """Локальное содержимое, адресуемое SHA-256: одинаковые байты хранятся один раз (см. blobstore)."""
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField(default=0)
+    storage_path = models.CharField(max_length=1024)
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_referenced_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Blob содержимого"
+        verbose_name_plural = "Blob содержимого"
+        indexes = [
+            models.Index(fields=["ref_count", "last_referenced_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.size} B, refs={self.ref_count})"
+
+
 class File(models.Model ):
     STORAGE_PROVIDER_CHOICES = [
         ("local", "Local"),
@@ -72,6 +95,16 @@ class File(models.Model ):
    ('other','Other'),
     ]
 
+    PROCESSING_STATE_CHOICES = [
+        ("ready", "Готов"),
+        ("processing", "Обработка"),
+        ("quarantine", "Антивирусная проверка"),
+        ("rejected", "Отклонён"),
+        ("failed", "Ошибка обработки"),
+    ]
+    # Содержимое в этих состояниях не отдаётся и не показывается никому (см. is_content_available).
+    CONTENT_BLOCKED_STATES = ("quarantine", "rejected")
+
     VISIBILITY_CHOICES =[
    ('private','Private - Только я'),
    ('shared','Shared - С определенными пользователями'),
@@ -85,6 +118,16 @@ class File(models.Model ):
     file_size =models.BigIntegerField(default =0 )
     storage_provider = models.CharField(max_length=20, choices=STORAGE_PROVIDER_CHOICES, default="local")
     yandex_path = models.CharField(max_length=1024, blank=True, default="")
+    # SHA-256 содержимого вне blob-хранилища (файл Диска, локальный файл до blob-хранилища),
+    # по которому построены рендишны; у файлов с content_blob — content_blob.sha256.
+    content_sha256 = models.CharField(max_length=64, blank=True, default="", db_index=True)
+    content_blob = models.ForeignKey(
+        ContentBlob,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="files",
+    )
 
     uploaded_by =models.ForeignKey(
     User ,
@@ -118,6 +161,10 @@ class File(models.Model ):
     )
     download_count =models.IntegerField(default =0 )
     importance = models.CharField(max_length=20, choices=IMPORTANCE_CHOICES, default="main")
+    processing_state = models.CharField(max_length=20, choices=PROCESSING_STATE_CHOICES, default="ready")
+    processing_error = models.TextField(blank=True, default="")
+    # Заполняет триггер PostgreSQL из title/description/extracted_text (см. search.py).
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
 
     class Meta :
         ordering =['-uploaded_at']
@@ -187,6 +234,10 @@ class File(models.Model ):
         if self.uploaded_by ==user :
             return True 
 
+        # До окончания антивирусной проверки файл не виден никому, кроме владельца.
+        if self.processing_state =="quarantine":
+            return False
+
         if self.visibility =='public':
             return True 
 
@@ -207,6 +258,16 @@ class File(models.Model ):
     def can_edit(self ,user ):
         return self.uploaded_by ==user or user.is_superuser 
 
+    def is_processing(self):
+        return self.processing_state == "processing"
+
+    def is_quarantined(self):
+        return self.processing_state == "quarantine"
+
+    def is_content_available(self):
+        """Можно скачивать, просматривать и раздавать: не на карантине и не отклонён."""
+        return self.processing_state not in self.CONTENT_BLOCKED_STATES
+
     def can_delete(self ,user ):
         return self.uploaded_by ==user or user.is_superuser or user.is_staff 
 
@@ -214,8 +275,9 @@ class File(models.Model ):
         return self.visibility == "shared" or self.shared_with.exists()
 
     def increment_download(self ):
+        # Один UPDATE ... SET download_count = download_count + 1: без чтения и без гонки параллельных скачиваний.
+        File.objects.filter(pk =self.pk ).update(download_count =F("download_count")+1 )
         self.download_count +=1 
-        self.save(update_fields =['download_count'])
 
     def add_to_favorites(self ,user ):
         self.favorite.add(user )
@@ -306,9 +368,18 @@ class FileVersion(models.Model ):
     blob_storage_path = models.CharField(max_length=1024, blank=True, default="")
     blob_size = models.BigIntegerField(default=0)
     blob_sha256 = models.CharField(max_length=64, blank=True, default="")
+    content_blob = models.ForeignKey(
+        ContentBlob,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="file_versions",
+    )
     extracted_text_snapshot = models.TextField(blank=True, default="")
     structured_snapshot = models.JSONField(blank=True, null=True)
     structured_schema_version = models.CharField(max_length=32, blank=True, default="v1")
+    # ClamAV нашёл угрозу в содержимом версии: она не отдаётся и не восстанавливается.
+    content_blocked = models.BooleanField(default=False)
     created_at =models.DateTimeField(auto_now_add =True )
 
     class Meta :
@@ -347,7 +418,8 @@ class FileActivity(models.Model ):
     )
     activity_type =models.CharField(max_length =20 ,choices =ACTIVITY_TYPES )
     description =models.TextField(blank =True )
-    created_at =models.DateTimeField(auto_now_add =True )
+    # Не auto_now_add: буферизованный журнал (activity_log) сохраняет время события, а не записи пачки.
+    created_at =models.DateTimeField(default =timezone.now ,editable =False )
     ip_address =models.GenericIPAddressField(null =True ,blank =True )
 
     class Meta :
@@ -357,6 +429,8 @@ class FileActivity(models.Model ):
         indexes =[
         models.Index(fields =['user','-created_at']),
         models.Index(fields =['activity_type','-created_at']),
+        # Keyset-пагинация журнала по (created_at, id) — см. pagination.keyset_page.
+        models.Index(fields =['-created_at','-id'],name ='file_manag_created_id_idx'),
         ]
 
     def __str__(self ):
@@ -364,13 +438,67 @@ class FileActivity(models.Model ):
 
     @classmethod 
     def log_activity(cls ,file ,user ,activity_type ,description ="",ip_address =None ):
-        return cls.objects.create(
-        file =file ,
-        user =user ,
-        activity_type =activity_type ,
-        description =description ,
-        ip_address =ip_address 
-        )
+        """Событие журнала; пишется пачкой через буфер процесса (см. activity_log)."""
+        from .activity_log import log 
+
+        return log(file ,user ,activity_type ,description =description ,ip_address =ip_address )
+
+
+class FileActivityArchive(models.Model):
+    """
+    Архив журнала: строки FileActivity старше ACTIVITY_LOG_RETENTION_DAYS переносятся сюда
+    при свёртке (см. activity_rollup). Без внешних ключей и вторичных индексов — таблица
+    только дописывается, а удаление файла или пользователя не трогает архив.
+    """
+
+    original_id = models.BigIntegerField()
+    file_id = models.BigIntegerField(null=True, blank=True)
+    user_id = models.BigIntegerField()
+    activity_type = models.CharField(max_length=20, choices=FileActivity.ACTIVITY_TYPES)
+    description = models.TextField(blank=True)
+    created_at = models.DateTimeField(db_index=True)
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        verbose_name = "Архивная активность с файлом"
+        verbose_name_plural = "Архив активности с файлами"
+
+    def __str__(self):
+        return f"{self.created_at:%Y-%m-%d} {self.user_id} {self.activity_type}"
+
+
+class FileActivityDailyRollup(models.Model):
+    """
+    Сводка журнала за день: сколько действий каждого типа пользователь совершил с файлом.
+    Строки FileActivity старше ACTIVITY_LOG_RETENTION_DAYS сворачиваются сюда командой
+    rollup_file_activity и переносятся в FileActivityArchive (см. activity_rollup).
+    """
+
+    day = models.DateField()
+    file = models.ForeignKey(
+        File,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="activity_rollups",
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="file_activity_rollups")
+    activity_type = models.CharField(max_length=20, choices=FileActivity.ACTIVITY_TYPES)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ["-day"]
+        verbose_name = "Сводка активности за день"
+        verbose_name_plural = "Сводки активности по дням"
+        indexes = [
+            models.Index(fields=["day", "activity_type"]),
+            models.Index(fields=["file", "day"]),
+            models.Index(fields=["user", "day"]),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.user_id} {self.activity_type} x{self.count}"
 class UserStorageQuota(models.Model ):
     user =models.OneToOneField(User ,on_delete =models.CASCADE ,related_name ='storage_quota')
     total_quota_bytes =models.BigIntegerField(default =5368709120 ,verbose_name ="Лимит")
@@ -409,6 +537,15 @@ class UserStorageQuota(models.Model ):
         self.used_bytes =total_size 
         self.save(update_fields =['used_bytes','last_updated'])
 
+    def get_physical_usage(self):
+        """
+        Реально занятые на диске байты: уникальные blob файлов и версий пользователя.
+        used_bytes — логический объём (сумма размеров файлов, по нему считается квота).
+        """
+        return ContentBlob.objects.filter(
+            models.Q(files__uploaded_by=self.user) | models.Q(file_versions__file__uploaded_by=self.user)
+        ).distinct().aggregate(total=models.Sum("size"))["total"] or 0
+
 
 class ExternalStorageConnection(models.Model):
     PROVIDER_CHOICES = [
@@ -460,4 +597,74 @@ class SharedWorkspace(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return self.title
\ No newline at end of file
+        return self.title
+
+
+class BackgroundJob(models.Model):
+    """Задача фоновой очереди для бэкенда database (см. file_manager/jobs.py)."""
+
+    STATUS_CHOICES = [
+        ("queued", "В очереди"),
+        ("running", "Выполняется"),
+        ("failed", "Ошибка"),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="queued")
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["run_after", "id"]
+        verbose_name = "Фоновая задача"
+        verbose_name_plural = "Фоновые задачи"
+        indexes = [
+            models.Index(fields=["status", "run_after"]),
+        ]
+
+    def __str__(self):
+        return f"{self.name}#{self.pk} ({self.status})"
+
+
+class Rendition(models.Model):
+    """
+    Производное представление содержимого (PDF офисного документа, страница, превью
+    изображения), адресуемое SHA-256 исходника и версией конвертера; байты лежат в blob-хранилище (см. renditions).
+    """
+
+    KIND_CHOICES = [
+        ("pdf", "PDF"),
+        ("pdf_linear", "Линеаризованный PDF"),
+        ("page_thumb", "Миниатюра страницы"),
+        ("page", "Изображение страницы"),
+        ("image_thumb", "Превью изображения"),
+    ]
+
+    source_sha256 = models.CharField(max_length=64)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default="pdf")
+    # Номер страницы для page_thumb / page (с 1), 0 — рендишн всего документа.
+    page = models.PositiveIntegerField(default=0)
+    converter_version = models.CharField(max_length=200)
+    content_blob = models.ForeignKey(ContentBlob, on_delete=models.PROTECT, related_name="renditions")
+    size = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Рендишн"
+        verbose_name_plural = "Рендишны"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["source_sha256", "kind", "page", "converter_version"],
+                name="file_manager_rendition_page_unique",
+            ),
+        ]
+
+    def __str__(self):
+        page = f" p{self.page}" if self.page else ""
+        return f"{self.kind}{page} {self.source_sha256[:12]} ({self.converter_version})"
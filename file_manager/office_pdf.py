@@ -3,10 +3,15 @@
 
 Порядок:
 1. ConvertAPI (если задан CONVERTAPI_SECRET / settings.CONVERTAPI_SECRET).
-2. LibreOffice в headless-режиме (локально, без оплаты API).
+2. LibreOffice в headless-режиме (локально, без оплаты API) — пул долгоживущих воркеров,
+   см. libreoffice_pool.py. Если пул занят, ConversionBusyError (вызывающий отвечает 503).
+
+Готовые PDF хранятся в кэше рендишнов (renditions.py) по SHA-256 исходника и
+get_converter_version(): смена конвертера или OFFICE_PDF_RENDITION_VERSION даёт новые PDF.
 """
 from __future__ import annotations
 
+import functools
 import os
 import shutil
 import subprocess
@@ -15,6 +20,8 @@ from pathlib import Path
 
 from django.conf import settings
 
+from .libreoffice_pool import ConversionBusyError, get_pool
+
 EXTENSIONS_LIBREOFFICE_TO_PDF = frozenset(
     {"doc", "docx", "xls", "xlsx", "ppt", "pptx", "odt", "ods", "odp", "rtf"}
 )
@@ -56,7 +63,37 @@ def is_office_pdf_conversion_available() -> bool:
     return is_convertapi_configured() or is_libreoffice_available()
 
 
+@functools.lru_cache(maxsize=4)
+def _libreoffice_version(exe: str) -> str:
+    try:
+        result = subprocess.run([exe, "--version"], capture_output=True, timeout=60)
+    except (OSError, subprocess.TimeoutExpired):
+        return "unknown"
+    # «LibreOffice 7.6.4.1 e19e193f88cd6c0525a17fb7a176ed8e6a3e2aa1» -> «LibreOffice 7.6.4.1»
+    words = result.stdout.decode("utf-8", "replace").split()
+    return " ".join(words[:2]) or "unknown"
+
+
+def get_converter_version() -> str:
+    """Метка конвертера, который будет использован первым, — часть ключа кэша рендишнов."""
+    schema = str(getattr(settings, "OFFICE_PDF_RENDITION_VERSION", "1") or "1")
+    if is_convertapi_configured():
+        return f"{schema}:convertapi"
+    exe = get_libreoffice_executable()
+    if exe:
+        return f"{schema}:{_libreoffice_version(exe)}"
+    return f"{schema}:none"
+
+
 def _convert_libreoffice_to_pdf_bytes(src_path: str, exe: str) -> bytes:
+    """Через пул тёплых воркеров (libreoffice_pool); LIBREOFFICE_WORKERS=0 — soffice на каждый вызов."""
+    pool = get_pool(exe)
+    if pool is not None:
+        return pool.convert(src_path)
+    return _convert_libreoffice_oneshot(src_path, exe)
+
+
+def _convert_libreoffice_oneshot(src_path: str, exe: str) -> bytes:
     if not os.path.isfile(src_path):
         raise FileNotFoundError(src_path)
     with tempfile.TemporaryDirectory(prefix="lo_pdf_") as tmpdir:
@@ -139,6 +176,8 @@ def convert_office_file_to_pdf_bytes(src_path: str) -> bytes:
             if exe:
                 try:
                     return _convert_libreoffice_to_pdf_bytes(src_path, exe)
+                except ConversionBusyError:
+                    raise
                 except Exception as lo_err:
                     raise RuntimeError(
                         f"ConvertAPI: {convertapi_err}; LibreOffice: {lo_err}"
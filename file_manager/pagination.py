@@ -0,0 +1,87 @@
+"""
+Keyset-пагинация по (created_at, id) для журналов, отсортированных от новых к старым.
+
+Paginator с OFFSET на глубоких страницах читает и отбрасывает все предыдущие строки и
+каждый раз считает COUNT(*) по всей таблице. Здесь страница задаётся курсором — ключом
+последней (before) или первой (after) строки соседней страницы, — и запрос идёт по индексу
+(-created_at, -id) с LIMIT: любая страница стоит одинаково, COUNT не нужен.
+"""
+from __future__ import annotations
+
+import datetime
+from dataclasses import dataclass, field
+
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def encode_cursor(obj) -> str:
+    """Курсор строки: микросекунды UNIX-времени created_at и id."""
+    # Целочисленно, без float: курсор должен совпадать с created_at до микросекунды.
+    micros = (obj.created_at - _EPOCH) // datetime.timedelta(microseconds=1)
+    return f"{micros}.{obj.pk}"
+
+
+def decode_cursor(value: str | None) -> tuple[datetime.datetime, int] | None:
+    """(created_at, id) из курсора; None — курсора нет или он испорчен (тогда первая страница)."""
+    if not value:
+        return None
+    micros, _, pk = value.partition(".")
+    try:
+        created_at = _EPOCH + datetime.timedelta(microseconds=int(micros))
+        return timezone.localtime(created_at), int(pk)
+    except (ValueError, OverflowError, OSError):
+        return None
+
+
+@dataclass
+class KeysetPage:
+    object_list: list = field(default_factory=list)
+    has_next: bool = False
+    has_previous: bool = False
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self) -> int:
+        return len(self.object_list)
+
+    def has_other_pages(self) -> bool:
+        return self.has_next or self.has_previous
+
+    @property
+    def next_cursor(self) -> str:
+        return encode_cursor(self.object_list[-1]) if self.has_next and self.object_list else ""
+
+    @property
+    def previous_cursor(self) -> str:
+        return encode_cursor(self.object_list[0]) if self.has_previous and self.object_list else ""
+
+
+def keyset_page(queryset: QuerySet, *, before: str | None = None, after: str | None = None, per_page: int = 20) -> KeysetPage:
+    """
+    Страница queryset от новых к старым. before — курсор: строки старше него (следующая
+    страница); after — строки новее него (предыдущая). Без курсора — самые новые строки;
+    если новее курсора after ничего нет (строки удалили), тоже отдаётся первая страница.
+    """
+    after_key = decode_cursor(after)
+    before_key = None if after_key else decode_cursor(before)
+    if after_key:
+        created_at, pk = after_key
+        rows = list(
+            queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk))
+            .order_by("created_at", "pk")[: per_page + 1]
+        )
+        if rows:
+            has_more = len(rows) > per_page
+            rows = rows[:per_page]
+            rows.reverse()
+            return KeysetPage(rows, has_next=True, has_previous=has_more)
+    if before_key:
+        created_at, pk = before_key
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+    rows = list(queryset.order_by("-created_at", "-pk")[: per_page + 1])
+    has_more = len(rows) > per_page
+    return KeysetPage(rows[:per_page], has_next=has_more, has_previous=before_key is not None)
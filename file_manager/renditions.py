@@ -0,0 +1,338 @@
+"""
+Кэш рендишнов: PDF офисных документов и постраничные изображения для просмотрщика.
+
+Раньше office_pdf_preview конвертировал документ на каждый запрос. Теперь:
+  - PDF хранится в blob-хранилище, строка Rendition держит ссылку на blob и ключ
+    (SHA-256 исходника, вид, office_pdf.get_converter_version()); одинаковые документы
+    (копии, версия = текущий файл, повторная загрузка) конвертируются один раз;
+  - после загрузки, новой версии и восстановления PDF и страницы готовятся фоновой задачей
+    file.render_previews (OFFICE_PDF_EAGER_RENDITIONS), так что просмотрщик обычно
+    получает готовый файл;
+  - ответ с ETag (SHA-256 самого PDF) и Last-Modified, повторное открытие — 304;
+  - для PDF (загруженного или полученного конвертацией) готовятся WebP-миниатюры страниц
+    (PDF_THUMBNAIL_WIDTH), изображения страниц (PDF_PAGE_IMAGE_WIDTH) и линеаризованный
+    PDF (fast web view: pdf.js показывает первую страницу, не дочитав файл). Ключ —
+    SHA-256 самого PDF и номер страницы. Растеризует pdftoppm (poppler-utils),
+    линеаризует qpdf; без них просмотрщик по-прежнему грузит PDF целиком через pdf.js;
+  - prerender_pdf() заранее делает линеаризацию и миниатюры первых
+    PDF_THUMBNAIL_PREFETCH_PAGES страниц, остальное рендерится по запросу страницы;
+  - для загруженных изображений — WebP-превью для списка файлов (kind image_thumb, пресет
+    FILE_THUMBNAIL_PRESET из thumbnails.py), ключ — SHA-256 исходника;
+  - prune_renditions() (команда collect_blobs) удаляет рендишны старых версий конвертера
+    и документов, которых больше нет; байты затем убирает сборщик мусора blob.
+"""
+from __future__ import annotations
+
+import hashlib
+import io
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Q
+
+from .blobstore import HASH_CHUNK_SIZE, acquire_blob, release_blob
+from .libreoffice_pool import ConversionBusyError
+from .models import ContentBlob, File, FileVersion, Rendition
+from .office_pdf import convert_office_file_to_pdf_bytes, get_converter_version
+from .thumbnails import make_thumbnail, pipeline_version, thumbnail_format
+
+logger = logging.getLogger(__name__)
+
+KIND_PDF = "pdf"
+KIND_PDF_LINEAR = "pdf_linear"
+KIND_PAGE_THUMB = "page_thumb"
+KIND_PAGE = "page"
+KIND_IMAGE_THUMB = "image_thumb"
+PAGE_KINDS = (KIND_PAGE_THUMB, KIND_PAGE)
+ALL_KINDS = (KIND_PDF, KIND_PDF_LINEAR, KIND_PAGE_THUMB, KIND_PAGE, KIND_IMAGE_THUMB)
+FILE_THUMBNAIL_PRESET = "grid"
+
+PAGE_IMAGE_CONTENT_TYPE = "image/webp"
+PAGE_PIPELINE_VERSION = "poppler-1"
+TOOL_TIMEOUT = 120
+DEFAULT_RENDER_CONCURRENCY = 2
+
+_render_slots: threading.BoundedSemaphore | None = None
+_render_slots_lock = threading.Lock()
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(HASH_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def rendition_path(rendition: Rendition) -> str:
+    return default_storage.path(rendition.content_blob.storage_path)
+
+
+def page_width(kind: str) -> int:
+    if kind == KIND_PAGE_THUMB:
+        return int(getattr(settings, "PDF_THUMBNAIL_WIDTH", 200) or 200)
+    return int(getattr(settings, "PDF_PAGE_IMAGE_WIDTH", 1200) or 1200)
+
+
+def page_pipeline_version() -> str:
+    """Версия постраничных рендишнов: смена размеров или схемы даёт новые изображения."""
+    schema = str(getattr(settings, "OFFICE_PDF_RENDITION_VERSION", "1") or "1")
+    return f"{schema}:{PAGE_PIPELINE_VERSION}:{page_width(KIND_PAGE_THUMB)}/{page_width(KIND_PAGE)}"
+
+
+def converter_version_for(kind: str) -> str:
+    if kind == KIND_PDF:
+        return get_converter_version()
+    if kind == KIND_IMAGE_THUMB:
+        return pipeline_version(FILE_THUMBNAIL_PRESET)
+    return page_pipeline_version()
+
+
+def _tool(setting_name: str, executable: str) -> str | None:
+    override = (getattr(settings, setting_name, "") or "").strip()
+    if override:
+        return override if os.path.isfile(override) and os.access(override, os.X_OK) else None
+    return shutil.which(executable)
+
+
+def get_pdftoppm() -> str | None:
+    return _tool("PDFTOPPM_PATH", "pdftoppm")
+
+
+def get_qpdf() -> str | None:
+    return _tool("QPDF_PATH", "qpdf")
+
+
+def page_rendering_available() -> bool:
+    return get_pdftoppm() is not None
+
+
+def find_rendition(source_sha256: str, kind: str = KIND_PDF, page: int = 0) -> Rendition | None:
+    """Готовый рендишн для текущей версии конвертера (без конвертации)."""
+    if not source_sha256:
+        return None
+    rendition = (
+        Rendition.objects.select_related("content_blob")
+        .filter(source_sha256=source_sha256, kind=kind, page=page, converter_version=converter_version_for(kind))
+        .first()
+    )
+    if rendition is not None and not default_storage.exists(rendition.content_blob.storage_path):
+        logger.warning("renditions: нет байтов %s, рендишн будет создан заново", rendition)
+        rendition.delete()
+        return None
+    return rendition
+
+
+def render_pdf(source_path: str, source_sha256: str | None = None) -> Rendition:
+    """
+    PDF-рендишн локального файла: из кэша или конвертацией (ConversionBusyError и ошибки
+    конвертера пробрасываются). source_sha256 — если хеш исходника уже известен.
+    """
+    source_sha256 = source_sha256 or file_sha256(source_path)
+    rendition = find_rendition(source_sha256)
+    if rendition is not None:
+        return rendition
+
+    converter_version = get_converter_version()
+    pdf_bytes = convert_office_file_to_pdf_bytes(source_path)
+    return _store(source_sha256, KIND_PDF, 0, converter_version, pdf_bytes, "rendition.pdf")
+
+
+def _store(source_sha256: str, kind: str, page: int, converter_version: str, data: bytes, name: str) -> Rendition:
+    blob = acquire_blob(data, name)
+    try:
+        with transaction.atomic():
+            rendition = Rendition.objects.create(
+                source_sha256=source_sha256,
+                kind=kind,
+                page=page,
+                converter_version=converter_version,
+                content_blob=blob,
+                size=len(data),
+            )
+    except IntegrityError:
+        # Тот же рендишн параллельно сделал другой запрос или воркер.
+        release_blob(blob.id)
+        return Rendition.objects.select_related("content_blob").get(
+            source_sha256=source_sha256, kind=kind, page=page, converter_version=converter_version
+        )
+    logger.info(
+        "renditions: %s%s sha256=%s (%s байт, %s)",
+        kind,
+        f" p{page}" if page else "",
+        source_sha256[:12],
+        len(data),
+        converter_version,
+    )
+    return rendition
+
+
+def render_image_thumbnail(source, source_sha256: str) -> Rendition:
+    """
+    Превью изображения для списка файлов: из кэша или через Pillow. source — bytes или
+    путь к локальному файлу; thumbnails.ThumbnailError, если это не изображение.
+    """
+    rendition = find_rendition(source_sha256, KIND_IMAGE_THUMB)
+    if rendition is not None:
+        return rendition
+    converter_version = pipeline_version(FILE_THUMBNAIL_PRESET)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = make_thumbnail(source, FILE_THUMBNAIL_PRESET)
+    else:
+        with open(source, "rb") as fh:
+            data = make_thumbnail(fh, FILE_THUMBNAIL_PRESET)
+    return _store(source_sha256, KIND_IMAGE_THUMB, 0, converter_version, data, f"thumb.{thumbnail_format()}")
+
+
+# --- страницы PDF ------------------------------------------------------------------
+
+
+def _slots() -> threading.BoundedSemaphore:
+    global _render_slots
+    if _render_slots is None:
+        with _render_slots_lock:
+            if _render_slots is None:
+                size = int(getattr(settings, "PDF_RENDER_CONCURRENCY", DEFAULT_RENDER_CONCURRENCY) or 1)
+                _render_slots = threading.BoundedSemaphore(max(size, 1))
+    return _render_slots
+
+
+def _run_tool(args: list[str]) -> subprocess.CompletedProcess:
+    """Внешняя утилита под общим лимитом процесса; занято дольше очереди — ConversionBusyError."""
+    slots = _slots()
+    if not slots.acquire(timeout=int(getattr(settings, "LIBREOFFICE_QUEUE_TIMEOUT", 20) or 0)):
+        raise ConversionBusyError("Все слоты рендеринга страниц заняты")
+    try:
+        return subprocess.run(args, capture_output=True, timeout=TOOL_TIMEOUT)
+    except subprocess.TimeoutExpired as exc:
+        raise RuntimeError(f"{os.path.basename(args[0])} превысил время ожидания") from exc
+    finally:
+        slots.release()
+
+
+def pdf_page_count(pdf_path: str, pdf_sha256: str) -> int:
+    """Число страниц PDF (кэшируется по SHA-256: содержимое с этим хешем не меняется)."""
+    key = f"renditions:pages:{pdf_sha256}"
+    count = cache.get(key)
+    if count is None:
+        import PyPDF2
+
+        with open(pdf_path, "rb") as fh:
+            count = len(PyPDF2.PdfReader(fh, strict=False).pages)
+        cache.set(key, count, None)
+    return count
+
+
+def _rasterize_page(pdf_path: str, page: int, width: int) -> bytes:
+    """PNG страницы page шириной width пикселей (pdftoppm)."""
+    exe = get_pdftoppm()
+    if not exe:
+        raise RuntimeError("pdftoppm (poppler-utils) не установлен")
+    with tempfile.TemporaryDirectory(prefix="pdf_page_") as tmpdir:
+        prefix = os.path.join(tmpdir, "page")
+        result = _run_tool(
+            [exe, "-f", str(page), "-l", str(page), "-scale-to-x", str(width), "-scale-to-y", "-1",
+             "-png", "-singlefile", pdf_path, prefix]
+        )
+        if result.returncode != 0 or not os.path.exists(f"{prefix}.png"):
+            err = (result.stderr or b"").decode("utf-8", "replace")[:2000]
+            raise RuntimeError(f"pdftoppm завершился с ошибкой: {err}")
+        with open(f"{prefix}.png", "rb") as fh:
+            return fh.read()
+
+
+def _to_webp(png_bytes: bytes, quality: int) -> bytes:
+    from PIL import Image
+
+    with Image.open(io.BytesIO(png_bytes)) as image:
+        out = io.BytesIO()
+        image.convert("RGB").save(out, "WEBP", quality=quality, method=4)
+    return out.getvalue()
+
+
+def render_page(pdf_path: str, pdf_sha256: str, page: int, kind: str = KIND_PAGE_THUMB) -> Rendition:
+    """WebP-изображение страницы page (с 1): из кэша или растеризацией."""
+    if kind not in PAGE_KINDS:
+        raise ValueError(kind)
+    rendition = find_rendition(pdf_sha256, kind, page)
+    if rendition is not None:
+        return rendition
+    if not 1 <= page <= pdf_page_count(pdf_path, pdf_sha256):
+        raise ValueError(f"В документе нет страницы {page}")
+    converter_version = page_pipeline_version()
+    png = _rasterize_page(pdf_path, page, page_width(kind))
+    webp = _to_webp(png, 70 if kind == KIND_PAGE_THUMB else 85)
+    return _store(pdf_sha256, kind, page, converter_version, webp, f"page{page}.webp")
+
+
+def _linearize(pdf_path: str, output_path: str) -> None:
+    exe = get_qpdf()
+    if not exe:
+        raise RuntimeError("qpdf не установлен")
+    result = _run_tool([exe, "--linearize", pdf_path, output_path])
+    # Код 3 — предупреждения о неидеальном исходнике, результат записан.
+    if result.returncode not in (0, 3) or not os.path.exists(output_path):
+        err = (result.stderr or b"").decode("utf-8", "replace")[:2000]
+        raise RuntimeError(f"qpdf завершился с ошибкой: {err}")
+
+
+def linearize_pdf(pdf_path: str, pdf_sha256: str) -> Rendition | None:
+    """Линеаризованная копия PDF; None — qpdf не установлен."""
+    rendition = find_rendition(pdf_sha256, KIND_PDF_LINEAR)
+    if rendition is not None or get_qpdf() is None:
+        return rendition
+    converter_version = page_pipeline_version()
+    with tempfile.TemporaryDirectory(prefix="pdf_linear_") as tmpdir:
+        output_path = os.path.join(tmpdir, "linear.pdf")
+        _linearize(pdf_path, output_path)
+        with open(output_path, "rb") as fh:
+            data = fh.read()
+    return _store(pdf_sha256, KIND_PDF_LINEAR, 0, converter_version, data, "linear.pdf")
+
+
+def prerender_pdf(pdf_path: str, pdf_sha256: str) -> None:
+    """Фоновая подготовка: линеаризация, миниатюры первых страниц и первая страница целиком."""
+    if not page_rendering_available():
+        return
+    linearize_pdf(pdf_path, pdf_sha256)
+    limit = int(getattr(settings, "PDF_THUMBNAIL_PREFETCH_PAGES", 50) or 0)
+    pages = min(pdf_page_count(pdf_path, pdf_sha256), limit)
+    for page in range(1, pages + 1):
+        render_page(pdf_path, pdf_sha256, page, KIND_PAGE_THUMB)
+    if pages:
+        render_page(pdf_path, pdf_sha256, 1, KIND_PAGE)
+
+
+def prune_renditions(*, dry_run: bool = False) -> int:
+    """
+    Удаляет рендишны чужих версий конвертера и рендишны исходников, на которые больше
+    не ссылается ни один blob, версия файла или файл вне blob-хранилища (Диск, старые локальные).
+    Возвращает число удалённых строк.
+    """
+    referenced = (
+        Exists(ContentBlob.objects.filter(sha256=OuterRef("source_sha256")))
+        | Exists(FileVersion.objects.filter(blob_sha256=OuterRef("source_sha256")))
+        # Файлы Диска и старые локальные файлы не лежат в blob-хранилище: их хэш — в File.content_sha256.
+        | Exists(File.objects.filter(content_sha256=OuterRef("source_sha256")))
+    )
+    # Источник страниц — PDF-рендишн офисного документа: его sha256 есть среди ContentBlob.
+    outdated = Q()
+    for kind in ALL_KINDS:
+        outdated |= Q(kind=kind) & ~Q(converter_version=converter_version_for(kind))
+    stale = Rendition.objects.filter(outdated | ~referenced)
+    if dry_run:
+        return stale.count()
+    removed = 0
+    for rendition in stale.iterator():
+        # delete() по одной строке: post_delete отпускает ссылку на blob (signals.py).
+        rendition.delete()
+        removed += 1
+    return removed
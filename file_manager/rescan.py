@@ -0,0 +1,148 @@
+"""
+Перепроверка уже сохранённого содержимого ClamAV (команда rescan_media).
+
+После обновления баз сигнатур файл, принятый чистым, может оказаться заражённым.
+Перепроверяется каждый blob, на который ссылаются файлы, версии или вложения чата,
+а также аватары и обложки курсов. Кэш вердиктов (clamav.py) хранит «чисто» только
+для текущей версии баз, поэтому повторный запуск без новых сигнатур clamd почти не
+нагружает: каждый blob проверяется один раз на версию баз.
+
+При угрозе:
+  - File переходит в «rejected», содержимое остаётся на диске для разбора администратором,
+    но не отдаётся (File.is_content_available);
+  - версии файла с этим blob помечаются content_blocked и не отдаются и не восстанавливаются;
+  - вложение сообщения чата отвязывается от blob;
+  - аватар или обложка удаляются вместе с миниатюрами.
+Файлы на карантине, проверка которых не удалась (нет ответа clamd), ставятся в очередь снова.
+"""
+from __future__ import annotations
+
+import logging
+import os
+from typing import Any
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.db.models import Q
+
+from .blobstore import release_blob
+from .clamav import scan_upload
+from .jobs import enqueue
+from .models import ContentBlob, File
+from .thumbnails import delete_sidecars
+
+logger = logging.getLogger(__name__)
+
+# (модель, поле) с изображениями в MEDIA вне blob-хранилища.
+MEDIA_FIELDS = (
+    ("classroom_core.UserProfile", "avatar"),
+    ("classroom_core.Course", "cover_image"),
+)
+
+
+def _empty_report() -> dict[str, Any]:
+    return {"scanned": 0, "cached": 0, "infected": 0, "errors": 0, "requeued": 0, "threats": []}
+
+
+def _count(report: dict[str, Any], scan: dict[str, Any], label: str) -> bool:
+    """Учитывает результат; True — найдена угроза."""
+    if not scan.get("performed"):
+        report["errors"] += 1
+        logger.warning("rescan: %s не проверен: %s", label, scan.get("error") or scan.get("skipped"))
+        return False
+    report["scanned"] += 1
+    if scan.get("cached"):
+        report["cached"] += 1
+    if scan.get("clean") is False:
+        report["infected"] += 1
+        report["threats"].append((label, scan.get("threat") or "неизвестная угроза"))
+        return True
+    return False
+
+
+def block_infected_blob(blob: ContentBlob, threat: str) -> None:
+    """Закрывает доступ ко всему, что ссылается на заражённый blob."""
+    from .views import block_infected_versions, reject_infected_file
+
+    for file_obj in blob.files.select_related("uploaded_by").exclude(processing_state="rejected"):
+        reject_infected_file(file_obj, threat, drop_content=False, sha256=blob.sha256)
+        logger.warning("rescan: file_id=%s заблокирован threat=%r", file_obj.id, threat)
+    # Старые версии, на которые больше не ссылается сам файл, закрываются отдельно.
+    block_infected_versions(blob.file_versions.all(), threat, drop_content=False)
+    for message in blob.chat_messages.all():
+        message.file_attachment.name = ""
+        message.content_blob = None
+        message.save(update_fields=["file_attachment", "content_blob"])
+        release_blob(blob.id)
+        logger.warning("rescan: вложение message_id=%s удалено threat=%r", message.id, threat)
+
+
+def _scan_blobs(report: dict[str, Any], *, dry_run: bool, limit: int | None) -> None:
+    blobs = (
+        ContentBlob.objects.filter(
+            Q(files__isnull=False) | Q(file_versions__isnull=False) | Q(chat_messages__isnull=False)
+        )
+        .distinct()
+        .order_by("pk")
+    )
+    if limit:
+        blobs = blobs[:limit]
+    for blob in blobs.iterator():
+        path = default_storage.path(blob.storage_path)
+        if not os.path.exists(path):
+            report["errors"] += 1
+            logger.warning("rescan: blob %s отсутствует на диске (%s)", blob.sha256, blob.storage_path)
+            continue
+        scan = scan_upload(path, filename=blob.storage_path, sha256=blob.sha256)
+        if _count(report, scan, f"blob {blob.sha256[:12]}") and not dry_run:
+            block_infected_blob(blob, scan.get("threat") or "неизвестная угроза")
+
+
+def _scan_media_fields(report: dict[str, Any], *, dry_run: bool) -> None:
+    for model_label, field in MEDIA_FIELDS:
+        try:
+            model = apps.get_model(model_label)
+        except LookupError:
+            continue
+        queryset = model._default_manager.exclude(**{field: ""}).exclude(**{f"{field}__isnull": True})
+        for obj in queryset.only("pk", field).iterator():
+            fieldfile = getattr(obj, field)
+            name = fieldfile.name
+            try:
+                with fieldfile.open("rb"):
+                    scan = scan_upload(fieldfile, filename=name)
+            except OSError as exc:
+                report["errors"] += 1
+                logger.warning("rescan: %s недоступен: %s", name, exc)
+                continue
+            if _count(report, scan, name) and not dry_run:
+                delete_sidecars(name, fieldfile.storage)
+                fieldfile.storage.delete(name)
+                # update(), а не save(): post_save снова поставил бы миниатюры для удалённого файла.
+                model._default_manager.filter(pk=obj.pk).update(**{field: ""})
+                logger.warning("rescan: %s.%s pk=%s удалён (%s)", model_label, field, obj.pk, name)
+
+
+def _requeue_quarantined(report: dict[str, Any], *, dry_run: bool) -> None:
+    # processing_error у файла на карантине пишет on_failure задачи file.scan_upload — попытки кончились.
+    stuck = File.objects.filter(processing_state="quarantine").exclude(processing_error="")
+    for file_obj in stuck.only("pk"):
+        report["requeued"] += 1
+        if dry_run:
+            continue
+        File.objects.filter(pk=file_obj.pk).update(processing_error="")
+        # Без начальной версии файл — свежая загрузка, после проверки ему нужна обработка.
+        enqueue("file.scan_upload", file_id=file_obj.pk, process=not file_obj.versions.exists())
+
+
+def rescan_media(*, dry_run: bool = False, limit: int | None = None, media: bool = True) -> dict[str, Any]:
+    """
+    Перепроверяет blob и изображения MEDIA. dry_run — только найти угрозы, ничего не менять;
+    limit — не больше N blob за запуск. Возвращает счётчики и список (объект, угроза).
+    """
+    report = _empty_report()
+    _scan_blobs(report, dry_run=dry_run, limit=limit)
+    if media:
+        _scan_media_fields(report, dry_run=dry_run)
+    _requeue_quarantined(report, dry_run=dry_run)
+    return report
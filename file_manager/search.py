@@ -0,0 +1,108 @@
+"""
+Поиск файлов.
+
+PostgreSQL: полнотекстовый индекс File.search_vector (русская + английская конфигурации,
+вес A — название, B — описание, C/D — извлечённый текст) с GIN-индексом и триграммный
+GIN-индекс по title для нечёткого совпадения (опечатки, часть слова). Вектор поддерживает
+триггер БД (миграция 0012), поэтому изменение extracted_text переиндексирует только эту строку.
+Результаты ранжируются ts_rank + similarity(title), фрагменты подсвечиваются ts_headline.
+
+Другие СУБД (SQLite в разработке): прежний фильтр icontains без ранжирования.
+"""
+from __future__ import annotations
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, TrigramSimilarity
+from django.db import connection
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+SEARCH_CONFIGS = ("russian", "english")
+
+# Маркеры ts_headline: исходный текст экранируется целиком, затем маркеры заменяются на <mark>.
+_SEL_START = "\x02"
+_SEL_STOP = "\x03"
+
+
+def is_full_text_search_available() -> bool:
+    return connection.vendor == "postgresql"
+
+
+def build_search_query(query: str) -> SearchQuery:
+    combined = None
+    for config in SEARCH_CONFIGS:
+        part = SearchQuery(query, config=config, search_type="websearch")
+        combined = part if combined is None else combined | part
+    return combined
+
+
+def apply_search(queryset, query: str | None):
+    """
+    Фильтрует queryset по запросу и добавляет аннотацию search_rank (на PostgreSQL).
+    Сортировку по релевантности выбирает вызывающий код: order_by("-search_rank").
+    """
+    query = (query or "").strip()
+    if not query:
+        return queryset
+    if not is_full_text_search_available():
+        return queryset.filter(
+            Q(title__icontains=query)
+            | Q(description__icontains=query)
+            | Q(extracted_text__icontains=query)
+        ).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    search_query = build_search_query(query)
+    return queryset.annotate(
+        title_similarity=TrigramSimilarity("title", query),
+    ).filter(
+        # Оператор % (trigram_similar, порог pg_trgm.similarity_threshold = 0.3) использует GIN-индекс по title.
+        Q(search_vector=search_query) | Q(title__trigram_similar=query)
+    ).annotate(
+        search_rank=Greatest(
+            Coalesce(SearchRank(F("search_vector"), search_query), Value(0.0)),
+            F("title_similarity"),
+            output_field=FloatField(),
+        ),
+    )
+
+
+def _render_headline(raw: str | None) -> str:
+    if not raw:
+        return ""
+    html = escape(raw).replace(_SEL_START, "<mark>").replace(_SEL_STOP, "</mark>")
+    return mark_safe(html)
+
+
+def attach_snippets(files, query: str | None) -> None:
+    """
+    Проставляет file.search_snippet (HTML с <mark>) для уже выбранной страницы файлов.
+    ts_headline дорогой, поэтому считается отдельным запросом только по id этой страницы.
+    """
+    query = (query or "").strip()
+    files = list(files)
+    if not query or not files or not is_full_text_search_available():
+        return
+    from .models import File
+
+    search_query = build_search_query(query)
+    headlines = dict(
+        File.objects.filter(pk__in=[f.pk for f in files])
+        .annotate(
+            snippet=SearchHeadline(
+                "extracted_text",
+                search_query,
+                config="russian",
+                start_sel=_SEL_START,
+                stop_sel=_SEL_STOP,
+                max_fragments=2,
+                max_words=25,
+                min_words=8,
+                fragment_delimiter=" … ",
+            )
+        )
+        .values_list("pk", "snippet")
+    )
+    for file_obj in files:
+        snippet = headlines.get(file_obj.pk) or ""
+        file_obj.search_snippet = _render_headline(snippet) if _SEL_START in snippet else ""
@@ -0,0 +1,41 @@
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from .blobstore import release_blob
+from .models import ContentBlob, File
+
+FILE_LIST_SUMMARY_GENERATION_KEY = "file_list_summary:generation"
+
+
+def release_content_blob(sender, instance, **kwargs):
+    """Удалённая запись (файл, версия, сообщение чата) отпускает свою ссылку на blob."""
+    release_blob(getattr(instance, "content_blob_id", None))
+
+
+def connect_blob_reference_signals():
+    for rel in ContentBlob._meta.related_objects:
+        if rel.one_to_many:
+            post_delete.connect(
+                release_content_blob,
+                sender=rel.related_model,
+                dispatch_uid=f"release_content_blob_{rel.related_model._meta.label_lower}",
+            )
+
+
+def bump_file_list_summary_generation(sender, **kwargs):
+    """Сбрасывает кэш итогов списка файлов (views._file_list_summary) при любом изменении File."""
+    try:
+        cache.incr(FILE_LIST_SUMMARY_GENERATION_KEY)
+    except ValueError:
+        cache.set(FILE_LIST_SUMMARY_GENERATION_KEY, 1, None)
+
+
+def connect_file_list_summary_signals():
+    post_save.connect(bump_file_list_summary_generation, sender=File, dispatch_uid="file_list_summary_save")
+    post_delete.connect(bump_file_list_summary_generation, sender=File, dispatch_uid="file_list_summary_delete")
+    for field_name in ("tags", "favorite", "shared_with"):
+        m2m_changed.connect(
+            bump_file_list_summary_generation,
+            sender=getattr(File, field_name).through,
+            dispatch_uid=f"file_list_summary_{field_name}",
+        )
@@ -1,5 +1,6 @@
 /**
  * Клиентский просмотр: PDF.js, docx-preview (бинарный docx), SheetJS (xlsx), Highlight.js (текст/код).
+ * PDF при наличии pagesUrl показывается изображениями страниц с сервера (renditions.py).
  * Данные конфигурации — элемент #file-viewer-config (JSON из Django json_script).
  */
 (function () {
@@ -58,30 +59,151 @@
     return await res.text();
   }
 
-  async function renderPdf(mount, previewUrl) {
+  async function fetchJson(url) {
+    var res = await fetch(url, { credentials: "same-origin", headers: { Accept: "application/json" } });
+    if (!res.ok) throw new Error("Не удалось загрузить данные (" + res.status + ")");
+    return await res.json();
+  }
+
+  function observeNearViewport(root, elements, onVisible) {
+    if (typeof IntersectionObserver === "undefined") {
+      elements.forEach(onVisible);
+      return;
+    }
+    var observer = new IntersectionObserver(
+      function (entries) {
+        entries.forEach(function (entry) {
+          if (!entry.isIntersecting) return;
+          observer.unobserve(entry.target);
+          onVisible(entry.target);
+        });
+      },
+      { root: root, rootMargin: "150% 0px" }
+    );
+    elements.forEach(function (el) {
+      observer.observe(el);
+    });
+  }
+
+  /**
+   * Страницы как изображения с сервера: лента миниатюр видна сразу, полные страницы
+   * подгружаются по мере прокрутки (до первой из них — увеличенная миниатюра).
+   */
+  function renderPdfPageImages(mount, pagesUrl, manifest, onTextMode) {
+    var layout = document.createElement("div");
+    layout.className = "file-viewer-pdf-layout";
+    var strip = document.createElement("nav");
+    strip.className = "file-viewer-pdf-strip";
+    var wrap = document.createElement("div");
+    wrap.className = "file-viewer-pdf-pages";
+
+    var toolbar = document.createElement("div");
+    toolbar.className = "file-viewer-pdf-toolbar";
+    var textMode = document.createElement("button");
+    textMode.type = "button";
+    textMode.className = "fv-btn";
+    textMode.textContent = "Выделяемый текст (PDF.js)";
+    textMode.addEventListener("click", function () {
+      layout.remove();
+      onTextMode();
+    });
+    toolbar.appendChild(textMode);
+    wrap.appendChild(toolbar);
+
+    var pages = [];
+    for (var i = 1; i <= manifest.pageCount; i++) {
+      var thumbUrl = pagesUrl + i + "/thumb/";
+
+      var link = document.createElement("a");
+      link.href = "#file-viewer-page-" + i;
+      link.title = "Страница " + i;
+      var thumb = document.createElement("img");
+      thumb.loading = "lazy";
+      thumb.width = manifest.thumbWidth;
+      thumb.alt = String(i);
+      thumb.src = thumbUrl;
+      link.appendChild(thumb);
+      strip.appendChild(link);
+
+      var pageImg = document.createElement("img");
+      pageImg.id = "file-viewer-page-" + i;
+      pageImg.className = "file-viewer-pdf-page";
+      pageImg.loading = "lazy";
+      pageImg.alt = "Страница " + i;
+      pageImg.src = thumbUrl;
+      pageImg.dataset.fullSrc = pagesUrl + i + "/full/";
+      wrap.appendChild(pageImg);
+      pages.push(pageImg);
+    }
+
+    layout.appendChild(strip);
+    layout.appendChild(wrap);
+    mount.appendChild(layout);
+    observeNearViewport(wrap, pages, function (img) {
+      img.src = img.dataset.fullSrc;
+    });
+  }
+
+  /** PDF.js: по Range загружаются только нужные части (быстрее всего с линеаризованным PDF), страницы рисуются при прокрутке. */
+  async function renderPdfJs(mount, pdfUrl) {
     if (typeof pdfjsLib === "undefined") throw new Error("PDF.js не загружен");
     pdfjsLib.GlobalWorkerOptions.workerSrc =
       "https://cdnjs.cloudflare.com/ajax/libs/pdf.js/3.11.174/pdf.worker.min.js";
 
-    var loadingTask = pdfjsLib.getDocument({ url: previewUrl, withCredentials: true });
+    var loadingTask = pdfjsLib.getDocument({
+      url: pdfUrl,
+      withCredentials: true,
+      disableAutoFetch: true,
+      disableStream: true,
+      rangeChunkSize: 256 * 1024,
+    });
     var pdf = await loadingTask.promise;
+    var scale = window.devicePixelRatio > 1 ? 1.6 : 1.35;
+    var firstViewport = (await pdf.getPage(1)).getViewport({ scale: scale });
 
     var wrap = document.createElement("div");
     wrap.className = "file-viewer-pdf-pages";
-
+    var canvases = [];
     for (var i = 1; i <= pdf.numPages; i++) {
-      var page = await pdf.getPage(i);
-      var viewport = page.getViewport({ scale: window.devicePixelRatio > 1 ? 1.6 : 1.35 });
       var canvas = document.createElement("canvas");
-      var ctx = canvas.getContext("2d");
-      canvas.height = viewport.height;
-      canvas.width = viewport.width;
-      canvas.style.maxWidth = "100%";
-      canvas.style.height = "auto";
-      await page.render({ canvasContext: ctx, viewport: viewport }).promise;
+      canvas.width = firstViewport.width;
+      canvas.height = firstViewport.height;
+      canvas.dataset.page = String(i);
       wrap.appendChild(canvas);
+      canvases.push(canvas);
     }
     mount.appendChild(wrap);
+
+    observeNearViewport(wrap, canvases, function (canvas) {
+      pdf.getPage(Number(canvas.dataset.page)).then(function (page) {
+        var viewport = page.getViewport({ scale: scale });
+        canvas.width = viewport.width;
+        canvas.height = viewport.height;
+        return page.render({ canvasContext: canvas.getContext("2d"), viewport: viewport }).promise;
+      });
+    });
+  }
+
+  async function renderPdf(mount, previewUrl, pagesUrl) {
+    var manifest = null;
+    if (pagesUrl) {
+      try {
+        manifest = await fetchJson(pagesUrl);
+      } catch (e) {
+        console.warn(e);
+      }
+    }
+    var pdfUrl = (manifest && manifest.pdfUrl) || previewUrl;
+    if (manifest && manifest.pageCount) {
+      renderPdfPageImages(mount, pagesUrl, manifest, function () {
+        renderPdfJs(mount, pdfUrl).catch(function (err) {
+          console.error(err);
+          showError(mount, err.message || String(err));
+        });
+      });
+      return;
+    }
+    await renderPdfJs(mount, pdfUrl);
   }
 
   async function renderText(mount, previewUrl, ext) {
@@ -214,7 +336,7 @@
 
     Promise.resolve()
       .then(function () {
-        if (mode === "js_pdf") return renderPdf(mount, previewUrl);
+        if (mode === "js_pdf") return renderPdf(mount, previewUrl, cfg.pagesUrl);
         if (mode === "js_text") return renderText(mount, previewUrl, ext);
         if (mode === "js_docx") return renderDocx(mount, previewUrl);
         if (mode === "js_xlsx") return renderXlsx(mount, previewUrl);
@@ -0,0 +1,79 @@
+"""Обработчики фоновых задач file_manager (см. jobs.py)."""
+import logging
+
+from .jobs import job
+from .models import File
+
+logger = logging.getLogger(__name__)
+
+
+def _mark_upload_failed(payload, exc):
+    File.objects.filter(pk=payload.get("file_id"), processing_state="processing").update(
+        processing_state="failed",
+        processing_error=f"Не удалось обработать файл: {exc}",
+    )
+
+
+@job("file.process_upload", max_attempts=3, on_failure=_mark_upload_failed)
+def process_upload(file_id):
+    from .views import process_uploaded_file
+
+    file_obj = File.objects.select_related("uploaded_by").filter(pk=file_id).first()
+    if file_obj is None or file_obj.processing_state != "processing":
+        logger.info("file.process_upload: file_id=%s уже обработан или удалён", file_id)
+        return
+    process_uploaded_file(file_obj)
+
+
+def _mark_scan_failed(payload, exc):
+    # Файл остаётся на карантине: без вердикта clamd содержимое не открывается. rescan_media поставит проверку снова.
+    File.objects.filter(pk=payload.get("file_id"), processing_state="quarantine").update(
+        processing_error=f"Антивирусная проверка не выполнена: {exc}",
+    )
+
+
+@job("file.scan_upload", max_attempts=5, on_failure=_mark_scan_failed)
+def scan_upload(file_id, process=False):
+    from .views import scan_quarantined_file
+
+    file_obj = File.objects.select_related("uploaded_by", "content_blob").filter(pk=file_id).first()
+    if file_obj is None or file_obj.processing_state != "quarantine":
+        logger.info("file.scan_upload: file_id=%s уже проверен или удалён", file_id)
+        return
+    scan_quarantined_file(file_obj, process=process)
+
+
+@job("file.render_previews", max_attempts=3)
+def render_previews(file_id):
+    from .views import prerender_viewer_renditions
+
+    file_obj = File.objects.select_related("uploaded_by", "content_blob").filter(pk=file_id).first()
+    if file_obj is None or file_obj.processing_state != "ready":
+        return
+    prerender_viewer_renditions(file_obj)
+
+
+@job("media.thumbnails", max_attempts=2)
+def media_thumbnails(source, presets):
+    from .thumbnails import ensure_sidecar
+
+    for preset in presets:
+        ensure_sidecar(source, preset)
+
+
+@job("activity.write", max_attempts=3)
+def write_activity(events):
+    from .activity_log import write_events
+
+    write_events(events)
+
+
+@job("yandex.reconcile_user", max_attempts=2)
+def reconcile_yandex_user(user_id):
+    from django.contrib.auth.models import User
+
+    from .yandex_sync import reconcile_user
+
+    user = User.objects.filter(pk=user_id).first()
+    if user is not None:
+        reconcile_user(user)
@@ -0,0 +1,15 @@
+"""Миниатюры в шаблонах: {{ user.profile.avatar|thumbnail_url:"avatar" }} (пресеты — file_manager/thumbnails.py)."""
+
+from django import template
+
+from file_manager.thumbnails import thumbnail_url as _thumbnail_url
+
+register = template.Library()
+
+
+@register.filter
+def thumbnail_url(fieldfile, preset):
+    """URL миниатюры поля с изображением; пустое поле — пустая строка."""
+    if not fieldfile:
+        return ""
+    return _thumbnail_url(fieldfile, preset)
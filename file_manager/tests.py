@@ -1,3 +1,1931 @@
-from django.test import TestCase 
+import hashlib
+import io
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote, unquote
 
+from datetime import timedelta
+from unittest import mock
 
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from file_manager import activity_log, content_cache
+from file_manager.activity_rollup import rollup_activity
+from file_manager.blobstore import acquire_blob, collect_garbage, release_blob
+from file_manager.clamav import get_pool as get_clamd_pool, scan_upload
+from file_manager.delivery import parse_range_header
+from file_manager.fake_yandex import FakeYandexDisk
+from file_manager.extraction import extract_text, extract_text_cached, extract_text_from_bytes
+from file_manager.jobs import RedisJobBackend, get_backend, run_job
+from file_manager.libreoffice_pool import ConversionBusyError, LibreOfficePool
+from file_manager.models import (
+    BackgroundJob,
+    ContentBlob,
+    File,
+    FileActivity,
+    FileActivityArchive,
+    FileActivityDailyRollup,
+    FileVersion,
+    Rendition,
+)
+from file_manager.pagination import encode_cursor, keyset_page
+from file_manager.search import _render_headline
+from file_manager.utils import search_files
+from file_manager.yandex_sync import reconcile_user, split_remote_path
+from file_manager.views import create_user_uploaded_file, extract_and_moderate
+from file_manager.wordfilter import (
+    BannedWordMatcher,
+    find_banned_match,
+    find_banned_match_in_chunks,
+    get_matcher as get_banned_matcher,
+)
+from file_manager.management.commands.bench_wordfilter import legacy_find_banned_match
+from file_manager.yandex_disk import YandexDiskClient
+from file_manager.yandex_transfer import TransferEngine
+from file_manager.zipstream import ZipEntry, stream_zip
+
+
+class RangeHeaderTests(TestCase):
+    def test_no_header_means_full_body(self):
+        self.assertIsNone(parse_range_header(None, 100))
+        self.assertIsNone(parse_range_header("items=0-5", 100))
+        self.assertIsNone(parse_range_header("bytes=0-5,10-20", 100))
+
+    def test_explicit_open_and_suffix_ranges(self):
+        self.assertEqual(parse_range_header("bytes=10-19", 100), (10, 19))
+        self.assertEqual(parse_range_header("bytes=90-", 100), (90, 99))
+        self.assertEqual(parse_range_header("bytes=-5", 100), (95, 99))
+        self.assertEqual(parse_range_header("bytes=50-500", 100), (50, 99))
+
+    def test_unsatisfiable_range(self):
+        self.assertIs(parse_range_header("bytes=100-", 100), False)
+        self.assertIs(parse_range_header("bytes=-0", 100), False)
+
+
+class FileDeliveryTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root, FILE_DELIVERY_CHUNK_SIZE=4096)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.owner = User.objects.create_user(username="owner", password="pass")
+        self.payload = bytes(range(256)) * 64
+        self.file_obj = File(title="clip.mp4", uploaded_by=self.owner, storage_provider="local")
+        self.file_obj.file.save("clip.mp4", ContentFile(self.payload), save=True)
+        self.client.force_login(self.owner)
+
+    def test_download_streams_whole_file(self):
+        response = self.client.get(reverse("file_manager:file_download", args=[self.file_obj.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(int(response["Content-Length"]), len(self.payload))
+        self.assertEqual(b"".join(response.streaming_content), self.payload)
+        self.assertIn("attachment", response["Content-Disposition"])
+
+    def test_preview_honours_range(self):
+        url = reverse("file_manager:file_preview", args=[self.file_obj.id])
+        response = self.client.get(url, HTTP_RANGE="bytes=5000-5099")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Type"], "video/mp4")
+        self.assertEqual(response["Content-Range"], f"bytes 5000-5099/{len(self.payload)}")
+        self.assertEqual(b"".join(response.streaming_content), self.payload[5000:5100])
+
+    def test_stale_if_range_returns_full_body(self):
+        url = reverse("file_manager:file_preview", args=[self.file_obj.id])
+        response = self.client.get(url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.payload)
+
+    def test_weak_if_range_returns_full_body(self):
+        url = reverse("file_manager:file_preview", args=[self.file_obj.id])
+        etag = self.client.get(url)["ETag"]
+        response = self.client.get(url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        response = self.client.get(url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=f"W/{etag}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.payload)
+
+    def test_unsatisfiable_range_returns_416(self):
+        url = reverse("file_manager:file_preview", args=[self.file_obj.id])
+        response = self.client.get(url, HTTP_RANGE=f"bytes={len(self.payload)}-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], f"bytes */{len(self.payload)}")
+
+
+class InternalRedirectDeliveryTests(TestCase):
+    """Режимы X-Accel-Redirect / X-Sendfile: проверяем только заголовки, nginx не нужен."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.owner = User.objects.create_user(username="owner", password="pass")
+        self.stranger = User.objects.create_user(username="stranger", password="pass")
+        self.file_obj = File(title="Лекция 1.pdf", uploaded_by=self.owner, storage_provider="local")
+        self.file_obj.file.save("Лекция 1.pdf", ContentFile(b"%PDF-1.4 test"), save=True)
+        self.relative_name = self.file_obj.file.name
+
+    def test_x_accel_redirect_points_into_protected_location(self):
+        self.client.force_login(self.owner)
+        with override_settings(
+            FILE_DELIVERY_MODE="x-accel-redirect",
+            FILE_DELIVERY_INTERNAL_PREFIX="/protected-media/",
+        ):
+            response = self.client.get(reverse("file_manager:file_preview", args=[self.file_obj.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(
+            response["X-Accel-Redirect"],
+            "/protected-media/" + quote(self.relative_name),
+        )
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertIn("inline", response["Content-Disposition"])
+
+    def test_x_sendfile_uses_absolute_path(self):
+        self.client.force_login(self.owner)
+        with override_settings(FILE_DELIVERY_MODE="x-sendfile"):
+            response = self.client.get(reverse("file_manager:file_download", args=[self.file_obj.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(unquote(response["X-Sendfile"]), os.path.realpath(self.file_obj.file.path))
+        self.assertIn("attachment", response["Content-Disposition"])
+        self.assertNotIn("X-Accel-Redirect", response)
+
+    def test_access_check_runs_before_redirect(self):
+        self.client.force_login(self.stranger)
+        with override_settings(FILE_DELIVERY_MODE="x-accel-redirect"):
+            response = self.client.get(reverse("file_manager:file_download", args=[self.file_obj.id]))
+        self.assertEqual(response.status_code, 403)
+        self.assertNotIn("X-Accel-Redirect", response)
+
+
+class ContentBlobStoreTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root, JOB_QUEUE_EAGER=True)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.alice = User.objects.create_user(username="alice", password="pass")
+        self.bob = User.objects.create_user(username="bob", password="pass")
+
+    def _upload(self, user, payload=b"lecture notes " * 100):
+        file_obj, err, _ = create_user_uploaded_file(user, SimpleUploadedFile("lecture.txt", payload))
+        self.assertIsNone(err)
+        return file_obj
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self._upload(self.alice)
+        second = self._upload(self.bob)
+
+        self.assertEqual(ContentBlob.objects.count(), 1)
+        blob = ContentBlob.objects.get()
+        self.assertEqual(first.content_blob_id, blob.id)
+        self.assertEqual(second.content_blob_id, blob.id)
+        self.assertEqual(first.file.name, blob.storage_path)
+        self.assertEqual(first.versions.get().content_blob_id, blob.id)
+        # два файла + две начальные версии
+        self.assertEqual(blob.ref_count, 4)
+        self.assertEqual(self.alice.storage_quota.get_physical_usage(), blob.size)
+
+    def test_upload_is_stored_without_reading_it_whole(self):
+        payload = b"lecture notes " * 100_000
+        uploaded = TemporaryUploadedFile("big.txt", "text/plain", len(payload), None)
+        uploaded.write(payload)
+        uploaded.seek(0)
+        self.addCleanup(uploaded.close)
+        read = uploaded.file.read
+
+        def bounded_read(size=-1):
+            self.assertTrue(0 < size <= 1024 * 1024, f"read({size}) целиком")
+            return read(size)
+
+        with mock.patch.object(uploaded.file, "read", side_effect=bounded_read):
+            file_obj, err, _ = create_user_uploaded_file(self.alice, uploaded)
+        self.assertIsNone(err)
+
+        blob = ContentBlob.objects.get()
+        self.assertEqual(blob.sha256, hashlib.sha256(payload).hexdigest())
+        self.assertEqual(blob.size, len(payload))
+        self.assertEqual(file_obj.versions.get().content_blob_id, blob.id)
+        with default_storage.open(blob.storage_path, "rb") as fh:
+            self.assertEqual(fh.read(), payload)
+
+    def test_garbage_collector_spares_blob_reacquired_before_lock(self):
+        payload = b"old lecture"
+        blob = acquire_blob(payload, "old.txt")
+        release_blob(blob.id)
+        ContentBlob.objects.filter(pk=blob.pk).update(last_referenced_at=timezone.now() - timedelta(days=1))
+        select_for_update = ContentBlob.objects.select_for_update
+
+        def reupload_then_lock(*args, **kwargs):
+            # Повторная загрузка тех же байтов между отбором кандидатов и блокировкой строки;
+            # File ещё не сохранён, ссылок по FK нет.
+            acquire_blob(payload, "old.txt")
+            return select_for_update(*args, **kwargs)
+
+        with mock.patch.object(ContentBlob.objects, "select_for_update", side_effect=reupload_then_lock):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(collect_garbage(grace=timedelta(hours=1)), (0, 0))
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertTrue(default_storage.exists(blob.storage_path))
+
+    def test_garbage_collector_keeps_referenced_and_reclaims_orphans(self):
+        first = self._upload(self.alice)
+        second = self._upload(self.bob)
+        blob = ContentBlob.objects.get()
+
+        first.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(collect_garbage(grace=timedelta(0)), (0, 0))
+
+        second.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            removed, freed = collect_garbage(grace=timedelta(0))
+        self.assertEqual((removed, freed), (1, blob.size))
+        self.assertFalse(ContentBlob.objects.exists())
+        self.assertFalse(default_storage.exists(blob.storage_path))
+
+
+class BackgroundUploadProcessingTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            UPLOAD_PROCESSING_IN_BACKGROUND=True,
+            JOB_QUEUE_BACKEND="database",
+            JOB_QUEUE_EAGER=False,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user(username="owner", password="pass")
+
+    def _upload(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            file_obj, err, _ = create_user_uploaded_file(
+                self.user, SimpleUploadedFile("notes.txt", b"conspect text " * 50)
+            )
+        self.assertIsNone(err)
+        return file_obj
+
+    def _work_off(self):
+        backend = get_backend()
+        while (job_obj := backend.reserve(0)) is not None:
+            run_job(job_obj, backend)
+
+    def test_upload_returns_processing_and_worker_finishes_it(self):
+        file_obj = self._upload()
+        self.assertEqual(file_obj.processing_state, "processing")
+        self.assertFalse(file_obj.versions.exists())
+        self.assertEqual(BackgroundJob.objects.get().name, "file.process_upload")
+
+        self.client.force_login(self.user)
+        status_url = reverse("file_manager:file_processing_status", args=[file_obj.id])
+        self.assertEqual(self.client.get(status_url).json()["state"], "processing")
+
+        self._work_off()
+        file_obj.refresh_from_db()
+        self.assertEqual(file_obj.processing_state, "ready")
+        self.assertIn("conspect", file_obj.extracted_text)
+        self.assertEqual(file_obj.versions.get().content_blob_id, file_obj.content_blob_id)
+        self.assertFalse(BackgroundJob.objects.exists())
+        self.assertTrue(self.client.get(status_url).json()["ready"])
+
+    def test_banned_content_is_rejected_in_background(self):
+        file_obj = self._upload()
+        with mock.patch("file_manager.views.extract_and_moderate", return_value=("", "плохое слово")):
+            self._work_off()
+        file_obj.refresh_from_db()
+        self.assertEqual(file_obj.processing_state, "rejected")
+        self.assertTrue(file_obj.processing_error)
+        self.assertFalse(file_obj.file)
+        self.assertEqual(ContentBlob.objects.get().ref_count, 0)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("file_manager:file_download", args=[file_obj.id]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_failing_job_is_retried_then_marked_failed(self):
+        file_obj = self._upload()
+        with mock.patch("file_manager.views.process_uploaded_file", side_effect=RuntimeError("boom")):
+            for attempt in range(1, 4):
+                BackgroundJob.objects.update(run_after=timezone.now())
+                self._work_off()
+                job_row = BackgroundJob.objects.get()
+                self.assertEqual(job_row.attempts, attempt)
+        self.assertEqual(job_row.status, "failed")
+        self.assertIn("boom", job_row.last_error)
+        file_obj.refresh_from_db()
+        self.assertEqual(file_obj.processing_state, "failed")
+
+
+class RedisJobBackendTests(TestCase):
+    def setUp(self):
+        # from_url не подключается к Redis; команды клиента подменены.
+        self.backend = RedisJobBackend("redis://localhost:6379/0", prefix="test:jobs")
+        self.backend.client = mock.Mock()
+        self.raw = json.dumps({"id": "job-1", "name": "file.process_upload", "payload": {}})
+        self.backend.client.lrange.return_value = [self.raw]
+
+    def test_job_without_start_time_is_not_recovered_at_once(self):
+        # Между BLMOVE и HSET в reserve времени старта ещё нет — задача уже выполняется.
+        self.backend.client.hget.return_value = None
+        self.assertEqual(self.backend.recover_stale(), 0)
+        self.backend.client.lrem.assert_not_called()
+        self.backend.client.hsetnx.assert_called_once_with(self.backend.started_key, "job-1", mock.ANY)
+
+    def test_job_past_visibility_timeout_is_requeued(self):
+        self.backend.client.hget.return_value = str(time.time() - 10_000)
+        self.backend.client.lrem.return_value = 1
+        with override_settings(JOB_QUEUE_VISIBILITY_TIMEOUT=60):
+            self.assertEqual(self.backend.recover_stale(), 1)
+        self.backend.client.lpush.assert_called_once_with(self.backend.ready_key, self.raw)
+
+
+class JobWorkerCommandTests(TestCase):
+    def test_stale_jobs_are_recovered_while_worker_runs(self):
+        backend = mock.Mock(**{"recover_stale.return_value": 0})
+        backend.reserve.side_effect = [object(), object(), None]
+        command = "file_manager.management.commands.run_job_worker"
+        with mock.patch(f"{command}.get_backend", return_value=backend), \
+                mock.patch(f"{command}.run_job", return_value=True), \
+                mock.patch(f"{command}.recovery_interval", return_value=0), \
+                mock.patch(f"{command}.signal.signal"):
+            call_command("run_job_worker", burst=True, stdout=io.StringIO())
+        # При старте и перед каждой выборкой: проверка не ограничена запуском воркера.
+        self.assertEqual(backend.recover_stale.call_count, 4)
+
+
+class TextExtractionTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+
+    def _write(self, name, payload):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, "wb") as fh:
+            fh.write(payload)
+        return path
+
+    def test_pool_extracts_text(self):
+        path = self._write("notes.txt", "Конспект лекции".encode("utf-8"))
+        with override_settings(TEXT_EXTRACTION_WORKERS=1):
+            result = extract_text(path)
+        self.assertEqual(result.text, "Конспект лекции")
+        self.assertFalse(result.truncated)
+
+    def test_output_is_capped_and_flagged(self):
+        path = self._write("big.txt", b"a" * 10_000)
+        with override_settings(TEXT_EXTRACTION_WORKERS=0, TEXT_EXTRACTION_MAX_CHARS=100):
+            result = extract_text(path)
+        self.assertEqual(len(result.text), 100)
+        self.assertTrue(result.truncated)
+
+    def test_non_utf8_byte_after_first_block_is_not_duplicated(self):
+        path = self._write("legacy.txt", b"a" * 300_000 + b"\xff" + b"tail")
+        with override_settings(TEXT_EXTRACTION_WORKERS=0):
+            result = extract_text(path)
+        self.assertEqual(len(result.text), 300_005)
+        self.assertTrue(result.text.endswith("\xfftail"))
+
+    def test_broken_document_reports_error_instead_of_silence(self):
+        path = self._write("broken.docx", b"not a zip archive")
+        with override_settings(TEXT_EXTRACTION_WORKERS=0):
+            result = extract_text(path)
+        self.assertEqual(result.text, "")
+        self.assertTrue(result.truncated)
+        self.assertTrue(result.error)
+
+    def test_same_bytes_are_parsed_once(self):
+        path = self._write("slides.txt", "Слайд 1".encode("utf-8"))
+        with override_settings(TEXT_EXTRACTION_WORKERS=0), mock.patch(
+            "file_manager.extraction.extract_text", wraps=extract_text
+        ) as parser:
+            first = extract_text_from_bytes("Слайд 1".encode("utf-8"), "upload.txt")
+            second = extract_text_cached(path)
+        self.assertEqual(first.text, "Слайд 1")
+        self.assertEqual(second.text, "Слайд 1")
+        self.assertEqual(parser.call_count, 1)
+
+
+class FileSearchTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="owner", password="pass")
+        self.match = File.objects.create(
+            title="syllabus.pdf", uploaded_by=self.owner, extracted_text="Темы: линейная алгебра"
+        )
+        File.objects.create(title="photo.jpg", uploaded_by=self.owner, extracted_text="")
+
+    def test_search_matches_extracted_text_and_annotates_rank(self):
+        results = list(search_files("алгебра", user=self.owner).order_by("-search_rank"))
+        self.assertEqual(results, [self.match])
+        self.assertTrue(hasattr(results[0], "search_rank"))
+
+    def test_file_list_search_uses_relevance_order(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse("file_manager:file_list"), {"query": "алгебра"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["file_list_sort"], "relevance")
+        self.assertEqual(list(response.context["page_obj"]), [self.match])
+
+    def test_quarantined_public_file_is_listed_only_for_owner(self):
+        File.objects.filter(pk=self.match.pk).update(visibility="public", processing_state="quarantine")
+        reader = User.objects.create_user(username="reader", password="pass")
+        self.assertEqual(list(search_files("алгебра", user=reader)), [])
+        self.assertEqual(list(search_files("алгебра", user=self.owner)), [self.match])
+
+        self.client.force_login(reader)
+        url = reverse("file_manager:file_list")
+        self.assertEqual(list(self.client.get(url).context["page_obj"]), [])
+        self.assertEqual(list(self.client.get(url, {"query": "алгебра"}).context["page_obj"]), [])
+
+    def test_headline_escapes_document_text(self):
+        html = _render_headline("<script>\x02алгебра\x03</script>")
+        self.assertEqual(html, "&lt;script&gt;<mark>алгебра</mark>&lt;/script&gt;")
+
+
+class FileListSummaryTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="owner", password="pass")
+        File.objects.create(title="a.txt", uploaded_by=self.owner, file_size=100)
+        File.objects.create(title="b.txt", uploaded_by=self.owner, file_size=250)
+        self.client.force_login(self.owner)
+
+    def test_totals_come_from_one_aggregate_and_feed_the_paginator(self):
+        response = self.client.get(reverse("file_manager:file_list"))
+        self.assertEqual(response.context["total_files"], 2)
+        self.assertEqual(response.context["total_size"], 350)
+        self.assertEqual(response.context["page_obj"].paginator.count, 2)
+
+    @override_settings(FILE_LIST_SUMMARY_CACHE_TTL=60)
+    def test_cached_summary_is_invalidated_by_file_changes(self):
+        url = reverse("file_manager:file_list")
+        self.assertEqual(self.client.get(url).context["total_files"], 2)
+        File.objects.create(title="c.txt", uploaded_by=self.owner, file_size=50)
+        response = self.client.get(url)
+        self.assertEqual(response.context["total_files"], 3)
+        self.assertEqual(response.context["total_size"], 400)
+
+
+class YandexReconcileTests(TestCase):
+    def setUp(self):
+        from file_manager.models import ExternalStorageConnection
+
+        cache.clear()
+        self.owner = User.objects.create_user(username="owner", password="pass")
+        ExternalStorageConnection.objects.create(user=self.owner, provider="yandex_disk", access_token="token")
+        self.kept = File.objects.create(
+            title="kept.pdf", uploaded_by=self.owner, storage_provider="yandex_disk", yandex_path="disk:/kept.pdf"
+        )
+        self.gone = File.objects.create(
+            title="gone.pdf", uploaded_by=self.owner, storage_provider="yandex_disk", yandex_path="disk:/gone.pdf"
+        )
+        self.in_app = File.objects.create(
+            title="n.txt",
+            uploaded_by=self.owner,
+            storage_provider="yandex_disk",
+            yandex_path=f"app:/Classroom/{self.owner.id}/n.txt",
+        )
+
+    def test_split_remote_path(self):
+        self.assertEqual(split_remote_path("disk:/kept.pdf"), ("disk:/", "kept.pdf"))
+        self.assertEqual(split_remote_path("app:/Classroom/1/n.txt"), ("app:/Classroom/1", "n.txt"))
+
+    def test_one_listing_per_folder_and_missing_files_removed(self):
+        listings = {"disk:/": ["kept.pdf", "other.doc"], f"app:/Classroom/{self.owner.id}": None}
+        with mock.patch(
+            "file_manager.yandex_sync.iter_folder_names", side_effect=lambda token, folder: listings[folder]
+        ) as listing:
+            removed = reconcile_user(self.owner)
+        self.assertEqual(listing.call_count, 2)
+        self.assertEqual(removed, 2)
+        self.assertEqual(list(File.objects.values_list("id", flat=True)), [self.kept.id])
+
+    def test_listing_error_keeps_files(self):
+        with mock.patch("file_manager.yandex_sync.iter_folder_names", side_effect=OSError("network")):
+            self.assertEqual(reconcile_user(self.owner), 0)
+        self.assertEqual(File.objects.count(), 3)
+
+    def test_file_list_does_not_call_yandex(self):
+        self.client.force_login(self.owner)
+        with mock.patch("requests.Session.request") as http, mock.patch(
+            "file_manager.yandex_sync.enqueue"
+        ) as enqueue:
+            response = self.client.get(reverse("file_manager:file_list"))
+        self.assertEqual(response.status_code, 200)
+        http.assert_not_called()
+        enqueue.assert_called_once_with("yandex.reconcile_user", user_id=self.owner.id)
+
+
+class YandexDiskClientTests(TestCase):
+    def setUp(self):
+        self.fake = FakeYandexDisk().start()
+        self.addCleanup(self.fake.stop)
+        self.client_api = YandexDiskClient(api_base=self.fake.api_base, backoff=0)
+
+    def test_connections_are_reused(self):
+        for _ in range(5):
+            self.client_api.get_disk_info("token")
+        self.assertEqual(self.fake.requests["GET /v1/disk"], 5)
+        self.assertEqual(self.fake.connections, 1)
+
+    def test_retries_transient_errors(self):
+        self.fake.fail_next(503, 2)
+        self.assertIn("total_space", self.client_api.get_disk_info("token"))
+        self.assertEqual(self.fake.requests["GET /v1/disk"], 3)
+
+    def test_post_is_not_retried(self):
+        self.fake.fail_next(503, 2)
+        response = self.client_api.session.post(f"{self.client_api.resources_url}/copy", params={"from": "disk:/a"})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.fake.requests["POST /v1/disk/resources/copy"], 1)
+
+    def test_known_folders_skip_segment_creation(self):
+        self.client_api.upload_file_bytes("token", "app:/Classroom/1/a.txt", b"a")
+        self.client_api.upload_file_bytes("token", "app:/Classroom/1/b.txt", b"bb")
+        self.assertEqual(self.fake.requests["PUT /v1/disk/resources"], 2)
+        self.assertEqual(self.fake.files["app:/Classroom/1/b.txt"], b"bb")
+
+    def test_folder_deleted_outside_app_is_recreated(self):
+        self.client_api.upload_file_bytes("token", "disk:/dir/a.txt", b"a")
+        self.fake.folders.discard("disk:/dir")
+        self.client_api.upload_file_bytes("token", "disk:/dir/b.txt", b"b")
+        self.assertIn("disk:/dir", self.fake.folders)
+        self.assertEqual(self.fake.files["disk:/dir/b.txt"], b"b")
+
+
+class YandexTransferTests(TestCase):
+    def setUp(self):
+        self.fake = FakeYandexDisk().start()
+        self.addCleanup(self.fake.stop)
+        self.engine = TransferEngine(YandexDiskClient(api_base=self.fake.api_base, backoff=0), chunk_size=4096)
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+
+    def test_upload_from_iterator_and_file(self):
+        sent = self.engine.upload("token", "disk:/a/it.bin", (bytes([i]) * 1000 for i in range(5)))
+        self.assertEqual(sent, 5000)
+        self.assertEqual(len(self.fake.files["disk:/a/it.bin"]), 5000)
+
+        source = os.path.join(self.tmp, "src.bin")
+        with open(source, "wb") as fh:
+            fh.write(b"z" * 10000)
+        self.fake.fail_next(503, path="/_upload")
+        self.assertEqual(self.engine.upload("token", "disk:/a/file.bin", source), 10000)
+        self.assertEqual(self.fake.files["disk:/a/file.bin"], b"z" * 10000)
+        self.assertEqual(self.fake.requests["PUT /_upload"], 3)
+
+    def test_download_to_file_and_many(self):
+        self.fake.put_file("disk:/x.bin", b"x" * 9000)
+        self.fake.put_file("disk:/y.bin", b"y" * 10)
+        target = os.path.join(self.tmp, "x.bin")
+        self.assertEqual(self.engine.download_to_file("token", "disk:/x.bin", target), 9000)
+        self.assertFalse(os.path.exists(target + ".part"))
+
+        results = list(
+            self.engine.download_many(
+                [("token", "disk:/y.bin", ".bin"), ("token", "disk:/missing.bin", ""), ("token", "disk:/x.bin", "")]
+            )
+        )
+        self.assertEqual([r[0] for r in results], ["disk:/y.bin", "disk:/missing.bin", "disk:/x.bin"])
+        self.assertIsNotNone(results[1][2])
+        with open(results[0][1], "rb") as fh:
+            self.assertEqual(fh.read(), b"y" * 10)
+        for _, temp_path, _ in results:
+            if temp_path:
+                os.unlink(temp_path)
+
+    def test_async_iter_download(self):
+        from asgiref.sync import async_to_sync
+
+        self.fake.put_file("disk:/a.bin", b"a" * 10000)
+
+        async def collect():
+            return b"".join([block async for block in self.engine.aiter_download("token", "disk:/a.bin")])
+
+        self.assertEqual(async_to_sync(collect)(), b"a" * 10000)
+
+    def test_archive_streams_yandex_files(self):
+        import zipfile
+
+        from file_manager.models import ExternalStorageConnection
+
+        owner = User.objects.create_user(username="owner", password="pass")
+        ExternalStorageConnection.objects.create(user=owner, provider="yandex_disk", access_token="token")
+        File.objects.create(title="cloud.txt", uploaded_by=owner, storage_provider="yandex_disk", yandex_path="disk:/cloud.txt")
+        self.fake.put_file("disk:/cloud.txt", b"from the cloud")
+        self.client.force_login(owner)
+        with override_settings(
+            YANDEX_DISK_API_BASE=self.fake.api_base, YANDEX_HTTP_BACKOFF=0, YANDEX_CONTENT_CACHE_MAX_BYTES=0
+        ):
+            response = self.client.get(reverse("file_manager:download_all_files_archive"))
+            body = b"".join(response.streaming_content)
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            self.assertEqual(archive.read("cloud.txt"), b"from the cloud")
+
+
+class YandexApiCacheTests(TestCase):
+    def setUp(self):
+        from file_manager.models import ExternalStorageConnection
+
+        cache.clear()
+        self.fake = FakeYandexDisk().start()
+        self.addCleanup(self.fake.stop)
+        settings_override = override_settings(
+            YANDEX_DISK_API_BASE=self.fake.api_base, YANDEX_HTTP_BACKOFF=0, YANDEX_CONTENT_CACHE_MAX_BYTES=0
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.owner = User.objects.create_user(username="owner", password="pass")
+        ExternalStorageConnection.objects.create(user=self.owner, provider="yandex_disk", access_token="token")
+        self.fake.put_file("disk:/doc.txt", b"hello")
+        self.file = File.objects.create(
+            title="doc.txt", uploaded_by=self.owner, storage_provider="yandex_disk", yandex_path="disk:/doc.txt"
+        )
+        self.client.force_login(self.owner)
+
+    def _preview(self):
+        response = self.client.get(reverse("file_manager:file_preview", args=[self.file.id]))
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def test_repeat_open_reuses_download_url(self):
+        self.assertEqual(self._preview(), b"hello")
+        self.assertEqual(self._preview(), b"hello")
+        self.assertEqual(self.fake.requests["GET /v1/disk/resources/download"], 1)
+
+    def test_short_lived_href_not_cached(self):
+        self.fake.href_lifetime = 30
+        self._preview()
+        self._preview()
+        self.assertEqual(self.fake.requests["GET /v1/disk/resources/download"], 2)
+
+    def test_stale_href_is_refreshed(self):
+        from file_manager.yandex_disk import get_client
+
+        stale_key = get_client()._cache_key("href", "token", "disk:/doc.txt")
+        cache.set(stale_key, f"{self.fake.base_url}/_download?path=disk%3A/removed.txt", 600)
+        self.assertEqual(self._preview(), b"hello")
+        self.assertEqual(self.fake.requests["GET /v1/disk/resources/download"], 1)
+
+    def test_upload_and_delete_invalidate_metadata(self):
+        from file_manager.yandex_disk import delete_resource, get_disk_info, get_resource_info, upload_file_bytes
+
+        self.assertEqual(get_resource_info("token", "disk:/doc.txt")["size"], 5)
+        get_disk_info("token")
+        get_resource_info("token", "disk:/doc.txt")
+        get_disk_info("token")
+        self.assertEqual(self.fake.requests["GET /v1/disk/resources"], 1)
+        self.assertEqual(self.fake.requests["GET /v1/disk"], 1)
+
+        upload_file_bytes("token", "disk:/doc.txt", b"longer text")
+        self.assertEqual(get_resource_info("token", "disk:/doc.txt")["size"], 11)
+        self.assertEqual(get_disk_info("token")["used_space"], 11)
+        delete_resource("token", "disk:/doc.txt")
+        self.assertIsNone(get_resource_info("token", "disk:/doc.txt"))
+
+
+class YandexContentCacheTests(TestCase):
+    def setUp(self):
+        from file_manager.models import ExternalStorageConnection
+
+        cache.clear()
+        self.fake = FakeYandexDisk().start()
+        self.addCleanup(self.fake.stop)
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        settings_override = override_settings(
+            YANDEX_DISK_API_BASE=self.fake.api_base,
+            YANDEX_HTTP_BACKOFF=0,
+            YANDEX_CONTENT_CACHE_DIR=self.cache_dir,
+            YANDEX_CONTENT_CACHE_MAX_BYTES=1024 * 1024,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.owner = User.objects.create_user(username="owner", password="pass")
+        ExternalStorageConnection.objects.create(user=self.owner, provider="yandex_disk", access_token="token")
+
+    def test_repeat_preview_served_from_cache(self):
+        self.fake.put_file("disk:/doc.txt", b"hello")
+        file_obj = File.objects.create(
+            title="doc.txt", uploaded_by=self.owner, storage_provider="yandex_disk", yandex_path="disk:/doc.txt"
+        )
+        self.client.force_login(self.owner)
+        for _ in range(2):
+            response = self.client.get(reverse("file_manager:file_preview", args=[file_obj.id]))
+            self.assertEqual(b"".join(response.streaming_content), b"hello")
+        self.assertEqual(self.fake.requests["GET /_download"], 1)
+        stats = content_cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 1, 1))
+
+    def test_changed_remote_file_gets_new_entry(self):
+        from file_manager.yandex_disk import upload_file_bytes
+
+        self.fake.put_file("disk:/doc.txt", b"old")
+        first = content_cache.get_local_copy("token", "disk:/doc.txt")
+        upload_file_bytes("token", "disk:/doc.txt", b"new")
+        second = content_cache.get_local_copy("token", "disk:/doc.txt")
+        self.assertNotEqual(first, second)
+        with open(second, "rb") as fh:
+            self.assertEqual(fh.read(), b"new")
+
+    def test_concurrent_fill_downloads_once(self):
+        import threading
+
+        self.fake.put_file("disk:/big.bin", b"b" * 50_000)
+        content_cache.get_local_copy("token", "disk:/missing-warmup.bin")  # прогрев пула соединений
+        self.fake.latency = 0.05
+        paths = []
+        threads = [
+            threading.Thread(target=lambda: paths.append(content_cache.get_local_copy("token", "disk:/big.bin")))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(paths)), 1)
+        self.assertEqual(self.fake.requests["GET /_download"], 1)
+
+    def test_eviction_keeps_cache_under_cap(self):
+        with override_settings(YANDEX_CONTENT_CACHE_MAX_BYTES=25_000):
+            paths = []
+            for index in range(3):
+                self.fake.put_file(f"disk:/f{index}.bin", bytes([index]) * 10_000)
+                paths.append(content_cache.get_local_copy("token", f"disk:/f{index}.bin"))
+                # Записи старше периода защиты от вытеснения, f0 — самая давняя.
+                os.utime(paths[-1], (time.time() - 3600 + index, time.time() - 3600 + index))
+        self.assertFalse(os.path.exists(paths[0]))
+        self.assertTrue(os.path.exists(paths[2]))
+        self.assertEqual(content_cache.stats()["evictions"], 1)
+
+
+FAKE_LO_BRIDGE = """
+import argparse, json, os, socket, sys, time
+parser = argparse.ArgumentParser()
+for name in ("--socket", "--profile", "--soffice", "--start-timeout"):
+    parser.add_argument(name)
+args = parser.parse_args()
+server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+server.bind(args.socket)
+server.listen(1)
+print("READY", flush=True)
+conn, _ = server.accept()
+with conn, conn.makefile("rwb") as stream:
+    for line in stream:
+        request = json.loads(line)
+        if request.get("cmd") == "quit":
+            break
+        with open(request["src"], "rb") as fh:
+            data = fh.read()
+        if data == b"hang":
+            time.sleep(60)
+        with open(request["dst"], "wb") as fh:
+            fh.write(b"%PDF " + data + b" pid=" + str(os.getpid()).encode())
+        stream.write(b'{"ok": true}\\n')
+        stream.flush()
+"""
+
+
+class LibreOfficePoolTests(TestCase):
+    """Пул с поддельным мостом: тот же протокол, что у lo_bridge.py, но без LibreOffice."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.bridge = os.path.join(self.tmp, "bridge.py")
+        with open(self.bridge, "w") as fh:
+            fh.write(FAKE_LO_BRIDGE)
+
+    def _pool(self, **kwargs):
+        pool = LibreOfficePool(soffice="soffice", bridge_command=[sys.executable, self.bridge], start_timeout=10, **kwargs)
+        self.addCleanup(pool.shutdown)
+        return pool
+
+    def _doc(self, content):
+        path = os.path.join(self.tmp, f"doc{len(os.listdir(self.tmp))}.docx")
+        with open(path, "wb") as fh:
+            fh.write(content)
+        return path
+
+    def test_worker_is_reused_between_jobs(self):
+        pool = self._pool(size=1)
+        first = pool.convert(self._doc(b"one"))
+        second = pool.convert(self._doc(b"two"))
+        self.assertTrue(first.startswith(b"%PDF one"))
+        self.assertEqual(first.rsplit(b"pid=", 1)[1], second.rsplit(b"pid=", 1)[1])
+        self.assertEqual(pool.started, 1)
+
+    def test_worker_recycled_after_max_jobs(self):
+        pool = self._pool(size=1, max_jobs_per_worker=2)
+        outputs = [pool.convert(self._doc(b"x")) for _ in range(3)]
+        pids = {out.rsplit(b"pid=", 1)[1] for out in outputs}
+        self.assertEqual(len(pids), 2)
+        self.assertEqual(pool.started, 2)
+
+    def test_hung_job_is_killed_and_slot_recovers(self):
+        pool = self._pool(size=1, job_timeout=0.5)
+        with self.assertRaises(RuntimeError):
+            pool.convert(self._doc(b"hang"))
+        self.assertTrue(pool.convert(self._doc(b"ok")).startswith(b"%PDF ok"))
+        self.assertEqual(pool.started, 2)
+
+    def test_busy_pool_rejects_with_backpressure(self):
+        import threading
+
+        pool = self._pool(size=1, job_timeout=1, queue_timeout=0.1, max_queue=0)
+        hung = threading.Thread(target=lambda: self.assertRaises(RuntimeError, pool.convert, self._doc(b"hang")))
+        hung.start()
+        time.sleep(0.5)
+        with self.assertRaises(ConversionBusyError):
+            pool.convert(self._doc(b"late"))
+        hung.join()
+
+
+@override_settings(OFFICE_PDF_EAGER_RENDITIONS=True, JOB_QUEUE_EAGER=True)
+class OfficePdfRenditionTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self._patch("file_manager.views.is_office_pdf_conversion_available", return_value=True)
+        self._patch("file_manager.renditions.get_converter_version", return_value="1:test")
+        self.convert = self._patch(
+            "file_manager.renditions.convert_office_file_to_pdf_bytes",
+            side_effect=lambda path: b"%PDF-1.4 " + open(path, "rb").read(),
+        )
+
+        self.owner = User.objects.create_user(username="owner", password="pass")
+        self.client.force_login(self.owner)
+
+    def _patch(self, target, **kwargs):
+        patcher = mock.patch(target, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def _local_file(self, title, content):
+        blob = acquire_blob(content, title)
+        file_obj = File(title=title, uploaded_by=self.owner, storage_provider="local", content_blob=blob)
+        file_obj.file.name = blob.storage_path
+        file_obj.save()
+        return file_obj
+
+    def test_repeat_preview_is_served_from_rendition_cache(self):
+        file_obj = self._local_file("lecture.docx", b"docx bytes")
+        url = reverse("file_manager:office_pdf_preview", args=[file_obj.id])
+        first = self.client.get(url)
+        self.assertEqual(b"".join(first.streaming_content), b"%PDF-1.4 docx bytes")
+        self.assertEqual(first["Content-Type"], "application/pdf")
+        second = self.client.get(url)
+        self.assertEqual(b"".join(second.streaming_content), b"%PDF-1.4 docx bytes")
+        self.assertEqual(self.convert.call_count, 1)
+        self.assertEqual(first["ETag"], second["ETag"])
+
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(self.convert.call_count, 1)
+
+    def test_identical_documents_share_one_rendition(self):
+        first = self._local_file("a.docx", b"same content")
+        second = self._local_file("b.docx", b"same content")
+        for file_obj in (first, second):
+            self.client.get(reverse("file_manager:office_pdf_preview", args=[file_obj.id]))
+        version = first.versions.create(
+            version_number=1, blob_sha256=first.content_blob.sha256, blob_storage_provider="local",
+            blob_storage_path=first.content_blob.storage_path, has_blob=True, snapshot_title="a.docx",
+        )
+        response = self.client.get(reverse("file_manager:file_version_office_pdf_preview", args=[first.id, version.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.convert.call_count, 1)
+        self.assertEqual(Rendition.objects.count(), 1)
+
+    def test_upload_renders_pdf_eagerly(self):
+        with override_settings(UPLOAD_PROCESSING_IN_BACKGROUND=False):
+            file_obj, err, _ = create_user_uploaded_file(self.owner, SimpleUploadedFile("slides.pptx", b"pptx bytes"))
+        self.assertIsNone(err)
+        self.assertEqual(self.convert.call_count, 1)
+        self.client.get(reverse("file_manager:office_pdf_preview", args=[file_obj.id]))
+        self.assertEqual(self.convert.call_count, 1)
+
+    def test_new_converter_version_rerenders_and_prunes_old(self):
+        from file_manager.renditions import prune_renditions
+
+        file_obj = self._local_file("lecture.docx", b"docx bytes")
+        url = reverse("file_manager:office_pdf_preview", args=[file_obj.id])
+        self.client.get(url)
+        with mock.patch("file_manager.renditions.get_converter_version", return_value="2:test"):
+            self.client.get(url)
+            self.assertEqual(self.convert.call_count, 2)
+            self.assertEqual(prune_renditions(), 1)
+        self.assertEqual(Rendition.objects.get().converter_version, "2:test")
+
+    def test_renditions_of_yandex_files_survive_pruning(self):
+        from file_manager.models import ExternalStorageConnection
+        from file_manager.renditions import prune_renditions
+
+        fake = FakeYandexDisk().start()
+        self.addCleanup(fake.stop)
+        ExternalStorageConnection.objects.create(user=self.owner, provider="yandex_disk", access_token="token")
+        fake.put_file("disk:/cloud.docx", b"cloud docx")
+        file_obj = File.objects.create(
+            title="cloud.docx", uploaded_by=self.owner, storage_provider="yandex_disk", yandex_path="disk:/cloud.docx"
+        )
+        with override_settings(YANDEX_DISK_API_BASE=fake.api_base, YANDEX_HTTP_BACKOFF=0):
+            response = self.client.get(reverse("file_manager:office_pdf_preview", args=[file_obj.id]))
+        self.assertEqual(response.status_code, 200)
+        file_obj.refresh_from_db()
+        self.assertEqual(file_obj.content_sha256, Rendition.objects.get().source_sha256)
+        self.assertEqual(prune_renditions(), 0)
+
+        file_obj.delete()
+        self.assertEqual(prune_renditions(), 1)
+
+
+def _make_pdf(pages):
+    from PIL import Image
+
+    images = [Image.new("RGB", (200, 280), (255, 255, 255 - index)) for index in range(pages)]
+    out = io.BytesIO()
+    images[0].save(out, "PDF", save_all=True, append_images=images[1:])
+    return out.getvalue()
+
+
+def _fake_rasterize(pdf_path, page, width):
+    from PIL import Image
+
+    out = io.BytesIO()
+    Image.new("RGB", (width, int(width * 1.4)), (page, page, page)).save(out, "PNG")
+    return out.getvalue()
+
+
+@override_settings(OFFICE_PDF_EAGER_RENDITIONS=True, JOB_QUEUE_EAGER=True, PDF_THUMBNAIL_PREFETCH_PAGES=2)
+class PdfPageRenditionTests(TestCase):
+    """pdftoppm / qpdf подменены: проверяется конвейер рендишнов, а не poppler."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.clear()
+        self._patch("file_manager.renditions.get_pdftoppm", return_value="/usr/bin/pdftoppm")
+        self._patch("file_manager.renditions.get_qpdf", return_value="/usr/bin/qpdf")
+        self.rasterize = self._patch("file_manager.renditions._rasterize_page", side_effect=_fake_rasterize)
+        self.linearize = self._patch("file_manager.renditions._linearize", side_effect=shutil.copyfile)
+
+        self.owner = User.objects.create_user(username="owner", password="pass")
+        self.client.force_login(self.owner)
+        blob = acquire_blob(_make_pdf(3), "slides.pdf")
+        self.file_obj = File(title="slides.pdf", uploaded_by=self.owner, storage_provider="local", content_blob=blob)
+        self.file_obj.file.name = blob.storage_path
+        self.file_obj.save()
+
+    def _patch(self, target, **kwargs):
+        patcher = mock.patch(target, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def test_manifest_and_page_images_are_cached(self):
+        manifest = self.client.get(reverse("file_manager:file_pdf_pages", args=[self.file_obj.id])).json()
+        self.assertEqual(manifest["pageCount"], 3)
+        self.assertIsNone(manifest["pdfUrl"])
+
+        url = reverse("file_manager:file_pdf_page", args=[self.file_obj.id, 2, "thumb"])
+        first = self.client.get(url)
+        self.assertEqual(first["Content-Type"], "image/webp")
+        body = b"".join(first.streaming_content)
+        self.assertEqual((body[:4], body[8:12]), (b"RIFF", b"WEBP"))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"]).status_code, 304)
+        self.client.get(url)
+        self.rasterize.assert_called_once()
+        self.assertEqual(self.rasterize.call_args.args[1:], (2, 200))
+
+        full = self.client.get(reverse("file_manager:file_pdf_page", args=[self.file_obj.id, 2, "full"]))
+        self.assertEqual(full.status_code, 200)
+        self.assertEqual(self.rasterize.call_args.args[1:], (2, 1200))
+
+    def test_legacy_local_pdf_is_hashed_once_and_renditions_kept(self):
+        from file_manager import renditions
+        from file_manager.renditions import prune_renditions
+        from file_manager.views import prerender_viewer_renditions
+
+        # Файл из времён до blob-хранилища: content_blob нет.
+        legacy = File.objects.create(
+            title="old.pdf", uploaded_by=self.owner, file=SimpleUploadedFile("old.pdf", _make_pdf(2))
+        )
+        with mock.patch("file_manager.renditions.file_sha256", wraps=renditions.file_sha256) as file_sha256:
+            for page in (1, 2, 1):
+                url = reverse("file_manager:file_pdf_page", args=[legacy.id, page, "thumb"])
+                self.assertEqual(self.client.get(url).status_code, 200)
+        file_sha256.assert_called_once()
+        legacy.refresh_from_db()
+        with open(legacy.file.path, "rb") as fh:
+            self.assertEqual(legacy.content_sha256, hashlib.sha256(fh.read()).hexdigest())
+
+        prerender_viewer_renditions(legacy)
+        manifest = self.client.get(reverse("file_manager:file_pdf_pages", args=[legacy.id])).json()
+        self.assertEqual(self.client.get(manifest["pdfUrl"]).status_code, 200)
+        self.assertEqual(prune_renditions(), 0)
+
+    def test_missing_page_is_404(self):
+        response = self.client.get(reverse("file_manager:file_pdf_page", args=[self.file_obj.id, 4, "thumb"]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_prerender_linearizes_and_fills_thumbnail_strip(self):
+        from file_manager.views import prerender_viewer_renditions
+
+        prerender_viewer_renditions(self.file_obj)
+        kinds = sorted(Rendition.objects.values_list("kind", "page"))
+        self.assertEqual(kinds, [("page", 1), ("page_thumb", 1), ("page_thumb", 2), ("pdf_linear", 0)])
+
+        manifest = self.client.get(reverse("file_manager:file_pdf_pages", args=[self.file_obj.id])).json()
+        linear = self.client.get(manifest["pdfUrl"], HTTP_RANGE="bytes=0-4")
+        self.assertEqual(linear.status_code, 206)
+        self.assertEqual(b"".join(linear.streaming_content), b"%PDF-")
+
+    def test_viewer_config_points_at_page_manifest(self):
+        response = self.client.get(reverse("file_manager:file_viewer", args=[self.file_obj.id]))
+        self.assertEqual(
+            response.context["viewer_config"]["pagesUrl"],
+            reverse("file_manager:file_pdf_pages", args=[self.file_obj.id]),
+        )
+
+    def test_pdf_tools_missing_disables_pages(self):
+        with mock.patch("file_manager.renditions.get_pdftoppm", return_value=None):
+            response = self.client.get(reverse("file_manager:file_pdf_pages", args=[self.file_obj.id]))
+        self.assertEqual(response.status_code, 404)
+
+
+def _make_image(size=(1600, 1200), fmt="JPEG", mode="RGB"):
+    from PIL import Image
+
+    out = io.BytesIO()
+    Image.new(mode, size, (200, 30, 30, 128)[: len(mode)]).save(out, fmt)
+    return out.getvalue()
+
+
+@override_settings(JOB_QUEUE_EAGER=True, THUMBNAIL_EAGER=True, THUMBNAIL_FORMAT="webp")
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.clear()
+        self.owner = User.objects.create_user(username="owner", password="pass")
+        self.client.force_login(self.owner)
+
+    def _image_size(self, data):
+        from PIL import Image
+
+        with Image.open(io.BytesIO(data)) as image:
+            return image.format, image.size
+
+    def test_presets_fit_or_crop(self):
+        from file_manager.thumbnails import make_thumbnail
+
+        self.assertEqual(self._image_size(make_thumbnail(_make_image(), "chat")), ("WEBP", (480, 360)))
+        self.assertEqual(self._image_size(make_thumbnail(_make_image(), "avatar")), ("WEBP", (128, 128)))
+        # Маленькие картинки не растягиваются.
+        self.assertEqual(self._image_size(make_thumbnail(_make_image((100, 50)), "chat"))[1], (100, 50))
+        with override_settings(THUMBNAIL_FORMAT="jpeg"):
+            png = _make_image((400, 400), "PNG", "RGBA")
+            self.assertEqual(self._image_size(make_thumbnail(png, "grid")), ("JPEG", (320, 320)))
+
+    def test_not_an_image_raises(self):
+        from file_manager.thumbnails import ThumbnailError, make_thumbnail
+
+        with self.assertRaises(ThumbnailError):
+            make_thumbnail(b"not an image", "chat")
+        with override_settings(THUMBNAIL_MAX_SOURCE_PIXELS=1000), self.assertRaises(ThumbnailError):
+            make_thumbnail(_make_image(), "chat")
+
+    def test_avatar_thumbnail_is_written_next_to_original(self):
+        from file_manager.thumbnails import sidecar_name
+
+        profile = self.owner.profile
+        profile.avatar.save("me.jpg", ContentFile(_make_image()))
+        target = sidecar_name(profile.avatar.name, "avatar")
+        self.assertTrue(target.startswith("avatars/me"))
+        self.assertTrue(target.endswith(".thumb-avatar-128x128.webp"))
+        self.assertTrue(default_storage.exists(target))
+
+        response = self.client.get(reverse("classroom_core:profile_view"))
+        self.assertContains(response, default_storage.url(target))
+
+    def test_lazy_thumbnail_link_generates_once(self):
+        from django.template import Context, Template
+
+        from file_manager.thumbnails import sidecar_name
+
+        name = default_storage.save("avatars/lazy.png", ContentFile(_make_image(fmt="PNG")))
+        fieldfile = self.owner.profile.avatar
+        fieldfile.name = name
+        url = Template('{% load thumbnails %}{{ f|thumbnail_url:"avatar" }}').render(Context({"f": fieldfile}))
+        self.assertIn("/thumbs/", url)
+
+        response = self.client.get(url)
+        target = sidecar_name(name, "avatar")
+        self.assertRedirects(response, default_storage.url(target), fetch_redirect_response=False)
+        self.assertTrue(default_storage.exists(target))
+        self.assertEqual(
+            Template('{% load thumbnails %}{{ f|thumbnail_url:"avatar" }}').render(Context({"f": fieldfile})),
+            default_storage.url(target),
+        )
+
+        tampered = url.replace("/thumbs/", "/thumbs/x")
+        self.assertEqual(self.client.get(tampered).status_code, 404)
+
+    def test_file_thumbnail_sets_has_preview_and_is_cached(self):
+        from file_manager.views import prerender_viewer_renditions
+
+        blob = acquire_blob(_make_image(), "photo.jpg")
+        file_obj = File(title="photo.jpg", uploaded_by=self.owner, storage_provider="local", content_blob=blob)
+        file_obj.file.name = blob.storage_path
+        file_obj.save()
+        self.assertFalse(file_obj.has_preview)
+
+        prerender_viewer_renditions(file_obj)
+        file_obj.refresh_from_db()
+        self.assertTrue(file_obj.has_preview)
+        self.assertEqual(Rendition.objects.get().kind, "image_thumb")
+
+        url = reverse("file_manager:file_thumbnail", args=[file_obj.id])
+        first = self.client.get(url)
+        self.assertEqual(first["Content-Type"], "image/webp")
+        self.assertEqual(self._image_size(b"".join(first.streaming_content)), ("WEBP", (320, 240)))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"]).status_code, 304)
+        self.assertContains(self.client.get(reverse("file_manager:file_list")), url)
+
+        stranger = User.objects.create_user(username="stranger", password="pass")
+        self.client.force_login(stranger)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_chat_image_gets_thumbnail_and_gc_removes_it(self):
+        from chat_manager.models import ChatRoom
+        from file_manager.thumbnails import sidecar_name
+
+        peer = User.objects.create_user(username="peer", password="pass")
+        room = ChatRoom.get_or_create_private_chat(self.owner, peer)
+        response = self.client.post(
+            reverse("chat_manager:upload_file", args=[room.id]),
+            {"file_attachment": SimpleUploadedFile("pic.jpg", _make_image(), content_type="image/jpeg")},
+        )
+        data = response.json()
+        blob_path = ContentBlob.objects.get().storage_path
+        target = sidecar_name(blob_path, "chat")
+        self.assertTrue(default_storage.exists(target))
+        self.assertEqual(data["thumb_url"], default_storage.url(target))
+
+        room.messages.all().delete()
+        ContentBlob.objects.update(last_referenced_at=timezone.now() - timedelta(days=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            collect_garbage()
+        self.assertFalse(default_storage.exists(blob_path))
+        self.assertFalse(default_storage.exists(target))
+
+
+class _FakeClamd:
+    """clamd в потоке на Unix-сокете: IDSESSION, INSTREAM, VERSION, END. «Вирус» — байты EICAR-TEST."""
+
+    def __init__(self, path, *, version="ClamAV 1.0.5/27400/Fri Oct 16 08:00:00 2026", close_after=0):
+        self.version = version
+        self.close_after = close_after
+        self.connections = 0
+        self.chunks = 0
+        self.scans = 0
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen(8)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self.server.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        buffer = bytearray()
+
+        def read(n):
+            while len(buffer) < n:
+                data = conn.recv(65536)
+                if not data:
+                    raise EOFError
+                buffer.extend(data)
+            out = bytes(buffer[:n])
+            del buffer[:n]
+            return out
+
+        def read_command():
+            while b"\0" not in buffer:
+                data = conn.recv(65536)
+                if not data:
+                    raise EOFError
+                buffer.extend(data)
+            end = buffer.index(b"\0")
+            out = bytes(buffer[:end])
+            del buffer[: end + 1]
+            return out
+
+        session, request_id = False, 0
+        with conn:
+            try:
+                while True:
+                    command = read_command()
+                    if command == b"zIDSESSION":
+                        session = True
+                        continue
+                    if command == b"zEND":
+                        return
+                    request_id += 1
+                    prefix = f"{request_id}: " if session else ""
+                    if command == b"zVERSION":
+                        reply = self.version
+                    else:
+                        self.scans += 1
+                        data = bytearray()
+                        while length := int.from_bytes(read(4), "big"):
+                            data.extend(read(length))
+                            self.chunks += 1
+                        reply = "stream: Eicar-Test-Signature FOUND" if b"EICAR-TEST" in data else "stream: OK"
+                    conn.sendall(f"{prefix}{reply}\0".encode())
+                    if self.close_after and request_id >= self.close_after:
+                        return
+            except (EOFError, OSError):
+                return
+
+
+class ClamavStreamingTests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.socket_path = os.path.join(self.tmpdir, "clamd.sock")
+        override = override_settings(
+            CLAMAV_ENABLED=True,
+            CLAMAV_FAIL_OPEN=False,
+            CLAMAV_USE_TCP=False,
+            CLAMAV_SOCKET_PATH=self.socket_path,
+            CLAMAV_VERDICT_CACHE=False,
+            MEDIA_ROOT=self.tmpdir,
+            JOB_QUEUE_EAGER=True,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def _start(self, **kwargs):
+        clamd = _FakeClamd(self.socket_path, **kwargs)
+        self.addCleanup(clamd.close)
+        return clamd
+
+    def test_streams_chunks_over_one_pooled_session(self):
+        clamd = self._start()
+        path = os.path.join(self.tmpdir, "big.bin")
+        with open(path, "wb") as fh:
+            fh.write(b"x" * (200 * 1024))
+        self.assertTrue(scan_upload(path)["clean"])
+        self.assertTrue(scan_upload(SimpleUploadedFile("notes.txt", b"fine"))["clean"])
+        infected = scan_upload(b"header EICAR-TEST trailer")
+        self.assertEqual((infected["clean"], infected["threat"]), (False, "Eicar-Test-Signature"))
+
+        self.assertEqual(clamd.connections, 1)
+        # 200 КиБ ушли кусками по CHUNK_SIZE, а не одним буфером.
+        self.assertGreaterEqual(clamd.chunks, 4)
+
+    def test_reconnects_when_clamd_closed_idle_session(self):
+        clamd = self._start(close_after=1)
+        self.assertTrue(scan_upload(b"one")["clean"])
+        self.assertTrue(scan_upload(SimpleUploadedFile("two.txt", b"two"))["clean"])
+        self.assertEqual(clamd.connections, 2)
+
+    def test_concurrency_cap_reports_busy(self):
+        self._start()
+        with override_settings(CLAMAV_MAX_CONCURRENT_SCANS=1, CLAMAV_QUEUE_TIMEOUT=0):
+            pool = get_clamd_pool()
+            pool._slots.acquire()
+            try:
+                scan = scan_upload(b"data")
+            finally:
+                pool._slots.release()
+            self.assertEqual((scan["performed"], scan["skipped"]), (False, "busy"))
+            self.assertTrue(scan_upload(b"data")["clean"])
+
+    def test_daemon_down_rejects_when_fail_closed(self):
+        scan = scan_upload(b"data")
+        self.assertEqual((scan["performed"], scan["skipped"]), (False, "daemon"))
+        user = User.objects.create_user(username="owner", password="pass")
+        file_obj, err, _ = create_user_uploaded_file(user, SimpleUploadedFile("a.txt", b"data"))
+        self.assertIsNone(file_obj)
+        self.assertIn("ClamAV", err)
+
+    def test_upload_is_scanned_from_file_and_stored_whole(self):
+        self._start()
+        user = User.objects.create_user(username="owner", password="pass")
+        file_obj, err, scan = create_user_uploaded_file(user, SimpleUploadedFile("a.txt", b"lecture " * 1000))
+        self.assertIsNone(err)
+        self.assertTrue(scan["clean"])
+        with file_obj.file.open("rb") as fh:
+            self.assertEqual(fh.read(), b"lecture " * 1000)
+
+        file_obj, err, _ = create_user_uploaded_file(user, SimpleUploadedFile("b.txt", b"EICAR-TEST"))
+        self.assertIsNone(file_obj)
+        self.assertIn("Eicar-Test-Signature", err)
+
+
+class ClamavVerdictCacheTests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.socket_path = os.path.join(self.tmpdir, "clamd.sock")
+        override = override_settings(
+            CLAMAV_ENABLED=True,
+            CLAMAV_USE_TCP=False,
+            CLAMAV_SOCKET_PATH=self.socket_path,
+            CLAMAV_VERDICT_CACHE=True,
+            CLAMAV_VERSION_CHECK_INTERVAL=0,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.clear()
+
+    def _start(self):
+        clamd = _FakeClamd(self.socket_path)
+        self.addCleanup(clamd.close)
+        return clamd
+
+    def test_identical_content_is_scanned_once_per_signature_version(self):
+        clamd = self._start()
+        for _ in range(3):
+            scan = scan_upload(SimpleUploadedFile("lecture.pdf", b"same lecture"))
+            self.assertTrue(scan["clean"])
+        self.assertEqual(clamd.scans, 1)
+        self.assertTrue(scan["cached"])
+
+        clamd.version = "ClamAV 1.0.5/27401/Sat Oct 17 08:00:00 2026"
+        self.assertFalse(scan_upload(b"same lecture")["cached"])
+        self.assertEqual(clamd.scans, 2)
+
+    def test_infected_verdict_survives_signature_update_and_daemon_outage(self):
+        clamd = self._start()
+        self.assertFalse(scan_upload(b"EICAR-TEST")["clean"])
+        clamd.version = "ClamAV 1.0.5/27401/Sat Oct 17 08:00:00 2026"
+        self.assertFalse(scan_upload(b"EICAR-TEST")["clean"])
+        self.assertEqual(clamd.scans, 1)
+
+        clamd.close()
+        os.unlink(self.socket_path)
+        get_clamd_pool().close()
+        scan = scan_upload(b"EICAR-TEST")
+        self.assertEqual((scan["clean"], scan["threat"], scan["cached"]), (False, "Eicar-Test-Signature", True))
+
+    def test_hit_rate_is_logged(self):
+        self._start()
+        scan_upload(b"notes")
+        with self.assertLogs("file_manager.clamav", "INFO") as logs:
+            scan_upload(b"notes")
+        self.assertIn("cache=hit", logs.output[-1])
+        self.assertIn("cache_hit_rate=", logs.output[-1])
+
+
+class ClamavQuarantineTests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.socket_path = os.path.join(self.tmpdir, "clamd.sock")
+        override = override_settings(
+            CLAMAV_ENABLED=True,
+            CLAMAV_QUARANTINE=True,
+            CLAMAV_USE_TCP=False,
+            CLAMAV_SOCKET_PATH=self.socket_path,
+            CLAMAV_VERDICT_CACHE=True,
+            CLAMAV_VERSION_CHECK_INTERVAL=0,
+            MEDIA_ROOT=self.tmpdir,
+            JOB_QUEUE_BACKEND="database",
+            JOB_QUEUE_EAGER=False,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.clear()
+        self.user = User.objects.create_user(username="owner", password="pass")
+        self.client.force_login(self.user)
+
+    def _start(self):
+        clamd = _FakeClamd(self.socket_path)
+        self.addCleanup(clamd.close)
+        return clamd
+
+    def _upload(self, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            file_obj, err, scan = create_user_uploaded_file(self.user, SimpleUploadedFile("notes.txt", content))
+        self.assertIsNone(err)
+        self.assertEqual(scan["skipped"], "quarantine")
+        return file_obj
+
+    def _work_off(self):
+        backend = get_backend()
+        while (job_obj := backend.reserve(0)) is not None:
+            run_job(job_obj, backend)
+
+    def test_upload_is_released_only_after_background_scan(self):
+        clamd = self._start()
+        file_obj = self._upload(b"lecture notes " * 100)
+        self.assertEqual(file_obj.processing_state, "quarantine")
+        self.assertEqual(clamd.scans, 0)
+        self.assertEqual(BackgroundJob.objects.get().name, "file.scan_upload")
+        download_url = reverse("file_manager:file_download", args=[file_obj.id])
+        self.assertEqual(self.client.get(download_url).status_code, 403)
+
+        self._work_off()
+        file_obj.refresh_from_db()
+        self.assertEqual(file_obj.processing_state, "ready")
+        self.assertTrue(file_obj.versions.exists())
+        self.assertEqual(clamd.scans, 1)
+        self.assertEqual(self.client.get(download_url).status_code, 200)
+
+    def test_infected_upload_is_rejected_and_content_dropped(self):
+        self._start()
+        file_obj = self._upload(b"EICAR-TEST")
+        self._work_off()
+        file_obj.refresh_from_db()
+        self.assertEqual(file_obj.processing_state, "rejected")
+        self.assertIn("Eicar-Test-Signature", file_obj.processing_error)
+        self.assertFalse(file_obj.file)
+        self.assertEqual(ContentBlob.objects.get().ref_count, 0)
+
+    def test_file_stays_quarantined_while_clamd_is_down(self):
+        file_obj = self._upload(b"lecture notes")
+        self._work_off()
+        file_obj.refresh_from_db()
+        self.assertEqual(file_obj.processing_state, "quarantine")
+        self.assertEqual(BackgroundJob.objects.get().attempts, 1)
+
+    def test_rescan_blocks_stored_content_matching_new_signatures(self):
+        clamd = self._start()
+        clean = File.objects.create(title="clean.txt", uploaded_by=self.user, file_size=5)
+        infected = File.objects.create(title="old.txt", uploaded_by=self.user, file_size=10)
+        for file_obj, content in ((clean, b"clean"), (infected, b"EICAR-TEST")):
+            blob = acquire_blob(content, file_obj.title)
+            file_obj.content_blob = blob
+            file_obj.file.name = blob.storage_path
+            file_obj.save()
+
+        out = io.StringIO()
+        call_command("rescan_media", stdout=out)
+        self.assertIn("угроз: 1", out.getvalue())
+        infected.refresh_from_db()
+        clean.refresh_from_db()
+        self.assertEqual((clean.processing_state, infected.processing_state), ("ready", "rejected"))
+        # Содержимое остаётся для разбора, но не отдаётся.
+        self.assertTrue(default_storage.exists(infected.file.name))
+        response = self.client.get(reverse("file_manager:file_download", args=[infected.id]))
+        self.assertEqual(response.status_code, 404)
+
+        # Без новых сигнатур повторный проход берёт вердикты из кэша.
+        call_command("rescan_media", stdout=io.StringIO())
+        self.assertEqual(clamd.scans, 2)
+
+    def test_unscanned_and_infected_versions_are_not_served(self):
+        self._start()
+        file_obj = self._upload(b"lecture notes " * 100)
+        self._work_off()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("file_manager:file_version_create", args=[file_obj.id]),
+                {"version_file": SimpleUploadedFile("notes.txt", b"EICAR-TEST"), "change_description": "v2"},
+            )
+        self.assertEqual(response.status_code, 302)
+        file_obj.refresh_from_db()
+        latest = file_obj.versions.get(version_number=file_obj.version)
+        preview_url = reverse("file_manager:file_version_preview", args=[file_obj.id, latest.id])
+        self.assertEqual(self.client.get(preview_url).status_code, 403)
+
+        self._work_off()
+        file_obj.refresh_from_db()
+        latest.refresh_from_db()
+        self.assertEqual(file_obj.processing_state, "rejected")
+        self.assertTrue(latest.content_blocked)
+        self.assertIsNone(latest.content_blob_id)
+        self.assertEqual(self.client.get(preview_url).status_code, 404)
+        self.assertFalse(file_obj.versions.exclude(pk=latest.pk).filter(content_blocked=True).exists())
+        infected_blob = ContentBlob.objects.get(sha256=latest.blob_sha256)
+        self.assertEqual(infected_blob.ref_count, 0)
+
+    def test_rescan_blocks_versions_of_infected_blob(self):
+        self._start()
+        file_obj = File.objects.create(title="notes.txt", uploaded_by=self.user, file_size=5, version=2)
+        current = acquire_blob(b"clean", file_obj.title)
+        file_obj.content_blob = current
+        file_obj.file.name = current.storage_path
+        file_obj.save()
+        old_blob = acquire_blob(b"EICAR-TEST", "notes.txt")
+        old = FileVersion.objects.create(
+            file=file_obj,
+            version_number=1,
+            has_blob=True,
+            blob_storage_provider="local",
+            blob_storage_path=old_blob.storage_path,
+            blob_sha256=old_blob.sha256,
+            content_blob=old_blob,
+        )
+        call_command("rescan_media", stdout=io.StringIO())
+        old.refresh_from_db()
+        file_obj.refresh_from_db()
+        self.assertTrue(old.content_blocked)
+        self.assertEqual(file_obj.processing_state, "ready")
+        preview_url = reverse("file_manager:file_version_preview", args=[file_obj.id, old.id])
+        self.assertEqual(self.client.get(preview_url).status_code, 404)
+
+
+class WordFilterTests(TestCase):
+    ENTRIES = ["кот", "кот-бегемот", "бля", "блядки", "плохая фраза", "Фраза целиком"]
+
+    def setUp(self):
+        self.matcher = BannedWordMatcher(self.ENTRIES)
+
+    def test_matches_previous_per_entry_implementation(self):
+        texts = [
+            "", "обычный конспект", "Кот пришёл.", "котик", "скот", "кот-бегемот!", "это ПЛОХАЯ ФРАЗАтекст",
+            "блядки и кот", "x_кот", "(бля)", "фраза Целиком", "плохая  фраза",
+        ]
+        for text in texts:
+            with self.subTest(text=text):
+                self.assertEqual(self.matcher.find(text), legacy_find_banned_match(text, self.ENTRIES))
+
+    def test_chunks_split_inside_words_and_phrases(self):
+        cases = [
+            (["пушистый ко", "т."], "кот"),
+            (["ко", "тик"], None),
+            (["пло", "хая фр", "аза"], "плохая фраза"),
+            (["сло", "во ", "бля", ""], "бля"),
+            (["бля", "дки"], "блядки"),
+        ]
+        for chunks, expected in cases:
+            with self.subTest(chunks=chunks):
+                self.assertEqual(self.matcher.scan(chunks), expected)
+                self.assertEqual(self.matcher.find("".join(chunks)), expected)
+
+    def test_word_boundary_context_on_chunk_edge(self):
+        # После первого куска хвост (max_length + 1 символ) начинается ровно с «кот» внутри «скот».
+        tail = "кот ".ljust(self.matcher.max_length + 1, "z")
+        chunks = ["ааас" + tail, " дальше"]
+        self.assertIsNone(self.matcher.find("".join(chunks)))
+        self.assertIsNone(self.matcher.scan(chunks))
+
+        stream = self.matcher.stream()
+        self.assertEqual(stream.feed("тут кот "), "кот")
+        self.assertIsNone(stream.feed("и всё"))
+        self.assertIsNone(stream.finish())
+
+    def test_scan_stops_at_first_hit(self):
+        consumed = []
+
+        def pages():
+            for page in ["чистая страница", "тут бля!", "дальше не читается"]:
+                consumed.append(page)
+                yield page
+
+        self.assertEqual(self.matcher.scan(pages()), "бля")
+        self.assertEqual(len(consumed), 2)
+
+    @override_settings(TEXT_EXTRACTION_WORKERS=0, TEXT_EXTRACTION_CACHE_TTL=0)
+    def test_extraction_stops_on_banned_page(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        path = os.path.join(tmpdir, "lecture.txt")
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.write("введение " + "бля " + "x" * (600 * 1024))
+        result = extract_text(path, matcher=self.matcher)
+        self.assertEqual(result.banned, "бля")
+        # Прочитан только первый блок TXT (256 КиБ), а не весь файл.
+        self.assertLess(len(result.text), 300 * 1024)
+        self.assertEqual(extract_text(path).banned, "")
+
+    @override_settings(TEXT_EXTRACTION_WORKERS=0, TEXT_EXTRACTION_CACHE_TTL=0)
+    def test_upload_check_ignores_word_split_by_block_edge(self):
+        # «скот» на границе блоков TXT: хвост первого блока начинается с «кот» посреди слова.
+        tail = "кот ".ljust(self.matcher.max_length + 1, "z")
+        text = "a" * (256 * 1024 - len(tail) - 1) + "с" + tail + " и дальше"
+        with mock.patch("file_manager.views.get_banned_matcher", return_value=self.matcher):
+            extracted, banned = extract_and_moderate("farm.txt", text.encode("utf-8"))
+        self.assertIsNone(banned)
+        self.assertEqual(extracted, text)
+
+    def test_matcher_is_rebuilt_when_words_file_changes(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        path = os.path.join(tmpdir, "words.txt")
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.write("первое # комментарий\n\n")
+        with mock.patch("file_manager.wordfilter.finders.find", return_value=path):
+            self.assertEqual(find_banned_match("Первое слово"), "первое")
+            self.assertIs(get_banned_matcher(), get_banned_matcher())
+            with open(path, "w", encoding="utf-8") as fh:
+                fh.write("второе\n")
+            os.utime(path, (time.time() + 10, time.time() + 10))
+            self.assertIsNone(find_banned_match("Первое слово"))
+            self.assertEqual(find_banned_match_in_chunks(["вто", "рое"]), "второе")
+
+
+@override_settings(ACTIVITY_LOG_BUFFER_SIZE=3, ACTIVITY_LOG_FLUSH_INTERVAL=3600, ACTIVITY_LOG_VIA_QUEUE=False)
+class ActivityLogBufferTests(TestCase):
+    def log(self, file_obj, activity_type):
+        with self.captureOnCommitCallbacks(execute=True):
+            FileActivity.log_activity(file=file_obj, user=self.user, activity_type=activity_type)
+
+    def setUp(self):
+        self.addCleanup(activity_log.flush)
+        self.user = User.objects.create_user(username="owner", password="pass")
+        self.file = File.objects.create(title="lecture.pdf", uploaded_by=self.user)
+
+    def test_events_are_written_in_batches_with_event_time(self):
+        self.log(self.file, "view")
+        first_logged = timezone.now()
+        self.log(self.file, "view")
+        self.assertFalse(FileActivity.objects.exists())
+        with self.assertNumQueries(3):  # проверка файлов и пользователей, один INSERT всей пачки
+            self.log(self.file, "download")
+        self.assertEqual(FileActivity.objects.count(), 3)
+        self.assertLessEqual(FileActivity.objects.order_by("created_at").first().created_at, first_logged)
+
+    def test_pending_events_of_deleted_file_keep_null_reference(self):
+        self.log(self.file, "view")
+        self.file.delete()
+        self.log(None, "delete")
+        self.assertEqual(activity_log.flush(), 2)
+        self.assertEqual(FileActivity.objects.filter(file__isnull=True).count(), 2)
+
+    def test_flush_through_job_queue(self):
+        with override_settings(ACTIVITY_LOG_VIA_QUEUE=True, JOB_QUEUE_EAGER=True):
+            self.log(self.file, "view")
+            activity_log.flush()
+        self.assertEqual(FileActivity.objects.get().activity_type, "view")
+
+    def test_download_counter_is_incremented_in_database(self):
+        stale = File.objects.get(pk=self.file.pk)
+        self.file.increment_download()
+        stale.increment_download()
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.download_count, 2)
+
+
+class ActivityRetentionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="owner", password="pass")
+        self.file = File.objects.create(title="lecture.pdf", uploaded_by=self.user)
+        # Полдень: строки одного «дня» в тестах не переходят через полночь.
+        self.now = timezone.localtime().replace(hour=12, minute=0, second=0, microsecond=0)
+
+    def add(self, days_ago, activity_type="view", count=1, seconds=0):
+        FileActivity.objects.bulk_create(
+            FileActivity(
+                file=self.file,
+                user=self.user,
+                activity_type=activity_type,
+                created_at=self.now - timedelta(days=days_ago, seconds=seconds + i),
+            )
+            for i in range(count)
+        )
+
+    def test_old_rows_are_rolled_up_per_day(self):
+        self.add(200, "view", count=3)
+        self.add(200, "download", count=2)
+        self.add(250, "view")
+        self.add(1, "view")
+        report = rollup_activity(days=180)
+        self.assertEqual(report, {"days": 2, "rows": 6, "groups": 3})
+        self.assertEqual(FileActivity.objects.count(), 1)
+        counts = {
+            (r.day, r.activity_type): r.count for r in FileActivityDailyRollup.objects.all()
+        }
+        day = timezone.localtime(self.now - timedelta(days=200)).date()
+        self.assertEqual(counts[(day, "view")], 3)
+        self.assertEqual(counts[(day, "download")], 2)
+
+    def test_rolled_up_rows_move_to_archive(self):
+        self.add(200, "download", count=2)
+        self.add(1, "view")
+        old_ids = set(FileActivity.objects.filter(activity_type="download").values_list("id", flat=True))
+        rollup_activity(days=180, dry_run=True)
+        self.assertFalse(FileActivityArchive.objects.exists())
+        rollup_activity(days=180)
+        archived = FileActivityArchive.objects.all()
+        self.assertEqual({a.original_id for a in archived}, old_ids)
+        self.assertEqual({(a.file_id, a.user_id, a.activity_type) for a in archived}, {(self.file.id, self.user.id, "download")})
+        # Архив без внешних ключей: удаление файла его не трогает.
+        self.file.delete()
+        self.assertEqual(FileActivityArchive.objects.count(), 2)
+
+        FileActivity.objects.create(
+            user=self.user, activity_type="view", created_at=self.now - timedelta(days=200)
+        )
+        with override_settings(ACTIVITY_LOG_ARCHIVE=False):
+            rollup_activity(days=180)
+        self.assertEqual(FileActivityArchive.objects.count(), 2)
+
+    def test_rerun_adds_to_existing_rollup_and_dry_run_changes_nothing(self):
+        self.add(200, "view", count=2)
+        rollup_activity(days=180)
+        self.add(200, "view", count=1, seconds=10)
+        self.assertEqual(rollup_activity(days=180, dry_run=True)["rows"], 1)
+        self.assertEqual(FileActivity.objects.count(), 1)
+        rollup_activity(days=180)
+        self.assertEqual(FileActivityDailyRollup.objects.get().count, 3)
+        self.assertFalse(FileActivity.objects.exists())
+
+    def test_keyset_pages_walk_both_directions(self):
+        # Одинаковое время у всех строк: порядок держится на id.
+        FileActivity.objects.bulk_create(
+            FileActivity(file=self.file, user=self.user, activity_type="view", created_at=self.now)
+            for _ in range(5)
+        )
+        self.add(1, count=2)
+        ids = list(FileActivity.objects.order_by("-created_at", "-id").values_list("id", flat=True))
+        qs = FileActivity.objects.all()
+        first = keyset_page(qs, per_page=3)
+        self.assertEqual([a.id for a in first], ids[:3])
+        self.assertFalse(first.has_previous)
+        second = keyset_page(qs, before=first.next_cursor, per_page=3)
+        third = keyset_page(qs, before=second.next_cursor, per_page=3)
+        self.assertEqual([a.id for a in second], ids[3:6])
+        self.assertEqual([a.id for a in third], ids[6:])
+        self.assertFalse(third.has_next)
+        back = keyset_page(qs, after=third.previous_cursor, per_page=3)
+        self.assertEqual([a.id for a in back], ids[3:6])
+        self.assertTrue(back.has_previous)
+        self.assertEqual([a.id for a in keyset_page(qs, after=back.previous_cursor, per_page=3)], ids[:3])
+
+    def test_stale_cursors_do_not_break_pages(self):
+        self.add(1, count=3)
+        qs = FileActivity.objects.all()
+        newest = FileActivity.objects.order_by("-created_at", "-id").first()
+        # Ничего новее курсора after нет — первая страница, а не пустая с «дальше».
+        page = keyset_page(qs, after=encode_cursor(newest), per_page=2)
+        self.assertEqual(len(page), 2)
+        self.assertFalse(page.has_previous)
+        self.assertTrue(page.has_next)
+        # Ничего старше курсора before нет — пустая страница без курсоров.
+        oldest = FileActivity.objects.order_by("created_at", "id").first()
+        empty = keyset_page(qs, before=encode_cursor(oldest), per_page=2)
+        self.assertEqual(len(empty), 0)
+        self.assertEqual((empty.next_cursor, empty.previous_cursor), ("", ""))
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("file_manager:activity_log"), {"after": encode_cursor(newest)})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse("file_manager:activity_log"), {"before": encode_cursor(oldest)})
+        self.assertEqual(response.status_code, 200)
+
+    def test_activity_log_view_uses_cursor_links(self):
+        self.add(0, count=25)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("file_manager:activity_log"))
+        page = response.context["page_obj"]
+        self.assertEqual(len(page), 20)
+        self.assertContains(response, f"?before={page.next_cursor}")
+        response = self.client.get(reverse("file_manager:activity_log"), {"before": page.next_cursor})
+        self.assertEqual(len(response.context["page_obj"]), 5)
+        self.assertFalse(response.context["page_obj"].has_next)
+
+
+class StreamingZipTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+
+    def make(self, name, content):
+        path = os.path.join(self.tmp, name)
+        with open(path, "wb") as fh:
+            fh.write(content)
+        return path
+
+    def test_stored_or_deflated_by_type_and_remote_entries_prefetched(self):
+        import zipfile
+
+        text = self.make("notes.txt", b"lorem ipsum " * 1000)
+        photo = self.make("photo.jpg", os.urandom(5000))
+        fetched = []
+
+        def fetch(content):
+            def run():
+                path = self.make(f"remote-{len(fetched)}.bin", content)
+                fetched.append(path)
+                return path
+            return run
+
+        def broken():
+            raise RuntimeError("нет связи")
+
+        entries = [
+            ZipEntry("notes.txt", path=text),
+            ZipEntry("cloud.txt", fetch=fetch(b"from the cloud")),
+            ZipEntry("lost.txt", fetch=broken),
+            ZipEntry("photo.jpg", path=photo),
+        ]
+        body = b"".join(stream_zip(entries, chunk_size=1024, prefetch=2))
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            self.assertEqual(archive.namelist(), ["notes.txt", "cloud.txt", "photo.jpg"])
+            self.assertEqual(archive.getinfo("notes.txt").compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(archive.getinfo("photo.jpg").compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(archive.read("cloud.txt"), b"from the cloud")
+            self.assertIsNone(archive.testzip())
+        self.assertFalse(any(os.path.exists(path) for path in fetched))
+
+    def test_cached_entries_survive_eviction_and_missing_ones_are_downloaded(self):
+        import zipfile
+
+        from file_manager.views import _archive_fetch
+
+        cached = self.make("cached.bin", b"from the cache")
+        downloaded = self.make("downloaded.bin", b"from the disk")
+        engine = mock.Mock(**{"download_to_tempfile.return_value": downloaded})
+        with mock.patch("file_manager.views.get_engine", return_value=engine), \
+                mock.patch("file_manager.views.content_cache.lookup", side_effect=[cached, cached]) as lookup:
+            entries = [
+                ZipEntry("a.txt", fetch=lambda: _archive_fetch("token", "disk:/a.txt")),
+                ZipEntry("b.txt", fetch=lambda: _archive_fetch("token", "disk:/b.txt")),
+            ]
+            chunks = stream_zip(entries, prefetch=1)
+            # Поиск в кэше — в пуле при подготовке записи, а не до начала ответа.
+            self.assertEqual(lookup.call_count, 0)
+            body = next(chunks)
+            # Первая запись открыта; вытеснение её файла архиву уже не мешает,
+            # а вторая запись к этому моменту не найдена в кэше и скачивается с Диска.
+            os.unlink(cached)
+            body += b"".join(chunks)
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            self.assertEqual(archive.read("a.txt"), b"from the cache")
+            self.assertEqual(archive.read("b.txt"), b"from the disk")
+        engine.download_to_tempfile.assert_called_once_with("token", "disk:/b.txt", suffix="")
+        self.assertFalse(os.path.exists(downloaded))
+
+    def test_first_block_is_sent_before_archive_is_complete(self):
+        big = self.make("big.bin", os.urandom(64 * 1024))
+        chunks = stream_zip([ZipEntry("a.bin", path=big), ZipEntry("b.bin", path=big)], chunk_size=4096)
+        first = next(chunks)
+        self.assertTrue(first.startswith(b"PK\x03\x04"))
+        self.assertLess(len(first), 16 * 1024)
+        chunks.close()
+
+    def test_zip64_records_past_limit(self):
+        import zipfile
+
+        payload = os.urandom(4096)
+        path = self.make("data.bin", payload)
+        # Порог ZIP64 понижен, чтобы не писать в тесте файлы по 4 ГБ.
+        with mock.patch.object(zipfile, "ZIP64_LIMIT", 1024):
+            body = b"".join(stream_zip([ZipEntry("one.bin", path=path), ZipEntry("two.bin", path=path)]))
+        self.assertIn(b"PK\x06\x06", body)  # конец центрального каталога ZIP64
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            self.assertEqual(archive.read("two.bin"), payload)
+
+    def test_archive_view_streams_without_length(self):
+        import zipfile
+
+        owner = User.objects.create_user(username="owner", password="pass")
+        self.client.force_login(owner)
+        with override_settings(MEDIA_ROOT=self.tmp):
+            File.objects.create(
+                title="notes.txt", uploaded_by=owner, file=SimpleUploadedFile("notes.txt", b"hello")
+            )
+            response = self.client.get(reverse("file_manager:download_all_files_archive"))
+            body = b"".join(response.streaming_content)
+        self.assertNotIn("Content-Length", response)
+        self.assertIn("portfolio_files.zip", response["Content-Disposition"])
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            self.assertEqual(archive.read("notes.txt"), b"hello")
@@ -0,0 +1,205 @@
+"""
+Миниатюры изображений фиксированных размеров (пресеты THUMBNAIL_PRESETS).
+
+Раньше аватары, обложки курсов и картинки в чате отдавались в списках в исходном
+разрешении, а utils.generate_preview нигде не вызывался (модуль его заменил). Теперь:
+  - для полей ImageField/FileField в MEDIA (аватар, обложка, вложение чата) миниатюра
+    лежит рядом с оригиналом: avatars/me.jpg -> avatars/me.thumb-avatar-128x128.webp.
+    Размер входит в имя, поэтому смена пресета даёт новый файл, а не устаревший кэш;
+  - миниатюры готовит фоновая задача media.thumbnails сразу после сохранения
+    (THUMBNAIL_EAGER), а если файла ещё нет, фильтр шаблона thumbnail_url отдаёт
+    подписанную ссылку media_thumbnail, которая создаёт миниатюру при первом запросе;
+  - для File превью — рендишн image_thumb (renditions.render_image_thumbnail), его отдаёт
+    file_thumbnail с проверкой доступа, а File.has_preview показывает, что превью есть;
+  - JPEG декодируется в уменьшенном масштабе (Image.draft), ориентация берётся из EXIF,
+    слишком большие исходники (THUMBNAIL_MAX_SOURCE_PIXELS) не открываются.
+"""
+from __future__ import annotations
+
+import io
+import logging
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.urls import reverse
+
+logger = logging.getLogger(__name__)
+
+# Имя -> (ширина, высота, обрезать до точного размера). Без обрезки картинка вписывается в рамку.
+DEFAULT_PRESETS = {
+    "avatar": (128, 128, True),
+    "cover": (1280, 480, True),
+    "icon": (96, 96, True),
+    "chat": (480, 480, False),
+    "grid": (320, 320, False),
+}
+IMAGE_EXTENSIONS = frozenset({"jpg", "jpeg", "png", "gif", "webp", "bmp"})
+FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+}
+THUMBNAIL_PIPELINE_VERSION = "pillow-1"
+SIDECAR_MARKER = ".thumb-"
+SIGNING_SALT = "file_manager.thumbnails"
+
+
+class ThumbnailError(Exception):
+    """Исходник не удалось прочитать как изображение."""
+
+
+def presets() -> dict[str, tuple[int, int, bool]]:
+    return {**DEFAULT_PRESETS, **(getattr(settings, "THUMBNAIL_PRESETS", None) or {})}
+
+
+def get_preset(name: str) -> tuple[int, int, bool]:
+    try:
+        return presets()[name]
+    except KeyError:
+        raise ValueError(f"Неизвестный пресет миниатюры: {name}") from None
+
+
+def thumbnail_format() -> str:
+    fmt = str(getattr(settings, "THUMBNAIL_FORMAT", "webp") or "webp").lower()
+    return fmt if fmt in FORMATS else "webp"
+
+
+def thumbnail_content_type() -> str:
+    return FORMATS[thumbnail_format()][1]
+
+
+def pipeline_version(preset: str) -> str:
+    """Ключ версии для рендишнов: формат, качество и размеры пресета."""
+    width, height, crop = get_preset(preset)
+    quality = int(getattr(settings, "THUMBNAIL_QUALITY", 80) or 80)
+    mode = "c" if crop else ""
+    return f"{THUMBNAIL_PIPELINE_VERSION}:{thumbnail_format()}:{quality}:{width}x{height}{mode}"
+
+
+def is_image_name(name: str | None) -> bool:
+    return PurePosixPath(name or "").suffix.lower().lstrip(".") in IMAGE_EXTENSIONS
+
+
+def make_thumbnail(source, preset: str) -> bytes:
+    """Байты миниатюры пресета preset; source — bytes или открытый бинарный файл."""
+    from PIL import Image, ImageOps
+
+    width, height, crop = get_preset(preset)
+    fmt = thumbnail_format()
+    pil_format = FORMATS[fmt][0]
+    quality = int(getattr(settings, "THUMBNAIL_QUALITY", 80) or 80)
+    max_pixels = int(getattr(settings, "THUMBNAIL_MAX_SOURCE_PIXELS", 50_000_000) or 0)
+    stream = io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source
+    try:
+        with Image.open(stream) as image:
+            if max_pixels and image.width * image.height > max_pixels:
+                raise ThumbnailError(f"Изображение {image.width}x{image.height} слишком большое")
+            # JPEG декодируется сразу в уменьшенном масштабе (1/2…1/8), без полного растра.
+            image.draft("RGB", (width, height))
+            image = ImageOps.exif_transpose(image)
+            has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+            if has_alpha and pil_format == "WEBP":
+                image = image.convert("RGBA")
+            elif has_alpha:
+                rgba = image.convert("RGBA")
+                image = Image.new("RGB", rgba.size, (255, 255, 255))
+                image.paste(rgba, mask=rgba.getchannel("A"))
+            else:
+                image = image.convert("RGB")
+            if crop:
+                image = ImageOps.fit(image, (width, height), Image.Resampling.LANCZOS)
+            else:
+                image.thumbnail((width, height), Image.Resampling.LANCZOS)
+            out = io.BytesIO()
+            image.save(out, pil_format, quality=quality, **({"method": 4} if pil_format == "WEBP" else {"optimize": True}))
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as exc:
+        raise ThumbnailError(str(exc)) from exc
+    return out.getvalue()
+
+
+# --- миниатюры рядом с оригиналом (MEDIA) ---------------------------------------------
+
+
+def sidecar_name(name: str, preset: str) -> str:
+    """avatars/me.jpg, avatar -> avatars/me.thumb-avatar-128x128.webp"""
+    width, height, _ = get_preset(preset)
+    path = PurePosixPath(name)
+    return str(path.with_name(f"{path.stem}{SIDECAR_MARKER}{preset}-{width}x{height}.{thumbnail_format()}"))
+
+
+def ensure_sidecar(name: str, preset: str, storage=None) -> str | None:
+    """Создаёт миниатюру рядом с name, если её ещё нет. None — исходник не изображение или недоступен."""
+    storage = storage or default_storage
+    target = sidecar_name(name, preset)
+    if storage.exists(target):
+        return target
+    try:
+        with storage.open(name, "rb") as fh:
+            data = make_thumbnail(fh, preset)
+    except (OSError, ThumbnailError) as exc:
+        logger.warning("thumbnails: %s (%s) не создана: %s", name, preset, exc)
+        return None
+    saved = storage.save(target, ContentFile(data))
+    if saved != target:
+        # Параллельный запрос успел записать тот же файл — лишнюю копию убираем.
+        storage.delete(saved)
+    return target
+
+
+def delete_sidecars(name: str, storage=None) -> int:
+    """Удаляет все миниатюры файла name (при удалении оригинала)."""
+    storage = storage or default_storage
+    path = PurePosixPath(name)
+    prefix = f"{path.stem}{SIDECAR_MARKER}"
+    try:
+        _, files = storage.listdir(str(path.parent))
+    except (FileNotFoundError, NotImplementedError):
+        return 0
+    removed = 0
+    for filename in files:
+        if filename.startswith(prefix):
+            storage.delete(str(path.parent / filename))
+            removed += 1
+    return removed
+
+
+def lazy_token(name: str, preset: str) -> str:
+    return signing.dumps({"n": name, "p": preset}, salt=SIGNING_SALT, compress=True)
+
+
+def read_lazy_token(token: str) -> tuple[str, str]:
+    """(имя файла, пресет) из подписанной ссылки; signing.BadSignature при подделке."""
+    data = signing.loads(token, salt=SIGNING_SALT)
+    return data["n"], data["p"]
+
+
+def thumbnail_url(fieldfile, preset: str) -> str:
+    """
+    URL миниатюры поля с файлом: готовый файл в MEDIA или подписанная ссылка на ленивую
+    генерацию. Не изображение — URL оригинала, пустое поле — "".
+    """
+    name = getattr(fieldfile, "name", None) or ""
+    if not name:
+        return ""
+    storage = getattr(fieldfile, "storage", None) or default_storage
+    if not is_image_name(name):
+        return storage.url(name)
+    target = sidecar_name(name, preset)
+    if storage.exists(target):
+        return storage.url(target)
+    return reverse("file_manager:media_thumbnail", args=[lazy_token(name, preset)])
+
+
+def schedule_thumbnails(fieldfile, preset_names) -> None:
+    """Ставит фоновую задачу media.thumbnails для недостающих миниатюр поля (THUMBNAIL_EAGER)."""
+    from .jobs import enqueue
+
+    name = getattr(fieldfile, "name", None) or ""
+    if not name or not is_image_name(name) or not getattr(settings, "THUMBNAIL_EAGER", True):
+        return
+    storage = getattr(fieldfile, "storage", None) or default_storage
+    missing = [preset for preset in preset_names if not storage.exists(sidecar_name(name, preset))]
+    if missing:
+        enqueue("media.thumbnails", source=name, presets=missing)
@@ -35,9 +35,15 @@ urlpatterns = [
     path("", views.file_list, name="file_list"),
 path('upload/',views.file_upload ,name ='file_upload'),
 path('<int:file_id>/',views.file_detail ,name ='file_detail'),
+path('<int:file_id>/status/', views.file_processing_status, name='file_processing_status'),
 path('<int:file_id>/download/',views.file_download ,name ='file_download'),
 path('<int:file_id>/preview/',views.file_preview ,name ='file_preview'),
 path('<int:file_id>/preview/pdf/',views.office_pdf_preview ,name ='office_pdf_preview'),
+path('<int:file_id>/thumbnail/', views.file_thumbnail, name='file_thumbnail'),
+path('thumbs/<str:token>/', views.media_thumbnail, name='media_thumbnail'),
+path('<int:file_id>/pages/', views.file_pdf_pages, name='file_pdf_pages'),
+path('<int:file_id>/pages/<int:page>/<str:size>/', views.file_pdf_page, name='file_pdf_page'),
+path('<int:file_id>/pages/linear.pdf', views.file_pdf_linearized, name='file_pdf_linearized'),
 path('<int:file_id>/versions/<int:version_id>/preview/', views.file_version_preview, name='file_version_preview'),
 path('<int:file_id>/versions/<int:version_id>/preview/pdf/', views.file_version_office_pdf_preview, name='file_version_office_pdf_preview'),
 path('<int:file_id>/versions/<int:version_id>/inline-viewer/', views.file_version_inline_viewer, name='file_version_inline_viewer'),
@@ -3,34 +3,45 @@ from django.urls import reverse
 from django.contrib.auth.decorators import login_required 
 from django.contrib import messages 
 from django.http import HttpResponse ,Http404 ,JsonResponse 
-from django.core.files.base import ContentFile
 from django.core.exceptions import PermissionDenied ,ValidationError 
-from django.db.models import Q, Count, Exists, OuterRef
+from django.db.models import Q, Count, Exists, OuterRef, Sum
 from django.core.paginator import Paginator 
 from django.contrib.auth.models import User
 from . models import File ,Tag ,FileComment ,FileVersion ,FileActivity ,UserStorageQuota 
 from . forms import FileEditForm ,FileVersionForm ,FileCommentForm ,TagForm ,FileSearchForm, BulkPermissionForm 
-from . utils import extract_text_from_file ,generate_preview ,search_files ,get_user_storage_usage 
+from . utils import search_files ,get_user_storage_usage 
+from . extraction import detect_format ,extract_text_cached ,extract_text_from_bytes 
+from . search import apply_search ,attach_snippets 
 from . office_pdf import (
+    ConversionBusyError,
     EXTENSIONS_LIBREOFFICE_TO_PDF,
-    convert_office_file_to_pdf_bytes,
     is_convertapi_configured,
     is_libreoffice_available,
     is_office_pdf_conversion_available,
 )
-from . clamav import flash_scan_followup ,scan_upload_bytes 
+from . clamav import flash_scan_followup ,quarantine_enabled ,quarantine_placeholder ,scan_upload 
+from . delivery import generated_content_response ,get_chunk_size ,local_file_response ,remote_file_response 
+from . blobstore import acquire_blob ,hash_source ,is_blob_path ,release_blob 
+from . jobs import enqueue 
+from . quota_units import format_bytes_ru 
+from . signals import FILE_LIST_SUMMARY_GENERATION_KEY 
+import contextlib 
 import logging 
 import os 
 import requests
 from django.conf import settings
+from django.core import signing
 from django.core.files.storage import default_storage
 from django.utils.crypto import get_random_string
 from django.utils import timezone
+from django.utils.functional import cached_property
+from django.core.cache import cache
 from django.views.decorators.http import require_http_methods
+from django.utils.cache import get_conditional_response
 from django.views.decorators.clickjacking import xframe_options_sameorigin
 from web_messages import flash_form_errors
 from .models import ExternalStorageConnection
-from .wordfilter import find_banned_match
+from .wordfilter import get_matcher as get_banned_matcher
 
 logger = logging.getLogger(__name__)
 from .models import SharedWorkspace
@@ -39,20 +50,29 @@ from .yandex_disk import (
     exchange_code_for_token,
     list_files,
     get_disk_info,
-    resource_exists,
     get_download_url,
+    get_resource_info,
     upload_file_bytes,
     delete_resource,
+    STALE_HREF_STATUSES,
 )
 from .import_pipeline import import_yandex_file
+from .yandex_transfer import get_engine
+from . import activity_log as activity_buffer
+from .pagination import keyset_page
+from .zipstream import ZipEntry, stream_zip
+from . import content_cache
+from . import renditions
+from . import thumbnails
+from .yandex_sync import schedule_reconcile
 import zipfile
 import io
 import json
-import tempfile
 import hashlib
 import difflib
 import mimetypes
 import xml.etree.ElementTree as ET
+from functools import partial
 from pathlib import Path
 from pathlib import PurePosixPath
 
@@ -143,6 +163,26 @@ def can_upload_file_version(user, file_obj):
     return is_file_workspace_collaborator(user, file_obj)
 
 
+def _require_content_available(file_obj):
+    """Содержимое на карантине (403) или отклонённое (404) не отдаётся никому, включая владельца."""
+    if file_obj.is_quarantined():
+        raise PermissionDenied
+    if not file_obj.is_content_available():
+        raise Http404
+
+
+def _require_version_available(file_obj, version_obj):
+    """
+    Версия файла на карантине не отдаётся: последняя версия — то же непроверенное содержимое.
+    Версия с угрозой (content_blocked) не отдаётся никогда; старые чистые версии
+    отклонённого файла остаются доступны.
+    """
+    if file_obj.is_quarantined():
+        raise PermissionDenied
+    if version_obj.content_blocked:
+        raise Http404
+
+
 def can_delete_file_object(user, file_obj):
     return file_obj.uploaded_by_id == user.id or is_admin_user(user)
 
@@ -173,71 +213,83 @@ def build_unique_title(user, original_name):
     return candidate
 
 
-def sync_deleted_yandex_files_for_user(user):
-    connection = get_yandex_connection(user, autocreate_from_social=True)
-    if not connection:
-        return
-    yandex_files = File.objects.filter(
-        uploaded_by=user,
-        storage_provider="yandex_disk",
-    ).exclude(yandex_path="")
-    for file_obj in yandex_files:
-        try:
-            exists = resource_exists(connection.access_token, file_obj.yandex_path)
-        except Exception:
-            continue
-        if not exists:
-            file_obj.delete()
+def extract_and_moderate(file_name, source, sha256=None):
+    """
+    (текст, запись словаря модерации или None) за один проход извлечения: разбор идёт
+    по страницам/абзацам и останавливается на первой запрещённой записи. source — путь
+    к файлу, UploadedFile (большой читается из временного файла, без копии в памяти) или bytes.
+    """
+    matcher = get_banned_matcher()
+    temporary_path = getattr(source, "temporary_file_path", None)
+    if temporary_path is not None:
+        source = temporary_path()
+    elif hasattr(source, "read"):
+        content = source.read()
+        source.seek(0)
+        source = content
+    try:
+        if isinstance(source, (bytes, bytearray)):
+            result = extract_text_from_bytes(bytes(source), file_name, sha256=sha256, matcher=matcher)
+        else:
+            result = extract_text_cached(source, detect_format(file_name), sha256=sha256, matcher=matcher)
+    except OSError:
+        return "", None
+    return result.text, result.banned or None
 
 
-def extract_text_from_uploaded_content(file_name, content):
-    if not content:
-        return ""
-    suffix = Path(file_name).suffix or ".tmp"
-    tmp_path = None
-    try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            tmp.write(content)
-            tmp_path = tmp.name
-        return extract_text_from_file(tmp_path)
-    except Exception:
-        return ""
-    finally:
-        if tmp_path and os.path.exists(tmp_path):
-            try:
-                os.remove(tmp_path)
-            except OSError:
-                pass
+def _rewound(source):
+    """Файловый источник — с начала: загрузку до этого уже читали ClamAV и модерация."""
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source
 
 
 def build_structured_snapshot(file_name, content):
+    """content — bytes, путь к файлу или файловый объект (UploadedFile); целиком в память не читается."""
+    with contextlib.ExitStack() as stack:
+        if content is None or isinstance(content, (bytes, bytearray)):
+            fh = io.BytesIO(content or b"")
+        elif isinstance(content, (str, os.PathLike)):
+            fh = stack.enter_context(open(content, "rb"))
+        else:
+            fh = content
+        fh.seek(0, os.SEEK_END)
+        size = fh.tell()
+        fh.seek(0)
+        try:
+            return _structured_snapshot(file_name, fh, size)
+        finally:
+            fh.seek(0)
+
+
+def _structured_snapshot(file_name, fh, size):
     ext = (Path(file_name).suffix or "").lower().lstrip(".")
     snapshot = {
         "schema_version": "v1",
         "ext": ext,
-        "size_bytes": len(content or b""),
+        "size_bytes": size,
     }
-    if not content:
+    if not size:
         snapshot["kind"] = "empty"
         return snapshot
 
     text_like = {"txt", "md", "csv", "json", "xml", "yml", "yaml", "log"}
     if ext in text_like:
-        text = (content[:500_000]).decode("utf-8", errors="replace")
+        text = fh.read(500_000).decode("utf-8", errors="replace")
         lines = text.splitlines()
         snapshot.update(
             {
                 "kind": "text_lines",
                 "line_count": len(lines),
                 "preview_lines": lines[:500],
-                "truncated": len(content) > 500_000 or len(lines) > 500,
+                "truncated": size > 500_000 or len(lines) > 500,
             }
         )
         return snapshot
 
     if ext == "docx":
         try:
-            with zipfile.ZipFile(io.BytesIO(content)) as zf:
+            with zipfile.ZipFile(fh) as zf:
                 xml_bytes = zf.read("word/document.xml")
             root = ET.fromstring(xml_bytes)
             paragraphs = []
@@ -263,7 +315,7 @@ def build_structured_snapshot(file_name, content):
 
     if ext == "xlsx":
         try:
-            with zipfile.ZipFile(io.BytesIO(content)) as zf:
+            with zipfile.ZipFile(fh) as zf:
                 sheet_files = sorted(
                     [name for name in zf.namelist() if name.startswith("xl/worksheets/sheet")]
                 )
@@ -293,48 +345,70 @@ def build_structured_snapshot(file_name, content):
 
 
 def _store_revision_blob(file_obj, uploaded_by, content, original_name, version_number):
-    sha256 = hashlib.sha256(content).hexdigest()
+    """content — bytes, путь к файлу или файловый объект (UploadedFile): читается блоками."""
     safe_name = PurePosixPath(original_name).name or f"v{version_number}.bin"
-    revision_file_name = f"v{version_number}_{sha256[:10]}_{safe_name}"
 
     if file_obj.storage_provider == "yandex_disk":
         connection = get_yandex_connection(file_obj.uploaded_by, autocreate_from_social=True)
         if not connection:
             raise ValidationError("Не найдено подключение Яндекс.Диска владельца файла")
+        sha256, size = hash_source(content)
+        revision_file_name = f"v{version_number}_{sha256[:10]}_{safe_name}"
         yandex_path = f"disk:/revisions/{file_obj.id}/{revision_file_name}"
-        upload_file_bytes(connection.access_token, yandex_path, content, overwrite=False)
+        get_engine().upload(connection.access_token, yandex_path, _rewound(content), overwrite=False)
         return {
             "has_blob": True,
             "blob_storage_provider": "yandex_disk",
             "blob_storage_path": yandex_path,
-            "blob_size": len(content),
+            "blob_size": size,
             "blob_sha256": sha256,
             "version_file_name": "",
+            "content_blob": None,
         }
 
-    storage_name = default_storage.save(
-        f"file_versions/{file_obj.id}/{revision_file_name}",
-        ContentFile(content),
-    )
+    blob = acquire_blob(_rewound(content), safe_name)
     return {
         "has_blob": True,
         "blob_storage_provider": "local",
-        "blob_storage_path": storage_name,
-        "blob_size": len(content),
-        "blob_sha256": sha256,
-        "version_file_name": storage_name,
+        "blob_storage_path": blob.storage_path,
+        "blob_size": blob.size,
+        "blob_sha256": blob.sha256,
+        "version_file_name": blob.storage_path,
+        "content_blob": blob,
     }
 
 
+def _switch_local_content(file_obj, content):
+    """
+    Переводит локальный File на blob с новым содержимым (до file_obj.save()).
+    Возвращает то, что нужно отпустить после сохранения: (id старого blob, путь legacy-файла).
+    """
+    old_blob_id = file_obj.content_blob_id
+    old_legacy_path = None
+    if file_obj.file and not is_blob_path(file_obj.file.name):
+        old_legacy_path = file_obj.file.path
+    blob = acquire_blob(content, file_obj.title)
+    file_obj.content_blob = blob
+    file_obj.file.name = blob.storage_path
+    return old_blob_id, old_legacy_path
+
+
+def _drop_previous_local_content(previous):
+    old_blob_id, old_legacy_path = previous
+    release_blob(old_blob_id)
+    if old_legacy_path and os.path.exists(old_legacy_path):
+        try:
+            os.remove(old_legacy_path)
+        except OSError:
+            pass
+
+
 def _read_revision_blob_bytes(version_obj):
     if version_obj.blob_storage_provider == "yandex_disk" and version_obj.blob_storage_path:
         connection = get_yandex_connection(version_obj.file.uploaded_by, autocreate_from_social=True)
         if not connection:
             raise ValidationError("Нет подключения Яндекс.Диска владельца файла")
-        download_url = get_download_url(connection.access_token, version_obj.blob_storage_path)
-        response = requests.get(download_url, timeout=120)
-        response.raise_for_status()
-        return response.content
+        return get_engine().read_bytes(connection.access_token, version_obj.blob_storage_path)
     if version_obj.blob_storage_provider == "local" and version_obj.blob_storage_path:
         if default_storage.exists(version_obj.blob_storage_path):
             with default_storage.open(version_obj.blob_storage_path, "rb") as fh:
@@ -345,6 +419,80 @@ def _read_revision_blob_bytes(version_obj):
     raise ValidationError("Для этой версии нет сохранённого blob")
 
 
+def _revision_blob_local_path(version_obj, *, suffix=""):
+    """
+    Путь к blob ревизии на локальном диске и флаг «удалить после использования».
+    Blob с Яндекс.Диска скачивается потоком во временный файл.
+    """
+    if version_obj.blob_storage_provider == "yandex_disk" and version_obj.blob_storage_path:
+        connection = get_yandex_connection(version_obj.file.uploaded_by, autocreate_from_social=True)
+        if not connection:
+            raise ValidationError("Нет подключения Яндекс.Диска владельца файла")
+        cached_path = _yandex_local_copy(connection.access_token, version_obj.blob_storage_path)
+        if cached_path:
+            return cached_path, False
+        return get_engine().download_to_tempfile(connection.access_token, version_obj.blob_storage_path, suffix=suffix), True
+    for name in (
+        version_obj.blob_storage_path if version_obj.blob_storage_provider == "local" else "",
+        version_obj.version_file.name if version_obj.version_file else "",
+    ):
+        if name and default_storage.exists(name):
+            return default_storage.path(name), False
+    raise ValidationError("Для этой версии нет сохранённого blob")
+
+
+def _yandex_local_copy(access_token, path):
+    """Путь к копии в content_cache или None (кэш выключен, файл крупный, ошибка Диска)."""
+    try:
+        return content_cache.get_local_copy(access_token, path)
+    except (requests.RequestException, RuntimeError, OSError):
+        logger.warning("content cache: не удалось заполнить %s", path, exc_info=True)
+        return None
+
+
+def _yandex_file_response(request, access_token, path, **kwargs):
+    """
+    Отдаёт файл Яндекс.Диска из локального кэша содержимого (с Range), иначе проксирует
+    по ссылке из кэша; если она устарела (403/404/410), один раз запрашивает новую.
+    """
+    local_path = _yandex_local_copy(access_token, path)
+    if local_path:
+        return local_file_response(request, local_path, **kwargs)
+    try:
+        return remote_file_response(request, get_download_url(access_token, path), **kwargs)
+    except requests.HTTPError as exc:
+        if exc.response is None or exc.response.status_code not in STALE_HREF_STATUSES:
+            raise
+    return remote_file_response(request, get_download_url(access_token, path, fresh=True), **kwargs)
+
+
+def _revision_blob_response(request, version_obj, *, content_type, filename):
+    """Потоковая отдача blob ревизии (без чтения в память, с поддержкой Range)."""
+    if version_obj.blob_storage_provider == "yandex_disk" and version_obj.blob_storage_path:
+        connection = get_yandex_connection(version_obj.file.uploaded_by, autocreate_from_social=True)
+        if not connection:
+            raise Http404
+        return _yandex_file_response(
+            request,
+            connection.access_token,
+            version_obj.blob_storage_path,
+            content_type=content_type,
+            filename=filename,
+        )
+    for name in (
+        version_obj.blob_storage_path if version_obj.blob_storage_provider == "local" else "",
+        version_obj.version_file.name if version_obj.version_file else "",
+    ):
+        if name and default_storage.exists(name):
+            return local_file_response(
+                request,
+                default_storage.path(name),
+                content_type=content_type,
+                filename=filename,
+            )
+    raise Http404
+
+
 def _build_side_by_side_diff(from_text, to_text):
     from_lines = (from_text or "").splitlines()
     to_lines = (to_text or "").splitlines()
@@ -427,6 +575,248 @@ def _preview_content_type_by_ext(ext):
     return 'application/octet-stream'
 
 
+def _create_initial_version(file_obj, user, content, extracted_text):
+    try:
+        if not FileVersion.objects.filter(file=file_obj, version_number=1).exists():
+            structured_snapshot = build_structured_snapshot(file_obj.title, content)
+            blob_info = _store_revision_blob(
+                file_obj=file_obj,
+                uploaded_by=user,
+                content=content,
+                original_name=file_obj.title,
+                version_number=1,
+            )
+            FileVersion.objects.create(
+                file=file_obj,
+                changed_by=user,
+                version_number=1,
+                change_description="Initial upload",
+                snapshot_title=file_obj.title,
+                snapshot_size=file_obj.file_size,
+                snapshot_storage_provider=file_obj.storage_provider,
+                snapshot_storage_path=file_obj.yandex_path if file_obj.storage_provider == "yandex_disk" else (file_obj.file.name if file_obj.file else ""),
+                has_blob=blob_info["has_blob"],
+                blob_storage_provider=blob_info["blob_storage_provider"],
+                blob_storage_path=blob_info["blob_storage_path"],
+                blob_size=blob_info["blob_size"],
+                blob_sha256=blob_info["blob_sha256"],
+                extracted_text_snapshot=extracted_text or "",
+                structured_snapshot=structured_snapshot,
+                structured_schema_version=structured_snapshot.get("schema_version", "v1"),
+                version_file=blob_info["version_file_name"] or None,
+                content_blob=blob_info["content_blob"],
+            )
+    except Exception:
+        logger.exception("failed to create initial file version file_id=%s", getattr(file_obj, "id", None))
+
+
+def _move_local_file_to_yandex(file_obj, connection):
+    """
+    Выгружает локальный файл на Яндекс.Диск владельца (потоком с диска). Возвращает id
+    локального blob — вызывающий отпускает его, когда локальная копия больше не нужна.
+    """
+    yandex_path = f"disk:/{file_obj.title}"
+    get_engine().upload(connection.access_token, yandex_path, file_obj.file.path, overwrite=True)
+    old_blob_id = file_obj.content_blob_id
+    file_obj.storage_provider = "yandex_disk"
+    file_obj.yandex_path = yandex_path
+    file_obj.content_blob = None
+    file_obj.file.name = ""
+    file_obj.save(update_fields=["storage_provider", "yandex_path", "content_blob", "file"])
+    return old_blob_id
+
+
+def process_uploaded_file(file_obj):
+    """
+    Фоновая часть загрузки (задача file.process_upload): извлечение текста, модерация,
+    перенос на Яндекс.Диск, начальная версия, квота. Повторный запуск безопасен.
+    """
+    user = file_obj.uploaded_by
+    # Содержимое не читается в память: локальный blob берётся с диска, файл Диска — временной копией.
+    source_path, cleanup = _resolve_path_for_viewing(file_obj)
+    if not source_path:
+        raise RuntimeError(f"содержимое файла file_id={file_obj.id} недоступно для обработки")
+    moved_blob_id = None
+    try:
+        # Модерация по страницам: отклоняемый документ разбирается только до первой находки.
+        extracted_text, banned_match = extract_and_moderate(
+            file_obj.title,
+            source_path,
+            sha256=file_obj.content_blob.sha256 if file_obj.content_blob_id else None,
+        )
+        if banned_match:
+            logger.warning(
+                "file upload rejected (wordfilter) user_id=%s file_id=%s matched=%r",
+                user.id,
+                file_obj.id,
+                banned_match,
+            )
+            old_blob_id = file_obj.content_blob_id
+            file_obj.content_blob = None
+            file_obj.file.name = ""
+            file_obj.file_size = 0
+            file_obj.processing_state = "rejected"
+            file_obj.processing_error = (
+                "Файл не принят: в содержимом обнаружен запрещённый фрагмент по словарю модерации. "
+                "Загрузите другой файл."
+            )
+            file_obj.save(update_fields=["content_blob", "file", "file_size", "processing_state", "processing_error"])
+            release_blob(old_blob_id)
+            get_user_storage_usage(user).update_usage()
+            return
+
+        if file_obj.storage_provider == "local":
+            yandex_connection = get_yandex_connection(user, autocreate_from_social=True)
+            if yandex_connection:
+                try:
+                    moved_blob_id = _move_local_file_to_yandex(file_obj, yandex_connection)
+                except Exception:
+                    logger.warning("upload: файл file_id=%s оставлен локально, Яндекс.Диск недоступен", file_obj.id, exc_info=True)
+
+        # Локальный blob отпускается после начальной версии: она читается из него же.
+        _create_initial_version(file_obj, user, source_path, extracted_text)
+    finally:
+        release_blob(moved_blob_id)
+        if cleanup:
+            try:
+                os.unlink(source_path)
+            except OSError:
+                pass
+    file_obj.extracted_text = extracted_text
+    file_obj.processing_state = "ready"
+    file_obj.processing_error = ""
+    file_obj.save(update_fields=["extracted_text", "processing_state", "processing_error"])
+    get_user_storage_usage(user).update_usage()
+    schedule_viewer_renditions(file_obj)
+    logger.info("file upload processed file_id=%s storage_provider=%s", file_obj.id, file_obj.storage_provider)
+
+
+def reject_infected_file(file_obj, threat, *, drop_content=True, sha256=""):
+    """
+    Помечает файл отклонённым антивирусом. drop_content — удалить локальное содержимое
+    (свежая загрузка); при перепроверке хранилища оно остаётся для разбора администратором.
+    sha256 — хэш заражённого содержимого, если известен (версии с ним тоже блокируются).
+    """
+    file_obj.processing_state = "rejected"
+    file_obj.processing_error = (
+        f"Файл заблокирован: антивирус ClamAV обнаружил угрозу «{threat}». "
+        "Загрузите другой файл."
+    )
+    fields = ["processing_state", "processing_error"]
+    if not sha256 and file_obj.content_blob_id:
+        sha256 = file_obj.content_blob.sha256
+    old_blob_id = None
+    if drop_content and file_obj.storage_provider == "local":
+        old_blob_id = file_obj.content_blob_id
+        file_obj.content_blob = None
+        file_obj.file.name = ""
+        file_obj.file_size = 0
+        fields += ["content_blob", "file", "file_size"]
+    file_obj.save(update_fields=fields)
+    release_blob(old_blob_id)
+    # Версия с тем же содержимым (последняя или с тем же SHA-256) закрывается вместе с файлом.
+    infected_versions = Q(version_number=file_obj.version)
+    if sha256:
+        infected_versions |= Q(blob_sha256=sha256)
+    block_infected_versions(file_obj.versions.filter(infected_versions), threat, drop_content=drop_content)
+    if old_blob_id:
+        get_user_storage_usage(file_obj.uploaded_by).update_usage()
+
+
+def block_infected_versions(versions, threat, *, drop_content=True):
+    """
+    Помечает версии content_blocked. drop_content — отвязать и отпустить локальный blob
+    (свежая загрузка); при перепроверке хранилища содержимое остаётся для разбора.
+    """
+    for version_obj in versions.exclude(content_blocked=True):
+        version_obj.content_blocked = True
+        fields = ["content_blocked"]
+        blob_id = None
+        if drop_content and version_obj.content_blob_id:
+            blob_id = version_obj.content_blob_id
+            version_obj.content_blob = None
+            version_obj.version_file = None
+            version_obj.blob_storage_path = ""
+            fields += ["content_blob", "version_file", "blob_storage_path"]
+        version_obj.save(update_fields=fields)
+        release_blob(blob_id)
+        logger.warning("clamav: version_id=%s заблокирована threat=%r", version_obj.id, threat)
+
+
+def scan_quarantined_file(file_obj, *, process=False):
+    """
+    Фоновая проверка файла на карантине (задача file.scan_upload). Чистый файл становится
+    доступен (process=True — свежая загрузка, дальше обычная обработка), заражённый
+    отклоняется. Если clamd не ответил, RuntimeError — задача повторится, файл остаётся закрытым.
+    """
+    path, cleanup = _resolve_path_for_viewing(file_obj)
+    if not path:
+        raise RuntimeError(f"содержимое файла file_id={file_obj.id} недоступно для проверки")
+    source_sha256 = _file_source_sha256(file_obj)
+    try:
+        scan = scan_upload(
+            path,
+            user_id=file_obj.uploaded_by_id,
+            filename=file_obj.title,
+            sha256=source_sha256 or None,
+        )
+    finally:
+        if cleanup:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+    if scan.get("performed") and scan.get("clean") is False:
+        threat = scan.get("threat") or "неизвестная угроза"
+        logger.warning("quarantine: file_id=%s rejected threat=%r", file_obj.id, threat)
+        reject_infected_file(file_obj, threat, sha256=source_sha256)
+        return scan
+    if not scan.get("performed"):
+        raise RuntimeError(scan.get("error") or f"проверка не выполнена ({scan.get('skipped')})")
+    if process:
+        file_obj.processing_state = "processing"
+        file_obj.save(update_fields=["processing_state"])
+        process_uploaded_file(file_obj)
+    else:
+        file_obj.processing_state = "ready"
+        file_obj.processing_error = ""
+        file_obj.save(update_fields=["processing_state", "processing_error"])
+        schedule_viewer_renditions(file_obj)
+    logger.info("quarantine: file_id=%s released", file_obj.id)
+    return scan
+
+
+def _store_upload_for_background_processing(user, unique_title, uploaded_file, file_size, *, quarantine=False):
+    """
+    Сохраняет загрузку в blob и ставит фоновую задачу: обработку (file.process_upload) или,
+    при CLAMAV_QUARANTINE, сначала антивирусную проверку (file.scan_upload, затем обработка).
+    """
+    blob = acquire_blob(uploaded_file, unique_title)
+    try:
+        file_obj = File(
+            title=unique_title,
+            description="",
+            uploaded_by=user,
+            visibility="private",
+            importance="main",
+            storage_provider="local",
+            yandex_path="",
+            file_size=file_size,
+            content_blob=blob,
+            processing_state="quarantine" if quarantine else "processing",
+        )
+        file_obj.file.name = blob.storage_path
+        file_obj.save()
+    except Exception:
+        release_blob(blob.id)
+        raise
+    if quarantine:
+        enqueue("file.scan_upload", file_id=file_obj.id, process=True)
+    else:
+        enqueue("file.process_upload", file_id=file_obj.id)
+    return file_obj
+
+
 def create_user_uploaded_file(user, uploaded_file):
     storage_quota = get_user_storage_usage(user)
     file_size = uploaded_file.size
@@ -442,12 +832,17 @@ def create_user_uploaded_file(user, uploaded_file):
             f"Недостаточно места в хранилище. Доступно: {storage_quota.get_quota_display()}"
         ), {"performed": False, "clean": None, "skipped": "quota"}
     unique_title = build_unique_title(user, file_name)
-    uploaded_content = uploaded_file.read()
-    scan = scan_upload_bytes(
-        uploaded_content,
-        user_id=user.id,
-        filename=file_name,
-    )
+    quarantine = quarantine_enabled()
+    if quarantine:
+        # Запрос не ждёт clamd: файл принимается на карантин, проверит задача file.scan_upload.
+        scan = quarantine_placeholder()
+    else:
+        # В clamd загрузка уходит кусками из UploadedFile (временный файл для больших), до чтения в память.
+        scan = scan_upload(
+            uploaded_file,
+            user_id=user.id,
+            filename=file_name,
+        )
 
     if scan.get("performed") and scan.get("clean") is False:
         threat = scan.get("threat") or "неизвестная угроза"
@@ -456,7 +851,7 @@ def create_user_uploaded_file(user, uploaded_file):
             "Выберите другой файл или проверьте данные на компьютере."
         ), scan
 
-    if getattr(settings, "CLAMAV_ENABLED", False) and not scan.get("performed"):
+    if getattr(settings, "CLAMAV_ENABLED", False) and not scan.get("performed") and not quarantine:
         if not getattr(settings, "CLAMAV_FAIL_OPEN", True):
             err = scan.get("error") or "проверка не выполнена"
             logger.warning(
@@ -470,19 +865,53 @@ def create_user_uploaded_file(user, uploaded_file):
                 f"но антивирус недоступен ({err})."
             ), scan
 
-    extracted_text = extract_text_from_uploaded_content(unique_title, uploaded_content)
-    banned_match = find_banned_match(extracted_text)
-    if banned_match:
-        logger.warning(
-            "file upload rejected (wordfilter) user_id=%s filename=%r matched=%r",
+    in_background = quarantine or getattr(settings, "UPLOAD_PROCESSING_IN_BACKGROUND", False)
+    if not in_background:
+        # Модерация до чтения загрузки в память (в фоне её делает process_uploaded_file).
+        extracted_text, banned_match = extract_and_moderate(unique_title, uploaded_file)
+        if banned_match:
+            logger.warning(
+                "file upload rejected (wordfilter) user_id=%s filename=%r matched=%r",
+                user.id,
+                file_name,
+                banned_match,
+            )
+            return None, (
+                "Файл не принят: в содержимом обнаружен запрещённый фрагмент по словарю модерации. "
+                "Загрузите другой файл."
+            ), scan
+
+    # Загрузка дальше не читается в память целиком: blob и Диск получают её блоками из UploadedFile.
+    if in_background:
+        try:
+            file_obj = _store_upload_for_background_processing(
+                user, unique_title, _rewound(uploaded_file), file_size, quarantine=quarantine
+            )
+        except Exception as exc:
+            logger.error(
+                "file upload save failed user_id=%s title=%r",
+                user.id,
+                unique_title,
+                exc_info=exc,
+            )
+            return None, f"Не удалось сохранить файл: {exc}", scan
+        try:
+            FileActivity.log_activity(
+                file=file_obj,
+                user=user,
+                activity_type="upload",
+                description=f"File uploaded: {file_obj.title}",
+            )
+        except Exception:
+            pass
+        logger.info(
+            "file upload queued for processing file_id=%s title=%r user_id=%s size_bytes=%s",
+            file_obj.id,
+            file_obj.title,
             user.id,
-            file_name,
-            banned_match,
+            file_size,
         )
-        return None, (
-            "Файл не принят: в содержимом обнаружен запрещённый фрагмент по словарю модерации. "
-            "Загрузите другой файл."
-        ), scan
+        return file_obj, None, scan
 
     yandex_connection = get_yandex_connection(user, autocreate_from_social=True)
     file_obj = None
@@ -490,7 +919,7 @@ def create_user_uploaded_file(user, uploaded_file):
     if yandex_connection:
         yandex_path = f"disk:/{unique_title}"
         try:
-            upload_file_bytes(yandex_connection.access_token, yandex_path, uploaded_content, overwrite=True)
+            get_engine().upload(yandex_connection.access_token, yandex_path, _rewound(uploaded_file), overwrite=True)
             file_obj = File.objects.create(
                 title=unique_title,
                 description="",
@@ -506,7 +935,9 @@ def create_user_uploaded_file(user, uploaded_file):
             file_obj = None
 
     if not file_obj:
+        blob = None
         try:
+            blob = acquire_blob(_rewound(uploaded_file), unique_title)
             file_obj = File(
                 title=unique_title,
                 description="",
@@ -517,9 +948,13 @@ def create_user_uploaded_file(user, uploaded_file):
                 yandex_path="",
                 file_size=file_size,
                 extracted_text=extracted_text,
+                content_blob=blob,
             )
-            file_obj.file.save(unique_title, ContentFile(uploaded_content), save=True)
+            file_obj.file.name = blob.storage_path
+            file_obj.save()
         except Exception as exc:
+            if blob is not None:
+                release_blob(blob.id)
             logger.error(
                 "file upload save failed user_id=%s title=%r",
                 user.id,
@@ -538,37 +973,8 @@ def create_user_uploaded_file(user, uploaded_file):
     except Exception:
         pass
 
-    try:
-        if not FileVersion.objects.filter(file=file_obj, version_number=1).exists():
-            structured_snapshot = build_structured_snapshot(unique_title, uploaded_content)
-            blob_info = _store_revision_blob(
-                file_obj=file_obj,
-                uploaded_by=user,
-                content=uploaded_content,
-                original_name=unique_title,
-                version_number=1,
-            )
-            FileVersion.objects.create(
-                file=file_obj,
-                changed_by=user,
-                version_number=1,
-                change_description="Initial upload",
-                snapshot_title=file_obj.title,
-                snapshot_size=file_obj.file_size,
-                snapshot_storage_provider=file_obj.storage_provider,
-                snapshot_storage_path=file_obj.yandex_path if file_obj.storage_provider == "yandex_disk" else (file_obj.file.name if file_obj.file else ""),
-                has_blob=blob_info["has_blob"],
-                blob_storage_provider=blob_info["blob_storage_provider"],
-                blob_storage_path=blob_info["blob_storage_path"],
-                blob_size=blob_info["blob_size"],
-                blob_sha256=blob_info["blob_sha256"],
-                extracted_text_snapshot=extracted_text or "",
-                structured_snapshot=structured_snapshot,
-                structured_schema_version=structured_snapshot.get("schema_version", "v1"),
-                version_file=blob_info["version_file_name"] or None,
-            )
-    except Exception:
-        logger.exception("failed to create initial file version file_id=%s", getattr(file_obj, "id", None))
+    _create_initial_version(file_obj, user, uploaded_file, extracted_text)
+    schedule_viewer_renditions(file_obj)
 
     try:
         storage_quota.update_usage()
@@ -591,9 +997,47 @@ def create_user_uploaded_file(user, uploaded_file):
     return file_obj, None, scan
 
 
+class KnownCountPaginator(Paginator):
+    """Paginator с заранее посчитанным числом объектов — без второго COUNT(*)."""
+
+    def __init__(self, object_list, per_page, *, count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self._known_count = count
+
+    @cached_property
+    def count(self):
+        return self._known_count
+
+
+def _file_list_summary(request, files):
+    """
+    Число файлов и их суммарный размер одним SQL-агрегатом по тем же фильтрам, что и список.
+    С FILE_LIST_SUMMARY_CACHE_TTL > 0 результат кэшируется по пользователю и набору фильтров;
+    любое сохранение/удаление File сбрасывает кэш (счётчик поколения, signals.py).
+    """
+    ttl = getattr(settings, "FILE_LIST_SUMMARY_CACHE_TTL", 0) or 0
+    cache_key = None
+    if ttl > 0:
+        params = request.GET.copy()
+        for name in ("page", "sort"):
+            params.pop(name, None)
+        generation = cache.get(FILE_LIST_SUMMARY_GENERATION_KEY, 0)
+        digest = hashlib.sha256(params.urlencode().encode("utf-8")).hexdigest()[:16]
+        cache_key = f"file_list_summary:{generation}:{request.user.id}:{digest}"
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    totals = files.order_by().aggregate(count=Count("pk"), total_size=Sum("file_size"))
+    summary = {"count": totals["count"] or 0, "total_size": totals["total_size"] or 0}
+    if cache_key:
+        cache.set(cache_key, summary, ttl)
+    return summary
+
+
 @login_required 
 def file_list(request ):
-    sync_deleted_yandex_files_for_user(request.user)
+    schedule_reconcile(request.user)
     storage_quota =get_user_storage_usage(request.user )
     yandex_connection = get_yandex_connection(request.user, autocreate_from_social=True)
 
@@ -608,13 +1052,7 @@ def file_list(request ):
 
     if is_admin_user(request.user):
         files = File.objects.all()
-        query = request.GET.get('query')
-        if query:
-            files = files.filter(
-                Q(title__icontains=query) |
-                Q(description__icontains=query) |
-                Q(extracted_text__icontains=query)
-            )
+        files = apply_search(files, request.GET.get('query'))
         if request.GET.get('file_type'):
             files = files.filter(file_type=request.GET.get('file_type'))
         if request.GET.get('date_from'):
@@ -636,6 +1074,8 @@ def file_list(request ):
     if request.GET.get('favorites_only'):
         files = files.filter(favorite=request.user)
 
+    summary = _file_list_summary(request, files)
+
     favorite_through = File.favorite.through
     files = (
         files.select_related("uploaded_by")
@@ -648,25 +1088,32 @@ def file_list(request ):
             )
         )
         .prefetch_related("tags")
+        .defer("search_vector", "extracted_text")
     )
-    sort_raw = request.GET.get("sort", "-uploaded_at")
+    search_query = (request.GET.get('query') or '').strip()
+    sort_raw = request.GET.get("sort", "relevance" if search_query else "-uploaded_at")
     allowed_sort = (
         _FILE_LIST_SORT_FIELDS_ADMIN
         if is_admin_user(request.user)
         else _FILE_LIST_SORT_FIELDS
     )
-    sort_by = sort_raw if sort_raw in allowed_sort else "-uploaded_at"
-    files = files.order_by(sort_by)
+    if search_query and sort_raw == "relevance":
+        sort_by = "relevance"
+        files = files.order_by("-search_rank", "-uploaded_at")
+    else:
+        sort_by = sort_raw if sort_raw in allowed_sort else "-uploaded_at"
+        files = files.order_by(sort_by)
 
-    paginator =Paginator(files ,20 )
+    paginator =KnownCountPaginator(files ,20 ,count =summary["count"])
     page_number =request.GET.get('page')
     page_obj =paginator.get_page(page_number )
     for file_obj in page_obj:
         file_obj.can_edit = can_edit_file_object(request.user, file_obj)
         file_obj.can_delete = can_delete_file_object(request.user, file_obj)
+    attach_snippets(page_obj, search_query)
 
-    total_files =files.count()
-    total_size =sum(f.file_size for f in files )
+    total_files =summary["count"]
+    total_size =summary["total_size"]
 
     filter_params = request.GET.copy()
     if 'page' in filter_params:
@@ -681,6 +1128,7 @@ def file_list(request ):
     'search_form':FileSearchForm(request.GET ),
     'total_files':total_files ,
     'total_size':total_size ,
+    'total_size_display': format_bytes_ru(total_size),
     'tags':Tag.objects.all(),
     'selected_tag_ids': tag_ids,
     'filter_querystring': filter_querystring,
@@ -760,20 +1208,42 @@ def file_detail(request ,file_id ):
 
     return render(request ,'file_manager/file_detail.html',context )
 
+
+@login_required
+def file_processing_status(request, file_id):
+    """Состояние фоновой обработки загрузки (опрашивается со страниц списка и файла)."""
+    file_obj = get_object_or_404(File, id=file_id)
+    if not file_obj.can_access(request.user):
+        raise PermissionDenied
+    return JsonResponse(
+        {
+            "id": file_obj.id,
+            "state": file_obj.processing_state,
+            "state_display": file_obj.get_processing_state_display(),
+            "ready": file_obj.processing_state == "ready",
+            "error": file_obj.processing_error,
+        }
+    )
+
 @login_required 
 def file_download(request ,file_id ):
     file_obj =get_object_or_404(File ,id =file_id )
 
     if not file_obj.can_access(request.user ):
         raise PermissionDenied 
+    _require_content_available(file_obj)
 
     if file_obj.storage_provider == "yandex_disk" and file_obj.yandex_path:
         connection = get_yandex_connection(file_obj.uploaded_by, autocreate_from_social=True)
         if not connection:
             raise Http404
-        download_url = get_download_url(connection.access_token, file_obj.yandex_path)
-        response = requests.get(download_url, timeout=60)
-        response.raise_for_status()
+        output = _yandex_file_response(
+            request,
+            connection.access_token,
+            file_obj.yandex_path,
+            filename=file_obj.title,
+            as_attachment=True,
+        )
         FileActivity.log_activity(
             file=file_obj,
             user=request.user,
@@ -782,17 +1252,17 @@ def file_download(request ,file_id ):
             ip_address=request.META.get('REMOTE_ADDR')
         )
         file_obj.increment_download()
-        output = HttpResponse(response.content, content_type="application/octet-stream")
-        output['Content-Disposition'] = f'attachment; filename="{file_obj.title}"'
         return output
 
     if file_obj.file and os.path.exists(file_obj.file.path):
         FileActivity.log_activity(file=file_obj, user=request.user, activity_type='download', description=f'File downloaded: {file_obj.title }', ip_address=request.META.get('REMOTE_ADDR'))
         file_obj.increment_download()
-        with open(file_obj.file.path ,'rb')as fh :
-            response =HttpResponse(fh.read(),content_type ="application/octet-stream")
-            response ['Content-Disposition']=f'attachment; filename="{os.path.basename(file_obj.file.path)}"'
-            return response
+        return local_file_response(
+            request,
+            file_obj.file.path,
+            filename=file_obj.title,
+            as_attachment=True,
+        )
     raise Http404
 
 @login_required 
@@ -801,58 +1271,225 @@ def file_preview(request ,file_id ):
 
     if not file_obj.can_access(request.user ):
         raise PermissionDenied 
+    _require_content_available(file_obj)
     # добавлены разные форматы файлов для предпросмотра
-    file_ext = (file_obj.get_extension() or "").lower()
-    content_type = 'application/octet-stream'
-    if file_ext in ['txt', 'csv', 'log', 'md', 'json', 'xml', 'yaml', 'yml']:
-        content_type = 'text/plain; charset=utf-8'
-    elif file_ext in ['pdf']:
-        content_type ='application/pdf'
-    elif file_ext in ['jpg','jpeg']:
-        content_type ='image/jpeg'
-    elif file_ext in ['png']:
-        content_type ='image/png'
-    elif file_ext in ['gif']:
-        content_type = 'image/gif'
-    elif file_ext in ['webp']:
-        content_type = 'image/webp'
-    elif file_ext in ['svg']:
-        content_type = 'image/svg+xml'
-    elif file_ext in ['mp4']:
-        content_type = 'video/mp4'
-    elif file_ext in ['webm']:
-        content_type = 'video/webm'
-    elif file_ext in ['mp3']:
-        content_type = 'audio/mpeg'
-    elif file_ext in ['wav']:
-        content_type = 'audio/wav'
-    elif file_ext in ['ogg']:
-        content_type = 'audio/ogg'
+    content_type = _preview_content_type_by_ext(file_obj.get_extension())
 
     if file_obj.storage_provider == "yandex_disk" and file_obj.yandex_path:
         connection = get_yandex_connection(file_obj.uploaded_by, autocreate_from_social=True)
         if not connection:
             raise Http404
-        download_url = get_download_url(connection.access_token, file_obj.yandex_path)
-        resp = requests.get(download_url, timeout=60)
-        resp.raise_for_status()
-        response = HttpResponse(resp.content, content_type=content_type)
-        response['Content-Disposition'] = f'inline; filename="{file_obj.title}"'
-        return response
+        return _yandex_file_response(
+            request,
+            connection.access_token,
+            file_obj.yandex_path,
+            content_type=content_type,
+            filename=file_obj.title,
+        )
 
     if file_obj.file and os.path.exists(file_obj.file.path):
-        with open(file_obj.file.path ,'rb')as fh :
-            response =HttpResponse(fh.read(),content_type =content_type )
-            response ['Content-Disposition']=f'inline; filename="{os.path.basename(file_obj.file.path )}"'
-            return response
+        return local_file_response(
+            request,
+            file_obj.file.path,
+            content_type=content_type,
+            filename=file_obj.title,
+        )
     raise Http404
 
+def _file_source_sha256(file_obj):
+    """SHA-256 текущего содержимого, если он известен без чтения файла (blob, метаданные Диска)."""
+    if file_obj.storage_provider == "yandex_disk" and file_obj.yandex_path:
+        connection = get_yandex_connection(file_obj.uploaded_by, autocreate_from_social=True)
+        if not connection:
+            return ""
+        try:
+            info = get_resource_info(connection.access_token, file_obj.yandex_path)
+        except requests.RequestException:
+            return ""
+        return _remember_source_sha256(file_obj, (info or {}).get("sha256") or "")
+    if file_obj.content_blob_id:
+        return file_obj.content_blob.sha256
+    # Локальный файл до blob-хранилища (миграция 0010 их не переносила): хэш, посчитанный
+    # при первом чтении. Новое содержимое такой файл получает только через blob.
+    return file_obj.content_sha256
+
+
+def _remember_source_sha256(file_obj, sha256):
+    """
+    Запоминает SHA-256 содержимого вне blob-хранилища (файл Диска, старый локальный файл):
+    следующие запросы находят рендишны без чтения файла, prune_renditions их не удаляет.
+    """
+    outside_blobstore = file_obj.storage_provider == "yandex_disk" or not file_obj.content_blob_id
+    if sha256 and outside_blobstore and file_obj.content_sha256 != sha256:
+        File.objects.filter(pk=file_obj.pk).update(content_sha256=sha256)
+        file_obj.content_sha256 = sha256
+    return sha256
+
+
+def get_office_pdf_rendition(file_obj):
+    """PDF текущего содержимого офисного файла из кэша рендишнов (или конвертацией); None — нет исходника."""
+    source_sha256 = _file_source_sha256(file_obj)
+    rendition = renditions.find_rendition(source_sha256)
+    if rendition is not None:
+        return rendition
+    path, cleanup = _resolve_path_for_viewing(file_obj)
+    if not path:
+        return None
+    try:
+        return renditions.render_pdf(path, source_sha256)
+    finally:
+        if cleanup:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def _version_office_pdf_rendition(version_obj, ext):
+    rendition = renditions.find_rendition(version_obj.blob_sha256)
+    if rendition is not None:
+        return rendition
+    source_path, cleanup = _revision_blob_local_path(version_obj, suffix=f".{ext or 'bin'}")
+    try:
+        return renditions.render_pdf(source_path, version_obj.blob_sha256)
+    finally:
+        if cleanup:
+            try:
+                os.unlink(source_path)
+            except OSError:
+                pass
+
+
+def _viewer_pdf_sha256(file_obj):
+    """SHA-256 PDF, который показывает просмотрщик (сам файл или его PDF-рендишн), без чтения файла."""
+    ext = (file_obj.get_extension() or "").lower()
+    if ext == "pdf":
+        return _file_source_sha256(file_obj)
+    if ext in EXTENSIONS_LIBREOFFICE_TO_PDF:
+        rendition = renditions.find_rendition(_file_source_sha256(file_obj))
+        return rendition.content_blob.sha256 if rendition else ""
+    return ""
+
+
+@contextlib.contextmanager
+def _viewer_pdf_source(file_obj):
+    """
+    Локальный PDF для страниц просмотрщика: (путь, SHA-256). Для офисного файла — его
+    PDF-рендишн (конвертируется при необходимости). (None, "") — PDF получить нельзя.
+    """
+    ext = (file_obj.get_extension() or "").lower()
+    if ext in EXTENSIONS_LIBREOFFICE_TO_PDF:
+        rendition = get_office_pdf_rendition(file_obj)
+        if rendition is None:
+            yield None, ""
+        else:
+            yield renditions.rendition_path(rendition), rendition.content_blob.sha256
+        return
+    if ext != "pdf":
+        yield None, ""
+        return
+    path, cleanup = _resolve_path_for_viewing(file_obj)
+    if not path:
+        yield None, ""
+        return
+    try:
+        yield path, _file_source_sha256(file_obj) or _remember_source_sha256(file_obj, renditions.file_sha256(path))
+    finally:
+        if cleanup:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def render_file_thumbnail(file_obj):
+    """Превью изображения для списка файлов (рендишн image_thumb); None — файл недоступен или не читается."""
+    path, cleanup = _resolve_path_for_viewing(file_obj)
+    if not path:
+        return None
+    try:
+        source_sha256 = _file_source_sha256(file_obj) or _remember_source_sha256(file_obj, renditions.file_sha256(path))
+        rendition = renditions.render_image_thumbnail(path, source_sha256)
+    except thumbnails.ThumbnailError as exc:
+        logger.info("file thumbnail skipped file_id=%s: %s", file_obj.id, exc)
+        return None
+    finally:
+        if cleanup:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+    if not file_obj.has_preview:
+        # update(), а не save(): превью не меняет сам файл и не должно трогать updated_at.
+        File.objects.filter(pk=file_obj.pk).update(has_preview=True)
+        file_obj.has_preview = True
+    return rendition
+
+
+def prerender_viewer_renditions(file_obj):
+    """Фоновая подготовка просмотра (задача file.render_previews): превью изображения или PDF, линеаризация, миниатюры страниц."""
+    if (file_obj.get_extension() or "").lower() in thumbnails.IMAGE_EXTENSIONS:
+        render_file_thumbnail(file_obj)
+        return
+    with _viewer_pdf_source(file_obj) as (pdf_path, pdf_sha256):
+        if pdf_path:
+            renditions.prerender_pdf(pdf_path, pdf_sha256)
+
+
+def schedule_viewer_renditions(file_obj):
+    """Заранее готовит превью, PDF и страницы для просмотрщика фоновой задачей file.render_previews."""
+    ext = (file_obj.get_extension() or "").lower()
+    if ext in thumbnails.IMAGE_EXTENSIONS:
+        if getattr(settings, "THUMBNAIL_EAGER", True):
+            enqueue("file.render_previews", file_id=file_obj.id)
+        return
+    if not getattr(settings, "OFFICE_PDF_EAGER_RENDITIONS", True):
+        return
+    if ext in EXTENSIONS_LIBREOFFICE_TO_PDF:
+        if not is_office_pdf_conversion_available():
+            return
+    elif ext != "pdf" or not renditions.page_rendering_available():
+        return
+    enqueue("file.render_previews", file_id=file_obj.id)
+
+
+def _rendition_response(request, rendition, *, filename, content_type="application/pdf"):
+    """Рендишн с ETag по содержимому: повторное открытие документа — 304 без тела."""
+    etag = f'"{rendition.content_blob.sha256}"'
+    last_modified = int(rendition.created_at.timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = local_file_response(
+            request,
+            renditions.rendition_path(rendition),
+            content_type=content_type,
+            filename=filename,
+            etag=etag,
+            last_modified=last_modified,
+        )
+    else:
+        response["ETag"] = etag
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def _conversion_busy_response():
+    response = HttpResponse(
+        "Сервер конвертации занят, повторите через несколько секунд.",
+        status=503,
+        content_type="text/plain; charset=utf-8",
+    )
+    response["Retry-After"] = "5"
+    return response
+
+
 # Добавлено преобразование в PDF для предпросмотра документов
 @login_required
 def office_pdf_preview(request, file_id):
     file_obj = get_object_or_404(File, id=file_id)
     if not file_obj.can_access(request.user):
         raise PermissionDenied
+    _require_content_available(file_obj)
     ext = (file_obj.get_extension() or "").lower()
     if ext not in EXTENSIONS_LIBREOFFICE_TO_PDF:
         raise Http404
@@ -863,27 +1500,142 @@ def office_pdf_preview(request, file_id):
             status=503,
             content_type="text/plain; charset=utf-8",
         )
-    path, cleanup = _resolve_path_for_viewing(file_obj)
-    if not path:
+    try:
+        rendition = get_office_pdf_rendition(file_obj)
+    except ConversionBusyError:
+        return _conversion_busy_response()
+    except Exception as exc:
+        return HttpResponse(
+            f"Не удалось сконвертировать в PDF: {exc}",
+            status=502,
+            content_type="text/plain; charset=utf-8",
+        )
+    if rendition is None:
+        raise Http404
+    return _rendition_response(request, rendition, filename="preview.pdf")
+
+
+@login_required
+def file_pdf_pages(request, file_id):
+    """Манифест страниц для просмотрщика: число страниц, размеры миниатюр, линеаризованный PDF."""
+    file_obj = get_object_or_404(File, id=file_id)
+    if not file_obj.can_access(request.user):
+        raise PermissionDenied
+    _require_content_available(file_obj)
+    if not renditions.page_rendering_available():
         raise Http404
     try:
+        with _viewer_pdf_source(file_obj) as (pdf_path, pdf_sha256):
+            if not pdf_path:
+                raise Http404
+            page_count = renditions.pdf_page_count(pdf_path, pdf_sha256)
+        linear = renditions.find_rendition(pdf_sha256, renditions.KIND_PDF_LINEAR)
+    except ConversionBusyError:
+        return _conversion_busy_response()
+    except Http404:
+        raise
+    except Exception as exc:
+        return HttpResponse(
+            f"Не удалось подготовить страницы: {exc}",
+            status=502,
+            content_type="text/plain; charset=utf-8",
+        )
+    return JsonResponse(
+        {
+            "pageCount": page_count,
+            "thumbWidth": renditions.page_width(renditions.KIND_PAGE_THUMB),
+            "pageWidth": renditions.page_width(renditions.KIND_PAGE),
+            "pdfUrl": reverse("file_manager:file_pdf_linearized", args=[file_obj.id]) if linear else None,
+        }
+    )
+
+
+@login_required
+def file_pdf_page(request, file_id, page, size):
+    """Изображение одной страницы: size=thumb — миниатюра для ленты, full — страница целиком."""
+    kind = {"thumb": renditions.KIND_PAGE_THUMB, "full": renditions.KIND_PAGE}.get(size)
+    if kind is None:
+        raise Http404
+    file_obj = get_object_or_404(File, id=file_id)
+    if not file_obj.can_access(request.user):
+        raise PermissionDenied
+    _require_content_available(file_obj)
+    if not renditions.page_rendering_available():
+        raise Http404
+    rendition = renditions.find_rendition(_viewer_pdf_sha256(file_obj), kind, page)
+    if rendition is None:
         try:
-            pdf_bytes = convert_office_file_to_pdf_bytes(path)
+            with _viewer_pdf_source(file_obj) as (pdf_path, pdf_sha256):
+                if not pdf_path:
+                    raise Http404
+                rendition = renditions.render_page(pdf_path, pdf_sha256, page, kind)
+        except ConversionBusyError:
+            return _conversion_busy_response()
+        except ValueError:
+            raise Http404
+        except Http404:
+            raise
         except Exception as exc:
             return HttpResponse(
-                f"Не удалось сконвертировать в PDF: {exc}",
+                f"Не удалось отрисовать страницу: {exc}",
                 status=502,
                 content_type="text/plain; charset=utf-8",
             )
-        response = HttpResponse(pdf_bytes, content_type="application/pdf")
-        response["Content-Disposition"] = 'inline; filename="preview.pdf"'
-        return response
-    finally:
-        if cleanup:
-            try:
-                os.unlink(path)
-            except OSError:
-                pass
+    return _rendition_response(
+        request,
+        rendition,
+        filename=f"page-{page}.webp",
+        content_type=renditions.PAGE_IMAGE_CONTENT_TYPE,
+    )
+
+
+@login_required
+def file_pdf_linearized(request, file_id):
+    """Линеаризованный PDF (fast web view): pdf.js по Range получает первые страницы сразу."""
+    file_obj = get_object_or_404(File, id=file_id)
+    if not file_obj.can_access(request.user):
+        raise PermissionDenied
+    _require_content_available(file_obj)
+    rendition = renditions.find_rendition(_viewer_pdf_sha256(file_obj), renditions.KIND_PDF_LINEAR)
+    if rendition is None:
+        raise Http404
+    return _rendition_response(request, rendition, filename="preview.pdf")
+
+
+@login_required
+def file_thumbnail(request, file_id):
+    """Превью изображения для списка файлов; нет в кэше — создаётся по запросу."""
+    file_obj = get_object_or_404(File, id=file_id)
+    if not file_obj.can_access(request.user):
+        raise PermissionDenied
+    _require_content_available(file_obj)
+    if (file_obj.get_extension() or "").lower() not in thumbnails.IMAGE_EXTENSIONS:
+        raise Http404
+    rendition = renditions.find_rendition(_file_source_sha256(file_obj), renditions.KIND_IMAGE_THUMB)
+    if rendition is None:
+        rendition = render_file_thumbnail(file_obj)
+    if rendition is None:
+        raise Http404
+    return _rendition_response(
+        request,
+        rendition,
+        filename=f"thumb.{thumbnails.thumbnail_format()}",
+        content_type=thumbnails.thumbnail_content_type(),
+    )
+
+
+@login_required
+def media_thumbnail(request, token):
+    """Ленивая миниатюра аватара, обложки или вложения чата по подписанной ссылке из thumbnail_url."""
+    try:
+        name, preset = thumbnails.read_lazy_token(token)
+        thumbnails.get_preset(preset)
+    except (signing.BadSignature, ValueError, KeyError, TypeError):
+        raise Http404
+    if not thumbnails.is_image_name(name) or not default_storage.exists(name):
+        raise Http404
+    target = thumbnails.ensure_sidecar(name, preset)
+    return redirect(default_storage.url(target or name))
 
 
 @login_required
@@ -892,11 +1644,13 @@ def file_version_preview(request, file_id, version_id):
     if not file_obj.can_access(request.user):
         raise PermissionDenied
     version_obj = get_object_or_404(FileVersion, file=file_obj, id=version_id)
-    content = _read_revision_blob_bytes(version_obj)
-    ext = _version_ext(version_obj)
-    response = HttpResponse(content, content_type=_preview_content_type_by_ext(ext))
-    response['Content-Disposition'] = f'inline; filename="{version_obj.snapshot_title or file_obj.title}"'
-    return response
+    _require_version_available(file_obj, version_obj)
+    return _revision_blob_response(
+        request,
+        version_obj,
+        content_type=_preview_content_type_by_ext(_version_ext(version_obj)),
+        filename=version_obj.snapshot_title or file_obj.title,
+    )
 
 
 @login_required
@@ -905,6 +1659,7 @@ def file_version_office_pdf_preview(request, file_id, version_id):
     if not file_obj.can_access(request.user):
         raise PermissionDenied
     version_obj = get_object_or_404(FileVersion, file=file_obj, id=version_id)
+    _require_version_available(file_obj, version_obj)
     ext = _version_ext(version_obj)
     if ext not in EXTENSIONS_LIBREOFFICE_TO_PDF:
         raise Http404
@@ -914,21 +1669,11 @@ def file_version_office_pdf_preview(request, file_id, version_id):
             status=503,
             content_type="text/plain; charset=utf-8",
         )
-    content = _read_revision_blob_bytes(version_obj)
-    fd, temp_path = tempfile.mkstemp(suffix=f".{ext or 'bin'}")
-    os.close(fd)
     try:
-        with open(temp_path, "wb") as f:
-            f.write(content)
-        pdf_bytes = convert_office_file_to_pdf_bytes(temp_path)
-        response = HttpResponse(pdf_bytes, content_type="application/pdf")
-        response["Content-Disposition"] = 'inline; filename="version-preview.pdf"'
-        return response
-    finally:
-        try:
-            os.unlink(temp_path)
-        except OSError:
-            pass
+        rendition = _version_office_pdf_rendition(version_obj, ext)
+    except ConversionBusyError:
+        return _conversion_busy_response()
+    return _rendition_response(request, rendition, filename="version-preview.pdf")
 
 
 @login_required
@@ -938,6 +1683,7 @@ def file_version_inline_viewer(request, file_id, version_id):
     if not file_obj.can_access(request.user):
         raise PermissionDenied
     version_obj = get_object_or_404(FileVersion, file=file_obj, id=version_id)
+    _require_version_available(file_obj, version_obj)
     compare_with_id = request.GET.get("compare_with")
     compare_side = request.GET.get("side", "left")
     ext = _version_ext(version_obj)
@@ -1011,19 +1757,15 @@ def _resolve_path_for_viewing(file_obj):
         connection = get_yandex_connection(file_obj.uploaded_by, autocreate_from_social=True)
         if not connection:
             return None, False
-        download_url = get_download_url(connection.access_token, file_obj.yandex_path)
-        try:
-            resp = requests.get(download_url, timeout=120)
-        except requests.RequestException:
-            return None, False
-        if resp.status_code != 200:
-            return None, False
+        cached_path = _yandex_local_copy(connection.access_token, file_obj.yandex_path)
+        if cached_path:
+            return cached_path, False
         ext = (file_obj.get_extension() or "bin").lower()
         suffix = f".{ext}" if ext else ".bin"
-        fd, temp_path = tempfile.mkstemp(suffix=suffix)
-        os.close(fd)
-        with open(temp_path, "wb") as f:
-            f.write(resp.content)
+        try:
+            temp_path = get_engine().download_to_tempfile(connection.access_token, file_obj.yandex_path, suffix=suffix)
+        except (requests.RequestException, RuntimeError, OSError):
+            return None, False
         return temp_path, True
     if file_obj.file and file_obj.file.path and os.path.exists(file_obj.file.path):
         return file_obj.file.path, False
@@ -1038,6 +1780,7 @@ def file_viewer(request, file_id):
     file_obj = get_object_or_404(File, id=file_id)
     if not file_obj.can_access(request.user):
         raise PermissionDenied
+    _require_content_available(file_obj)
 
     ext = (file_obj.get_extension() or "").lower()
     versions = list(file_obj.versions.select_related("changed_by").order_by("-version_number"))
@@ -1053,6 +1796,9 @@ def file_viewer(request, file_id):
     preview_path = reverse("file_manager:file_preview", args=[file_obj.id])
     office_pdf_path = reverse("file_manager:office_pdf_preview", args=[file_obj.id])
     pdf_conversion_ready = is_office_pdf_conversion_available()
+    pages_path = (
+        reverse("file_manager:file_pdf_pages", args=[file_obj.id]) if renditions.page_rendering_available() else None
+    )
 
     if request.user != file_obj.uploaded_by:
         FileActivity.log_activity(
@@ -1116,11 +1862,12 @@ def file_viewer(request, file_id):
 
     if ext == "pdf":
         context["viewer_mode"] = "js_pdf"
-        context["viewer_config"] = {"previewUrl": preview_path, "ext": ext, "mode": "js_pdf"}
+        context["viewer_config"] = {"previewUrl": preview_path, "pagesUrl": pages_path, "ext": ext, "mode": "js_pdf"}
     elif ext in EXTENSIONS_LIBREOFFICE_TO_PDF and pdf_conversion_ready:
         context["viewer_mode"] = "js_pdf"
         context["viewer_config"] = {
             "previewUrl": office_pdf_path,
+            "pagesUrl": pages_path,
             "ext": "pdf",
             "mode": "js_pdf",
         }
@@ -1157,7 +1904,14 @@ def file_viewer(request, file_id):
             messages.error(request, "Не удалось получить файл для просмотра.")
             return redirect(detail_url)
         try:
-            text = extract_text_from_file(path) or ""
+            extraction = extract_text_cached(
+                path,
+                detect_format(file_obj.title) or detect_format(path),
+                sha256=file_obj.content_blob.sha256 if file_obj.content_blob_id and not cleanup else None,
+            )
+            text = extraction.text
+            if extraction.truncated:
+                context["text_truncated"] = True
             if not text.strip():
                 context["viewer_note"] = (
                     "Текст не извлечён (пустой файл или ограничение парсера). "
@@ -1285,12 +2039,14 @@ def file_delete(request ,file_id ):
         file_uploaded_by =file_obj.uploaded_by 
 
         yandex_path = file_obj.yandex_path
-        local_path = file_obj.file.path if file_obj.file else None
+        # Blob-содержимое отпускается сигналом post_delete и удаляется сборщиком collect_blobs.
+        local_path = file_obj.file.path if (file_obj.file and not is_blob_path(file_obj.file.name)) else None
         owner = file_obj.uploaded_by
 
         file_obj.delete()
 
-        FileActivity.objects.create(
+        FileActivity.log_activity(
+        file =None ,
         user =request.user ,
         activity_type ='delete',
         description =f'File deleted: {file_title }'
@@ -1334,8 +2090,7 @@ def file_version_create(request ,file_id ):
         form =FileVersionForm(request.POST ,request.FILES, current_file=file_obj)
         if form.is_valid():
             uploaded_file = request.FILES["version_file"]
-            uploaded_content = uploaded_file.read()
-            file_size = len(uploaded_content)
+            file_size = uploaded_file.size
             old_size = file_obj.file_size or 0
             extra_required = max(0, file_size - old_size)
             if file_obj.storage_provider == "local" and not storage_quota.has_enough_space(extra_required):
@@ -1345,22 +2100,30 @@ def file_version_create(request ,file_id ):
                 )
                 return redirect('file_manager:file_version_create',file_id =file_id )
 
-            scan = scan_upload_bytes(
-                uploaded_content,
-                user_id=request.user.id,
-                filename=uploaded_file.name,
-            )
+            quarantine = quarantine_enabled()
+            if quarantine:
+                scan = quarantine_placeholder()
+            else:
+                scan = scan_upload(
+                    uploaded_file,
+                    user_id=request.user.id,
+                    filename=uploaded_file.name,
+                )
             if scan.get("performed") and scan.get("clean") is False:
                 threat = scan.get("threat") or "неизвестная угроза"
                 messages.error(request, f"Новая версия не загружена: ClamAV обнаружил угрозу «{threat}».")
                 return redirect('file_manager:file_version_create', file_id=file_id)
-            if getattr(settings, "CLAMAV_ENABLED", False) and not scan.get("performed") and not getattr(settings, "CLAMAV_FAIL_OPEN", True):
+            if (
+                getattr(settings, "CLAMAV_ENABLED", False)
+                and not scan.get("performed")
+                and not quarantine
+                and not getattr(settings, "CLAMAV_FAIL_OPEN", True)
+            ):
                 err = scan.get("error") or "проверка не выполнена"
                 messages.error(request, f"Новая версия отклонена: ClamAV недоступен ({err}).")
                 return redirect('file_manager:file_version_create', file_id=file_id)
 
-            extracted_text = extract_text_from_uploaded_content(uploaded_file.name, uploaded_content)
-            banned_match = find_banned_match(extracted_text)
+            extracted_text, banned_match = extract_and_moderate(uploaded_file.name, uploaded_file)
             if banned_match:
                 messages.error(
                     request,
@@ -1370,12 +2133,12 @@ def file_version_create(request ,file_id ):
 
             version_number = file_obj.version + 1
             snapshot_path = file_obj.yandex_path if file_obj.storage_provider == "yandex_disk" else (file_obj.file.name if file_obj.file else "")
-            structured_snapshot = build_structured_snapshot(uploaded_file.name, uploaded_content)
+            structured_snapshot = build_structured_snapshot(uploaded_file.name, uploaded_file)
             try:
                 blob_info = _store_revision_blob(
                     file_obj=file_obj,
                     uploaded_by=request.user,
-                    content=uploaded_content,
+                    content=uploaded_file,
                     original_name=uploaded_file.name,
                     version_number=version_number,
                 )
@@ -1401,29 +2164,35 @@ def file_version_create(request ,file_id ):
                 structured_snapshot=structured_snapshot,
                 structured_schema_version=structured_snapshot.get("schema_version", "v1"),
                 version_file=blob_info["version_file_name"] or None,
+                content_blob=blob_info["content_blob"],
             )
 
-            old_file_path = file_obj.file.path if (file_obj.storage_provider == "local" and file_obj.file) else None
+            previous_local_content = None
             if file_obj.storage_provider == "yandex_disk":
                 connection = get_yandex_connection(owner, autocreate_from_social=True)
                 if not connection:
                     messages.error(request, "Не найдено подключение Яндекс.Диска владельца файла")
                     return redirect('file_manager:file_version_create', file_id=file_id)
                 target_yandex_path = file_obj.yandex_path or f"disk:/{file_obj.title}"
-                upload_file_bytes(connection.access_token, target_yandex_path, uploaded_content, overwrite=True)
+                get_engine().upload(connection.access_token, target_yandex_path, _rewound(uploaded_file), overwrite=True)
                 file_obj.yandex_path = target_yandex_path
             else:
-                file_obj.file.save(file_obj.title, ContentFile(uploaded_content), save=False)
-                if old_file_path and os.path.exists(old_file_path):
-                    try:
-                        os.remove(old_file_path)
-                    except OSError:
-                        pass
+                previous_local_content = _switch_local_content(file_obj, _rewound(uploaded_file))
 
             file_obj.file_size = file_size
             file_obj.extracted_text = extracted_text
             file_obj.version = version_number
+            if quarantine:
+                # Новая версия недоступна другим пользователям, пока её не проверит file.scan_upload.
+                file_obj.processing_state = "quarantine"
+                file_obj.processing_error = ""
             file_obj.save()
+            if previous_local_content:
+                _drop_previous_local_content(previous_local_content)
+            if quarantine:
+                enqueue("file.scan_upload", file_id=file_obj.id)
+            else:
+                schedule_viewer_renditions(file_obj)
 
             FileActivity.log_activity(
             file =file_obj ,
@@ -1511,6 +2280,9 @@ def file_version_restore(request, file_id, version_id):
     if not can_upload_file_version(request.user, file_obj):
         raise PermissionDenied
     target_version = get_object_or_404(FileVersion, file=file_obj, id=version_id)
+    if target_version.content_blocked:
+        messages.error(request, "Эта версия заблокирована антивирусом и не может быть восстановлена.")
+        return redirect("file_manager:file_detail", file_id=file_id)
     if not target_version.has_blob and not target_version.version_file:
         messages.error(request, "Эта версия legacy и не содержит blob для восстановления.")
         return redirect("file_manager:file_detail", file_id=file_id)
@@ -1523,7 +2295,7 @@ def file_version_restore(request, file_id, version_id):
 
     restored_text = target_version.extracted_text_snapshot or ""
     owner = file_obj.uploaded_by
-    old_file_path = file_obj.file.path if (file_obj.storage_provider == "local" and file_obj.file) else None
+    previous_local_content = None
     if file_obj.storage_provider == "yandex_disk":
         connection = get_yandex_connection(owner, autocreate_from_social=True)
         if not connection:
@@ -1533,12 +2305,7 @@ def file_version_restore(request, file_id, version_id):
         upload_file_bytes(connection.access_token, target_yandex_path, restored_content, overwrite=True)
         file_obj.yandex_path = target_yandex_path
     else:
-        file_obj.file.save(file_obj.title, ContentFile(restored_content), save=False)
-        if old_file_path and os.path.exists(old_file_path):
-            try:
-                os.remove(old_file_path)
-            except OSError:
-                pass
+        previous_local_content = _switch_local_content(file_obj, restored_content)
 
     new_version_number = file_obj.version + 1
     try:
@@ -1571,12 +2338,16 @@ def file_version_restore(request, file_id, version_id):
         structured_snapshot=target_version.structured_snapshot,
         structured_schema_version=target_version.structured_schema_version or "v1",
         version_file=blob_info["version_file_name"] or None,
+        content_blob=blob_info["content_blob"],
     )
 
     file_obj.file_size = len(restored_content)
     file_obj.extracted_text = restored_text
     file_obj.version = new_version_number
     file_obj.save()
+    if previous_local_content:
+        _drop_previous_local_content(previous_local_content)
+    schedule_viewer_renditions(file_obj)
 
     FileActivity.log_activity(
         file=file_obj,
@@ -1664,6 +2435,8 @@ def file_comment_delete(request ,comment_id ):
 
 @login_required 
 def activity_log(request ):
+    # События этого процесса, ещё лежащие в буфере, должны попасть в журнал, который сейчас покажем.
+    activity_buffer.flush()
     if is_admin_user(request.user):
         activities = FileActivity.objects.all().select_related('file', 'user')
     else:
@@ -1673,9 +2446,13 @@ def activity_log(request ):
     if activity_type :
         activities =activities.filter(activity_type =activity_type )
 
-    paginator =Paginator(activities ,20 )
-    page_number =request.GET.get('page')
-    page_obj =paginator.get_page(page_number )
+    # Keyset по (created_at, id): глубокие страницы не дороже первой (OFFSET и COUNT не нужны).
+    page_obj =keyset_page(
+    activities ,
+    before =request.GET.get('before'),
+    after =request.GET.get('after'),
+    per_page =20 ,
+    )
 
     context ={
     'page_obj':page_obj ,
@@ -1835,13 +2612,17 @@ def yandex_file_picker(request):
         if not selected_path or not selected_name:
             messages.error(request, "Файл не выбран")
             return redirect("file_manager:yandex_picker")
-        download_url = get_download_url(connection.access_token, selected_path)
-        if not download_url:
-            messages.error(request, "Не удалось получить ссылку на скачивание")
+        suffix = PurePosixPath(selected_name).suffix
+        try:
+            temp_path = get_engine().download_to_tempfile(connection.access_token, selected_path, suffix=suffix)
+        except (requests.RequestException, RuntimeError):
+            messages.error(request, "Не удалось скачать файл с Яндекс.Диска")
             return redirect("file_manager:yandex_picker")
-        response = requests.get(download_url, timeout=60)
-        response.raise_for_status()
-        file_obj = import_yandex_file(request.user, selected_name, response.content)
+        try:
+            file_obj = import_yandex_file(request.user, selected_name, temp_path)
+        finally:
+            os.unlink(temp_path)
+        schedule_viewer_renditions(file_obj)
         storage_quota = get_user_storage_usage(request.user)
         storage_quota.update_usage()
         if assignment_id:
@@ -1883,6 +2664,7 @@ def yandex_export_file(request, file_id):
     file_obj = get_object_or_404(File, id=file_id)
     if not file_obj.can_access(request.user):
         raise PermissionDenied
+    _require_content_available(file_obj)
 
     connection = get_yandex_connection(request.user, autocreate_from_social=True)
     if not connection:
@@ -1895,8 +2677,7 @@ def yandex_export_file(request, file_id):
 
     yandex_path = f"disk:/{file_obj.title}"
     try:
-        with open(file_obj.file.path, "rb") as fh:
-            upload_file_bytes(connection.access_token, yandex_path, fh.read(), overwrite=True)
+        get_engine().upload(connection.access_token, yandex_path, file_obj.file.path, overwrite=True)
     except Exception:
         messages.error(request, "Не удалось выгрузить файл на Яндекс.Диск")
         return redirect("file_manager:file_detail", file_id=file_obj.id)
@@ -1905,34 +2686,60 @@ def yandex_export_file(request, file_id):
     return redirect("file_manager:file_detail", file_id=file_obj.id)
 
 
+def _archive_fetch(access_token, yandex_path, *, suffix=""):
+    """
+    Содержимое файла Диска для архива (в пуле zipstream, не до начала ответа): открытая
+    запись локального кэша или, если её нет или её успели вытеснить, временный файл с Диска.
+    """
+    cached_path = content_cache.lookup(access_token, yandex_path)
+    if cached_path:
+        try:
+            return open(cached_path, "rb")
+        except FileNotFoundError:
+            logger.info("archive: запись кэша %s вытеснена, файл скачивается с Диска", yandex_path)
+    return get_engine().download_to_tempfile(access_token, yandex_path, suffix=suffix)
+
+
 @login_required
 def download_all_files_archive(request):
-    files = File.objects.filter(uploaded_by=request.user)
+    files = File.objects.filter(uploaded_by=request.user).exclude(processing_state__in=File.CONTENT_BLOCKED_STATES)
     if files.count() == 0:
         messages.error(request, "Нет файлов для скачивания")
         return redirect("file_manager:file_list")
     else:
-        archive_buffer = io.BytesIO()
-        with zipfile.ZipFile(archive_buffer, "w", zipfile.ZIP_DEFLATED) as archive:
-            for file_obj in files:
-                try:
-                    if file_obj.storage_provider == "yandex_disk" and file_obj.yandex_path:
-                        connection = get_yandex_connection(file_obj.uploaded_by, autocreate_from_social=True)
-                        if not connection:
-                            continue
-                        href = get_download_url(connection.access_token, file_obj.yandex_path)
-                        content = requests.get(href, timeout=60).content
-                        archive.writestr(file_obj.title, content)
-                    elif file_obj.file:
-                        file_path = Path(file_obj.file.path)
-                        if file_path.exists():
-                            archive.write(file_path, arcname=file_path.name)
-                except Exception:
-                    continue
-        archive_buffer.seek(0)
-        response = HttpResponse(archive_buffer.getvalue(), content_type="application/zip")
-        response["Content-Disposition"] = 'attachment; filename="portfolio_files.zip"'
-        return response
+        # Архив отдаётся потоком (zipstream.py): первые байты уходят сразу, память не растёт
+        # с размером архива. Файлы Яндекс.Диска скачиваются во временные файлы параллельно,
+        # не больше YANDEX_TRANSFER_CONCURRENCY впереди записываемого.
+        engine = get_engine()
+        connection = None
+        entries = []
+        for file_obj in files:
+            try:
+                if file_obj.storage_provider == "yandex_disk" and file_obj.yandex_path:
+                    connection = connection or get_yandex_connection(file_obj.uploaded_by, autocreate_from_social=True)
+                    if not connection:
+                        continue
+                    entries.append(ZipEntry(
+                        file_obj.title,
+                        fetch=partial(
+                            _archive_fetch,
+                            connection.access_token,
+                            file_obj.yandex_path,
+                            suffix=PurePosixPath(file_obj.title).suffix,
+                        ),
+                    ))
+                elif file_obj.file:
+                    file_path = Path(file_obj.file.path)
+                    if file_path.exists():
+                        entries.append(ZipEntry(file_obj.title, path=str(file_path)))
+            except Exception:
+                continue
+        return generated_content_response(
+            stream_zip(entries, chunk_size=get_chunk_size(), prefetch=engine.concurrency),
+            content_type="application/zip",
+            filename="portfolio_files.zip",
+            as_attachment=True,
+        )
 
 
 @login_required
@@ -2169,6 +2976,7 @@ def workspace_add_file(request, file_id):
     file_obj = get_object_or_404(File, id=file_id)
     if not file_obj.can_access(request.user):
         raise PermissionDenied
+    _require_content_available(file_obj)
     if not can_edit_file_object(request.user, file_obj):
         messages.error(
             request,
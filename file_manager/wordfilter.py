@@ -4,12 +4,23 @@
 Формат файла: одна запись на строку; `#` — комментарий до конца строки.
 Пустые строки игнорируются. Одно слово ищется как целое слово (регистр не важен);
 если в строке есть пробел — фраза ищется как подстрока (регистр не важен).
+
+Словарь компилируется один раз на mtime words.txt в BannedWordMatcher: все слова — в одно
+регулярное выражение, построенное по префиксному дереву (общие префиксы не повторяются,
+на каждой позиции текста проверяется не больше символов, чем в самой длинной записи),
+фразы — во второе. Текст просматривается один раз на выражение, а не ~1300 раз, как при
+отдельном re.compile на каждую запись. Текст можно подавать кусками (scan, stream) —
+так извлечение текста (extraction.py) проверяет документ по страницам и останавливается
+на первой найденной записи. Модуль не требует настроенного Django: matcher передаётся
+в процессы пула извлечения.
+Сравнение со старой реализацией: manage.py bench_wordfilter.
 """
 from __future__ import annotations
 
 import logging
 import os
 import re
+from typing import Iterable
 
 from django.contrib.staticfiles import finders
 
@@ -19,6 +30,9 @@ STATIC_REL_PATH = "file_manager/words.txt"
 
 _mtime_cache: float | None = None
 _words_cache: frozenset[str] | None = None
+_matcher_cache: BannedWordMatcher | None = None
+
+_END = ""
 
 
 def _read_words_file(path: str) -> frozenset[str]:
@@ -35,9 +49,138 @@ def _read_words_file(path: str) -> frozenset[str]:
     return frozenset(out)
 
 
+def _trie_pattern(keys: Iterable[str]) -> str:
+    """Регулярное выражение по префиксному дереву ключей: бл(?:я|яд(?:ки|ство)?) вместо бля|блядки|блядство."""
+    root: dict = {}
+    for key in keys:
+        node = root
+        for ch in key:
+            node = node.setdefault(ch, {})
+        node[_END] = {}
+
+    def build(node: dict) -> str:
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch != _END]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if _END in node:
+            # Жадный «?»: на позиции сначала пробуется более длинная запись.
+            return f"(?:{body})?"
+        return body
+
+    return build(root)
+
+
+class BannedWordMatcher:
+    """Скомпилированный словарь: целые слова и фразы-подстроки без учёта регистра."""
+
+    def __init__(self, entries: Iterable[str]):
+        # Ключ — запись в нижнем регистре, значение — как в words.txt (её и возвращаем).
+        self._entries: dict[str, str] = {}
+        for entry in sorted(entries):
+            e = entry.strip()
+            if e:
+                self._entries.setdefault(e.lower(), entry)
+        words = [key for key in self._entries if " " not in key]
+        phrases = [key for key in self._entries if " " in key]
+        flags = re.IGNORECASE | re.UNICODE
+        # Просмотр вперёд с группой: совпадения ищутся на каждой позиции, в том числе перекрывающиеся.
+        self._words_re = (
+            re.compile(r"(?<!\w)(?=(" + _trie_pattern(words) + r")(?!\w))", flags) if words else None
+        )
+        self._phrases_re = re.compile(r"(?=(" + _trie_pattern(phrases) + "))", flags) if phrases else None
+        self.max_length = max((len(key) for key in self._entries), default=0)
+
+    def __bool__(self) -> bool:
+        return bool(self._entries)
+
+    def _matches(self, text: str, *, pos: int = 0, checked: int = 0, final: bool = True) -> Iterable[str]:
+        """
+        Ключи записей в text начиная с pos (символы до pos — только контекст для границы
+        слова). Совпадения, кончающиеся не дальше checked, уже проверены и пропускаются.
+        final=False — text обрывается на полуслове, совпадение у самого конца не засчитывается
+        (граница слова станет известна со следующим куском).
+        """
+        limit = len(text) if final else len(text) - 1
+        for pattern in (self._words_re, self._phrases_re):
+            if pattern is None:
+                continue
+            for m in pattern.finditer(text, pos):
+                if checked < m.end(1) <= limit:
+                    yield m.group(1).lower()
+
+    def _pick(self, keys: Iterable[str]) -> str | None:
+        # Как раньше: из найденного — самая длинная запись словаря.
+        best = max(keys, key=lambda key: (len(key), key), default=None)
+        return self._entries.get(best, best) if best is not None else None
+
+    def find(self, text: str) -> str | None:
+        """Запись словаря, найденная в text (самая длинная из найденных), иначе None."""
+        if not text or not self._entries:
+            return None
+        return self._pick(self._matches(text))
+
+    def stream(self) -> MatchStream:
+        return MatchStream(self)
+
+    def scan(self, chunks: Iterable[str]) -> str | None:
+        """
+        Проверка текста кусками; останавливается на первом куске с найденной записью
+        (из его совпадений — самая длинная). Итератор chunks дальше не читается.
+        """
+        if not self._entries:
+            return None
+        stream = self.stream()
+        for chunk in chunks:
+            if hit := stream.feed(chunk):
+                return hit
+        return stream.finish()
+
+
+class MatchStream:
+    """
+    Инкрементальная проверка: feed(кусок) -> запись или None, в конце finish(). Между кусками
+    хранится только хвост длиной в самую длинную запись (+1 символ для границы слова),
+    поэтому слово или фраза на стыке кусков не теряются, а весь текст не собирается.
+    Символ перед хвостом хранится отдельно: без него начало хвоста посреди слова выглядело бы
+    границей слова. Совпадения, уже проверенные в прошлом куске, повторно не сообщаются.
+    """
+
+    def __init__(self, matcher: BannedWordMatcher):
+        self._matcher = matcher
+        self._context = ""
+        self._tail = ""
+        # Сколько символов от начала хвоста уже проверено (совпадения, кончающиеся в них).
+        self._checked = 0
+
+    def _check(self, chunk: str, *, final: bool) -> str | None:
+        buffer = self._context + self._tail + chunk
+        start = len(self._context)
+        hit = self._matcher._pick(
+            self._matcher._matches(buffer, pos=start, checked=start + self._checked, final=final)
+        )
+        cut = max(len(buffer) - (self._matcher.max_length + 1), start)
+        self._context = buffer[cut - 1:cut] if cut > 0 else ""
+        self._tail = buffer[cut:]
+        self._checked = len(buffer) - 1 - cut
+        return hit
+
+    def feed(self, chunk: str) -> str | None:
+        if not chunk or not self._matcher:
+            return None
+        return self._check(chunk, final=False)
+
+    def finish(self) -> str | None:
+        if not self._tail or not self._matcher:
+            return None
+        hit = self._check("", final=True)
+        self._context, self._tail, self._checked = "", "", 0
+        return hit
+
+
 def load_banned_entries() -> frozenset[str]:
     """Слова/фразы из words.txt; при отсутствии файла — пустой набор."""
-    global _mtime_cache, _words_cache
+    global _mtime_cache, _words_cache, _matcher_cache
     path = finders.find(STATIC_REL_PATH)
     if not path:
         return frozenset()
@@ -50,34 +193,32 @@ def load_banned_entries() -> frozenset[str]:
     words = _read_words_file(path)
     _mtime_cache = mtime
     _words_cache = words
+    _matcher_cache = None
     return words
 
 
+def get_matcher() -> BannedWordMatcher:
+    """Скомпилированный словарь; пересобирается, только когда меняется mtime words.txt."""
+    global _matcher_cache
+    entries = load_banned_entries()
+    matcher = _matcher_cache
+    if matcher is None or entries is not _words_cache:
+        matcher = BannedWordMatcher(entries)
+        if entries is _words_cache:
+            _matcher_cache = matcher
+    return matcher
+
+
 def find_banned_match(text: str) -> str | None:
     """
     Возвращает первую найденную запись из словаря, если она встречается в text, иначе None.
+    При нескольких совпадениях — самую длинную запись.
     """
     if not text or not text.strip():
         return None
-    entries = load_banned_entries()
-    if not entries:
-        return None
-    lowered_full = text.lower()
-    for entry in sorted(entries, key=len, reverse=True):
-        e = entry.strip()
-        if not e:
-            continue
-        if " " in e:
-            if e.lower() in lowered_full:
-                return entry
-            continue
-        try:
-            pattern = re.compile(
-                r"(?<!\w)" + re.escape(e) + r"(?!\w)",
-                re.IGNORECASE | re.UNICODE,
-            )
-        except re.error:
-            continue
-        if pattern.search(text):
-            return entry
-    return None
+    return get_matcher().find(text)
+
+
+def find_banned_match_in_chunks(chunks: Iterable[str]) -> str | None:
+    """find_banned_match для текста, приходящего кусками (потоковое извлечение)."""
+    return get_matcher().scan(chunks)
@@ -1,10 +1,56 @@
-import requests
+"""
+Клиент REST API Яндекс.Диска.
+
+YandexDiskClient держит один requests.Session на процесс:
+  - keep-alive и пул соединений (YANDEX_HTTP_POOL_SIZE) вместо нового TLS на каждый вызов;
+  - повторы с экспоненциальной паузой на 429 / 5xx и сетевые ошибки
+    (YANDEX_HTTP_RETRIES, YANDEX_HTTP_BACKOFF; Retry-After учитывается);
+  - кэш уже существующих папок в памяти процесса: загрузка в известную папку
+    не делает PUT на каждый сегмент пути;
+  - кэш в Django-кэше (Redis) подписанных ссылок на скачивание (не дольше их срока
+    действия из параметра expires), метаданных ресурса (размер, md5, дата изменения)
+    и сведений о диске. Загрузка и удаление через клиент сбрасывают записи пути и диска;
+    ключи строятся из хэша токена и пути, сам токен в кэш не попадает.
+Функции модуля (list_files, upload_file_bytes, …) — прежний интерфейс поверх get_client().
+YANDEX_DISK_API_BASE переопределяет адрес API (локальный фейковый сервер в тестах,
+см. fake_yandex.py).
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
 from pathlib import PurePosixPath
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+logger = logging.getLogger(__name__)
 
 YANDEX_OAUTH_URL = "https://oauth.yandex.ru/authorize"
 YANDEX_TOKEN_URL = "https://oauth.yandex.ru/token"
-YANDEX_DISK_API = "https://cloud-api.yandex.net/v1/disk/resources"
+YANDEX_DISK_API_BASE = "https://cloud-api.yandex.net/v1/disk"
+YANDEX_DISK_API = f"{YANDEX_DISK_API_BASE}/resources"
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Ответы сервера загрузки на устаревшую ссылку из кэша: ссылку нужно получить заново.
+STALE_HREF_STATUSES = (403, 404, 410)
+KNOWN_FOLDERS_LIMIT = 10_000
+
+# Поля метаданных ресурса, которые кэшируются (без превью, _embedded и т.п.).
+RESOURCE_INFO_FIELDS = (
+    "name", "path", "type", "size", "md5", "sha256", "revision", "modified", "mime_type", "media_type",
+)
+# Ссылку на скачивание перестаём отдавать из кэша за столько секунд до её истечения.
+DOWNLOAD_URL_EXPIRY_MARGIN = 60
 
 
 def get_authorize_url(client_id, redirect_uri, state):
@@ -14,137 +60,376 @@ def get_authorize_url(client_id, redirect_uri, state):
     )
 
 
+def split_disk_root(path: str) -> tuple[str, str]:
+    """'app:/a/b' -> ('app:', 'a/b'); путь без корня считается disk:."""
+    path_str = str(path)
+    for root in ("app:", "disk:"):
+        if path_str.startswith(f"{root}/"):
+            return root, path_str[len(root) + 1 :]
+    return "disk:", path_str.lstrip("/")
+
+
+class YandexDiskClient:
+    def __init__(
+        self,
+        *,
+        api_base: str = YANDEX_DISK_API_BASE,
+        pool_size: int = 10,
+        retries: int = 3,
+        backoff: float = 0.5,
+        timeout: float = 20,
+        upload_timeout: float = 60,
+        download_url_ttl: int = 0,
+        resource_info_ttl: int = 0,
+        disk_info_ttl: int = 0,
+    ):
+        self.api_base = api_base.rstrip("/")
+        self.download_url_ttl = download_url_ttl
+        self.resource_info_ttl = resource_info_ttl
+        self.disk_info_ttl = disk_info_ttl
+        self.resources_url = f"{self.api_base}/resources"
+        self.timeout = timeout
+        self.upload_timeout = upload_timeout
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=RETRY_STATUSES,
+            # Без POST: обмен кода на токен и копирование/перемещение не идемпотентны —
+            # повтор после обрыва мог бы выполнить операцию дважды.
+            allowed_methods=frozenset({"GET", "HEAD", "PUT", "DELETE"}),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._known_folders: OrderedDict[tuple[str, str], None] = OrderedDict()
+        self._known_lock = threading.Lock()
+
+    # --- кэш существующих папок -------------------------------------------------
+
+    @staticmethod
+    def _token_key(access_token: str) -> str:
+        return hashlib.sha256(access_token.encode("utf-8")).hexdigest()[:16]
+
+    def _is_known_folder(self, access_token: str, path: str) -> bool:
+        with self._known_lock:
+            return (self._token_key(access_token), path) in self._known_folders
+
+    def _remember_folder(self, access_token: str, path: str) -> None:
+        with self._known_lock:
+            self._known_folders[(self._token_key(access_token), path)] = None
+            self._known_folders.move_to_end((self._token_key(access_token), path))
+            while len(self._known_folders) > KNOWN_FOLDERS_LIMIT:
+                self._known_folders.popitem(last=False)
+
+    def forget_folders(self, access_token: str, path: str | None = None) -> None:
+        """Забывает папку path и вложенные (или все папки токена, если path не задан)."""
+        token_key = self._token_key(access_token)
+        with self._known_lock:
+            for key in list(self._known_folders):
+                if key[0] != token_key:
+                    continue
+                if path is None or key[1] == path or key[1].startswith(f"{path}/"):
+                    del self._known_folders[key]
+
+    # --- кэш ссылок и метаданных ------------------------------------------------
+
+    @staticmethod
+    def _cache_key(kind: str, access_token: str, path: str = "") -> str:
+        digest = hashlib.sha256(f"{access_token}\0{path}".encode("utf-8")).hexdigest()[:32]
+        return f"yandex:{kind}:{digest}"
+
+    def _download_url_ttl(self, href: str) -> int:
+        ttl = self.download_url_ttl
+        expires = parse_qs(urlsplit(href).query).get("expires")
+        if expires:
+            try:
+                ttl = min(ttl, int(expires[0]) - int(time.time()) - DOWNLOAD_URL_EXPIRY_MARGIN)
+            except ValueError:
+                pass
+        return int(ttl)
+
+    def invalidate(self, access_token: str, path: str | None = None) -> None:
+        """Сбрасывает кэш ссылки и метаданных path (если задан) и сведения о диске."""
+        keys = [self._cache_key("disk", access_token)]
+        if path:
+            keys += [self._cache_key("href", access_token, str(path)), self._cache_key("info", access_token, str(path))]
+        cache.delete_many(keys)
+
+    # --- API ---------------------------------------------------------------------
+
+    @staticmethod
+    def _auth(access_token: str) -> dict[str, str]:
+        return {"Authorization": f"OAuth {access_token}"}
+
+    def exchange_code_for_token(self, client_id, client_secret, code):
+        response = self.session.post(
+            YANDEX_TOKEN_URL,
+            data={
+                "grant_type": "authorization_code",
+                "code": code,
+                "client_id": client_id,
+                "client_secret": client_secret,
+            },
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def list_files(self, access_token, limit=100, path=None, offset=0, fields=None):
+        params = {"limit": limit}
+        if path:
+            params["path"] = path
+        if offset:
+            params["offset"] = offset
+        if fields:
+            params["fields"] = fields
+        response = self.session.get(
+            self.resources_url,
+            params=params,
+            headers=self._auth(access_token),
+            timeout=self.timeout,
+        )
+        if path and response.status_code == 404:
+            return None
+        response.raise_for_status()
+        data = response.json()
+        return data.get("_embedded", {}).get("items", [])
+
+    def iter_folder_names(self, access_token, path, page_size=1000):
+        names = []
+        offset = 0
+        while True:
+            items = self.list_files(
+                access_token,
+                limit=page_size,
+                path=path,
+                offset=offset,
+                fields="_embedded.items.name",
+            )
+            if items is None:
+                return None if offset == 0 else names
+            names.extend(item["name"] for item in items if item.get("name"))
+            if len(items) < page_size:
+                return names
+            offset += page_size
+
+    def get_disk_info(self, access_token):
+        key = self._cache_key("disk", access_token)
+        if self.disk_info_ttl > 0:
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+        response = self.session.get(self.api_base, headers=self._auth(access_token), timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        if self.disk_info_ttl > 0:
+            cache.set(key, data, self.disk_info_ttl)
+        return data
+
+    def get_resource_info(self, access_token, path):
+        """Метаданные ресурса (кэшируются только поля RESOURCE_INFO_FIELDS) или None, если его нет."""
+        key = self._cache_key("info", access_token, str(path))
+        if self.resource_info_ttl > 0:
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+        response = self.session.get(
+            self.resources_url,
+            params={"path": path},
+            headers=self._auth(access_token),
+            timeout=self.timeout,
+        )
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        data = response.json()
+        if self.resource_info_ttl > 0:
+            data = {field: data[field] for field in RESOURCE_INFO_FIELDS if field in data}
+            cache.set(key, data, self.resource_info_ttl)
+        return data
+
+    def resource_exists(self, access_token, path):
+        return self.get_resource_info(access_token, path) is not None
+
+    def get_download_url(self, access_token, path, *, fresh=False):
+        """Подписанная ссылка на скачивание; повторный вызов берёт её из кэша, пока она действует."""
+        key = self._cache_key("href", access_token, str(path))
+        if self.download_url_ttl > 0 and not fresh:
+            cached = cache.get(key)
+            if cached:
+                return cached
+        response = self.session.get(
+            f"{self.resources_url}/download",
+            params={"path": path},
+            headers=self._auth(access_token),
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        href = response.json().get("href")
+        if href and self.download_url_ttl > 0:
+            ttl = self._download_url_ttl(href)
+            if ttl > 0:
+                cache.set(key, href, ttl)
+        return href
+
+    def get_upload_url(self, access_token, path, overwrite=True):
+        response = self.session.get(
+            f"{self.resources_url}/upload",
+            params={"path": path, "overwrite": str(overwrite).lower()},
+            headers=self._auth(access_token),
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json().get("href")
+
+    def ensure_disk_segment(self, access_token, path):
+        """Создаёт папку на Яндекс.Диске (201 — создана, 409 — уже есть)."""
+        response = self.session.put(
+            self.resources_url,
+            params={"path": path},
+            headers=self._auth(access_token),
+            timeout=self.timeout,
+        )
+        if response.status_code not in (201, 409):
+            response.raise_for_status()
+        self._remember_folder(access_token, path)
+
+    def ensure_disk_parent_segments(self, access_token, file_path):
+        root, rootless_file = split_disk_root(file_path)
+        if "/" not in rootless_file:
+            return
+        parent_path = rootless_file.rsplit("/", 1)[0]
+        parts = [part for part in PurePosixPath(parent_path).parts if part not in ("", ".")]
+        chain = []
+        current = root
+        for part in parts:
+            current = f"{current}/{part}"
+            chain.append(current)
+        # Известна самая глубокая папка — значит, известна и вся цепочка.
+        if chain and self._is_known_folder(access_token, chain[-1]):
+            return
+        for folder in chain:
+            if not self._is_known_folder(access_token, folder):
+                self.ensure_disk_segment(access_token, folder)
+
+    def prepare_upload(self, access_token, path, overwrite=True):
+        """Создаёт недостающие папки и возвращает href для PUT содержимого."""
+        self.ensure_disk_parent_segments(access_token, path)
+        try:
+            upload_url = self.get_upload_url(access_token, path, overwrite=overwrite)
+        except requests.HTTPError as exc:
+            # 409 DiskPathDoesntExistsError: папку из кэша удалили вне приложения — создаём заново.
+            if exc.response is None or exc.response.status_code != 409:
+                raise
+            self.forget_folders(access_token)
+            self.ensure_disk_parent_segments(access_token, path)
+            upload_url = self.get_upload_url(access_token, path, overwrite=overwrite)
+        if not upload_url:
+            raise RuntimeError("Не удалось получить upload URL Яндекс.Диска")
+        return upload_url
+
+    def upload_file_bytes(self, access_token, path, content, overwrite=True):
+        upload_url = self.prepare_upload(access_token, path, overwrite=overwrite)
+        response = self.session.put(upload_url, data=content, timeout=self.upload_timeout)
+        response.raise_for_status()
+        self.invalidate(access_token, path)
+
+    def delete_resource(self, access_token, path, permanently=False):
+        response = self.session.delete(
+            self.resources_url,
+            params={"path": path, "permanently": str(permanently).lower()},
+            headers=self._auth(access_token),
+            timeout=self.timeout,
+        )
+        self.forget_folders(access_token, str(path))
+        self.invalidate(access_token, path)
+        # 202 accepted or 204 no content are successful variants
+        if response.status_code not in (202, 204):
+            response.raise_for_status()
+
+
+_client: YandexDiskClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> YandexDiskClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = YandexDiskClient(
+                    api_base=getattr(settings, "YANDEX_DISK_API_BASE", "") or YANDEX_DISK_API_BASE,
+                    pool_size=int(getattr(settings, "YANDEX_HTTP_POOL_SIZE", 10) or 10),
+                    retries=int(getattr(settings, "YANDEX_HTTP_RETRIES", 3)),
+                    backoff=float(getattr(settings, "YANDEX_HTTP_BACKOFF", 0.5)),
+                    download_url_ttl=int(getattr(settings, "YANDEX_DOWNLOAD_URL_CACHE_TTL", 0) or 0),
+                    resource_info_ttl=int(getattr(settings, "YANDEX_RESOURCE_INFO_CACHE_TTL", 0) or 0),
+                    disk_info_ttl=int(getattr(settings, "YANDEX_DISK_INFO_CACHE_TTL", 0) or 0),
+                )
+    return _client
+
+
+@receiver(setting_changed)
+def _reset_client(*, setting, **kwargs):
+    global _client
+    if setting.startswith(("YANDEX_DISK_API", "YANDEX_HTTP_")) or setting.endswith("_CACHE_TTL"):
+        _client = None
+
+
 def exchange_code_for_token(client_id, client_secret, code):
-    response = requests.post(
-        YANDEX_TOKEN_URL,
-        data={
-            "grant_type": "authorization_code",
-            "code": code,
-            "client_id": client_id,
-            "client_secret": client_secret,
-        },
-        timeout=20,
-    )
-    response.raise_for_status()
-    return response.json()
+    return get_client().exchange_code_for_token(client_id, client_secret, code)
 
 
-def list_files(access_token, limit=100):
-    response = requests.get(
-        YANDEX_DISK_API,
-        params={"limit": limit},
-        headers={"Authorization": f"OAuth {access_token}"},
-        timeout=20,
-    )
-    response.raise_for_status()
-    data = response.json()
-    return data.get("_embedded", {}).get("items", [])
+def list_files(access_token, limit=100, path=None, offset=0, fields=None):
+    return get_client().list_files(access_token, limit=limit, path=path, offset=offset, fields=fields)
+
+
+def iter_folder_names(access_token, path, page_size=1000):
+    """
+    Имена ресурсов в папке path, постранично (offset), только поле name.
+    Возвращает None, если папки нет.
+    """
+    return get_client().iter_folder_names(access_token, path, page_size=page_size)
 
 
 def get_disk_info(access_token):
-    response = requests.get(
-        "https://cloud-api.yandex.net/v1/disk",
-        headers={"Authorization": f"OAuth {access_token}"},
-        timeout=20,
-    )
-    response.raise_for_status()
-    return response.json()
+    return get_client().get_disk_info(access_token)
 
 
 def get_resource_info(access_token, path):
-    response = requests.get(
-        YANDEX_DISK_API,
-        params={"path": path},
-        headers={"Authorization": f"OAuth {access_token}"},
-        timeout=20,
-    )
-    if response.status_code == 404:
-        return None
-    response.raise_for_status()
-    return response.json()
+    return get_client().get_resource_info(access_token, path)
 
 
 def resource_exists(access_token, path):
-    return get_resource_info(access_token, path) is not None
+    return get_client().resource_exists(access_token, path)
 
 
-def get_download_url(access_token, path):
-    response = requests.get(
-        f"{YANDEX_DISK_API}/download",
-        params={"path": path},
-        headers={"Authorization": f"OAuth {access_token}"},
-        timeout=20,
-    )
-    response.raise_for_status()
-    return response.json().get("href")
+def get_download_url(access_token, path, *, fresh=False):
+    return get_client().get_download_url(access_token, path, fresh=fresh)
 
 
 def get_upload_url(access_token, path, overwrite=True):
-    response = requests.get(
-        f"{YANDEX_DISK_API}/upload",
-        params={"path": path, "overwrite": str(overwrite).lower()},
-        headers={"Authorization": f"OAuth {access_token}"},
-        timeout=20,
-    )
-    response.raise_for_status()
-    return response.json().get("href")
+    return get_client().get_upload_url(access_token, path, overwrite=overwrite)
 
 
 def ensure_disk_segment(access_token, path):
     """Создаёт цепочку ресурсов по пути на Яндекс.Диске (API)."""
-    response = requests.put(
-        YANDEX_DISK_API,
-        params={"path": path},
-        headers={"Authorization": f"OAuth {access_token}"},
-        timeout=20,
-    )
-    # 201 created, 409 already exists
-    if response.status_code not in (201, 409):
-        response.raise_for_status()
+    get_client().ensure_disk_segment(access_token, path)
 
 
 def ensure_disk_parent_segments(access_token, file_path):
-    path_str = str(file_path)
-    if "/" not in path_str:
-        return
-
-    if path_str.startswith("app:/"):
-        root = "app:"
-        rootless_file = path_str.replace("app:/", "", 1)
-    elif path_str.startswith("disk:/"):
-        root = "disk:"
-        rootless_file = path_str.replace("disk:/", "", 1)
-    else:
-        root = "disk:"
-        rootless_file = path_str.lstrip("/")
-
-    if "/" not in rootless_file:
-        return
-
-    parent_path = rootless_file.rsplit("/", 1)[0]
-    parts = [part for part in PurePosixPath(parent_path).parts if part not in ("", ".")]
-    current = root
-    for part in parts:
-        current = f"{current}/{part}"
-        ensure_disk_segment(access_token, current)
+    get_client().ensure_disk_parent_segments(access_token, file_path)
 
 
 def upload_file_bytes(access_token, path, content, overwrite=True):
-    ensure_disk_parent_segments(access_token, path)
-    upload_url = get_upload_url(access_token, path, overwrite=overwrite)
-    if not upload_url:
-        raise RuntimeError("Не удалось получить upload URL Яндекс.Диска")
-    response = requests.put(upload_url, data=content, timeout=60)
-    response.raise_for_status()
+    get_client().upload_file_bytes(access_token, path, content, overwrite=overwrite)
 
 
 def delete_resource(access_token, path, permanently=False):
-    response = requests.delete(
-        YANDEX_DISK_API,
-        params={"path": path, "permanently": str(permanently).lower()},
-        headers={"Authorization": f"OAuth {access_token}"},
-        timeout=20,
-    )
-    # 202 accepted or 204 no content are successful variants
-    if response.status_code not in (202, 204):
-        response.raise_for_status()
+    get_client().delete_resource(access_token, path, permanently=permanently)
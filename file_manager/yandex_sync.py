@@ -0,0 +1,99 @@
+"""
+Фоновая сверка файлов на Яндекс.Диске с записями File.
+
+Раньше file_list делал HTTP-запрос resource_exists на каждый файл пользователя при каждом
+открытии страницы. Теперь:
+  - страница только проверяет метку в кэше и, если сверка устарела
+    (старше YANDEX_RECONCILE_INTERVAL), ставит задачу yandex.reconcile_user в очередь;
+  - задача группирует File.yandex_path по родительским папкам (disk:/, app:/Classroom/<id>/ …),
+    читает каждую папку постранично (offset, fields=_embedded.items.name) и удаляет
+    записи, которых на Диске больше нет, — один запрос на страницу папки, а не на файл;
+  - команда reconcile_yandex_files сверяет всех пользователей по расписанию (cron).
+Ошибка чтения папки ничего не удаляет: файлы этой папки проверятся в следующий раз.
+"""
+from __future__ import annotations
+
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .jobs import enqueue
+from .models import ExternalStorageConnection, File
+from .yandex_disk import iter_folder_names
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RECONCILE_INTERVAL = 300
+
+
+def _reconcile_interval() -> int:
+    return int(getattr(settings, "YANDEX_RECONCILE_INTERVAL", DEFAULT_RECONCILE_INTERVAL) or 0)
+
+
+def _fresh_key(user_id: int) -> str:
+    return f"yandex_reconcile:fresh:{user_id}"
+
+
+def split_remote_path(path: str) -> tuple[str, str]:
+    """'disk:/a/b.pdf' -> ('disk:/a', 'b.pdf'); 'app:/x.pdf' -> ('app:/', 'x.pdf')."""
+    folder, _, name = path.rstrip("/").rpartition("/")
+    if folder.endswith(":"):
+        folder += "/"
+    return folder, name
+
+
+def reconcile_user(user) -> int:
+    """Удаляет File пользователя, которых нет на Яндекс.Диске. Возвращает число удалённых."""
+    from .views import get_yandex_connection
+
+    connection = get_yandex_connection(user, autocreate_from_social=True)
+    if not connection:
+        return 0
+
+    by_folder: dict[str, dict[str, list[int]]] = defaultdict(lambda: defaultdict(list))
+    rows = (
+        File.objects.filter(uploaded_by=user, storage_provider="yandex_disk")
+        .exclude(yandex_path="")
+        .values_list("id", "yandex_path")
+    )
+    for file_id, yandex_path in rows:
+        folder, name = split_remote_path(yandex_path)
+        by_folder[folder][name].append(file_id)
+
+    missing: list[int] = []
+    for folder, files_by_name in by_folder.items():
+        try:
+            names = iter_folder_names(connection.access_token, folder)
+        except Exception:
+            logger.warning("yandex reconcile: папка %s недоступна user_id=%s", folder, user.id, exc_info=True)
+            continue
+        present = set(names or ())
+        for name, file_ids in files_by_name.items():
+            if name not in present:
+                missing.extend(file_ids)
+
+    if missing:
+        File.objects.filter(id__in=missing).delete()
+        logger.info("yandex reconcile: удалено %s записей user_id=%s", len(missing), user.id)
+    cache.set(_fresh_key(user.id), True, _reconcile_interval())
+    return len(missing)
+
+
+def schedule_reconcile(user) -> bool:
+    """
+    Без сетевых запросов: ставит сверку в очередь, если прошлая устарела.
+    cache.add гарантирует одну задачу на интервал даже при параллельных запросах.
+    """
+    interval = _reconcile_interval()
+    if interval <= 0 or not user.is_authenticated:
+        return False
+    if not cache.add(_fresh_key(user.id), True, interval):
+        return False
+    if not ExternalStorageConnection.objects.filter(user=user, provider="yandex_disk").exists() and not (
+        File.objects.filter(uploaded_by=user, storage_provider="yandex_disk").exists()
+    ):
+        return False
+    enqueue("yandex.reconcile_user", user_id=user.id)
+    return True
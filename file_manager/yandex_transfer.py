@@ -0,0 +1,317 @@
+"""
+Потоковая передача содержимого Яндекс.Диска.
+
+TransferEngine не держит файл целиком в памяти:
+  - upload() отправляет bytes, путь к файлу, файловый объект или итератор блоков
+    (итератор уходит chunked-запросом, файл — с Content-Length без чтения в память);
+  - download_to_file() / download_to_tempfile() пишут ответ на диск блоками
+    YANDEX_TRANSFER_CHUNK_SIZE, iter_download() отдаёт блоки для HTTP-ответа;
+  - download_many() скачивает несколько файлов параллельно;
+  - целых передач одновременно не больше YANDEX_TRANSFER_CONCURRENCY на процесс —
+    семафор общий для потоков воркера и запросов ASGI.
+Соединения берутся из пула YandexDiskClient (yandex_disk.get_client()).
+
+Асинхронный интерфейс (aupload, adownload_to_file, aiter_download) для ASGI-кода выполняет
+те же операции в потоках через sync_to_async: httpx/aiohttp в зависимостях нет, а сокеты
+requests и так блокирующие. Фоновые задачи вызывают синхронные методы напрямую.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import tempfile
+import threading
+from collections.abc import AsyncIterator, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+
+from .yandex_disk import RETRY_STATUSES, STALE_HREF_STATUSES, YandexDiskClient, get_client
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 256 * 1024
+DEFAULT_CONCURRENCY = 4
+UPLOAD_ATTEMPTS = 3
+
+_END_OF_STREAM = object()
+
+
+class _ChunkedBody:
+    """
+    Тело запроса из итератора: requests отправит его chunked, без накопления в памяти.
+    Пустые блоки пропускаются (пустой chunk завершил бы тело), отправленные байты считаются.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = chunks
+        self.sent = 0
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            if chunk:
+                self.sent += len(chunk)
+                yield bytes(chunk)
+
+
+def _iter_file(fh, chunk_size: int) -> Iterator[bytes]:
+    while True:
+        block = fh.read(chunk_size)
+        if not block:
+            return
+        yield block
+
+
+class TransferEngine:
+    def __init__(
+        self,
+        client: YandexDiskClient | None = None,
+        *,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        timeout: float = 120,
+    ):
+        self._client = client
+        self.chunk_size = max(int(chunk_size), 4096)
+        self.concurrency = max(int(concurrency), 1)
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+
+    @property
+    def client(self) -> YandexDiskClient:
+        return self._client or get_client()
+
+    # --- загрузка ----------------------------------------------------------------
+
+    def upload(self, access_token: str, path: str, source, *, overwrite: bool = True) -> int:
+        """
+        Загружает source по пути path. source: bytes, путь к файлу, файловый объект
+        (читается с текущей позиции) или итератор bytes. Возвращает число отправленных байт.
+        Перезапускаемые источники (bytes, файл с seek) повторяются на 5xx / обрыве связи.
+        """
+        with self._slots:
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                data = bytes(source)
+                return self._put_with_retries(access_token, path, overwrite, lambda: data, len(data))
+            if isinstance(source, (str, os.PathLike)):
+                with open(source, "rb") as fh:
+                    return self._upload_handle(access_token, path, fh, overwrite)
+            if hasattr(source, "read"):
+                return self._upload_handle(access_token, path, source, overwrite)
+            body = _ChunkedBody(source)
+            self._put(access_token, path, overwrite, body)
+            return body.sent
+
+    def _upload_handle(self, access_token: str, path: str, fh, overwrite: bool) -> int:
+        try:
+            start = fh.tell()
+            size = os.fstat(fh.fileno()).st_size - start
+        except (AttributeError, OSError, ValueError):
+            body = _ChunkedBody(_iter_file(fh, self.chunk_size))
+            self._put(access_token, path, overwrite, body)
+            return body.sent
+
+        def rewind():
+            # Файл с известной длиной requests отправляет с Content-Length, читая блоками.
+            fh.seek(start)
+            return fh
+
+        return self._put_with_retries(access_token, path, overwrite, rewind, size)
+
+    def _put_with_retries(self, access_token, path, overwrite, make_body, size: int) -> int:
+        for attempt in range(1, UPLOAD_ATTEMPTS + 1):
+            try:
+                self._put(access_token, path, overwrite, make_body())
+                return size
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                error = exc
+            except requests.HTTPError as exc:
+                if exc.response is None or exc.response.status_code not in RETRY_STATUSES:
+                    raise
+                error = exc
+            if attempt == UPLOAD_ATTEMPTS:
+                raise error
+            logger.info("yandex upload retry %s/%s path=%s: %s", attempt, UPLOAD_ATTEMPTS, path, error)
+
+    def _put(self, access_token, path, overwrite, body) -> None:
+        client = self.client
+        upload_url = client.prepare_upload(access_token, path, overwrite=overwrite)
+        # Сессия без повторов urllib3: потоковое тело нельзя отправить второй раз.
+        response = _upload_session().put(upload_url, data=body, timeout=client.upload_timeout)
+        response.raise_for_status()
+        client.invalidate(access_token, path)
+
+    # --- скачивание --------------------------------------------------------------
+
+    def open_download(self, access_token: str, path: str, *, headers: dict | None = None) -> requests.Response:
+        """Открытый потоковый ответ сервера загрузки; вызывающий закрывает его сам."""
+        client = self.client
+        href = client.get_download_url(access_token, path)
+        if not href:
+            raise RuntimeError("Не удалось получить ссылку на скачивание с Яндекс.Диска")
+        response = client.session.get(href, headers=headers or {}, stream=True, timeout=self.timeout)
+        if response.status_code in STALE_HREF_STATUSES:
+            # Ссылка из кэша истекла или указывает на перезаписанный файл — берём новую.
+            response.close()
+            href = client.get_download_url(access_token, path, fresh=True)
+            response = client.session.get(href, headers=headers or {}, stream=True, timeout=self.timeout)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            response.close()
+            raise
+        return response
+
+    def iter_download(self, access_token: str, path: str) -> Iterator[bytes]:
+        response = self.open_download(access_token, path)
+        try:
+            for block in response.iter_content(chunk_size=self.chunk_size):
+                if block:
+                    yield block
+        finally:
+            response.close()
+
+    def download_to_file(self, access_token: str, path: str, destination) -> int:
+        """
+        Скачивает path в файл (путь или файловый объект). Для пути пишет во временный
+        .part и переименовывает, чтобы оборванная загрузка не оставила обрезанный файл.
+        """
+        with self._slots:
+            if hasattr(destination, "write"):
+                return self._copy_to(access_token, path, destination)
+            destination = os.fspath(destination)
+            partial = f"{destination}.part"
+            try:
+                with open(partial, "wb") as fh:
+                    written = self._copy_to(access_token, path, fh)
+                os.replace(partial, destination)
+            except BaseException:
+                try:
+                    os.unlink(partial)
+                except OSError:
+                    pass
+                raise
+            return written
+
+    def _copy_to(self, access_token: str, path: str, fh) -> int:
+        written = 0
+        for block in self.iter_download(access_token, path):
+            fh.write(block)
+            written += len(block)
+        return written
+
+    def download_to_tempfile(self, access_token: str, path: str, *, suffix: str = "") -> str:
+        """Скачивает во временный файл и возвращает путь; удаляет вызывающий."""
+        fd, temp_path = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+        try:
+            self.download_to_file(access_token, path, temp_path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+        return temp_path
+
+    def read_bytes(self, access_token: str, path: str) -> bytes:
+        """Содержимое целиком — только там, где дальше всё равно нужны bytes."""
+        with self._slots:
+            return b"".join(self.iter_download(access_token, path))
+
+    def download_many(self, items: Iterable[tuple[str, str, str]]) -> Iterator[tuple[str, str | None, Exception | None]]:
+        """
+        items: (access_token, remote_path, suffix). Скачивает во временные файлы не более
+        concurrency штук одновременно и отдаёт (remote_path, temp_path | None, ошибка | None)
+        в исходном порядке. Впереди текущего элемента готовится не больше concurrency файлов.
+        """
+        items = iter(items)
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="yandex-transfer") as pool:
+            window = []
+
+            def submit_next() -> bool:
+                item = next(items, None)
+                if item is None:
+                    return False
+                token, remote_path, suffix = item
+                window.append((remote_path, pool.submit(self.download_to_tempfile, token, remote_path, suffix=suffix)))
+                return True
+
+            for _ in range(self.concurrency):
+                if not submit_next():
+                    break
+            while window:
+                remote_path, future = window.pop(0)
+                submit_next()
+                try:
+                    yield remote_path, future.result(), None
+                except Exception as exc:
+                    yield remote_path, None, exc
+
+    # --- асинхронный интерфейс (ASGI) ---------------------------------------------
+
+    async def aupload(self, access_token: str, path: str, source, *, overwrite: bool = True) -> int:
+        return await sync_to_async(self.upload, thread_sensitive=False)(
+            access_token, path, source, overwrite=overwrite
+        )
+
+    async def adownload_to_file(self, access_token: str, path: str, destination) -> int:
+        return await sync_to_async(self.download_to_file, thread_sensitive=False)(access_token, path, destination)
+
+    async def aiter_download(self, access_token: str, path: str) -> AsyncIterator[bytes]:
+        iterator = self.iter_download(access_token, path)
+        step = sync_to_async(next, thread_sensitive=False)
+        try:
+            while True:
+                block = await step(iterator, _END_OF_STREAM)
+                if block is _END_OF_STREAM:
+                    return
+                yield block
+        finally:
+            await sync_to_async(iterator.close, thread_sensitive=False)()
+
+
+_engine: TransferEngine | None = None
+_session: requests.Session | None = None
+_lock = threading.Lock()
+
+
+def _upload_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_maxsize=max(int(getattr(settings, "YANDEX_TRANSFER_CONCURRENCY", DEFAULT_CONCURRENCY)), 1),
+                    max_retries=0,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def get_engine() -> TransferEngine:
+    global _engine
+    if _engine is None:
+        with _lock:
+            if _engine is None:
+                _engine = TransferEngine(
+                    chunk_size=int(getattr(settings, "YANDEX_TRANSFER_CHUNK_SIZE", DEFAULT_CHUNK_SIZE) or DEFAULT_CHUNK_SIZE),
+                    concurrency=int(getattr(settings, "YANDEX_TRANSFER_CONCURRENCY", DEFAULT_CONCURRENCY) or 1),
+                )
+    return _engine
+
+
+@receiver(setting_changed)
+def _reset_engine(*, setting, **kwargs):
+    global _engine, _session
+    if setting.startswith("YANDEX_TRANSFER_"):
+        _engine = None
+        _session = None
@@ -0,0 +1,198 @@
+"""
+Потоковая сборка ZIP-архива: блоки архива отдаются клиенту по мере записи.
+
+Архив не собирается ни в памяти, ни во временном файле целиком: zipfile пишет в приёмник
+без seek (размеры и CRC — в дескрипторах данных после содержимого), а генератор после
+каждого блока файла забирает накопленные байты. В памяти — один блок файла и буфер сжатия.
+  - ZIP64 включается сам: для файлов больше 4 ГБ и когда смещения или число записей
+    выходят за пределы обычного ZIP (архив с файлами одного студента на 3+ ГБ);
+  - уже сжатые форматы (изображения, видео, архивы, документы OOXML/ODF) пишутся без
+    сжатия (ZIP_STORED) — deflate тратил бы на них процессор без выигрыша, остальные — deflate;
+  - содержимое, которое нужно сначала получить (файлы Яндекс.Диска), готовится в пуле потоков
+    на prefetch записей вперёд: пока пишется текущий файл, следующие уже скачиваются
+    во временные файлы (или открываются из локального кэша), и на диске одновременно
+    не больше prefetch таких файлов.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import time
+import zipfile
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import PurePosixPath
+from typing import BinaryIO
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_PREFETCH = 4
+
+# Форматы, которые уже сжаты: повторное сжатие deflate почти ничего не даёт.
+STORED_SUFFIXES = frozenset({
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".avif",
+    ".mp3", ".m4a", ".aac", ".ogg", ".oga", ".opus", ".flac",
+    ".mp4", ".m4v", ".mov", ".avi", ".mkv", ".webm",
+    ".zip", ".rar", ".7z", ".gz", ".tgz", ".bz2", ".xz", ".zst",
+    ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".odp", ".epub",
+})
+
+
+def compress_type_for(name: str) -> int:
+    return zipfile.ZIP_STORED if PurePosixPath(name).suffix.lower() in STORED_SUFFIXES else zipfile.ZIP_DEFLATED
+
+
+@dataclass
+class ZipEntry:
+    """
+    Файл архива: path — готовый локальный файл, либо fetch — функция, которая получает
+    содержимое во временный файл и возвращает его путь (файл удаляется после записи) или
+    возвращает уже открытый файл (закрывается после записи, не удаляется): так запись
+    локального кэша не пропадёт из-под архива, если её вытеснят, пока очередь дойдёт до неё.
+    """
+
+    name: str
+    path: str | None = None
+    fetch: Callable[[], str | BinaryIO] | None = None
+
+
+class _Sink:
+    """Приёмник без seek: zipfile пишет сюда, генератор забирает накопленное."""
+
+    def __init__(self):
+        self._parts: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data, self._parts = b"".join(self._parts), []
+        return data
+
+
+def _unlink_quietly(path: str | None) -> None:
+    if not path:
+        return
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _release(source: str | BinaryIO | None, temporary: bool) -> None:
+    """Открытый файл закрывается, временный путь удаляется."""
+    if source is not None and not isinstance(source, str):
+        source.close()
+    elif temporary:
+        _unlink_quietly(source)
+
+
+def _discard(future: Future) -> None:
+    # Уже запущенное скачивание нельзя отменить — его файл удаляется, когда оно закончится.
+    if not future.cancel():
+        future.add_done_callback(lambda f: _release(None if f.exception() else f.result(), True))
+
+
+def _open_source(entry: ZipEntry, source: str | BinaryIO) -> tuple[zipfile.ZipInfo, BinaryIO]:
+    """ZipInfo (время и размер — из файла) и открытый файл записи."""
+    if isinstance(source, str):
+        info = zipfile.ZipInfo.from_file(source, arcname=entry.name, strict_timestamps=False)
+        return info, open(source, "rb")
+    st = os.fstat(source.fileno())
+    date_time = time.localtime(st.st_mtime)[:6]
+    if date_time[0] < 1980:
+        date_time = (1980, 1, 1, 0, 0, 0)
+    info = zipfile.ZipInfo(entry.name, date_time)
+    info.external_attr = (st.st_mode & 0xFFFF) << 16
+    info.file_size = st.st_size
+    return info, source
+
+
+def _prepared(
+    entries: Iterable[ZipEntry], pool: ThreadPoolExecutor, prefetch: int
+) -> Iterator[tuple[ZipEntry, str | BinaryIO | None, bool]]:
+    """(запись, путь или открытый файл | None при ошибке, временный ли путь) в исходном порядке."""
+    entries = iter(entries)
+    window: deque[tuple[ZipEntry, Future | None]] = deque()
+    in_flight = 0
+    exhausted = False
+    try:
+        while True:
+            # Окно: впереди текущей записи запущено не больше prefetch скачиваний.
+            while not exhausted and in_flight < prefetch:
+                entry = next(entries, None)
+                if entry is None:
+                    exhausted = True
+                    break
+                future = pool.submit(entry.fetch) if entry.fetch is not None else None
+                in_flight += future is not None
+                window.append((entry, future))
+            if not window:
+                return
+            entry, future = window.popleft()
+            if future is None:
+                yield entry, entry.path, False
+                continue
+            in_flight -= 1
+            try:
+                path = future.result()
+            except Exception as exc:
+                logger.warning("zipstream: не удалось получить %s: %s", entry.name, exc)
+                yield entry, None, False
+                continue
+            yield entry, path, True
+    finally:
+        # Клиент оборвал скачивание: временные файлы из окна не должны остаться на диске.
+        for _entry, future in window:
+            if future is not None:
+                _discard(future)
+
+
+def stream_zip(
+    entries: Iterable[ZipEntry],
+    *,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    prefetch: int = DEFAULT_PREFETCH,
+) -> Iterator[bytes]:
+    """
+    Блоки ZIP-архива из entries. Записи без содержимого (файл пропал, скачивание не удалось)
+    пропускаются с предупреждением в журнале — архив собирается из остальных.
+    """
+    sink = _Sink()
+    prefetch = max(prefetch, 1)
+    pool = ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix="zipstream")
+    prepared = _prepared(entries, pool, prefetch)
+    try:
+        with zipfile.ZipFile(sink, "w", allowZip64=True) as archive:
+            for entry, prepared_source, temporary in prepared:
+                if prepared_source is None:
+                    continue
+                try:
+                    try:
+                        info, source = _open_source(entry, prepared_source)
+                    except OSError as exc:
+                        logger.warning("zipstream: пропущен %s: %s", entry.name, exc)
+                        continue
+                    info.compress_type = compress_type_for(entry.name)
+                    with source, archive.open(info, "w") as target:
+                        while block := source.read(chunk_size):
+                            target.write(block)
+                            if data := sink.drain():
+                                yield data
+                finally:
+                    _release(prepared_source, temporary)
+                if data := sink.drain():
+                    yield data
+        # Центральный каталог (и записи ZIP64) пишется при закрытии архива.
+        yield sink.drain()
+    finally:
+        prepared.close()
+        # Не ждём скачиваний, ставших ненужными (клиент ушёл): их файлы удалит _discard.
+        pool.shutdown(wait=False, cancel_futures=True)